@@ -25,7 +25,7 @@ Functions to export a Detectron2 model as a pure pytorch model and functions to
 import json
 import logging
 from pathlib import Path
-from typing import Literal, Union
+from typing import List, Literal, Union
 
 import cv2
 import numpy as np
@@ -61,23 +61,34 @@ def get_sample_img(sample: Path) -> torch.Tensor:
 def export_model(
     config_path: Path,
     weights_path: Path,
-    sample_img: Path,
+    sample_img: Union[Path, List[Path]],
     option: EXPORT_OPTIONS = "cuda",
+    batch_size: int = None,
 ) -> None:
     """Exports a Detectron2 model to be usable with just pytorch.
 
+    The exported model is run with a fixed number of images at once, i.e.
+    ``model(img_1, ..., img_n)``, and returns the outputs of every image one
+    after another. Running it on a batch of images amortizes the overhead of
+    every forward pass, see
+    :func:`~ParticleDetection.utils.detection.model_batch_size`.
+
     Parameters
     ----------
     config_path : Path
         File that holds the model's configuration in yaml format.
     weights_path : Path
         File that holds the trained model's weights.
-    sample_img : Path
-        Image to be used to trace the model.
+    sample_img : Path | List[Path]
+        Image(s) to be used to trace the model.
     option : EXPORT_OPTIONS, optional
         Option whether to restrict the exported model to be used on the CPU or
         to also allow the use of a GPU.\n
         By default ``"cuda"``.
+    batch_size : int, optional
+        Number of images the exported model is run with at once. The sample
+        images are repeated, if fewer are given.\n
+        By default ``None``, i.e. the number of sample images.
 
     Note
     ----
@@ -85,15 +96,19 @@ def export_model(
     The CPU version can be run with both, pytorch's CPU and GPU version.
     """
 
-    def inference_func(model, image):
-        inputs = [{"image": image}]
-        return model.inference(inputs, do_postprocess=False)[0]
+    def inference_func(model, *images):
+        inputs = [{"image": image} for image in images]
+        return model.inference(inputs, do_postprocess=False)
 
     cfg = CfgNode(CfgNode.load_yaml_with_base(str(config_path.resolve())))
     cfg.MODEL.WEIGHTS = str(weights_path.resolve())
     cfg.MODEL.DEVICE = option
-    image = get_sample_img(sample_img)
-    inputs = tuple(image.clone() for _ in range(1))
+    if not isinstance(sample_img, (list, tuple)):
+        sample_img = [sample_img]
+    if batch_size is None:
+        batch_size = len(sample_img)
+    images = [get_sample_img(sample) for sample in sample_img]
+    inputs = tuple(images[i % len(images)].clone() for i in range(batch_size))
     model = DefaultPredictor(cfg).model
     wrapper = TracingAdapter(model, inputs, inference_func)
     wrapper.eval()
@@ -194,9 +209,13 @@ def annotation_to_json(
                 "type": str(predicted_class),
             },
         }
-        idxs = np.nonzero(prediction["pred_masks"][i])
-        # [outer_points, 2]
-        points = np.asarray((idxs[:, 1], idxs[:, 0])).swapaxes(0, 1)
+        if isinstance(prediction["pred_masks"], ds.ROIMasks):
+            # [outer_points, 2]
+            points = prediction["pred_masks"].points(i)
+        else:
+            idxs = np.nonzero(prediction["pred_masks"][i])
+            # [outer_points, 2]
+            points = np.asarray((idxs[:, 1], idxs[:, 0])).swapaxes(0, 1)
 
         hull = cv2.convexHull(points).squeeze()
         if len(hull) > 20:
@@ -27,10 +27,19 @@ import os
 import random
 import warnings
 from pathlib import Path
-from typing import Callable, Iterable, List, Literal, Union, overload
+from typing import (
+    Callable,
+    Iterable,
+    List,
+    Literal,
+    Sequence,
+    Union,
+    overload,
+)
 
 import cv2
 import numpy as np
+import torch
 from detectron2.config import CfgNode
 from detectron2.engine import DefaultPredictor
 from detectron2.utils.logger import setup_logger
@@ -39,6 +48,8 @@ import ParticleDetection.modelling.export as export
 import ParticleDetection.modelling.visualization as visualization
 import ParticleDetection.utils.datasets as ds
 from ParticleDetection.modelling.configs import write_configs
+from ParticleDetection.utils.batching import BatchSize, run_batched
+from ParticleDetection.utils.prefetching import ImagePrefetcher
 
 _logger = logging.getLogger(__name__)
 
@@ -134,6 +145,9 @@ def detect(
     visualize: bool = False,
     vis_random_samples: int = -1,
     device: Literal["cpu", "cuda"] = "cpu",
+    batch_size: BatchSize = 1,
+    workers: int = 2,
+    prefetch: int = 4,
     **kwargs,
 ) -> None:
     """Run object detection on a dataset with custom result saving.
@@ -141,7 +155,9 @@ def detect(
     Run object detection on a given dataset with the possibility to visualize
     all or some results. Additionally, it is possible to apply (custom) saving
     functions to the detection result of each given image. The detection can be
-    run either on the CPU or GPU.
+    run either on the CPU or GPU. Multiple images can be detected in one
+    forward pass of the model (``batch_size``), the results are saved per
+    image in the order of the dataset.
 
     Parameters
     ----------
@@ -187,6 +203,19 @@ def detect(
     device : Literal["cpu", "cuda"], optional
         Device the detection is going to be run with, i.e. CPU or GPU.\n
         By default ``"cpu"``.
+    batch_size : int | ``"auto"``, optional
+        Number of images detected in one forward pass of the model or
+        ``"auto"`` to determine it during the run, see
+        :func:`~ParticleDetection.utils.batching.run_batched`.\n
+        By default ``1``.
+    workers : int, optional
+        Number of threads reading the upcoming image files in the background,
+        see :class:`~ParticleDetection.utils.prefetching.ImagePrefetcher`.\n
+        By default ``2``.
+    prefetch : int, optional
+        Maximum number of image files read ahead, ``0`` disables
+        prefetching.\n
+        By default ``4``.
     **kwargs : dict, optional
         The `dataset` parameter can accept formattable strings, i.e.
         `dataset.format(...)` can be run. This allows to specify a dataset
@@ -317,42 +346,90 @@ def detect(
             to_visualize = np.ones(len(dataset))
 
     _logger.info(f"Starting inference on {num_images} file(s).")
-    for image in dataset:
-        file = image
-        if not isinstance(image, np.ndarray):
-            # read image
-            if not Path(file).exists():
-                warnings.warn(
-                    "The following image is skipped because it "
-                    f"does not exist: {file}",
-                    UserWarning,
-                )
-                _logger.warning(
-                    "The following image is skipped because it "
-                    f"does not exist: {file}"
+    available = []
+    for file in dataset:
+        if not isinstance(file, np.ndarray) and not Path(file).exists():
+            warnings.warn(
+                "The following image is skipped because it "
+                f"does not exist: {file}",
+                UserWarning,
+            )
+            _logger.warning(
+                "The following image is skipped because it "
+                f"does not exist: {file}"
+            )
+            continue
+        available.append(file)
+
+    def predict(files: Sequence[Union[str, Path, np.ndarray]]) -> List[dict]:
+        images = []
+        for file in files:
+            if not isinstance(file, np.ndarray):
+                _logger.info(f"Inference on: {file}")
+                file = loader.read(file)
+            images.append(file)
+        return _predict_batch(predictor, images)
+
+    loader = ImagePrefetcher(
+        (file for file in available if not isinstance(file, np.ndarray)),
+        load=lambda file: cv2.imread(str(file)),
+        workers=workers,
+        prefetch=prefetch,
+    )
+    with loader:
+        for file, outputs in run_batched(predict, available, batch_size):
+            _logger.debug(f"Detected {len(outputs['instances'])} objects.")
+
+            # Thresholding/cleaning results
+            outputs["instances"] = outputs["instances"][
+                outputs["instances"].scores > threshold
+            ]
+            _logger.info(f"Found {len(outputs['instances'])} valid objects.")
+
+            # Save (intermediate) results
+            for fun in saving_functions:
+                fun(outputs, file, classes, output_dir, **kwargs)
+
+            # Visualizations
+            if visualize:
+                visualization.visualize(
+                    outputs, file, output_dir=output_dir, **kwargs
                 )
-                continue
-            _logger.info(f"Inference on: {file}")
-            image = cv2.imread(str(file))
 
-        outputs = predictor(image)
-        _logger.debug(f"Detected {len(outputs['instances'])} objects.")
 
-        # Thresholding/cleaning results
-        outputs["instances"] = outputs["instances"][
-            outputs["instances"].scores > threshold
-        ]
-        _logger.info(f"Found {len(outputs['instances'])} valid objects.")
+def _predict_batch(
+    predictor: DefaultPredictor, images: List[np.ndarray]
+) -> List[dict]:
+    """Runs the model of a ``DefaultPredictor`` on multiple images in one
+    forward pass.
 
-        # Save (intermediate) results
-        for fun in saving_functions:
-            fun(outputs, file, classes, output_dir, **kwargs)
+    The images are preprocessed like ``DefaultPredictor.__call__()`` does for
+    a single image.
 
-        # Visualizations
-        if visualize:
-            visualization.visualize(
-                outputs, file, output_dir=output_dir, **kwargs
-            )
+    Parameters
+    ----------
+    predictor : DefaultPredictor
+        Predictor holding the model and its input configuration.
+    images : List[ndarray]
+        Images in BGR format.
+
+    Returns
+    -------
+    List[dict]
+        Predictions of the model, one per image.
+    """
+    inputs = []
+    for image in images:
+        if predictor.input_format == "RGB":
+            image = image[:, :, ::-1]
+        height, width = image.shape[:2]
+        transformed = predictor.aug.get_transform(image).apply_image(image)
+        transformed = torch.as_tensor(
+            transformed.astype("float32").transpose(2, 0, 1)
+        )
+        inputs.append({"image": transformed, "height": height, "width": width})
+    with torch.no_grad():
+        return predictor.model(inputs)
 
 
 def run_detection(
@@ -32,6 +32,8 @@ import numpy as np
 import torch
 from detectron2.utils.visualizer import GenericMask
 
+import ParticleDetection.utils.datasets as ds
+
 _logger = logging.getLogger(__name__)
 
 
@@ -149,6 +151,8 @@ def create_figure(img, predictions, gt: dict = None, colors: Iterable = None):
 
     def add_outlines(mask_data, axes, color=None, confidences=None):
         """Adds the masks data as outlines to the axes."""
+        if isinstance(mask_data, ds.ROIMasks):
+            mask_data = mask_data.to_bitmasks()
         if isinstance(mask_data, torch.Tensor):
             mask_data = mask_data.numpy()
         masks = [GenericMask(x, height, width) for x in mask_data]
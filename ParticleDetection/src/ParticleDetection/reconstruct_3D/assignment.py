@@ -0,0 +1,471 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+In-process solver for the n-partite (axial) assignment problems of
+:func:`~ParticleDetection.reconstruct_3D.matchND.npartite_matching`.
+
+Solving these problems with PuLP writes a model file and starts a CBC process
+for every frame. :class:`AssignmentSolver` instead solves them with SciPy in
+the calling process:
+
+- 2 groups: Hungarian method (``scipy.optimize.linear_sum_assignment``).
+- 3 groups: Lagrangian relaxation of one group's constraints, that leaves a
+  Hungarian subproblem per iteration, polished by a local search. The
+  relative duality gap of the solution is reported and, if it exceeds a
+  threshold, the problem is solved exactly with ``scipy.optimize.milp``
+  (HiGHS).
+- more groups: ``scipy.optimize.milp`` (HiGHS).
+
+**Authors**: Adrian Niemann (adrian.niemann@ovgu.de), Dmitry Puzyrev
+(dmitry.puzyrev@ovgu.de)
+
+**Date**:       2024
+
+"""
+import logging
+import warnings
+from typing import Tuple, Union
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import (
+    Bounds,
+    LinearConstraint,
+    OptimizeResult,
+    linear_sum_assignment,
+    milp,
+)
+
+_logger = logging.getLogger(__name__)
+
+_STALL_ITERATIONS = 5
+
+
+class AssignmentSolver:
+    """In-process solver for n-partite (axial) assignment problems.
+
+    An instance can be given as the ``solver`` of
+    :func:`~ParticleDetection.reconstruct_3D.matchND.npartite_matching`,
+    :func:`~ParticleDetection.reconstruct_3D.matchND.match_frame` and
+    :func:`~ParticleDetection.reconstruct_3D.matchND.assign`. Unlike the
+    PuLP formulation, the solver always returns a complete assignment, i.e.
+    every member of the smallest group is assigned. For the non-negative
+    weights of :func:`~ParticleDetection.reconstruct_3D.matchND.create_weights`
+    both are equivalent.
+
+    Parameters
+    ----------
+    max_iterations : int, optional
+        Maximum number of subgradient iterations of the Lagrangian relaxation
+        for problems with 3 groups.\n
+        By default ``100``.
+    gap_tolerance : float, optional
+        Relative duality gap, below which a solution is accepted. The
+        iterations stop early, once it is reached.\n
+        By default ``1e-6``.
+    local_search : bool, optional
+        Flag, whether to improve the best solution of the Lagrangian
+        relaxation by reassigning one group at a time with the Hungarian
+        method.\n
+        By default ``True``.
+    exact_fallback : bool, optional
+        Flag, whether to solve a problem exactly with
+        ``scipy.optimize.milp``, if the duality gap of the Lagrangian
+        relaxation exceeds ``gap_tolerance``.\n
+        By default ``True``.
+
+    Attributes
+    ----------
+    lower_bound : float
+        Lower bound of the (minimization) objective of the last problem.
+    upper_bound : float
+        Objective of the returned solution of the last problem, converted to
+        a minimization.
+    gap : float
+        Relative duality gap of the last problem's solution, i.e.
+        ``(upper_bound - lower_bound) / max(|upper_bound|, |lower_bound|)``.
+        It is ``0.0`` for solutions that are known to be optimal.
+    exact : bool
+        Flag, whether the last problem was solved exactly by the Hungarian
+        method or ``scipy.optimize.milp``.
+    multipliers : ndarray | None
+        Final Lagrangian multipliers of the last problem with 3 groups, that
+        can be used to warm start the next one.
+    relaxed_axis : int | None
+        Group of the last problem, whose constraints were relaxed with
+        :attr:`multipliers`.
+
+    Examples
+    --------
+    >>> solver = AssignmentSolver()
+    >>> npartite_matching(weights, maximize=True, solver=solver)
+    (array([0, 1, 2, 3]), array([6, 9, 1, 0]), array([2, 1, 0, 3]))
+    >>> solver.gap
+    0.0
+    """
+
+    def __init__(
+        self,
+        max_iterations: int = 100,
+        gap_tolerance: float = 1e-6,
+        local_search: bool = True,
+        exact_fallback: bool = True,
+    ):
+        self.max_iterations = max_iterations
+        self.gap_tolerance = gap_tolerance
+        self.local_search = local_search
+        self.exact_fallback = exact_fallback
+        self.lower_bound = np.nan
+        self.upper_bound = np.nan
+        self.gap = np.nan
+        self.exact = False
+        self.multipliers = None
+        self.relaxed_axis = None
+
+    def solve(
+        self,
+        weights: np.ndarray,
+        maximize: bool = True,
+        initial: Tuple[np.ndarray] = None,
+        multipliers: np.ndarray = None,
+    ) -> Tuple[np.ndarray]:
+        """Solves an n-partite assignment problem.
+
+        Parameters
+        ----------
+        weights : ndarray
+            A n-dimensional matrix where each entry is the cost associated
+            with choosing the combination of indices, see
+            :func:`~ParticleDetection.reconstruct_3D.matchND.npartite_matching`.
+        maximize : bool, optional
+            Flag, whether to maximize or minimize the sum of weights.\n
+            By default ``True``.
+        initial : Tuple[ndarray], optional
+            A complete assignment in the format of the returned one, e.g. the
+            solution of a similar problem. It is the starting solution of the
+            Lagrangian relaxation for problems with 3 groups. Incomplete or
+            invalid assignments are ignored.\n
+            By default ``None``.
+        multipliers : ndarray, optional
+            Initial Lagrangian multipliers for problems with 3 groups, e.g.
+            :attr:`multipliers` of a similar problem. The constraints of the
+            largest group are relaxed, of several largest groups the last one.
+            Multipliers of a different size are ignored.\n
+            By default ``None``.
+
+        Returns
+        -------
+        Tuple[ndarray]
+            The length of the tuple is equal to the number of dimensions of
+            ``weights``. Each element has the size of the smallest dimension
+            of ``weights`` and contains the indices of the assigned members
+            of its group. The assignments are sorted like the output of
+            ``np.where()``.
+
+        Raises
+        ------
+        ValueError
+            Is raised for ``weights`` with less than 2 dimensions or
+            non-finite entries.
+        """
+        weights = np.asarray(weights, dtype=float)
+        if weights.ndim < 2:
+            raise ValueError(
+                f"At least 2 groups are required, got {weights.ndim}."
+            )
+        if not np.isfinite(weights).all():
+            raise ValueError("The weights must be finite.")
+        costs = -weights if maximize else weights
+        self.multipliers = None
+        self.relaxed_axis = None
+        if 0 in costs.shape:
+            self._report(0.0, 0.0, exact=True)
+            return tuple(np.empty(0, dtype=int) for _ in costs.shape)
+
+        if costs.ndim == 2:
+            indices = linear_sum_assignment(costs)
+            objective = costs[indices].sum()
+            self._report(objective, objective, exact=True)
+        elif costs.ndim == 3:
+            indices = self._solve_3d(costs, initial, multipliers)
+        else:
+            indices = self._solve_exact(costs)
+            objective = costs[indices].sum()
+            self._report(objective, objective, exact=True)
+        order = np.lexsort(indices[::-1])
+        return tuple(np.asarray(idx, dtype=int)[order] for idx in indices)
+
+    def _solve_3d(
+        self,
+        costs: np.ndarray,
+        initial: Tuple[np.ndarray] = None,
+        multipliers: np.ndarray = None,
+    ) -> Tuple[np.ndarray]:
+        """Lagrangian relaxation of the largest group's constraints.
+
+        The axes are sorted by size, so the first group is completely
+        assigned. Relaxing the constraints of the last group with multipliers
+        ``u`` leaves ``min_k(c[i, j, k] + u[k])`` as a 2-dimensional
+        assignment problem for the first two groups.
+        """
+        axes = np.argsort(costs.shape, kind="stable")
+        c = costs.transpose(axes)
+        n1, _, n3 = c.shape
+        # With as many members in the last group as in the first, its
+        # constraints are equalities, i.e. the multipliers are unbounded.
+        equality = n1 == n3
+
+        u = np.zeros(n3)
+        if multipliers is not None and np.shape(multipliers) == (n3,):
+            u = np.asarray(multipliers, dtype=float)
+            if not equality:
+                u = np.maximum(u, 0)
+        lower, best_u = -np.inf, u
+        best, upper = None, np.inf
+        if initial is not None:
+            best = _valid_assignment([initial[axis] for axis in axes], c.shape)
+            if best is not None:
+                upper = c[best].sum()
+        step = 2.0
+        stall = 0
+        for _ in range(max(1, self.max_iterations)):
+            reduced = c + u
+            choice = np.argmin(reduced, axis=2)
+            d = np.take_along_axis(reduced, choice[..., None], axis=2)[..., 0]
+            rows, cols = linear_sum_assignment(d)
+            bound = d[rows, cols].sum() - u.sum()
+            if bound > lower:
+                lower, stall, best_u = bound, 0, u
+            else:
+                stall += 1
+                if stall >= _STALL_ITERATIONS:
+                    step, stall = step / 2, 0
+
+            candidate = _assign_last(c, rows, cols)
+            objective = c[candidate].sum()
+            if objective < upper:
+                best, upper = candidate, objective
+            if _relative_gap(lower, upper) <= self.gap_tolerance:
+                break
+
+            subgradient = np.bincount(choice[rows, cols], minlength=n3) - 1.0
+            norm = subgradient @ subgradient
+            if norm == 0:
+                break
+            u = u + step * (upper - bound) / norm * subgradient
+            if not equality:
+                u = np.maximum(u, 0)
+
+        if self.local_search:
+            best = _local_search(c, best)
+            upper = c[best].sum()
+        gap = _relative_gap(lower, upper)
+        exact = gap <= 0
+        if gap > self.gap_tolerance and self.exact_fallback:
+            _logger.debug(
+                f"Duality gap {gap:.3g} exceeds {self.gap_tolerance:.3g}, "
+                f"solving exactly."
+            )
+            exact_solution = self._solve_exact(c, fallback=best)
+            if exact_solution is not best:
+                best = exact_solution
+                upper = lower = c[best].sum()
+                exact = True
+        self._report(lower, upper, exact)
+        self.multipliers = best_u
+        self.relaxed_axis = int(axes[-1])
+
+        indices = [None] * 3
+        for sorted_axis, axis in enumerate(axes):
+            indices[axis] = best[sorted_axis]
+        return tuple(indices)
+
+    @staticmethod
+    def _solve_exact(
+        costs: np.ndarray, fallback: Tuple[np.ndarray] = None
+    ) -> Tuple[np.ndarray]:
+        """Solves the problem as a binary linear program with HiGHS.
+
+        The members of the (first) smallest group must all be assigned, all
+        other members at most once. If the solver fails, ``fallback`` is
+        returned, if it is given.
+        """
+        shape = costs.shape
+        members = np.unravel_index(np.arange(costs.size), shape)
+        result = _milp(members, costs.ravel(), shape)
+        if result.x is None:
+            if fallback is None:
+                raise RuntimeError(
+                    f"The assignment problem could not be solved: "
+                    f"{result.message}"
+                )
+            warnings.warn(
+                f"Exact solution failed ({result.message}), using the "
+                f"approximate solution."
+            )
+            return fallback
+        return np.unravel_index(np.flatnonzero(result.x > 0.5), shape)
+
+    def solve_sparse(
+        self,
+        indices: Tuple[np.ndarray],
+        costs: np.ndarray,
+        shape: Tuple[int],
+    ) -> Union[np.ndarray, None]:
+        """Solves a (minimization) n-partite assignment problem, that only
+        allows the given candidate combinations.
+
+        The problem is solved exactly with ``scipy.optimize.milp`` (HiGHS)
+        with one variable per candidate, i.e. its size grows with the number
+        of candidates instead of the product of the group sizes.
+
+        Parameters
+        ----------
+        indices : Tuple[ndarray]
+            One array per group with the member indices of all candidate
+            combinations.
+        costs : ndarray
+            Cost of every candidate combination.
+        shape : Tuple[int]
+            Number of members per group.
+
+        Returns
+        -------
+        ndarray | None
+            Positions of the chosen candidates, sorted by the member of the
+            first group. Every member of the smallest group is assigned.
+            ``None`` is returned, if the candidates do not allow such an
+            assignment.
+        """
+        costs = np.asarray(costs, dtype=float)
+        if 0 in shape:
+            self._report(0.0, 0.0, exact=True)
+            return np.empty(0, dtype=int)
+        result = _milp(indices, costs, shape)
+        if result.status == 2:
+            # infeasible
+            return None
+        if result.x is None:
+            raise RuntimeError(
+                f"The assignment problem could not be solved: "
+                f"{result.message}"
+            )
+        chosen = np.flatnonzero(result.x > 0.5)
+        objective = costs[chosen].sum()
+        self._report(objective, objective, exact=True)
+        return chosen[np.argsort(indices[0][chosen], kind="stable")]
+
+    def _report(self, lower: float, upper: float, exact: bool):
+        self.lower_bound = float(lower)
+        self.upper_bound = float(upper)
+        self.gap = 0.0 if exact else _relative_gap(lower, upper)
+        self.exact = exact
+
+
+def _milp(
+    indices: Tuple[np.ndarray], costs: np.ndarray, shape: Tuple[int]
+) -> OptimizeResult:
+    """Solves the binary linear program of an assignment problem with the
+    given variables. Each variable combines the members ``indices[g][v]`` of
+    the groups ``g``. The members of the (first) smallest group must all be
+    assigned, all other members at most once."""
+    n_vars = len(costs)
+    offsets = np.cumsum((0,) + tuple(shape[:-1]))
+    rows = np.concatenate(
+        [offset + np.asarray(idx) for offset, idx in zip(offsets, indices)]
+    )
+    cols = np.tile(np.arange(n_vars), len(shape))
+    A = sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)), shape=(sum(shape), n_vars)
+    )
+    lb = np.zeros(sum(shape))
+    smallest = int(np.argmin(shape))
+    lb[offsets[smallest] : offsets[smallest] + shape[smallest]] = 1
+    return milp(
+        costs,
+        constraints=LinearConstraint(A, lb, np.ones(sum(shape))),
+        integrality=np.ones(n_vars),
+        bounds=Bounds(0, 1),
+    )
+
+
+def _relative_gap(lower: float, upper: float) -> float:
+    """Relative difference of an upper and lower bound, that is ``0`` for
+    (numerically) equal bounds."""
+    if not np.isfinite(upper) or not np.isfinite(lower):
+        return np.inf
+    scale = max(abs(upper), abs(lower))
+    if scale == 0:
+        return 0.0
+    return max(upper - lower, 0.0) / scale
+
+
+def _valid_assignment(
+    assignment: Tuple[np.ndarray], shape: Tuple[int]
+) -> Union[Tuple[np.ndarray], None]:
+    """Sorts a complete assignment of a problem, whose first group is the
+    smallest, by the first group. Returns ``None`` for invalid or incomplete
+    assignments."""
+    try:
+        assignment = [np.asarray(idx, dtype=int) for idx in assignment]
+    except (TypeError, ValueError):
+        return None
+    if len(assignment) != len(shape):
+        return None
+    for idx, dim in zip(assignment, shape):
+        if (
+            idx.shape != (shape[0],)
+            or np.unique(idx).size != shape[0]
+            or idx.min() < 0
+            or idx.max() >= dim
+        ):
+            return None
+    order = np.argsort(assignment[0])
+    return tuple(idx[order] for idx in assignment)
+
+
+def _assign_last(
+    costs: np.ndarray, rows: np.ndarray, cols: np.ndarray
+) -> Tuple[np.ndarray]:
+    """Completes pairs of the first two groups with optimally assigned
+    members of the last group."""
+    _, third = linear_sum_assignment(costs[rows, cols, :])
+    return rows, cols, third
+
+
+def _local_search(
+    costs: np.ndarray, solution: Tuple[np.ndarray]
+) -> Tuple[np.ndarray]:
+    """Improves a solution of a 3-dimensional assignment problem by
+    optimally reassigning one group to the fixed pairs of the other two, until
+    this no longer reduces the objective."""
+    first, second, third = solution
+    objective = costs[first, second, third].sum()
+    while True:
+        previous = objective
+        _, idx = linear_sum_assignment(costs[first, second, :])
+        third = idx
+        _, idx = linear_sum_assignment(costs[first, :, third])
+        second = idx
+        # all members of the first group are assigned, so the pairs of the
+        # other groups can be permuted among them
+        _, perm = linear_sum_assignment(costs[:, second, third])
+        second, third = second[perm], third[perm]
+        first = np.arange(costs.shape[0])
+        objective = costs[first, second, third].sum()
+        if objective >= previous:
+            return first, second, third
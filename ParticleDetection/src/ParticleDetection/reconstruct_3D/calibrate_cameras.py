@@ -19,7 +19,11 @@ from typing import Tuple, Union
 
 import cv2
 import numpy as np
-from scipy.spatial.transform import Rotation as R
+
+from ParticleDetection.reconstruct_3D.stereo_rig import (
+    StereoRig,
+    as_stereo_rig,
+)
 
 
 def stereo_calibrate(cam1_path: str, cam2_path: str, visualize: bool = False):
@@ -137,7 +141,7 @@ def stereo_calibrate(cam1_path: str, cam2_path: str, visualize: bool = False):
 def project_points(
     p_cam1: np.ndarray,
     p_cam2: np.ndarray,
-    calibration: dict,
+    calibration: Union[dict, StereoRig],
     transforms: Union[dict, None] = None,
 ):
     """Project points from a stereocamera system to 3D coordinates.
@@ -150,19 +154,22 @@ def project_points(
     p_cam2 : ndarray
         Point coordinates on camera 2.
         Shape: ``(2, n)``
-    calibration : dict
+    calibration : dict | StereoRig
         Stereocamera calibration parameters with the required fields:
         ``"CM1"``: camera matrix of cam1\n
         ``"R"``: rotation matrix between cam1 & cam2\n
         ``"T"``: translation vector between cam1 & cam2\n
-        ``"CM2"``: camera matrix of cam2
+        ``"CM2"``: camera matrix of cam2\n
+        Alternatively, an already prepared :class:`.StereoRig`.
     transforms : dict | None
         Coordinate system transformation matrices from camera 1 coordinates to
         *world*/*experiment* coordinates.
         **Must contain the following fields:**\n
         ``"rotation"``, ``"translation"``\n
         Transformation of 3D coordinates to *world*/*experiment* coordinates is
-        omitted if ``transforms`` is ``None``.\n
+        omitted if ``transforms`` is ``None``. It is ignored if
+        ``calibration`` is a :class:`.StereoRig`, whose own transformation is
+        applied instead.\n
         Default is ``None``.
 
     Returns
@@ -177,30 +184,19 @@ def project_points(
     :func:`~ParticleDetection.utils.data_loading.load_world_transformation`
     :func:`~ParticleDetection.utils.data_loading.load_camera_calibration`
     """
-    # Derive projection matrices from the calibration
-    r1 = np.eye(3)
-    t1 = np.expand_dims(np.array([0.0, 0.0, 0.0]), 1)
-    P1 = np.vstack((r1.T, t1.T)) @ calibration["CM1"].T
-    P1 = P1.T
-
-    r2 = calibration["R"]
-    t2 = calibration["T"]
-    P2 = np.vstack((r2.T, t2.T)) @ calibration["CM2"].T
-    P2 = P2.T
-
-    p3d = cv2.triangulatePoints(P1, P2, p_cam1, p_cam2)
-    p3d = p3d[0:3] / p3d[3]
-
-    if transforms is not None:
-        rot = R.from_matrix(transforms["rotation"])
-        trans = transforms["translation"]
-        p3d = (rot.apply(p3d.T) + trans).T
-
-    return p3d
+    rig = as_stereo_rig(calibration, transforms)
+    p3d = rig.triangulate(
+        np.asarray(p_cam1).T, np.asarray(p_cam2).T, undistort=False
+    )
+    if transforms is not None or isinstance(calibration, StereoRig):
+        p3d = rig.to_world(p3d)
+    return p3d.T
 
 
 def reproject_points(
-    points: np.ndarray, calibration: dict, transforms: Union[dict, None] = None
+    points: np.ndarray,
+    calibration: Union[dict, StereoRig],
+    transforms: Union[dict, None] = None,
 ) -> Tuple[np.ndarray, np.ndarray]:
     """Project 3D coordinates to 2D stereocamera coordinates.
 
@@ -210,19 +206,22 @@ def reproject_points(
         3D point coordinates in either the *world*/*experiment* coordinates or
         camera 1 coordinates, depending on whether ``transforms`` is given.
         Shape: ``(3, n)`` or ``(n, 3)``
-    calibration : dict
+    calibration : dict | StereoRig
         Stereocamera calibration parameters with the required fields:\n
         ``"CM1"``: camera matrix of cam1\n
         ``"R"``: rotation matrix between cam1 & cam2\n
         ``"T"``: translation vector between cam1 & cam2\n
-        ``"CM2"``: camera matrix of cam2
+        ``"CM2"``: camera matrix of cam2\n
+        Alternatively, an already prepared :class:`.StereoRig`.
     transforms : dict | None
         Coordinate system transformation matrices from camera 1 coordinates to
         *world*/*experiment* coordinates.
         **Must contain the following fields:**\n
         ``"rotation"``, ``"translation"``\n
         Transformation of 3D coordinates from *world*/*experiment* coordinates
-        is omitted if ``transforms`` is ``None``.
+        is omitted if ``transforms`` is ``None``. It is ignored if
+        ``calibration`` is a :class:`.StereoRig`, whose own transformation is
+        applied instead.\n
         Default is ``None``.
 
     Returns
@@ -235,28 +234,12 @@ def reproject_points(
     :func:`~ParticleDetection.utils.data_loading.load_world_transformation`
     :func:`~ParticleDetection.utils.data_loading.load_camera_calibration`
     """
-    # Derive projection matrices from the calibration
-    r1 = np.eye(3)
-    t1 = np.expand_dims(np.array([0.0, 0.0, 0.0]), 1)
-    P1 = np.vstack((r1.T, t1.T)) @ calibration["CM1"].T
-    P1 = P1.T
-
-    r2 = calibration["R"]
-    t2 = calibration["T"]
-    P2 = np.vstack((r2.T, t2.T)) @ calibration["CM2"].T
-    P2 = P2.T
-
-    if transforms is not None:
-        rot_inv = R.from_matrix(transforms["rotation"]).inv()
-        trans = transforms["translation"]
-        # BUG: The attempt of applying a rotation to NaN crashes the function
-        points = rot_inv.apply(points - trans)
-
-    repr_cam1 = cv2.projectPoints(
-        points, r1, t1, calibration["CM1"], calibration["dist1"]
-    )[0].squeeze()
-    repr_cam2 = cv2.projectPoints(
-        points, r2, t2, calibration["CM2"], calibration["dist2"]
-    )[0].squeeze()
+    rig = as_stereo_rig(calibration, transforms)
+    world = transforms is not None or isinstance(calibration, StereoRig)
+    points = np.asarray(points, dtype=float)
+    if points.ndim == 2 and points.shape[-1] != 3:
+        points = points.T
+    repr_cam1 = rig.reproject(points, cam=1, world=world).squeeze()
+    repr_cam2 = rig.reproject(points, cam=2, world=world).squeeze()
 
     return repr_cam1, repr_cam2
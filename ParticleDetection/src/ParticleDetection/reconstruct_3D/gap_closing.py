@@ -0,0 +1,257 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Re-linking of tracks, that were interrupted by rods missed for a few frames.
+
+Trackers, that only relate consecutive frames, lose the identity of a rod,
+that is not observed for some frames, and continue it as a new particle.
+:func:`close_gaps` is a post-pass over a whole tracked dataset, that links
+the ends of tracks to the starts of later tracks in one global assignment
+and relabels the particles accordingly.
+
+**Authors**: Adrian Niemann (adrian.niemann@ovgu.de), Dmitry Puzyrev
+(dmitry.puzyrev@ovgu.de)
+
+**Date**:       2024
+
+"""
+import logging
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+from scipy.spatial import cKDTree
+
+_logger = logging.getLogger(__name__)
+
+_POINT_COLUMNS = ["x1", "y1", "z1", "x2", "y2", "z2"]
+
+
+def close_gaps(
+    data: pd.DataFrame,
+    max_gap: int = 3,
+    max_distance: float = 10.0,
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Links tracks, that end, to tracks, that start shortly after.
+
+    A track is the sequence of observed rows of one particle (per color). A
+    row is observed, if its endpoints are finite and the rod is not
+    *unseen*, i.e. its ``unseen`` column is not set or, without this column,
+    none of its ``seen_...`` columns is ``0``.
+    The end of every track is extrapolated with its last velocity to the
+    frames of up to ``max_gap`` missed frames later. Tracks starting in these
+    frames within ``max_distance`` of the extrapolated rod center are the
+    candidates for a link. The costs of a link are the summed endpoint
+    distances of the extrapolated and the starting rod. All links are chosen
+    at once by a global assignment, in which every track end and start can
+    also stay unlinked at the cost of ``max_distance``. Linked tracks get the
+    particle number of the earlier track.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Tracked rods. Must contain at least the following columns:
+        x1, y1, z1, x2, y2, z2, frame, particle(, color, unseen, seen_...)
+    max_gap : int, optional
+        Maximum number of frames without an observation between two linked
+        tracks.\n
+        By default ``3``.
+    max_distance : float, optional
+        Maximum distance between the extrapolated and the starting rod center
+        of two linked tracks.\n
+        By default ``10.0``.
+
+    Returns
+    -------
+    Tuple[DataFrame, ndarray]
+        Returns the data with adjusted particle numbers. Unobserved rows,
+        that collide with observed rows of a linked track in the same frame,
+        are removed. Additionally, returns the costs of all links.
+    """
+    keys = ["color", "particle"] if "color" in data.columns else ["particle"]
+    track_ids = data.groupby(keys, sort=False).ngroup().to_numpy()
+    # first row of every track
+    tracks, track_rows = np.unique(track_ids, return_index=True)
+    frames = data["frame"].to_numpy()
+    points = data[_POINT_COLUMNS].to_numpy(dtype=float).reshape(-1, 2, 3)
+    observed = np.isfinite(points).all(axis=(1, 2)) & ~_unseen(data)
+
+    ends, starts, velocity = _track_ends(
+        track_ids[observed], frames[observed], points[observed]
+    )
+    end_track, start_track, cost = _candidates(
+        ends, starts, velocity, max_gap, max_distance
+    )
+    if "color" in data.columns:
+        colors = data["color"].to_numpy()[track_rows]
+        same_color = colors[end_track] == colors[start_track]
+        end_track = end_track[same_color]
+        start_track = start_track[same_color]
+        cost = cost[same_color]
+    linked, link_cost = _assign_links(
+        end_track, start_track, cost, max_distance
+    )
+    _logger.info(f"Closed {len(link_cost)} gaps between tracks.")
+
+    # every track takes the particle number of the first track of its chain
+    root = np.arange(len(tracks))
+    root[linked[1]] = linked[0]
+    while np.any(root[root] != root):
+        root = root[root]
+    particles = data["particle"].to_numpy()[track_rows]
+    out = data.copy()
+    out["particle"] = particles[root[track_ids]]
+    if len(link_cost):
+        # keep observed rows over unobserved ones of the same particle
+        out["_observed"] = observed
+        out = out.sort_values(by="_observed", ascending=False, kind="stable")
+        out = out.loc[~out.duplicated(subset=["frame", *keys])]
+        out = out.drop(columns="_observed").sort_index()
+    return out, link_cost
+
+
+def _unseen(data: pd.DataFrame) -> np.ndarray:
+    """Flags of *unseen* rods."""
+    if "unseen" in data.columns:
+        return data["unseen"].fillna(False).to_numpy(dtype=bool)
+    seen_cols = [col for col in data.columns if col.startswith("seen_")]
+    if not seen_cols:
+        return np.zeros(len(data), dtype=bool)
+    return (data[seen_cols] == 0).any(axis=1).to_numpy()
+
+
+def _track_ends(
+    track_ids: np.ndarray, frames: np.ndarray, points: np.ndarray
+) -> Tuple[dict, dict, np.ndarray]:
+    """First and last observation of every track and the velocity of the
+    rod center between its last two observations."""
+    order = np.lexsort((frames, track_ids))
+    track_ids, frames, points = track_ids[order], frames[order], points[order]
+    present, first = np.unique(track_ids, return_index=True)
+    last = np.r_[first[1:], len(track_ids)] - 1
+    before = np.maximum(last - 1, first)
+
+    centers = points.mean(axis=1)
+    dt = frames[last] - frames[before]
+    velocity = np.zeros((len(present), 3))
+    moving = dt > 0
+    velocity[moving] = centers[last[moving]] - centers[before[moving]]
+    velocity[moving] /= dt[moving, None]
+
+    ends = {
+        "track": present,
+        "frame": frames[last],
+        "points": points[last],
+    }
+    starts = {
+        "track": present,
+        "frame": frames[first],
+        "points": points[first],
+    }
+    return ends, starts, velocity
+
+
+def _candidates(
+    ends: dict,
+    starts: dict,
+    velocity: np.ndarray,
+    max_gap: int,
+    max_distance: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pairs of track ends and starts, whose rod centers are within
+    ``max_distance`` after extrapolating the ends to the start's frame."""
+    if not len(starts["track"]):
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0)
+    tree = cKDTree(starts["points"].mean(axis=1))
+    # (end, frame difference, coordinate)
+    steps = np.arange(1, max_gap + 2)
+    predicted = (
+        ends["points"].mean(axis=1)[:, None]
+        + velocity[:, None] * steps[None, :, None]
+    )
+    hits = tree.query_ball_point(predicted.reshape(-1, 3), r=max_distance)
+    lengths = np.fromiter((len(h) for h in hits), dtype=int, count=len(hits))
+    query = np.repeat(np.arange(len(hits)), lengths)
+    start = np.fromiter(
+        (j for h in hits for j in h), dtype=int, count=lengths.sum()
+    )
+    end, step = np.divmod(query, len(steps))
+    valid = starts["frame"][start] - ends["frame"][end] == steps[step]
+    end, step, start = end[valid], step[valid], start[valid]
+
+    shift = (velocity[end] * steps[step, None])[:, None]
+    cost = _endpoint_distances(
+        ends["points"][end] + shift, starts["points"][start]
+    )
+    return ends["track"][end], starts["track"][start], cost
+
+
+def _assign_links(
+    end_track: np.ndarray,
+    start_track: np.ndarray,
+    cost: np.ndarray,
+    alternative: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Chooses the links with the lowest total cost, where every track end
+    and start is linked at most once or stays unlinked at the
+    ``alternative`` cost. Returns the linked (end, start) tracks and the
+    costs of the links."""
+    if not len(cost):
+        return np.zeros((2, 0), dtype=int), np.zeros(0)
+    ends, end_idx = np.unique(end_track, return_inverse=True)
+    starts, start_idx = np.unique(start_track, return_inverse=True)
+    n_e, n_s = len(ends), len(starts)
+    # rows: ends, dummy starts; columns: starts, dummy ends
+    rows = np.concatenate(
+        [end_idx, np.arange(n_e), n_e + np.arange(n_s), n_e + start_idx]
+    )
+    cols = np.concatenate(
+        [start_idx, n_s + np.arange(n_e), np.arange(n_s), n_s + end_idx]
+    )
+    weights = np.concatenate(
+        [
+            cost,
+            np.full(n_e, alternative),
+            np.full(n_s, alternative),
+            np.zeros(len(cost)),
+        ]
+    )
+    graph = csr_matrix(
+        # offset, because explicit zeros are not treated as edges reliably
+        (weights + 1.0, (rows, cols)),
+        shape=(n_e + n_s, n_s + n_e),
+    )
+    row, col = min_weight_full_bipartite_matching(graph)
+    link = (row < n_e) & (col < n_s)
+    row, col = row[link], col[link]
+    link_cost = np.asarray(graph[row, col]).ravel() - 1.0
+    return np.stack([ends[row], starts[col]]), link_cost
+
+
+def _endpoint_distances(
+    points1: np.ndarray, points2: np.ndarray
+) -> np.ndarray:
+    """Summed endpoint distances of pairs of rods, of the better of both
+    endpoint orientations."""
+    return np.minimum(
+        np.linalg.norm(points1[:, 0] - points2[:, 0], axis=-1)
+        + np.linalg.norm(points1[:, 1] - points2[:, 1], axis=-1),
+        np.linalg.norm(points1[:, 0] - points2[:, 1], axis=-1)
+        + np.linalg.norm(points1[:, 1] - points2[:, 0], axis=-1),
+    )
@@ -25,25 +25,45 @@ Some functions are directly ported from a MATLAB implementation to python.
 **Date**:       01.11.2022
 
 """
+import contextlib
+import functools
 import itertools
 import logging
 import os
 import pathlib
 import warnings
-from typing import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Tuple, Union
 
 import cv2
 import numpy as np
 import pandas as pd
 import scipy.io as sio
 from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+from scipy.spatial import cKDTree
 from scipy.spatial.transform import Rotation as R
-from tqdm import tqdm
 
 import ParticleDetection.utils.data_loading as dl
+from ParticleDetection.reconstruct_3D.geometry import (
+    project_points,
+    triangulate_points,
+)
+from ParticleDetection.reconstruct_3D.stereo_rig import (
+    StereoRig,
+    as_stereo_rig,
+    init_worker,
+    worker_rig,
+)
+from ParticleDetection.utils.sinks import CSVSink
 
 _logger = logging.getLogger(__name__)
 
+_BLOCK_FRAMES = 1024
+"""int: Maximum number of frames matched at once by
+:func:`match_csv_complex`, before the results are written to disk."""
+
 
 def match_matlab_simple(
     cam1_folder,
@@ -417,23 +437,17 @@ def match_matlab_complex(
             ]
             pairs_original = np.reshape(pairs_original, (-1, 2, 2))
 
-            p_triang = cv2.triangulatePoints(
-                P1,
-                P2,
-                pairs_all[:, 0, :].squeeze().transpose(),
-                pairs_all[:, 1, :].squeeze().transpose(),
-            )
-            p_triang = np.asarray(
-                [p[0:3] / p[3] for p in p_triang.transpose()]
+            p_triang = triangulate_points(
+                P1, P2, pairs_all[:, 0, :], pairs_all[:, 1, :]
             )
 
             # Reprojection to the image plane for point matching
-            repr_cam1 = cv2.projectPoints(
+            repr_cam1 = project_points(
                 p_triang, r1, t1, calibration["CM1"], calibration["dist1"]
-            )[0].squeeze()
-            repr_cam2 = cv2.projectPoints(
+            )
+            repr_cam2 = project_points(
                 p_triang, r2, t2, calibration["CM2"], calibration["dist2"]
-            )[0].squeeze()
+            )
 
             repr_cam1 = pairs_original[:, 0, :] - repr_cam1
             repr_cam2 = pairs_original[:, 1, :] - repr_cam2
@@ -520,13 +534,19 @@ def match_csv_complex(
     calibration_file=None,
     transformation_file=None,
     rematching=True,
+    rig: StereoRig = None,
+    epipolar_tolerance: float = None,
+    rod_length: Tuple[float, float] = None,
+    workers: int = 1,
 ):
     """Matches and triangulates rods from ``*.csv`` data files.
 
     The function matches rod endpoints per frame such that the reprojection
     error is minimal. It takes ``*.csv`` files with the columns from
     :const:`~ParticleDetection.utils.datasets.DEFAULT_COLUMNS` as input and
-    also outputs the results in this format.
+    also outputs the results in this format. The results are appended to the
+    output files in blocks of frames, i.e. the output files can be read
+    while the matching is still running.
 
     Parameters
     ----------
@@ -558,6 +578,28 @@ def match_csv_complex(
         transformation from the first camera's coordinate system to the
         world/box coordinate system.\n
         By default the transformation constructed with Matlab is used.
+    rematching : bool, optional
+        Flag, whether to (re-)evaluate the rod combinations between camera 1
+        and camera 2, see ``renumber`` in :func:`match_frames`.\n
+        By default ``True``.
+    rig : StereoRig, optional
+        Already loaded stereocamera system. If it is given,
+        ``calibration_file`` and ``transformation_file`` are ignored.\n
+        By default ``None``.
+    epipolar_tolerance : float, optional
+        See :func:`match_frames`.\n
+        By default ``None``.
+    rod_length : Tuple[float, float], optional
+        See :func:`match_frames`.\n
+        By default ``None``.
+    workers : int, optional
+        Number of worker processes. With more than one worker, every color
+        is split into blocks of consecutive frames, that are matched in
+        parallel. The stereocamera system is sent to every worker only once
+        and the results are merged in frame order, i.e. the output is the
+        same as with a single process. ``None`` uses as many workers as
+        there are CPUs.\n
+        By default ``1``, i.e. all frames are matched in the calling process.
 
     Returns
     -------
@@ -577,69 +619,97 @@ def match_csv_complex(
     if not os.path.exists(output_folder):
         os.mkdir(output_folder)
 
-    calibration = dl.load_camera_calibration(str(calibration_file))
-    transforms = dl.load_world_transformation(str(transformation_file))
-
-    # Derive projection matrices from the calibration
-    r1 = np.eye(3)
-    t1 = np.expand_dims(np.array([0.0, 0.0, 0.0]), 1)
-    P1 = np.vstack((r1.T, t1.T)) @ calibration["CM1"].T
-    P1 = P1.T
-
-    r2 = calibration["R"]
-    t2 = calibration["T"]
-    P2 = np.vstack((r2.T, t2.T)) @ calibration["CM2"].T
-    P2 = P2.T
-
-    # Preparation of world transformations
-    rot = R.from_matrix(transforms["rotation"])
-    trans = transforms["translation"]
+    if rig is None:
+        rig = StereoRig.from_files(calibration_file, transformation_file)
+    if workers is None:
+        workers = os.cpu_count()
+    options = (rematching, epipolar_tolerance, rod_length)
+    colors = list(colors)
+    frame_numbers = list(frame_numbers)
+    n_blocks = max(workers, -(-len(frame_numbers) // _BLOCK_FRAMES))
+    blocks = [b for b in np.array_split(frame_numbers, n_blocks) if len(b)]
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker, initargs=(rig,)
+        )
 
-    all_repr_errs = []
-    all_rod_lengths = []
-    for color in colors:
+    def color_tasks(color: str):
+        # yields one callable per block, that returns the block's results
         f_in = input_folder + f"/rods_df_{color}.csv"
         data = pd.read_csv(f_in, sep=",", index_col=0)
-        df_out = pd.DataFrame()
-        for idx in frame_numbers:
-            ret = match_frame(
-                data,
+        for block in blocks:
+            args = (
+                data.loc[data.frame.isin(block)],
                 cam1_name,
                 cam2_name,
-                idx,
+                block,
                 color,
-                calibration,
-                P1,
-                P2,
-                rot,
-                trans,
-                r1,
-                r2,
-                t1,
-                t2,
-                rematching,
+                *options,
             )
-            tmp_df, costs, lens = ret
-            all_repr_errs.append(costs)
-            all_rod_lengths.append(lens)
-            df_out = pd.concat([df_out, tmp_df])
-        df_out.reset_index(drop=True, inplace=True)
-        df_out.to_csv(
-            os.path.join(output_folder, f"rods_df_{color}.csv"), sep=","
-        )
+            if pool is None:
+                yield functools.partial(_match_block, *args, rig=rig)
+            else:
+                yield pool.submit(_match_block, *args).result
+
+    all_repr_errs = []
+    all_rod_lengths = []
+    with pool or contextlib.nullcontext():
+        if pool is None:
+            # evaluated lazily, i.e. one block after the other
+            tasks = (color_tasks(color) for color in colors)
+        else:
+            tasks = [list(color_tasks(color)) for color in colors]
+
+        for color, color_blocks in zip(colors, tasks):
+            f_out = os.path.join(output_folder, f"rods_df_{color}.csv")
+            with CSVSink(f_out) as sink:
+                for block in color_blocks:
+                    df_out, costs, lens = block()
+                    sink.append(df_out)
+                    all_repr_errs.extend(costs)
+                    all_rod_lengths.extend(lens)
 
     return np.array(all_repr_errs), np.array(all_rod_lengths)
 
 
+def _match_block(
+    data: pd.DataFrame,
+    cam1_name: str,
+    cam2_name: str,
+    frames: Iterable[int],
+    color: str,
+    rematching: bool,
+    epipolar_tolerance: float,
+    rod_length: Tuple[float, float],
+    rig: StereoRig = None,
+) -> Tuple[pd.DataFrame, List[np.ndarray], List[np.ndarray]]:
+    """Runs :func:`match_frames` on a block of frames, using the worker's
+    stereocamera system if no ``rig`` is given."""
+    return match_frames(
+        data,
+        cam1_name,
+        cam2_name,
+        frames,
+        color,
+        worker_rig(rig),
+        renumber=rematching,
+        epipolar_tolerance=epipolar_tolerance,
+        rod_length=rod_length,
+    )
+
+
 def match_complex(
     data: pd.DataFrame,
     frame_numbers: Iterable[int],
     color: str,
-    calibration: dict,
-    transform: dict,
+    calibration: Union[dict, StereoRig],
+    transform: dict = None,
     cam1_name="gp1",
     cam2_name="gp2",
     renumber: bool = True,
+    epipolar_tolerance: float = None,
+    rod_length: Tuple[float, float] = None,
 ):
     """Matches and triangulates rods from a ``DataFrame``.
 
@@ -654,18 +724,26 @@ def match_complex(
         An iterable of frame numbers present in the data.
     color : str
         Color of the rods in ``data`` to match.
-    calibration : dict
+    calibration : dict | StereoRig
         Stereocamera calibration parameters with the required fields:\n
         ``"CM1"``: camera matrix of cam1\n
+        ``"dist1"``: distortion coefficients of cam1\n
+        ``"CM2"``: camera matrix of cam2\n
+        ``"dist2"``: distortion coefficients of cam2\n
         ``"R"``: rotation matrix between cam1 & cam2\n
         ``"T"``: translation vector between cam1 & cam2\n
-        ``"CM2"``: camera matrix of cam2
-    transform : dict
+        Alternatively, an already prepared :class:`.StereoRig`, that includes
+        the transformation to *world*/*experiment* coordinates.
+    transform : dict, optional
         Coordinate system transformation matrices from camera 1 coordinates to
         *world*/*experiment* coordinates.
         **Must contain the following fields:**\n
+        ``"rotation"``, ``"translation"``\n
+        or in the legacy format:\n
         ``"M_rotate_x"``, ``"M_rotate_y"``, ``"M_rotate_z"``, ``"M_trans"``,
-        ``"M_trans2"``
+        ``"M_trans2"``\n
+        It is ignored, if ``calibration`` is a :class:`.StereoRig`.\n
+        By default ``None``.
     cam1_name : str, optional
         First camera's identifier in the given dataset.\n
         By default ``"gp1"``.
@@ -679,6 +757,12 @@ def match_complex(
         ``False``:  Rod combinations between camera 1 and camera 1 as well as
         their respective endpoint combinations are (re-)evaluated.\n
         By default ``True``.
+    epipolar_tolerance : float, optional
+        See :func:`match_frames`.\n
+        By default ``None``.
+    rod_length : Tuple[float, float], optional
+        See :func:`match_frames`.\n
+        By default ``None``.
 
     Returns
     -------
@@ -686,56 +770,18 @@ def match_complex(
         Returns the endpoint matched `DataFrame` together with the reprojection
         errors and the resulted rod lengths.
     """
-    # Derive projection matrices from the calibration
-    r1 = np.eye(3)
-    t1 = np.expand_dims(np.array([0.0, 0.0, 0.0]), 1)
-    P1 = np.vstack((r1.T, t1.T)) @ calibration["CM1"].T
-    P1 = P1.T
-
-    r2 = calibration["R"]
-    t2 = calibration["T"]
-    P2 = np.vstack((r2.T, t2.T)) @ calibration["CM2"].T
-    P2 = P2.T
-
-    if "translation" in transform.keys():
-        rot = R.from_matrix(transform["rotation"])
-        trans = transform["translation"]
-    else:
-        rotx = R.from_matrix(np.asarray(transform["M_rotate_x"])[0:3, 0:3])
-        roty = R.from_matrix(np.asarray(transform["M_rotate_y"])[0:3, 0:3])
-        rotz = R.from_matrix(np.asarray(transform["M_rotate_z"])[0:3, 0:3])
-        tw1 = np.asarray(transform["M_trans"])[0:3, 3]
-        tw2 = np.asarray(transform["M_trans2"])[0:3, 3]
-        rot = rotz * roty * rotx
-        trans = rot.apply(tw1) + tw2
-
-    all_repr_errs = []
-    all_rod_lengths = []
-    df_out = pd.DataFrame()
-    for idx in frame_numbers:
-        ret = match_frame(
-            data,
-            cam1_name,
-            cam2_name,
-            idx,
-            color,
-            calibration,
-            P1,
-            P2,
-            rot,
-            trans,
-            r1,
-            r2,
-            t1,
-            t2,
-            renumber,
-        )
-        tmp_df, costs, lens = ret
-        all_repr_errs.append(costs)
-        all_rod_lengths.append(lens)
-        df_out = pd.concat([df_out, tmp_df])
-    df_out.reset_index(drop=True, inplace=True)
-    return df_out, all_repr_errs, all_rod_lengths
+    rig = as_stereo_rig(calibration, transform)
+    return match_frames(
+        data,
+        cam1_name,
+        cam2_name,
+        frame_numbers,
+        color,
+        rig,
+        renumber=renumber,
+        epipolar_tolerance=epipolar_tolerance,
+        rod_length=rod_length,
+    )
 
 
 def match_frame(
@@ -744,16 +790,18 @@ def match_frame(
     cam2_name: str,
     frame: int,
     color: str,
-    calibration: dict,
-    P1: np.ndarray,
-    P2: np.ndarray,
-    rot: R,
-    trans: np.ndarray,
-    r1: np.ndarray,
-    r2: np.ndarray,
-    t1: np.ndarray,
-    t2: np.ndarray,
+    calibration: Union[dict, StereoRig],
+    P1: np.ndarray = None,
+    P2: np.ndarray = None,
+    rot: R = None,
+    trans: np.ndarray = None,
+    r1: np.ndarray = None,
+    r2: np.ndarray = None,
+    t1: np.ndarray = None,
+    t2: np.ndarray = None,
     renumber: bool = True,
+    epipolar_tolerance: float = None,
+    rod_length: Tuple[float, float] = None,
 ):
     """Matches and triangulates rods from a ``DataFrame``.
 
@@ -769,29 +817,28 @@ def match_frame(
         Frame in ``data`` who's endpoints shall be (re-)evaluated.
     color : str
         Color of the rods in ``data`` to match.
-    calibration : dict
+    calibration : dict | StereoRig
         Stereocamera calibration parameters with the required fields:\n
         ``"CM1"``: camera matrix of cam1\n
+        ``"dist1"``: distortion coefficients of cam1\n
+        ``"CM2"``: camera matrix of cam2\n
+        ``"dist2"``: distortion coefficients of cam2\n
         ``"R"``: rotation matrix between cam1 & cam2\n
         ``"T"``: translation vector between cam1 & cam2\n
-        ``"CM2"``: camera matrix of cam2
-    P1 : ndarray
-        Projection matrix for camera 1.
-    P2 : ndarray
-        Projection matrix for camera 2.
-    rot : Rotation
+        Preferably, an already prepared :class:`.StereoRig`, that includes
+        the transformation to *world*/*experiment* coordinates.
+    P1, P2, r1, r2, t1, t2 : ndarray, optional
+        Unused, the projection matrices and camera poses are derived from
+        ``calibration``. Only kept for backwards compatibility.
+    rot : Rotation, optional
         Rotation from camera 1 coordinates to *world*/*experiment* coordinates.
-    trans : ndarray
+        It is ignored, if ``calibration`` is a :class:`.StereoRig`.\n
+        By default ``None``, i.e. no transformation.
+    trans : ndarray, optional
         Translation vector as part of the transformation to
         *world*/*experiment* coordinates.
-    r1 : ndarray
-        Rotation matrix of camera 1.
-    r2 : ndarray
-        Rotation matrix of camera 2.
-    t1 : ndarray
-        Translation vector of camera 1.
-    t2 : ndarray
-        Translation vector of camera 2.
+        It is ignored, if ``calibration`` is a :class:`.StereoRig`.\n
+        By default ``None``, i.e. no transformation.
     renumber : bool, optional
         Flag, whether to keep the already assigned combinations between
         camera 1 and camera 2.\n
@@ -799,16 +846,156 @@ def match_frame(
         ``False``: Rod combinations between camera 1 and camera 1 as well as
         their respective endpoint combinations are (re-)evaluated.\n
         By default ``True``.
+    epipolar_tolerance : float, optional
+        See :func:`match_frames`.\n
+        By default ``None``.
+    rod_length : Tuple[float, float], optional
+        See :func:`match_frames`.\n
+        By default ``None``.
 
     Returns
     -------
-    Tuple[DataFrame, ndarray, ndarray]
+    Tuple[DataFrame, ndarray, ndarray] | None
         Returns the ``DataFrame`` with (re-)matched endpoints for ``frame`` of
         ``color``. Additionally, returns the assignment costs, i.e. the sum of
         end point reprojection errors per rod. Lastly, returns the lengths of
-        the reconstructed rods.
+        the reconstructed rods.\n
+        Returns ``None``, if no rod data is available for matching on
+        ``frame``.
+
+    See also
+    --------
+    :func:`match_frames`
+    """
+    tmp_df, costs, lens = match_frames(
+        data,
+        cam1_name,
+        cam2_name,
+        [frame],
+        color,
+        _rig_from_arguments(calibration, rot, trans),
+        renumber=renumber,
+        epipolar_tolerance=epipolar_tolerance,
+        rod_length=rod_length,
+    )
+    if not len(costs):
+        # no rod data available for matching
+        return
+    return tmp_df, costs[0], lens[0]
+
+
+def match_frames(
+    data: pd.DataFrame,
+    cam1_name: str,
+    cam2_name: str,
+    frames: Iterable[int],
+    color: str,
+    calibration: Union[dict, StereoRig],
+    P1: np.ndarray = None,
+    P2: np.ndarray = None,
+    rot: R = None,
+    trans: np.ndarray = None,
+    r1: np.ndarray = None,
+    r2: np.ndarray = None,
+    t1: np.ndarray = None,
+    t2: np.ndarray = None,
+    renumber: bool = True,
+    chunk_size: int = 256,
+    epipolar_tolerance: float = None,
+    rod_length: Tuple[float, float] = None,
+    dtype: type = np.float64,
+) -> Tuple[pd.DataFrame, List[np.ndarray], List[np.ndarray]]:
+    """Matches and triangulates rods of multiple frames from a ``DataFrame``.
+
+    This is the batched equivalent of calling :func:`match_frame` for every
+    frame in ``frames``. Undistortion, triangulation and reprojection of all
+    rod/endpoint combinations are computed with a few vectorized calls for
+    blocks of ``chunk_size`` frames, only the assignment of rods between the
+    cameras is solved frame by frame.
+
+    By default, every rod of camera 1 is combined with every rod of camera 2
+    of the same frame when ``renumber=True``. Set ``epipolar_tolerance``
+    and/or ``rod_length`` to triangulate only plausible rod combinations and
+    solve a sparse assignment instead. Frames, for which the plausible
+    combinations do not allow to assign every rod of the camera with fewer
+    rods, are matched with all combinations as before.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Dataset of rod positions.
+    cam1_name : str
+        First camera's identifier in the given dataset, e.g. ``"gp1"``.
+    cam2_name : str
+        Second camera's identifier in the given dataset, e.g. ``"gp2"``.
+    frames : Iterable[int]
+        Frames in ``data`` who's endpoints shall be (re-)evaluated.
+    color : str
+        Color of the rods in ``data`` to match.
+    calibration : dict | StereoRig
+        Stereocamera calibration parameters with the required fields:\n
+        ``"CM1"``: camera matrix of cam1\n
+        ``"dist1"``: distortion coefficients of cam1\n
+        ``"CM2"``: camera matrix of cam2\n
+        ``"dist2"``: distortion coefficients of cam2\n
+        ``"R"``: rotation matrix between cam1 & cam2\n
+        ``"T"``: translation vector between cam1 & cam2\n
+        Preferably, an already prepared :class:`.StereoRig`, that includes
+        the transformation to *world*/*experiment* coordinates.
+    P1, P2, r1, r2, t1, t2 : ndarray, optional
+        Unused, the projection matrices and camera poses are derived from
+        ``calibration``. Only kept for backwards compatibility.
+    rot : Rotation, optional
+        Rotation from camera 1 coordinates to *world*/*experiment* coordinates.
+        It is ignored, if ``calibration`` is a :class:`.StereoRig`.\n
+        By default ``None``, i.e. no transformation.
+    trans : ndarray, optional
+        Translation vector as part of the transformation to
+        *world*/*experiment* coordinates.
+        It is ignored, if ``calibration`` is a :class:`.StereoRig`.\n
+        By default ``None``, i.e. no transformation.
+    renumber : bool, optional
+        Flag, whether to keep the already assigned combinations between
+        camera 1 and camera 2.\n
+        ``True``: Only the endpoint combinations are (re-)evaluated.\n
+        ``False``: Rod combinations between camera 1 and camera 1 as well as
+        their respective endpoint combinations are (re-)evaluated.\n
+        By default ``True``.
+    chunk_size : int, optional
+        Number of frames that are processed together. Larger values reduce
+        the per-frame overhead further, but the memory consumption grows with
+        ``chunk_size * rods_cam1 * rods_cam2``.\n
+        By default ``256``.
+    epipolar_tolerance : float, optional
+        Maximum distance in pixels of (undistorted) rod endpoints to the
+        epipolar lines of their counterparts in the other camera for a rod
+        combination to be considered. Candidates are found with a KD-tree
+        over the epipolar coordinates of the endpoints, see
+        :meth:`.StereoRig.epipolar_coordinates`. Only used with
+        ``renumber=True``.\n
+        By default ``None``, i.e. no epipolar gating.
+    rod_length : Tuple[float, float], optional
+        Minimum and maximum plausible length of a reconstructed rod in
+        *world*/*experiment* units. Rod combinations outside of this window
+        are discarded before the assignment. Only used with
+        ``renumber=True``.\n
+        By default ``None``, i.e. no restriction of the rod length.
+    dtype : type, optional
+        Floating point type of the undistorted points, triangulations and
+        reprojections of all rod combinations. ``np.float32`` halves their
+        memory, which allows larger ``chunk_size`` values, at the expense of
+        a coarser reconstruction, see
+        :mod:`~ParticleDetection.reconstruct_3D.geometry`.\n
+        By default ``np.float64``.
+
+    Returns
+    -------
+    Tuple[DataFrame, List[ndarray], List[ndarray]]
+        Returns the ``DataFrame`` with (re-)matched endpoints for all
+        ``frames`` of ``color``. Additionally, returns the assignment costs
+        and the lengths of the reconstructed rods, one array per frame.
+        Frames without rod data for matching are omitted from all outputs.
     """
-    # Load data
     cols_cam1 = [
         f"x1_{cam1_name}",
         f"y1_{cam1_name}",
@@ -821,181 +1008,474 @@ def match_frame(
         f"x2_{cam2_name}",
         f"y2_{cam2_name}",
     ]
-    _data_cam1 = data.loc[data.frame == frame, cols_cam1]
-    _data_cam2 = data.loc[data.frame == frame, cols_cam2]
-    # remove rows with NaNs or only 0s
-    _data_cam1.dropna(how="all", inplace=True)
-    _data_cam2.dropna(how="all", inplace=True)
-    _data_cam1 = _data_cam1.loc[(_data_cam1 != 0).any(axis=1)]
-    _data_cam2 = _data_cam2.loc[(_data_cam2 != 0).any(axis=1)]
-    if not renumber:
-        drop_rows = _data_cam1.index.symmetric_difference(_data_cam2.index)
-        _data_cam1.drop(index=drop_rows, inplace=True, errors="ignore")
-        _data_cam2.drop(index=drop_rows, inplace=True, errors="ignore")
-        df_particles = data.drop(index=drop_rows, errors="ignore")[
-            ["frame", "particle"]
-        ]
-    if len(_data_cam1.index) == 0 or len(_data_cam2.index) == 0:
-        # no rod data available for matching
-        return
+    cols_3d = ["x1", "y1", "z1", "x2", "y2", "z2", "x", "y", "z", "l"]
+    seen_cols = [col for col in data.columns if "seen" in col]
+    keep_particles = (not renumber) and ("particle" in data.columns)
+    rig = _rig_from_arguments(calibration, rot, trans)
+
+    # Group the rows by frame, following the order given in ``frames``
+    frames = pd.unique(np.asarray(list(frames)))
+    selected = data.loc[data.frame.isin(frames)]
+    frame_pos = pd.Index(frames).get_indexer(selected.frame)
+    order = np.argsort(frame_pos, kind="stable")
+    frame_pos = frame_pos[order]
+    rods_cam1 = selected[cols_cam1].to_numpy(dtype=float)[order]
+    rods_cam2 = selected[cols_cam2].to_numpy(dtype=float)[order]
+    if keep_particles:
+        particles = selected["particle"].to_numpy()[order]
+
+    out_arrays = []
+    out_frames = []
+    out_particles = []
+    all_repr_errs = []
+    all_rod_lengths = []
+    for start in range(0, len(frames), chunk_size):
+        lo, hi = np.searchsorted(frame_pos, [start, start + chunk_size])
+        groups = frame_pos[lo:hi] - start
+        matched = _match_chunk(
+            rods_cam1[lo:hi].reshape(-1, 2, 2),
+            rods_cam2[lo:hi].reshape(-1, 2, 2),
+            groups,
+            min(chunk_size, len(frames) - start),
+            rig,
+            renumber,
+            epipolar_tolerance,
+            rod_length,
+            dtype,
+        )
+        for group, row1, out, costs in matched:
+            out_arrays.append(out)
+            out_frames.append(np.full(len(out), frames[start + group]))
+            if keep_particles:
+                out_particles.append(particles[lo:hi][row1])
+            else:
+                out_particles.append(np.arange(len(out)))
+            all_repr_errs.append(costs)
+            all_rod_lengths.append(out[:, 9])
 
-    # format of rods_camX: [rod, point, coordinate(x/y)]
-    rods_cam1 = _data_cam1.to_numpy().reshape(-1, 2, 2)
-    rods_cam2 = _data_cam2.to_numpy().reshape(-1, 2, 2)
+    if not out_arrays:
+        return pd.DataFrame(), all_repr_errs, all_rod_lengths
 
-    # Undistort points using the camera calibration
-    tmp_points = cv2.undistortImagePoints(
-        rods_cam1.reshape(2, -1), calibration["CM1"], calibration["dist1"]
-    ).squeeze()
-    undist_cam1 = np.zeros(tmp_points.shape)
-    tmp_points = np.concatenate([tmp_points[:, 0], tmp_points[:, 1]])
-    for i in range(len(tmp_points)):
-        undist_cam1[i // 2][i % 2] = tmp_points[i]
-    undist_cam1 = undist_cam1.reshape((-1, 2, 2))
-
-    tmp_points = cv2.undistortImagePoints(
-        rods_cam2.reshape(2, -1), calibration["CM2"], calibration["dist2"]
-    ).squeeze()
-    undist_cam2 = np.zeros(tmp_points.shape)
-    tmp_points = np.concatenate([tmp_points[:, 0], tmp_points[:, 1]])
-    for i in range(len(tmp_points)):
-        undist_cam2[i // 2][i % 2] = tmp_points[i]
-    undist_cam2 = undist_cam2.reshape((-1, 2, 2))
-
-    if renumber:
-        # Triangulation of all possible point-pairs to 3D
-        pairs_all = [
-            list(itertools.product(p[0], p[1]))
-            for p in itertools.product(undist_cam1, undist_cam2)
-        ]
-        pairs_original = [
-            list(itertools.product(p[0], p[1]))
-            for p in itertools.product(rods_cam1, rods_cam2)
-        ]
-
-    else:
-        pairs_all = [
-            list(itertools.product(p[0], p[1]))
-            for p in zip(undist_cam1, undist_cam2)
-        ]
-        pairs_original = [
-            list(itertools.product(p[0], p[1]))
-            for p in zip(rods_cam1, rods_cam2)
-        ]
-
-    pairs_all = np.reshape(pairs_all, (-1, 2, 2))
-    pairs_original = np.reshape(pairs_original, (-1, 2, 2))
-
-    p_triang = cv2.triangulatePoints(
-        P1,
-        P2,
-        pairs_all[:, 0, :].squeeze().transpose(),
-        pairs_all[:, 1, :].squeeze().transpose(),
+    # Data preparation for saving as *.csv
+    df_out = pd.DataFrame(
+        np.concatenate(out_arrays), columns=[*cols_3d, *cols_cam1, *cols_cam2]
+    )
+    df_out["frame"] = np.concatenate(out_frames)
+    df_out["color"] = color
+    df_out["particle"] = np.concatenate(out_particles)
+    df_out[seen_cols] = 1
+    return df_out, all_repr_errs, all_rod_lengths
+
+
+def triangulate_rods(
+    rods_cam1: np.ndarray,
+    rods_cam2: np.ndarray,
+    calibration: Union[dict, StereoRig],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Triangulates already matched rods without solving an assignment.
+
+    Both endpoint combinations of every rod pair are evaluated and the one
+    with the lower reprojection error is used, like :func:`match_frame` does
+    with ``renumber=False``. This is intended for re-triangulating
+    individual rods with low latency, e.g. after manual corrections of their
+    2D positions.
+
+    Parameters
+    ----------
+    rods_cam1 : ndarray
+        Rod endpoints on camera 1 ``[x1, y1, x2, y2]`` of shape ``(n, 4)`` or
+        ``(4,)``.
+    rods_cam2 : ndarray
+        Endpoints of the same rods on camera 2, same shape as ``rods_cam1``.
+    calibration : dict | StereoRig
+        Stereocamera calibration parameters, see :func:`match_frame`.
+        Preferably, an already prepared :class:`.StereoRig`, that includes
+        the transformation to *world*/*experiment* coordinates.
+
+    Returns
+    -------
+    Tuple[ndarray, ndarray]
+        The reconstructed rods in the column order ``[x1, y1, z1, x2, y2, z2,
+        x, y, z, l]`` of shape ``(n, 10)`` and the sum of endpoint
+        reprojection errors per rod ``(n,)``. The 3D endpoints are ordered
+        like the endpoints on camera 1.
+    """
+    rig = as_stereo_rig(calibration)
+    rods_cam1 = np.asarray(rods_cam1, dtype=float).reshape(-1, 2, 2)
+    rods_cam2 = np.asarray(rods_cam2, dtype=float).reshape(-1, 2, 2)
+    p_triang, repr_errs = _combo_geometry(
+        rods_cam1,
+        rods_cam2,
+        rig.undistort(rods_cam1, cam=1),
+        rig.undistort(rods_cam2, cam=2),
+        rig,
+    )
+    costs, point_choices = _endpoint_choice(repr_errs)
+    # endpoint 1 of camera 1 is part of the combinations 0 and 1
+    p1 = np.where(point_choices[:, None], p_triang[:, 0], p_triang[:, 1])
+    p2 = np.where(point_choices[:, None], p_triang[:, 3], p_triang[:, 2])
+    out = np.empty((len(p_triang), 10))
+    out[:, 0:3] = p1
+    out[:, 3:6] = p2
+    out[:, 6:9] = (p1 + p2) / 2
+    out[:, 9] = np.linalg.norm(p2 - p1, axis=1)
+    return out, costs
+
+
+def _rig_from_arguments(
+    calibration: Union[dict, StereoRig],
+    rot: R = None,
+    trans: np.ndarray = None,
+) -> StereoRig:
+    """Creates a :class:`.StereoRig` from the legacy function arguments."""
+    if isinstance(calibration, StereoRig) or rot is None:
+        return as_stereo_rig(calibration)
+    return StereoRig(
+        calibration, {"rotation": rot.as_matrix(), "translation": trans}
+    )
+
+
+def _valid_rods(rods: np.ndarray) -> np.ndarray:
+    """Marks rods (``(n, 2, 2)``) that are neither only ``NaN`` nor only
+    ``0``."""
+    rods = rods.reshape(len(rods), -1)
+    return ~np.isnan(rods).all(axis=1) & (rods != 0).any(axis=1)
+
+
+def _group_positions(
+    groups: np.ndarray, mask: np.ndarray, n_groups: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Position of every masked row within its (sorted, contiguous) group and
+    the number of masked rows per group."""
+    counts = np.bincount(groups[mask], minlength=n_groups)
+    before = np.cumsum(mask) - mask
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    return before - offsets[groups], counts
+
+
+def _combo_geometry(
+    rods_cam1: np.ndarray,
+    rods_cam2: np.ndarray,
+    undist_cam1: np.ndarray,
+    undist_cam2: np.ndarray,
+    rig: StereoRig,
+    dtype: type = np.float64,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Triangulates and reprojects all four endpoint combinations of rod
+    pairs.
+
+    The rod arrays are of shape ``(n, 2, 2)``, i.e. ``(pair, endpoint,
+    coordinate)``, and the combinations are ordered as
+    ``(p11, p21), (p11, p22), (p12, p21), (p12, p22)``.
+
+    Returns
+    -------
+    Tuple[ndarray, ndarray]
+        The 3D points in *world*/*experiment* coordinates ``(n, 4, 3)`` and
+        the mean reprojection error of both cameras per combination
+        ``(n, 4)``.
+    """
+    # combination c uses endpoint c // 2 of cam1 and c % 2 of cam2
+    ep1 = np.array([0, 0, 1, 1])
+    ep2 = np.array([0, 1, 0, 1])
+    p_triang = rig.triangulate(
+        undist_cam1[:, ep1], undist_cam2[:, ep2], undistort=False, dtype=dtype
     )
-    p_triang = np.asarray([p[0:3] / p[3] for p in p_triang.transpose()])
 
     # Reprojection to the image plane for point matching
-    repr_cam1 = cv2.projectPoints(
-        p_triang, r1, t1, calibration["CM1"], calibration["dist1"]
-    )[0].squeeze()
-    repr_cam2 = cv2.projectPoints(
-        p_triang, r2, t2, calibration["CM2"], calibration["dist2"]
-    )[0].squeeze()
-
-    repr_cam1 = pairs_original[:, 0, :] - repr_cam1
-    repr_cam2 = pairs_original[:, 1, :] - repr_cam2
-    # Dimensions p_repr: [combo, err_point, cam]
-    p_repr = np.stack([repr_cam1, repr_cam2], axis=2)
-    p_repr = np.swapaxes(p_repr, 1, 2)  # [combo, cam, err_point]
-    repr_errs = np.mean(np.linalg.norm(p_repr, axis=2), axis=1)
+    repr_cam1 = rig.reproject(p_triang, cam=1, dtype=dtype)
+    repr_cam2 = rig.reproject(p_triang, cam=2, dtype=dtype)
+    repr_errs = (
+        np.linalg.norm(rods_cam1[:, ep1] - repr_cam1, axis=-1)
+        + np.linalg.norm(rods_cam2[:, ep2] - repr_cam2, axis=-1)
+    ) / 2
 
     # Transformation to world coordinates
-    p_triang = rot.apply(p_triang) + trans
+    return rig.to_world(p_triang).astype(dtype, copy=False), repr_errs
+
+
+def _endpoint_choice(repr_errs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Chooses the endpoint matching with the lower reprojection error from
+    the combinations of :func:`_combo_geometry`.
 
-    # Consolidate data
+    Returns
+    -------
+    Tuple[ndarray, ndarray]
+        The costs of the chosen matching per rod pair and whether the
+        matching (p11, p21) & (p12, p22) was chosen.
+    """
     # Caution: the data order is different form the MATLAB script
     #   ---> Matlab: (p11, p21), (p12, p21), (p11, p22), (p12, p22)
     #   ---> Python: (p11, p21), (p11, p22), (p12, p21), (p12, p22)
-    # repr_errs desired shape:[block x err(p)] with
-    #   block: re11, re12, re21, re22
-    repr_errs = np.reshape(repr_errs, (-1, 4))
-    if renumber:
-        costs = np.reshape(
-            np.min(
-                [
-                    np.sum(repr_errs[:, 0::3], axis=1),
-                    np.sum(repr_errs[:, 1:3], axis=1),
-                ],
-                axis=0,
-            ),
-            (len(undist_cam1), len(undist_cam2)),
-        )
-        cam1_ind, cam2_ind = linear_sum_assignment(costs)
-        costs = costs[cam1_ind, cam2_ind]
-        point_choices = np.asarray(
-            np.sum(repr_errs[:, 0::3], axis=1)
-            <= np.sum(repr_errs[:, 1:3], axis=1)
+    err_straight = repr_errs[:, 0] + repr_errs[:, 3]
+    err_crossed = repr_errs[:, 1] + repr_errs[:, 2]
+    return np.minimum(err_straight, err_crossed), err_straight <= err_crossed
+
+
+def _match_chunk(
+    rods_cam1: np.ndarray,
+    rods_cam2: np.ndarray,
+    groups: np.ndarray,
+    n_groups: int,
+    rig: StereoRig,
+    renumber: bool,
+    epipolar_tolerance: float = None,
+    rod_length: Tuple[float, float] = None,
+    dtype: type = np.float64,
+) -> List[Tuple[int, np.ndarray, np.ndarray, np.ndarray]]:
+    """Matches the rods of a block of frames.
+
+    ``rods_cam1`` and ``rods_cam2`` hold one row of the dataset per rod with
+    the shape ``(rows, endpoint, coordinate)``. ``groups`` assigns every row to
+    a frame of the block and must be sorted. See :func:`match_frames` for
+    ``epipolar_tolerance``, ``rod_length`` and ``dtype``.
+
+    Returns
+    -------
+    List[Tuple[int, ndarray, ndarray, ndarray]]
+        One entry per frame with data to match: the frame's index in the
+        block, the rows used from camera 1, the output rows in the layout of
+        :func:`match_frame` and the assignment costs.
+    """
+    valid1 = _valid_rods(rods_cam1)
+    valid2 = _valid_rods(rods_cam2)
+    if not renumber:
+        # only rods present in both cameras can be reconstructed
+        valid1 = valid2 = valid1 & valid2
+
+    # Undistort points using the camera calibration
+    undist_cam1 = np.full(rods_cam1.shape, np.nan, dtype=dtype)
+    undist_cam2 = np.full(rods_cam2.shape, np.nan, dtype=dtype)
+    undist_cam1[valid1] = rig.undistort(rods_cam1[valid1], cam=1)
+    undist_cam2[valid2] = rig.undistort(rods_cam2[valid2], cam=2)
+
+    def geometry(row1, row2):
+        p_triang, repr_errs = _combo_geometry(
+            rods_cam1[row1],
+            rods_cam2[row2],
+            undist_cam1[row1],
+            undist_cam2[row2],
+            rig,
+            dtype,
         )
-        point_choices = point_choices.reshape((len(rods_cam1), len(rods_cam2)))
-    else:
-        costs = np.min(
-            [
-                np.sum(repr_errs[:, 0::3], axis=1),
-                np.sum(repr_errs[:, 1:3], axis=1),
-            ],
-            axis=0,
+        return (p_triang, *_endpoint_choice(repr_errs))
+
+    def collect(group, row1, row2, chosen, p_triang, costs, choices):
+        return (
+            group,
+            row1[chosen],
+            _assemble_output(
+                p_triang[chosen],
+                choices[chosen],
+                rods_cam1[row1[chosen]],
+                rods_cam2[row2[chosen]],
+            ),
+            costs[chosen],
         )
-        cam1_ind = np.arange(0, len(undist_cam1))
-        cam2_ind = np.arange(0, len(undist_cam2))
-        point_choices = np.sum(repr_errs[:, 0::3], axis=1) <= np.sum(
-            repr_errs[:, 1:3], axis=1
+
+    results = []
+    if not renumber:
+        row1 = np.nonzero(valid1)[0]
+        n_rods = np.bincount(groups[row1], minlength=n_groups)
+        starts = np.concatenate([[0], np.cumsum(n_rods)[:-1]])
+        matched = geometry(row1, row1)
+        for group in np.nonzero(n_rods)[0]:
+            chosen = np.arange(starts[group], starts[group] + n_rods[group])
+            results.append(collect(group, row1, row1, chosen, *matched))
+        return results
+
+    pos1, n1 = _group_positions(groups, valid1, n_groups)
+    pos2, n2 = _group_positions(groups, valid2, n_groups)
+    dense = (n1 > 0) & (n2 > 0)
+    if epipolar_tolerance is not None or rod_length is not None:
+        if epipolar_tolerance is None:
+            row1, row2 = _all_pairs(groups, valid1, valid2, pos1, pos2, dense)
+        else:
+            row1, row2 = _epipolar_pairs(
+                undist_cam1,
+                undist_cam2,
+                groups,
+                valid1,
+                valid2,
+                rig,
+                epipolar_tolerance,
+            )
+        p_triang, pair_costs, point_choices = geometry(row1, row2)
+        plausible = np.isfinite(pair_costs)
+        if rod_length is not None:
+            lengths = np.where(
+                point_choices,
+                np.linalg.norm(p_triang[:, 3] - p_triang[:, 0], axis=1),
+                np.linalg.norm(p_triang[:, 2] - p_triang[:, 1], axis=1),
+            )
+            plausible &= (lengths >= rod_length[0]) & (
+                lengths <= rod_length[1]
+            )
+        row1, row2 = row1[plausible], row2[plausible]
+        matched = (
+            p_triang[plausible],
+            pair_costs[plausible],
+            point_choices[plausible],
         )
-        point_choices = np.eye(len(point_choices)) * point_choices
-        p_triang = p_triang.reshape(-1, 4, 3)
-        p_triang = np.tile(p_triang, (len(p_triang), 1, 1))
-
-    try:
-        p_triang = p_triang.reshape((len(rods_cam1), len(rods_cam2), 4, 3))
-    except ValueError as e:
-        _logger.error(f"A value error has occured during reshaping: {e}")
-
-    # Accumulation of the data for saving
-    out = np.zeros((len(cam1_ind), 2 * 3 + 3 + 1 + 4 + 4))
-    for i1 in range(len(cam1_ind)):
-        i2 = cam2_ind[i1]
-        if point_choices[i1, i2]:
-            # use point matching of (p11,p21) and (p12,p22)
-            out[i1, 0:6] = p_triang[i1, i2, 0::3, :].flatten()
-            out[i1, 6:9] = p_triang[i1, i2, 0::3, :].sum(axis=0) / 2
-            out[i1, 9] = np.linalg.norm(
-                np.diff(p_triang[i1, i2, 0::3, :], axis=0)
+        i_pair, j_pair = pos1[row1], pos2[row2]
+        bounds = np.searchsorted(groups[row1], np.arange(n_groups + 1))
+        for group in np.nonzero(dense)[0]:
+            lo, hi = bounds[group], bounds[group + 1]
+            # candidates are sorted by (i, j) within every frame
+            keys = i_pair[lo:hi] * n2[group] + j_pair[lo:hi]
+            graph = csr_matrix(
+                # offset, because all matchings have the same size and
+                # explicit zeros are not treated as edges reliably
+                (matched[1][lo:hi] + 1.0, (i_pair[lo:hi], j_pair[lo:hi])),
+                shape=(n1[group], n2[group]),
             )
-            out[i1, 10:14] = rods_cam1[i1, :].flatten()
-            out[i1, 14:] = rods_cam2[i2, :].flatten()
-        else:
-            # use point matching of (p11,p22) and (p12,p21)
-            out[i1, 0:6] = p_triang[i1, i2, 1:3, :].flatten()
-            out[i1, 6:9] = p_triang[i1, i2, 1:3, :].sum(axis=0) / 2
-            out[i1, 9] = np.linalg.norm(
-                np.diff(p_triang[i1, i2, 1:3, :], axis=0)
+            try:
+                cam1_ind, cam2_ind = min_weight_full_bipartite_matching(graph)
+            except ValueError:
+                # the plausible combinations leave rods unmatched
+                continue
+            chosen = lo + np.searchsorted(
+                keys, cam1_ind * n2[group] + cam2_ind
+            )
+            results.append(collect(group, row1, row2, chosen, *matched))
+            dense[group] = False
+        if dense.any():
+            _logger.debug(
+                f"Matching {dense.sum()} frame(s) with all rod combinations."
             )
-            out[i1, 10:14] = rods_cam1[i1, -1::-1].flatten()
-            out[i1, 14:] = rods_cam2[i2, -1::-1].flatten()
 
-    # Data preparation for saving as *.csv
-    cols_3d = ["x1", "y1", "z1", "x2", "y2", "z2", "x", "y", "z", "l"]
-    tmp_df = pd.DataFrame(out, columns=[*cols_3d, *cols_cam1, *cols_cam2])
-    tmp_df["frame"] = frame
-    tmp_df["color"] = color
-    if (not renumber) and ("particle" in data.columns):
-        tmp_df["particle"] = df_particles.loc[
-            df_particles.frame == frame, "particle"
-        ].values
-    else:
-        tmp_df["particle"] = list(range(len(tmp_df)))
-    seen_cols = [col for col in data.columns if "seen" in col]
-    tmp_df[seen_cols] = 1
-    return tmp_df, costs, out[:, 9]
+    # Pair every rod of cam1 with every rod of cam2 of the same frame
+    row1, row2 = _all_pairs(groups, valid1, valid2, pos1, pos2, dense)
+    matched = geometry(row1, row2)
+    i_pair, j_pair = pos1[row1], pos2[row2]
+    bounds = np.searchsorted(groups[row1], np.arange(n_groups + 1))
+    for group in np.nonzero(dense)[0]:
+        lo, hi = bounds[group], bounds[group + 1]
+        costs = matched[1][lo:hi].reshape(n1[group], n2[group])
+        cam1_ind, cam2_ind = linear_sum_assignment(costs)
+        chosen = lo + cam1_ind * n2[group] + cam2_ind
+        results.append(collect(group, row1, row2, chosen, *matched))
+    results.sort(key=lambda result: result[0])
+    return results
+
+
+def _all_pairs(
+    groups: np.ndarray,
+    valid1: np.ndarray,
+    valid2: np.ndarray,
+    pos1: np.ndarray,
+    pos2: np.ndarray,
+    selected: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Rows of all combinations of valid rods of camera 1 and camera 2 within
+    the ``selected`` frames, ordered by frame and position in the frame."""
+    valid1 = valid1 & selected[groups]
+    valid2 = valid2 & selected[groups]
+    n_groups = len(selected)
+    idx1 = np.full((n_groups, max(pos1[valid1].max(initial=-1) + 1, 1)), -1)
+    idx2 = np.full((n_groups, max(pos2[valid2].max(initial=-1) + 1, 1)), -1)
+    idx1[groups[valid1], pos1[valid1]] = np.nonzero(valid1)[0]
+    idx2[groups[valid2], pos2[valid2]] = np.nonzero(valid2)[0]
+    pair_mask = (idx1 >= 0)[:, :, None] & (idx2 >= 0)[:, None, :]
+    g_pair, i_pair, j_pair = np.nonzero(pair_mask)
+    return idx1[g_pair, i_pair], idx2[g_pair, j_pair]
+
+
+def _epipolar_pairs(
+    undist_cam1: np.ndarray,
+    undist_cam2: np.ndarray,
+    groups: np.ndarray,
+    valid1: np.ndarray,
+    valid2: np.ndarray,
+    rig: StereoRig,
+    tolerance: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Rows of the rod combinations of the same frame whose endpoints lie
+    within ``tolerance`` pixels of each other's epipolar lines, for either
+    of the two endpoint combinations.
+
+    The rods are represented by the sorted epipolar coordinates of their
+    endpoints, which bounds the epipolar distance of both endpoint
+    combinations at once. A KD-tree search with the largest coordinate
+    sensitivity yields a superset of the candidates, that is then checked
+    exactly with the fundamental matrix.
+    """
+    rows1 = np.nonzero(valid1)[0]
+    rows2 = np.nonzero(valid2)[0]
+    coords1 = rig.epipolar_coordinates(
+        undist_cam1[rows1], cam=1, undistort=False
+    )[0]
+    coords2, sensitivity = rig.epipolar_coordinates(
+        undist_cam2[rows2], cam=2, undistort=False
+    )
+    finite1 = np.isfinite(coords1).all(axis=1)
+    finite2 = np.isfinite(coords2).all(axis=1) & np.isfinite(sensitivity).all(
+        axis=1
+    )
+    rows1, coords1 = rows1[finite1], coords1[finite1]
+    rows2, coords2 = rows2[finite2], coords2[finite2]
+    if not len(rows1) or not len(rows2):
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    # 10% margin for the linearization of the epipolar coordinate and 1px
+    # for deviations between the calibration's ``F`` and the camera poses
+    radius = (1.1 * tolerance + 1.0) * sensitivity[finite2].max()
+    # separates the frames by more than the search radius
+    spacing = 2 * radius + 1.0
+    tree1 = cKDTree(
+        np.column_stack([groups[rows1] * spacing, np.sort(coords1, axis=1)])
+    )
+    tree2 = cKDTree(
+        np.column_stack([groups[rows2] * spacing, np.sort(coords2, axis=1)])
+    )
+    found = tree1.sparse_distance_matrix(
+        tree2, radius, p=np.inf, output_type="ndarray"
+    )
+    row1 = rows1[found["i"]]
+    row2 = rows2[found["j"]]
+
+    # combination c uses endpoint c // 2 of cam1 and c % 2 of cam2
+    distances = rig.epipolar_distance(
+        undist_cam1[row1][:, [0, 0, 1, 1]],
+        undist_cam2[row2][:, [0, 1, 0, 1]],
+        undistort=False,
+    )
+    plausible = (
+        np.minimum(
+            np.maximum(distances[:, 0], distances[:, 3]),
+            np.maximum(distances[:, 1], distances[:, 2]),
+        )
+        <= tolerance
+    )
+    row1, row2 = row1[plausible], row2[plausible]
+    order = np.lexsort((row2, row1))
+    return row1[order], row2[order]
+
+
+def _assemble_output(
+    p_triang: np.ndarray,
+    point_choices: np.ndarray,
+    rods_cam1: np.ndarray,
+    rods_cam2: np.ndarray,
+) -> np.ndarray:
+    """Accumulates matched rods in the output layout ``[x1, y1, z1, x2, y2,
+    z2, x, y, z, l, *cam1_2D, *cam2_2D]``."""
+    # use point matching of (p11,p21) and (p12,p22) if chosen, otherwise
+    # (p11,p22) and (p12,p21)
+    p1 = np.where(point_choices[:, None], p_triang[:, 0], p_triang[:, 1])
+    p2 = np.where(point_choices[:, None], p_triang[:, 3], p_triang[:, 2])
+    flip = ~point_choices[:, None, None]
+    rods_cam1 = np.where(flip, rods_cam1[:, ::-1], rods_cam1)
+    rods_cam2 = np.where(flip, rods_cam2[:, ::-1], rods_cam2)
+
+    out = np.zeros((len(p_triang), 2 * 3 + 3 + 1 + 4 + 4))
+    out[:, 0:3] = p1
+    out[:, 3:6] = p2
+    out[:, 6:9] = (p1 + p2) / 2
+    out[:, 9] = np.linalg.norm(p2 - p1, axis=1)
+    out[:, 10:14] = rods_cam1.reshape(-1, 4)
+    out[:, 14:] = rods_cam2.reshape(-1, 4)
+    return out
 
 
 def reorder_endpoints_csv(
@@ -1036,14 +1516,15 @@ def reorder_endpoints_csv(
         Second camera's identifier in the given dataset.\n
         By default ``"gp2"``.
     frame_numbers : Iterable[int], optional
-        An iterable of frame numbers present in the data.\n
-        By default ``None``.
+        An iterable of consecutive frame numbers present in the data.\n
+        By default ``None``, i.e. all frames of the data.
 
     Returns
     -------
     Tuple[ndarray]
-        Returns the assignment costs, i.e. the sum of end point reprojection
-        errors per rod.
+        Returns the assignment costs, i.e. the endpoint displacements per rod
+        and frame transition, of the last color in ``colors``. See
+        :func:`reorder_endpoints`.
     """
     if not os.path.exists(output_folder):
         os.mkdir(output_folder)
@@ -1051,96 +1532,145 @@ def reorder_endpoints_csv(
     for color in colors:
         f_in = input_folder + f"/rods_df_{color}.csv"
         data = pd.read_csv(f_in, sep=",", index_col=0)
+        df_out, mincosts_T = reorder_endpoints(
+            data, cam1_name, cam2_name, frame_numbers
+        )
+        df_out.to_csv(
+            os.path.join(output_folder, f"rods_df_{color}.csv"), sep=","
+        )
 
-        frame = frame_numbers[0]
-        dfs_out = []
-        df_raw_add = data.loc[data["frame"] == frame].sort_values("particle")
-        mincosts_T = np.zeros((len(df_raw_add), len(frame_numbers) - 1))
-        df0 = df_raw_add.copy()
-
-        dfs_out.append(df_raw_add)
-
-        for frame in tqdm(frame_numbers[1:]):
-            df1 = data.loc[data["frame"] == frame].sort_values("particle")
-
-            df_raw_add = df1.copy()
-
-            for i in df1["particle"].unique():
-                x1_0 = df0.loc[df0["particle"] == i, "x1"].to_numpy()
-                y1_0 = df0.loc[df0["particle"] == i, "y1"].to_numpy()
-                z1_0 = df0.loc[df0["particle"] == i, "z1"].to_numpy()
-                x2_0 = df0.loc[df0["particle"] == i, "x2"].to_numpy()
-                y2_0 = df0.loc[df0["particle"] == i, "y2"].to_numpy()
-                z2_0 = df0.loc[df0["particle"] == i, "z2"].to_numpy()
-
-                x1_1 = df1.loc[df1["particle"] == i, "x1"].to_numpy()
-                y1_1 = df1.loc[df1["particle"] == i, "y1"].to_numpy()
-                z1_1 = df1.loc[df1["particle"] == i, "z1"].to_numpy()
-                x2_1 = df1.loc[df1["particle"] == i, "x2"].to_numpy()
-                y2_1 = df1.loc[df1["particle"] == i, "y2"].to_numpy()
-                z2_1 = df1.loc[df1["particle"] == i, "z2"].to_numpy()
-
-                x1gp1_1 = df1.loc[df1["particle"] == i, "x1_gp1"].to_numpy()
-                y1gp1_1 = df1.loc[df1["particle"] == i, "y1_gp1"].to_numpy()
-                x2gp1_1 = df1.loc[df1["particle"] == i, "x2_gp1"].to_numpy()
-                y2gp1_1 = df1.loc[df1["particle"] == i, "y2_gp1"].to_numpy()
-
-                x1gp2_1 = df1.loc[df1["particle"] == i, "x1_gp2"].to_numpy()
-                y1gp2_1 = df1.loc[df1["particle"] == i, "y1_gp2"].to_numpy()
-                x2gp2_1 = df1.loc[df1["particle"] == i, "x2_gp2"].to_numpy()
-                y2gp2_1 = df1.loc[df1["particle"] == i, "y2_gp2"].to_numpy()
-
-                comb1 = np.linalg.norm(
-                    [x1_0 - x1_1, y1_0 - y1_1, z1_0 - z1_1]
-                ) + np.linalg.norm([x2_0 - x2_1, y2_0 - y2_1, z2_0 - z2_1])
-                comb2 = np.linalg.norm(
-                    [x2_0 - x1_1, y2_0 - y1_1, z2_0 - z1_1]
-                ) + np.linalg.norm([x1_0 - x2_1, y1_0 - y2_1, z1_0 - z2_1])
-
-                mincosts_T[i, frame - frame_numbers[1]] = min(comb1, comb2)
-
-                if comb2 < comb1:
-                    df_raw_add.loc[df_raw_add["particle"] == i, "x1"] = x2_1
-                    df_raw_add.loc[df_raw_add["particle"] == i, "y1"] = y2_1
-                    df_raw_add.loc[df_raw_add["particle"] == i, "z1"] = z2_1
-                    df_raw_add.loc[df_raw_add["particle"] == i, "x2"] = x1_1
-                    df_raw_add.loc[df_raw_add["particle"] == i, "y2"] = y1_1
-                    df_raw_add.loc[df_raw_add["particle"] == i, "z2"] = z1_1
-
-                    df_raw_add.loc[df_raw_add["particle"] == i, "x1_gp1"] = (
-                        x2gp1_1
-                    )
-                    df_raw_add.loc[df_raw_add["particle"] == i, "y1_gp1"] = (
-                        y2gp1_1
-                    )
-                    df_raw_add.loc[df_raw_add["particle"] == i, "x2_gp1"] = (
-                        x1gp1_1
-                    )
-                    df_raw_add.loc[df_raw_add["particle"] == i, "y2_gp1"] = (
-                        y1gp1_1
-                    )
+    return mincosts_T
 
-                    df_raw_add.loc[df_raw_add["particle"] == i, "x1_gp2"] = (
-                        x2gp2_1
-                    )
-                    df_raw_add.loc[df_raw_add["particle"] == i, "y1_gp2"] = (
-                        y2gp2_1
-                    )
-                    df_raw_add.loc[df_raw_add["particle"] == i, "x2_gp2"] = (
-                        x1gp2_1
-                    )
-                    df_raw_add.loc[df_raw_add["particle"] == i, "y2_gp2"] = (
-                        y1gp2_1
-                    )
 
-            df0 = df_raw_add.copy()
-            dfs_out.append(df_raw_add)
+def reorder_endpoints(
+    data: pd.DataFrame,
+    cam1_name: str = "gp1",
+    cam2_name: str = "gp2",
+    frame_numbers: Iterable[int] = None,
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Reorders rod endpoints, such that their displacement between
+    consecutive frames is minimal.
 
-        df_out = pd.concat(dfs_out)
+    The endpoints of every rod are compared to the (already reordered)
+    endpoints of the same particle in the previous frame. If the crossed
+    combination has a smaller total displacement than the straight one, the
+    endpoints in 3D and in both cameras are swapped. Rods without a
+    counterpart in the previous frame are left unchanged.
 
-        df_out.reset_index(drop=True, inplace=True)
-        df_out.to_csv(
-            os.path.join(output_folder, f"rods_df_{color}.csv"), sep=","
-        )
+    All rods and frames are evaluated at once on a dense ``(frame, particle,
+    endpoint, coordinate)`` array. The swaps of consecutive frames are
+    accumulated into one mask, that is applied to all columns in bulk.
 
-    return mincosts_T
+    Parameters
+    ----------
+    data : DataFrame
+        Dataset of 3D rod positions with unique particle numbers per frame.
+    cam1_name : str, optional
+        First camera's identifier in the given dataset.\n
+        By default ``"gp1"``.
+    cam2_name : str, optional
+        Second camera's identifier in the given dataset.\n
+        By default ``"gp2"``.
+    frame_numbers : Iterable[int], optional
+        Consecutive frame numbers to reorder the endpoints in.\n
+        By default ``None``, i.e. all frames of ``data``.
+
+    Returns
+    -------
+    Tuple[DataFrame, ndarray]
+        The reordered dataset of all ``frame_numbers``, sorted by frame and
+        particle, and the displacement costs of the chosen endpoint
+        combinations ``(particle, frame_numbers[1:])``. The rows of the costs
+        belong to the distinct particle numbers in ascending order. The costs
+        of rods without a counterpart in the previous frame are ``0``.
+    """
+    if frame_numbers is None:
+        frame_numbers = np.unique(data["frame"])
+    frame_numbers = np.asarray(list(frame_numbers))
+    pairs_3d = [("x1", "x2"), ("y1", "y2"), ("z1", "z2")]
+    pairs_2d = [
+        (f"{c}1_{cam}", f"{c}2_{cam}")
+        for cam in (cam1_name, cam2_name)
+        for c in ("x", "y")
+    ]
+
+    # Select the frames in the given order, sorted by particle within
+    frame_pos = pd.Index(frame_numbers).get_indexer(data["frame"])
+    selected = frame_pos >= 0
+    frame_pos = frame_pos[selected]
+    particles = data["particle"].to_numpy()[selected]
+    order = np.lexsort((particles, frame_pos))
+    df_out = data.loc[selected].iloc[order].reset_index(drop=True)
+    frame_pos = frame_pos[order]
+    particles = particles[order]
+
+    # Dense endpoint array (frame, particle, endpoint, xyz), indexed by the
+    # position of a particle number among all distinct particle numbers
+    _, particles = np.unique(particles, return_inverse=True)
+    particles = particles.reshape(-1)
+    n_particles = particles.max(initial=-1) + 1
+    points = np.full((len(frame_numbers), n_particles, 2, 3), np.nan)
+    present = np.zeros((len(frame_numbers), n_particles), dtype=bool)
+    points[frame_pos, particles] = (
+        df_out[[col for pair in zip(*pairs_3d) for col in pair]]
+        .to_numpy(dtype=float)
+        .reshape(-1, 2, 3)
+    )
+    present[frame_pos, particles] = True
+
+    # Costs of both combinations w.r.t. the unchanged previous frame
+    previous, current = points[:-1], points[1:]
+    straight = _distance(previous[:, :, 0], current[:, :, 0]) + _distance(
+        previous[:, :, 1], current[:, :, 1]
+    )
+    crossed = _distance(previous[:, :, 1], current[:, :, 0]) + _distance(
+        previous[:, :, 0], current[:, :, 1]
+    )
+    comparable = present[:-1] & present[1:]
+    cheaper = comparable & (crossed < straight)
+    dearer = comparable & (straight < crossed)
+
+    # A rod is swapped, if the crossed combination w.r.t. the reordered
+    # previous frame is cheaper. Once the previous frame was swapped, the
+    # combinations are swapped as well, i.e. the swaps alternate with every
+    # frame, where the crossed combination is cheaper than the straight one.
+    # This chain restarts, where both are equally expensive (or NaN) or
+    # there is no previous rod, because nothing is swapped there.
+    restart = ~(cheaper | dearer)
+    n_cheaper = np.vstack(
+        [np.zeros((1, n_particles), dtype=int), np.cumsum(cheaper, axis=0)]
+    )
+    last_restart = np.maximum.accumulate(
+        np.where(
+            np.vstack([np.ones((1, n_particles), dtype=bool), restart]),
+            np.arange(len(frame_numbers))[:, None],
+            0,
+        ),
+        axis=0,
+    )
+    swapped = (
+        n_cheaper - np.take_along_axis(n_cheaper, last_restart, axis=0)
+    ) % 2 == 1
+
+    comb1 = np.where(swapped[:-1], crossed, straight)
+    comb2 = np.where(swapped[:-1], straight, crossed)
+    mincosts_T = np.where(
+        comparable, np.where(comb2 < comb1, comb2, comb1), 0.0
+    )
+
+    # Swap the endpoint columns of all affected rows at once
+    rows = swapped[frame_pos, particles]
+    for col1, col2 in pairs_3d + pairs_2d:
+        values1 = df_out[col1].to_numpy(copy=True)
+        values2 = df_out[col2].to_numpy(copy=True)
+        df_out[col1] = np.where(rows, values2, values1)
+        df_out[col2] = np.where(rows, values1, values2)
+    return df_out, mincosts_T.T
+
+
+def _distance(points1: np.ndarray, points2: np.ndarray) -> np.ndarray:
+    """Euclidean distance along the last axis. It is computed as a (stacked)
+    dot product, like ``np.linalg.norm`` does for a single vector, to get
+    bitwise identical results."""
+    diff = points1 - points2
+    return np.sqrt((diff[..., None, :] @ diff[..., :, None])[..., 0, 0])
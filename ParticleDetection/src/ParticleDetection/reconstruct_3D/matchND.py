@@ -23,29 +23,53 @@ frame and the respective previous frame .
 **Date:**       31.10.2022
 
 """
+import collections
 import copy
 import itertools
+import logging
 import os
 import pathlib
+import pickle
 import warnings
-from typing import Iterable, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Tuple, Union
 
-import cv2
 import numpy as np
 import pandas as pd
 import pulp
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial import cKDTree
 from scipy.spatial.transform import Rotation as R
 from tqdm import tqdm
 
-import ParticleDetection.utils.data_loading as dl
 from ParticleDetection.reconstruct_3D import match2D
+from ParticleDetection.reconstruct_3D.assignment import AssignmentSolver
+from ParticleDetection.reconstruct_3D.prediction import ConstantVelocityFilter
+from ParticleDetection.reconstruct_3D.sharding import (
+    shard_ranges,
+    stitch_tracks,
+)
+from ParticleDetection.reconstruct_3D.stereo_rig import (
+    StereoRig,
+    init_worker,
+    worker_rig,
+)
+from ParticleDetection.utils.sinks import CSVSink
+
+_logger = logging.getLogger(__name__)
+
+_WEIGHTS_CHUNK_ELEMENTS = 2**22
 
 
 # BUG: the minimization does not work yet
 def npartite_matching(
     weights: np.ndarray,
     maximize: bool = True,
-    solver: pulp.LpSolver = pulp.PULP_CBC_CMD(msg=False),
+    solver: Union[pulp.LpSolver, AssignmentSolver] = pulp.PULP_CBC_CMD(
+        msg=False
+    ),
+    initial: Tuple[np.ndarray] = None,
 ) -> Tuple[np.ndarray]:
     """Solve an n-partite matching problem.
 
@@ -61,9 +85,16 @@ def npartite_matching(
         members in this group.
     maximize : bool, optional
         By default ``True``.
-    solver : LpSolver, optional
-        A solver for the matching problem.\n
+    solver : LpSolver | AssignmentSolver, optional
+        A solver for the matching problem. An :class:`.AssignmentSolver`
+        solves it in the calling process instead of formulating it with
+        PuLP.\n
         By default ``PULP_CBC_CMD(msg=False)``.
+    initial : Tuple[ndarray], optional
+        A known assignment in the format of the returned one, e.g. the
+        solution of a similar problem, that is used as the starting solution.
+        PuLP solvers only use it with the ``warmStart=True`` option.\n
+        By default ``None``.
 
     Returns
     -------
@@ -90,6 +121,8 @@ def npartite_matching(
     Adapted from:
     https://stackoverflow.com/questions/60940781/solving-the-assignment-problem-for-3-groups-instead-of-2
     """
+    if isinstance(solver, AssignmentSolver):
+        return solver.solve(weights, maximize=maximize, initial=initial)
     if not maximize:
         warnings.warn(
             "Minimization is currently not fully supported."
@@ -126,6 +159,11 @@ def npartite_matching(
             vary = itertools.product(*gric)
             problem += pulp.lpSum(xxx[iii] for iii in vary) <= 1
 
+    if initial is not None:
+        for iii in xxx:
+            xxx[iii].setInitialValue(0)
+        for iii in zip(*initial):
+            xxx[tuple(int(i) for i in iii)].setInitialValue(1)
     problem.solve(solver)
 
     # write binary variables to array
@@ -138,6 +176,84 @@ def npartite_matching(
     return whr
 
 
+def sparse_npartite_matching(
+    indices: np.ndarray,
+    costs: np.ndarray,
+    shape: Tuple[int],
+    solver: Union[pulp.LpSolver, AssignmentSolver] = pulp.PULP_CBC_CMD(
+        msg=False
+    ),
+    initial: np.ndarray = None,
+) -> Union[np.ndarray, None]:
+    """Solve an n-partite matching problem, that only allows the given
+    combinations.
+
+    In contrast to :func:`npartite_matching` only the given combinations
+    become variables of the problem. All members of the smallest group must
+    be matched, the costs of the chosen combinations are minimized.
+
+    Parameters
+    ----------
+    indices : ndarray
+        Combinations of group members of shape ``(len(shape), n)``.
+    costs : ndarray
+        Cost of every combination of shape ``(n,)``.
+    shape : Tuple[int]
+        Number of members in every group.
+    solver : LpSolver | AssignmentSolver, optional
+        A solver for the matching problem. An :class:`.AssignmentSolver`
+        solves it in the calling process instead of formulating it with
+        PuLP.\n
+        By default ``PULP_CBC_CMD(msg=False)``.
+    initial : ndarray, optional
+        Positions of combinations forming a known assignment, that is used as
+        the starting solution by PuLP solvers with the ``warmStart=True``
+        option.\n
+        By default ``None``.
+
+    Returns
+    -------
+    ndarray | None
+        Positions of the chosen combinations, sorted by the member of the
+        first group. ``None`` is returned, if the given combinations do not
+        allow matching all members of the smallest group.
+    """
+    smallest = int(np.argmin(shape))
+    if np.unique(indices[smallest]).size < shape[smallest]:
+        # a member of the smallest group has no candidate combination
+        return None
+    if isinstance(solver, AssignmentSolver):
+        return solver.solve_sparse(tuple(indices), costs, shape)
+
+    xxx = [
+        pulp.LpVariable(f"xxx_{i}", cat=pulp.LpBinary)
+        for i in range(len(costs))
+    ]
+    problem = pulp.LpProblem("RodMatching_sparse", pulp.LpMinimize)
+    problem += pulp.lpSum(c * x for c, x in zip(costs, xxx))
+    for idi, dim in enumerate(shape):
+        members = [[] for _ in range(dim)]
+        for var, member in zip(xxx, indices[idi]):
+            members[member].append(var)
+        for member in members:
+            if not member:
+                continue
+            if idi == smallest:
+                problem += pulp.lpSum(member) == 1
+            else:
+                problem += pulp.lpSum(member) <= 1
+    if initial is not None:
+        for x in xxx:
+            x.setInitialValue(0)
+        for i in initial:
+            xxx[i].setInitialValue(1)
+    problem.solve(solver)
+    if pulp.LpStatus[problem.status] != "Optimal":
+        return None
+    chosen = np.flatnonzero([x.value() > 0.5 for x in xxx])
+    return chosen[np.argsort(indices[0][chosen], kind="stable")]
+
+
 def create_weights(
     p_3D: np.ndarray, p_3D_prev: np.ndarray, repr_errs: np.ndarray
 ) -> np.ndarray:
@@ -146,6 +262,8 @@ def create_weights(
     Creates a weight matrix for matching rods between frames, using the rod
     endpoint displacement between frames times the reprojection-error of the
     rod endpoints as the cost of an assignment.
+    All combinations are evaluated at once, split into chunks of previous
+    rods to bound the memory usage for large numbers of rods.
 
     Parameters
     ----------
@@ -176,47 +294,471 @@ def create_weights(
     weights = np.zeros((rods_prev, rods1, rods2))
     point_choices = np.zeros((rods_prev, rods1, rods2))
 
-    for i in range(rods_prev):
-        prev_p1 = p_3D_prev[i, 0, :]
-        prev_p2 = p_3D_prev[i, 1, :]
-        for j in range(rods1):
-            for k in range(rods2):
-                c1_p1 = p_3D[j, k, 0, :]
-                c1_p2 = p_3D[j, k, 3, :]
-                c2_p1 = p_3D[j, k, 1, :]
-                c2_p2 = p_3D[j, k, 2, :]
-
-                c1_re = np.sum(repr_errs[j, k, 0::3, :])
-                c2_re = np.sum(repr_errs[j, k, 1:2, :])
-
-                # 0 -> 0,3
-                s1 = (
-                    np.linalg.norm(c1_p1 - prev_p1, axis=-1)
-                    + np.linalg.norm(c1_p2 - prev_p2, axis=-1)
-                ) * c1_re
-                # 1 -> 1,2
-                s2 = (
-                    np.linalg.norm(c2_p1 - prev_p1, axis=-1)
-                    + np.linalg.norm(c2_p2 - prev_p2, axis=-1)
-                ) * c2_re
-                # 2 -> 2,1
-                s3 = (
-                    np.linalg.norm(c2_p1 - prev_p2, axis=-1)
-                    + np.linalg.norm(c2_p2 - prev_p1, axis=-1)
-                ) * c2_re
-                # 3 -> 3,0
-                s4 = (
-                    np.linalg.norm(c1_p1 - prev_p2, axis=-1)
-                    + np.linalg.norm(c1_p2 - prev_p1, axis=-1)
-                ) * c1_re
-
-                weights[i, j, k] = np.min([s1, s2, s3, s4])
-                point_choices[i, j, k] = np.argmin([s1, s2, s3, s4])
+    # Bound the (prev, rod1, rod2, combo, end-point, 3D-coordinates) tensor
+    # of displacements by processing the previous rods in chunks
+    chunk = max(1, _WEIGHTS_CHUNK_ELEMENTS // max(1, rods1 * rods2 * 24))
+    for i in range(0, rods_prev, chunk):
+        prev = p_3D_prev[i : i + chunk]
+        scores = _combination_scores(
+            p_3D[None], prev[:, None, None], repr_errs[None]
+        )
+        weights[i : i + chunk] = np.min(scores, axis=-1)
+        point_choices[i : i + chunk] = np.argmin(scores, axis=-1)
 
     weights = np.max(weights) - weights
     return weights, point_choices
 
 
+def create_sparse_weights(
+    p_3D: np.ndarray,
+    p_3D_prev: np.ndarray,
+    repr_errs: np.ndarray,
+    candidates: int = None,
+    max_displacement: float = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Generate 3D-displacement*reprojection-error costs for plausible
+    assignments only.
+
+    Like :func:`create_weights`, but the costs are only computed for the
+    combinations of a previous rod with the stereo rod pairs, whose rod
+    center is close to the previous rod's center. The number of combinations
+    therefore grows linearly with the number of previous rods instead of
+    cubically.
+
+    Parameters
+    ----------
+    p_3D : np.ndarray
+        Shape must be in (rod_ids(cam1), rod_ids(cam2), 4, 3), see
+        :func:`create_weights`.
+    p_3D_prev : np.ndarray
+        Shape must be in (rod_ids, 2, 3), see :func:`create_weights`.
+    repr_errs : np.ndarray
+        Shape must be in (rod_ids(cam1), rod_ids(cam2), 4, 2), see
+        :func:`create_weights`.
+    candidates : int, optional
+        Number of stereo rod pairs with the closest rod centers, that are
+        kept per previous rod.\n
+        By default ``None``, i.e. no limit.
+    max_displacement : float, optional
+        Maximum distance between the rod centers of a previous rod and a
+        stereo rod pair, that is kept.\n
+        By default ``None``, i.e. no limit.
+
+    Returns
+    -------
+    indices : np.ndarray
+        Combinations (rod_id, rod_id(cam1), rod_id(cam2)) of shape ``(3, n)``.
+    costs : np.ndarray
+        Cost of every combination, i.e. the minimum of :func:`create_weights`
+        *before* its conversion to weights, that shall be maximized.
+    point_choices : np.ndarray
+        Choices of minimizing endpoint combination of every combination.
+
+    Raises
+    ------
+    ValueError
+        Is raised, if neither ``candidates`` nor ``max_displacement`` is
+        given, or if rod positions are not finite.
+    """
+    if candidates is None and max_displacement is None:
+        raise ValueError(
+            "Either 'candidates' or 'max_displacement' must be given."
+        )
+    rods1, rods2 = p_3D.shape[0:2]
+    n_pairs = rods1 * rods2
+    # rod centers of both endpoint combinations of all stereo rod pairs
+    centers = np.concatenate(
+        [
+            (p_3D[:, :, 0] + p_3D[:, :, 3]).reshape(-1, 3) / 2,
+            (p_3D[:, :, 1] + p_3D[:, :, 2]).reshape(-1, 3) / 2,
+        ]
+    )
+    prev_centers = (p_3D_prev[:, 0] + p_3D_prev[:, 1]) / 2
+    if not (np.isfinite(centers).all() and np.isfinite(prev_centers).all()):
+        raise ValueError("Rod positions must be finite.")
+
+    n_query = 2 * n_pairs if candidates is None else 2 * candidates
+    n_query = min(n_query, 2 * n_pairs)
+    bound = np.inf if max_displacement is None else max_displacement
+    dist, hits = cKDTree(centers).query(
+        prev_centers, k=max(n_query, 1), distance_upper_bound=bound
+    )
+    dist = dist.reshape(len(prev_centers), -1)
+    hits = hits.reshape(len(prev_centers), -1)
+    prev_idx = np.repeat(np.arange(len(prev_centers)), hits.shape[1])
+    found = np.isfinite(dist.ravel())
+    pairs = hits.ravel()[found] % max(n_pairs, 1)
+    prev_idx = prev_idx[found]
+    # both endpoint combinations of a pair may be found, keep it once and only
+    # the closest candidates
+    combos = np.unique(prev_idx * n_pairs + pairs, return_index=True)[1]
+    combos = np.sort(combos)
+    prev_idx, pairs = prev_idx[combos], pairs[combos]
+    if candidates is not None:
+        rank = np.arange(len(prev_idx)) - np.searchsorted(prev_idx, prev_idx)
+        keep = rank < candidates
+        prev_idx, pairs = prev_idx[keep], pairs[keep]
+    idx1, idx2 = np.divmod(pairs, rods2)
+
+    scores = _combination_scores(
+        p_3D[idx1, idx2], p_3D_prev[prev_idx], repr_errs[idx1, idx2]
+    )
+    return (
+        np.stack([prev_idx, idx1, idx2]),
+        np.min(scores, axis=-1),
+        np.argmin(scores, axis=-1),
+    )
+
+
+def _sparse_matching(
+    p_3D: np.ndarray,
+    p_3D_prev: np.ndarray,
+    repr_errs: np.ndarray,
+    candidates: Union[int, None],
+    max_displacement: Union[float, None],
+    solver: Union[pulp.LpSolver, AssignmentSolver],
+    initial: Tuple[np.ndarray] = None,
+) -> Tuple[Union[Tuple[np.ndarray], None], int, float]:
+    """Matches previous rods to stereo rod pairs using only plausible
+    combinations, see :func:`create_sparse_weights`, and the combinations of
+    an ``initial`` assignment. The limits are relaxed until a complete
+    assignment is possible. Returns ``None``, if the rod positions are not
+    finite or all combinations are needed, and the final limits."""
+    shape = (len(p_3D_prev), *p_3D.shape[0:2])
+    n_pairs = shape[1] * shape[2]
+    while True:
+        try:
+            indices, costs, _ = create_sparse_weights(
+                p_3D, p_3D_prev, repr_errs, candidates, max_displacement
+            )
+        except ValueError:
+            _logger.debug("Rod positions are not finite.")
+            return None, candidates, max_displacement
+        start = None
+        if initial is not None:
+            keys = np.ravel_multi_index(tuple(indices), shape)
+            initial_keys = np.ravel_multi_index(tuple(initial), shape)
+            missing = ~np.isin(initial_keys, keys)
+            rod, idx1, idx2 = (np.asarray(idx)[missing] for idx in initial)
+            scores = _combination_scores(
+                p_3D[idx1, idx2], p_3D_prev[rod], repr_errs[idx1, idx2]
+            )
+            indices = np.concatenate([indices, [rod, idx1, idx2]], axis=1)
+            costs = np.concatenate([costs, np.min(scores, axis=-1)])
+            keys = np.concatenate([keys, initial_keys[missing]])
+            start = np.flatnonzero(np.isin(keys, initial_keys))
+        if len(costs) == shape[0] * n_pairs:
+            # no reduction of the problem size (anymore)
+            return None, candidates, max_displacement
+        chosen = sparse_npartite_matching(
+            indices, costs, shape, solver, initial=start
+        )
+        if chosen is not None:
+            return tuple(indices[:, chosen]), candidates, max_displacement
+        if candidates is not None:
+            candidates = min(2 * candidates, n_pairs)
+        if max_displacement is not None:
+            max_displacement = 2 * max_displacement
+        _logger.debug(
+            f"Relaxing the candidate limits to candidates={candidates}, "
+            f"max_displacement={max_displacement}."
+        )
+
+
+class FrameTracker:
+    """Stateful assignment of tracked rods to the stereo rod pairs of
+    consecutive frames.
+
+    Consecutive frames result in nearly identical assignment problems. A
+    :class:`FrameTracker` carries the state of the last frame's assignment
+    forward and uses it as the starting point of the next frame's
+    assignment:
+
+    - Every tracked rod is assigned to the stereo rod pair of the current
+      frame, whose 2D rods are closest to the ones it was assigned to in the
+      last frame. This assignment is the starting solution of the solver and
+      is always part of the candidates of the sparse formulation.
+    - The Lagrangian multipliers of an :class:`.AssignmentSolver` are kept per
+      tracked rod.
+    - Candidate limits, that had to be relaxed, stay relaxed for the
+      following frames.
+
+    With a ``predictor`` the tracked rods are not compared to their
+    positions in the last frame, but to their predicted poses in the current
+    frame. The candidates are then found around the predicted rod centers,
+    so that the candidate limits can stay tight for fast rods.
+
+    Parameters
+    ----------
+    solver : LpSolver | AssignmentSolver, optional
+        Solver for the assignment problems, see :func:`npartite_matching`.
+        A copy of a PuLP solver with the ``warmStart=True`` option is used,
+        if ``warm_start`` is enabled.\n
+        By default ``AssignmentSolver()``.
+    candidates : int, optional
+        Number of stereo rod pairs per tracked rod, that are considered for
+        the assignment, see :func:`match_frame`.\n
+        By default ``None``, i.e. all stereo rod pairs are considered.
+    max_displacement : float, optional
+        Maximum displacement of a rod center between consecutive frames, see
+        :func:`match_frame`.\n
+        By default ``None``, i.e. all stereo rod pairs are considered.
+    warm_start : bool, optional
+        Flag, whether to carry the state forward to the next frame.\n
+        By default ``True``.
+    predictor : ConstantVelocityFilter, optional
+        Filter of the tracked rods' poses, that predicts them for the next
+        frame. It is (re-)initialized with the last frame's rod positions,
+        whenever the number of tracked rods changes.\n
+        By default ``None``, i.e. the last frame's rod positions are used.
+
+    Attributes
+    ----------
+    solver : LpSolver | AssignmentSolver
+        Solver for the assignment problems.
+    candidates : int | None
+        Current number of stereo rod pairs considered per tracked rod.
+    max_displacement : float | None
+        Current maximum displacement of a rod center.
+    warm_start : bool
+        Flag, whether the state is carried forward to the next frame.
+    frames : int
+        Number of matched frames.
+    warm_starts : int
+        Number of frames, that were started from the last frame's assignment.
+    hits : int
+        Number of frames, whose starting assignment was already optimal.
+    predictor : ConstantVelocityFilter | None
+        Filter of the tracked rods' poses.
+
+    Raises
+    ------
+    ValueError
+        Is raised when ``candidates`` or ``max_displacement`` is not positive.
+
+    Examples
+    --------
+    >>> tracker = FrameTracker(AssignmentSolver(), candidates=4)
+    >>> for frame in frames:
+    ...     tracked, *_ = match_frame(
+    ...         data, tracked, "gp1", "gp2", frame, "red", rig, tracker=tracker
+    ...     )
+    >>> tracker.hit_rate
+    0.9
+    """
+
+    def __init__(
+        self,
+        solver: Union[pulp.LpSolver, AssignmentSolver] = None,
+        candidates: int = None,
+        max_displacement: float = None,
+        warm_start: bool = True,
+        predictor: ConstantVelocityFilter = None,
+    ):
+        if candidates is not None and candidates < 1:
+            raise ValueError("'candidates' must be a positive number.")
+        if max_displacement is not None and not max_displacement > 0:
+            raise ValueError("'max_displacement' must be a positive number.")
+        if solver is None:
+            solver = AssignmentSolver()
+        elif warm_start and hasattr(solver, "optionsDict"):
+            solver = copy.copy(solver)
+            solver.optionsDict = {**solver.optionsDict, "warmStart": True}
+        self.solver = solver
+        self.candidates = candidates
+        self.max_displacement = max_displacement
+        self.warm_start = warm_start
+        self.predictor = predictor
+        self.frames = 0
+        self.warm_starts = 0
+        self.hits = 0
+        self._rods = None
+        self._multipliers = None
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of warm started frames, whose starting assignment was
+        already optimal. It is ``nan`` before the first warm start."""
+        if self.warm_starts == 0:
+            return np.nan
+        return self.hits / self.warm_starts
+
+    def match(
+        self,
+        p_3D: np.ndarray,
+        p_3D_prev: np.ndarray,
+        repr_errs: np.ndarray,
+        rods_cam1: np.ndarray,
+        rods_cam2: np.ndarray,
+    ) -> Tuple[np.ndarray]:
+        """Assigns the tracked rods to stereo rod pairs of the current frame.
+
+        Parameters
+        ----------
+        p_3D : np.ndarray
+            Shape must be in (rod_ids(cam1), rod_ids(cam2), 4, 3), see
+            :func:`create_weights`.
+        p_3D_prev : np.ndarray
+            Shape must be in (rod_ids, 2, 3), see :func:`create_weights`.
+        repr_errs : np.ndarray
+            Shape must be in (rod_ids(cam1), rod_ids(cam2), 4, 2), see
+            :func:`create_weights`.
+        rods_cam1 : np.ndarray
+            2D rods of camera 1 of shape (rod_ids(cam1), 2, 2).
+        rods_cam2 : np.ndarray
+            2D rods of camera 2 of shape (rod_ids(cam2), 2, 2).
+
+        Returns
+        -------
+        Tuple[ndarray]
+            Indices of the tracked rods and their assigned rods of camera 1
+            and camera 2, sorted by the tracked rods.
+        """
+        initial = None
+        if self.warm_start:
+            initial = self._carry_forward(len(p_3D_prev), rods_cam1, rods_cam2)
+        if self.predictor is not None:
+            if len(self.predictor) != len(p_3D_prev):
+                self.predictor.initialize(p_3D_prev)
+            p_3D_prev = self.predictor.predict()
+        self.frames += 1
+        if initial is not None:
+            self.warm_starts += 1
+
+        matched = None
+        if self.candidates is not None or self.max_displacement is not None:
+            matched, candidates, max_displacement = _sparse_matching(
+                p_3D,
+                p_3D_prev,
+                repr_errs,
+                self.candidates,
+                self.max_displacement,
+                self.solver,
+                initial,
+            )
+            if self.warm_start:
+                self.candidates = candidates
+                self.max_displacement = max_displacement
+        if matched is None:
+            weights, _ = create_weights(p_3D, p_3D_prev, repr_errs)
+            matched = self._match_dense(weights, initial)
+
+        if initial is not None and set(zip(*map(list, matched))) == set(
+            zip(*map(list, initial))
+        ):
+            self.hits += 1
+        if self.warm_start:
+            rod, cam1_ind, cam2_ind = matched
+            self._rods = tuple(
+                np.full((len(p_3D_prev), 2, 2), np.nan) for _ in range(2)
+            )
+            self._rods[0][rod] = rods_cam1[cam1_ind]
+            self._rods[1][rod] = rods_cam2[cam2_ind]
+        return matched
+
+    def observe(self, points: np.ndarray):
+        """Updates the predictor with the tracked rods' positions in the
+        current frame.
+
+        Parameters
+        ----------
+        points : ndarray
+            Endpoints of the tracked rods of shape ``(rod_ids, 2, 3)``.
+        """
+        if self.predictor is None:
+            return
+        if len(self.predictor) != len(points):
+            self.predictor.initialize(points)
+            return
+        self.predictor.update(points)
+
+    def _match_dense(
+        self, weights: np.ndarray, initial: Union[Tuple[np.ndarray], None]
+    ) -> Tuple[np.ndarray]:
+        """Solves the assignment problem with all combinations."""
+        if not self.warm_start or not isinstance(
+            self.solver, AssignmentSolver
+        ):
+            return npartite_matching(
+                weights, maximize=True, solver=self.solver, initial=initial
+            )
+        # The tracked rods become the last group, so that their constraints
+        # are relaxed and the multipliers can be carried forward
+        weights = np.moveaxis(weights, 0, -1)
+        if initial is not None:
+            initial = (initial[1], initial[2], initial[0])
+        multipliers = None
+        if np.argsort(weights.shape, kind="stable")[-1] == 2:
+            multipliers = self._multipliers
+        cam1_ind, cam2_ind, rod = self.solver.solve(
+            weights, maximize=True, initial=initial, multipliers=multipliers
+        )
+        self._multipliers = None
+        if self.solver.relaxed_axis == 2:
+            self._multipliers = self.solver.multipliers
+        order = np.lexsort((cam2_ind, cam1_ind, rod))
+        return rod[order], cam1_ind[order], cam2_ind[order]
+
+    def _carry_forward(
+        self, n_rods: int, rods_cam1: np.ndarray, rods_cam2: np.ndarray
+    ) -> Union[Tuple[np.ndarray], None]:
+        """Assigns the tracked rods to the current 2D rods closest to the ones
+        they were assigned to in the last frame."""
+        if self._rods is None or len(self._rods[0]) != n_rods:
+            return None
+        assigned = []
+        for last, current in zip(self._rods, (rods_cam1, rods_cam2)):
+            last = np.mean(last, axis=1)
+            current = np.mean(current, axis=1)
+            valid_last = np.flatnonzero(np.isfinite(last).all(axis=1))
+            valid_current = np.flatnonzero(np.isfinite(current).all(axis=1))
+            dist = np.linalg.norm(
+                last[valid_last, None] - current[None, valid_current], axis=-1
+            )
+            rows, cols = linear_sum_assignment(dist)
+            mapping = np.full(n_rods, -1)
+            mapping[valid_last[rows]] = valid_current[cols]
+            assigned.append(mapping)
+        rod = np.flatnonzero((assigned[0] >= 0) & (assigned[1] >= 0))
+        if len(rod) == 0:
+            return None
+        return rod, assigned[0][rod], assigned[1][rod]
+
+
+def _combination_scores(
+    p_3D: np.ndarray, p_3D_prev: np.ndarray, repr_errs: np.ndarray
+) -> np.ndarray:
+    """Costs of the 4 endpoint combinations of stereo rod pairs ``(..., 4,
+    3)`` with previous rods ``(..., 2, 3)``, given the reprojection errors
+    ``(..., 4, 2)``. The leading dimensions must be broadcastable."""
+    # Summed reprojection errors of the endpoint combinations (0, 3) and (1,)
+    # per candidate pair, accumulated in the same order as np.sum() would
+    c1_re = (
+        repr_errs[..., 0, 0]
+        + repr_errs[..., 0, 1]
+        + repr_errs[..., 3, 0]
+        + repr_errs[..., 3, 1]
+    )
+    c2_re = repr_errs[..., 1, 0] + repr_errs[..., 1, 1]
+    # dist: (..., combo, end-point of the previous rod)
+    dist = np.linalg.norm(
+        p_3D[..., :, None, :] - p_3D_prev[..., None, :, :], axis=-1
+    )
+    return np.stack(
+        [
+            # 0 -> 0,3
+            (dist[..., 0, 0] + dist[..., 3, 1]) * c1_re,
+            # 1 -> 1,2
+            (dist[..., 1, 0] + dist[..., 2, 1]) * c2_re,
+            # 2 -> 2,1
+            (dist[..., 1, 1] + dist[..., 2, 0]) * c2_re,
+            # 3 -> 3,0
+            (dist[..., 0, 1] + dist[..., 3, 0]) * c1_re,
+        ],
+        axis=-1,
+    )
+
+
 def assign(
     input_folder: str,
     output_folder: str,
@@ -226,7 +768,17 @@ def assign(
     frame_numbers: Iterable[int] = None,
     calibration_file: str = None,
     transformation_file: str = None,
-    solver: pulp.LpSolver = pulp.PULP_CBC_CMD(msg=False),
+    solver: Union[pulp.LpSolver, AssignmentSolver] = pulp.PULP_CBC_CMD(
+        msg=False
+    ),
+    rig: StereoRig = None,
+    workers: int = 1,
+    candidates: int = None,
+    max_displacement: float = None,
+    predictor: ConstantVelocityFilter = None,
+    resume: bool = False,
+    shard_size: int = None,
+    overlap: int = 2,
 ) -> Tuple[np.ndarray]:
     """Matches, triangulates and tracks rods over frames from ``*.csv data``
     files.
@@ -238,7 +790,9 @@ def assign(
     It takes ``*.csv files`` with the columns from
     :const:`~ParticleDetection.utils.datasets.DEFAULT_COLUMNS` as input and
     also outputs the results in this format. The resulting dataset is saved in
-    the given output folder.
+    the given output folder. The rods are written to the output files while
+    they are tracked, i.e. the memory usage does not grow with the number of
+    frames.
 
     Parameters
     ----------
@@ -258,8 +812,8 @@ def assign(
         Second camera's identifier in the given dataset.\n
         By default ``"gp2"``.
     frame_numbers : Iterable[int], optional
-        An iterable of frame numbers present in the data.\n
-        By default ``None``.
+        An iterable of ascending frame numbers present in the data.\n
+        By default ``None``, i.e. all frames in the data.
     calibration_file : str, optional
         Path to a ``*.json`` file with stereocalibration data for the cameras
         which produced the images for the rod position data.\n
@@ -270,15 +824,62 @@ def assign(
         transformation from the first camera's coordinate system to the
         world/box coordinate system.\n
         By default the transformation constructed with Matlab is used.
-    solver : LpSolver, optional
-        Solver that is used for the n-partite matching problem.\n
+    solver : LpSolver | AssignmentSolver, optional
+        Solver that is used for the n-partite matching problem, see
+        :func:`npartite_matching`.\n
         Default is ``PULP_CBC_CMD(msg=False)``.
+    rig : StereoRig, optional
+        Already loaded stereocamera system. If it is given,
+        ``calibration_file`` and ``transformation_file`` are ignored.\n
+        By default ``None``.
+    workers : int, optional
+        Number of worker processes. With more than one worker and color, the
+        colors are tracked in parallel, because they are independent of each
+        other. The stereocamera system is sent to every worker only once.
+        ``None`` uses as many workers as there are CPUs.\n
+        By default ``1``, i.e. all colors are tracked in the calling process.
+    candidates : int, optional
+        Number of stereo rod pairs per tracked rod, that are considered for
+        the assignment, see :func:`match_frame`.\n
+        By default ``None``, i.e. all stereo rod pairs are considered.
+    max_displacement : float, optional
+        Maximum displacement of a rod center between consecutive frames, see
+        :func:`match_frame`.\n
+        By default ``None``, i.e. all stereo rod pairs are considered.
+    predictor : ConstantVelocityFilter, optional
+        Filter, whose copies predict the poses of every color's rods for the
+        next frame, see :class:`FrameTracker`.\n
+        By default ``None``, i.e. the rods are compared to their positions in
+        the last frame.
+    resume : bool, optional
+        Flag, whether to continue the interrupted tracking of every color
+        from its last checkpoint, see :func:`track_csv`. The returned values
+        then only cover the newly tracked frames.\n
+        By default ``False``.
+    shard_size : int, optional
+        Number of frames per shard. The frames of every color are split into
+        shards, that overlap by ``overlap`` frames and are tracked
+        independently, in parallel with multiple ``workers``. The particle
+        numbers of consecutive shards are stitched by an assignment in their
+        overlapping frames, see
+        :mod:`~ParticleDetection.reconstruct_3D.sharding`. The number of
+        rods, that disagree between the shards, is logged.\n
+        By default ``None``, i.e. every color is tracked sequentially.
+    overlap : int, optional
+        Number of frames, that consecutive shards overlap.\n
+        By default ``2``.
 
     Returns
     -------
     Tuple[ndarray, ndarray]
         [0]: reprojection errors\n
         [1]: rod lengths
+
+    Raises
+    ------
+    ValueError
+        Is raised, if ``resume`` is used with a ``shard_size`` or the
+        ``overlap`` is not in ``[1, shard_size)``.
     """
     if calibration_file is None:
         this_dir = pathlib.Path(__file__).parent.resolve()
@@ -293,33 +894,406 @@ def assign(
     if not os.path.exists(output_folder):
         os.mkdir(output_folder)
 
-    calibration = dl.load_camera_calibration(str(calibration_file))
-    transforms = dl.load_world_transformation(str(transformation_file))
-
-    # Derive projection matrices from the calibration
-    r1 = np.eye(3)
-    t1 = np.expand_dims(np.array([0.0, 0.0, 0.0]), 1)
-    P1 = np.vstack((r1.T, t1.T)) @ calibration["CM1"].T
-    P1 = P1.T
-
-    r2 = calibration["R"]
-    t2 = calibration["T"]
-    P2 = np.vstack((r2.T, t2.T)) @ calibration["CM2"].T
-    P2 = P2.T
-
-    # Preparation of world transformations
-    rot = R.from_matrix(transforms["rotation"])
-    trans = transforms["translation"]
+    if rig is None:
+        rig = StereoRig.from_files(calibration_file, transformation_file)
+    if workers is None:
+        workers = os.cpu_count()
+    options = (
+        cam1_name,
+        cam2_name,
+        frame_numbers,
+        solver,
+        candidates,
+        max_displacement,
+        predictor,
+        resume,
+    )
+    colors = list(colors)
+
+    if shard_size is not None:
+        if resume:
+            raise ValueError("Sharded tracking can not be resumed.")
+        results = _assign_sharded(
+            input_folder,
+            output_folder,
+            colors,
+            options[:-1],
+            shard_size,
+            overlap,
+            workers,
+            rig,
+        )
+    elif workers > 1 and len(colors) > 1:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(colors)),
+            initializer=init_worker,
+            initargs=(rig,),
+        ) as pool:
+            tasks = [
+                pool.submit(
+                    _assign_color,
+                    input_folder,
+                    output_folder,
+                    color,
+                    *options,
+                    progress=False,
+                )
+                for color in colors
+            ]
+            results = [
+                task.result()
+                for task in tqdm(tasks, colour="green", unit="color")
+            ]
+    else:
+        # evaluated lazily, i.e. one color after the other
+        results = (
+            _assign_color(
+                input_folder, output_folder, color, *options, rig=rig
+            )
+            for color in colors
+        )
 
     all_repr_errs = []
     all_rod_lengths = []
+    for repr_errs, rod_lengths in results:
+        all_repr_errs.extend(repr_errs)
+        all_rod_lengths.extend(rod_lengths)
+    return np.asarray(all_repr_errs), np.asarray(all_rod_lengths)
+
+
+def _assign_color(
+    input_folder: str,
+    output_folder: str,
+    color: str,
+    cam1_name: str,
+    cam2_name: str,
+    frame_numbers: Iterable[int],
+    solver: Union[pulp.LpSolver, AssignmentSolver],
+    candidates: Union[int, None],
+    max_displacement: Union[float, None],
+    predictor: Union[ConstantVelocityFilter, None],
+    resume: bool,
+    rig: StereoRig = None,
+    progress: bool = True,
+) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """Matches, triangulates and tracks the rods of one color, see
+    :func:`assign`, and streams the results to the color's output file.
+    Without a ``rig``, the worker's stereocamera system is used."""
+    rig = worker_rig(rig)
+    tracker = FrameTracker(
+        solver,
+        candidates,
+        max_displacement,
+        predictor=copy.deepcopy(predictor),
+    )
+    f_in = input_folder + f"/rods_df_{color}.csv"
+    f_out = os.path.join(output_folder, f"rods_df_{color}.csv")
+    repr_errs = []
+    rod_lengths = []
+    for _, tmp_costs, tmp_lengths in track_csv(
+        f_in,
+        f_out,
+        color,
+        cam1_name,
+        cam2_name,
+        rig,
+        frame_numbers,
+        tracker,
+        resume=resume,
+        progress=progress,
+    ):
+        repr_errs.append(tmp_costs)
+        rod_lengths.append(tmp_lengths)
+    return repr_errs, rod_lengths
+
+
+def _assign_sharded(
+    input_folder: str,
+    output_folder: str,
+    colors: List[str],
+    options: tuple,
+    shard_size: int,
+    overlap: int,
+    workers: int,
+    rig: StereoRig,
+) -> List[Tuple[List[np.ndarray], List[np.ndarray]]]:
+    """Tracks overlapping shards of the frames of all colors independently
+    and stitches them per color, see :func:`assign`."""
+    cam1_name, cam2_name, frame_numbers, *tracking = options
+    shards = []
     for color in colors:
         f_in = input_folder + f"/rods_df_{color}.csv"
-        data = pd.read_csv(f_in, sep=",", index_col=0)
-        df_out = pd.DataFrame()
-        for fn in tqdm(range(len(frame_numbers)), colour="green"):
-            frame = frame_numbers[fn]
-            if fn == 0:
+        if frame_numbers is None:
+            frames = pd.read_csv(f_in, usecols=["frame"]).frame.unique()
+        else:
+            frames = frame_numbers
+        frames = list(frames)
+        ranges = shard_ranges(len(frames), shard_size, overlap)
+        shards.extend(
+            (
+                color,
+                i,
+                (start, core, stop),
+                (f_in, _shard_file(output_folder, color, i), color),
+                (cam1_name, cam2_name, frames[start:stop], *tracking),
+                frames,
+            )
+            for i, (start, core, stop) in enumerate(ranges)
+        )
+
+    if workers > 1 and len(shards) > 1:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(shards)),
+            initializer=init_worker,
+            initargs=(rig,),
+        ) as pool:
+            tasks = [
+                pool.submit(_track_shard, *files, *args)
+                for _, _, _, files, args, _ in shards
+            ]
+            tracked = [
+                task.result()
+                for task in tqdm(tasks, colour="green", unit="shard")
+            ]
+    else:
+        tracked = [
+            _track_shard(*files, *args, rig=rig)
+            for _, _, _, files, args, _ in tqdm(
+                shards, colour="green", unit="shard"
+            )
+        ]
+
+    results = []
+    for color in colors:
+        color_shards = [
+            (shard[2], shard[3][1], result)
+            for shard, result in zip(shards, tracked)
+            if shard[0] == color
+        ]
+        frames = next(shard[5] for shard in shards if shard[0] == color)
+        f_out = os.path.join(output_folder, f"rods_df_{color}.csv")
+        repr_errs, rod_lengths, disagreements = _stitch_shards(
+            f_out, frames, color_shards
+        )
+        log = _logger.warning if disagreements else _logger.info
+        log(
+            f"Stitched {len(color_shards)} shards of color '{color}' with "
+            f"{disagreements} rods disagreeing at the shard boundaries."
+        )
+        results.append((repr_errs, rod_lengths))
+    return results
+
+
+def _shard_file(output_folder: str, color: str, shard: int) -> str:
+    """Path of the intermediate output file of a shard."""
+    return os.path.join(output_folder, f"rods_df_{color}.shard{shard}.csv")
+
+
+def _track_shard(
+    f_in: str,
+    f_out: str,
+    color: str,
+    cam1_name: str,
+    cam2_name: str,
+    frame_numbers: List[int],
+    solver: Union[pulp.LpSolver, AssignmentSolver],
+    candidates: Union[int, None],
+    max_displacement: Union[float, None],
+    predictor: Union[ConstantVelocityFilter, None],
+    rig: StereoRig = None,
+) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+    """Tracks the frames of one shard independently of the other shards.
+    Without a ``rig``, the worker's stereocamera system is used."""
+    tracker = FrameTracker(
+        solver,
+        candidates,
+        max_displacement,
+        predictor=copy.deepcopy(predictor),
+    )
+    return list(
+        track_csv(
+            f_in,
+            f_out,
+            color,
+            cam1_name,
+            cam2_name,
+            worker_rig(rig),
+            frame_numbers,
+            tracker,
+            progress=False,
+        )
+    )
+
+
+def _stitch_shards(
+    f_out: str,
+    frames: List[int],
+    shards: List[Tuple[Tuple[int, int, int], str, list]],
+) -> Tuple[List[np.ndarray], List[np.ndarray], int]:
+    """Stitches the particle numbers of consecutive shards and writes their
+    core frames to the output file. The intermediate files of the shards are
+    removed. Returns the reprojection errors, rod lengths and number of
+    disagreeing rods."""
+    repr_errs = []
+    rod_lengths = []
+    disagreements = 0
+    previous = None
+    with CSVSink(f_out) as sink:
+        for (start, core, stop), shard_file, tracked in shards:
+            shard = pd.read_csv(
+                shard_file, index_col=0, float_precision="round_trip"
+            )
+            os.remove(shard_file)
+            if previous is not None:
+                overlap = frames[start:core]
+                particles_prev = np.unique(previous.particle)
+                particles_next = np.unique(shard.particle)
+                mapping, diff = stitch_tracks(
+                    _particle_points(previous, overlap, particles_prev),
+                    _particle_points(shard, overlap, particles_next),
+                )
+                disagreements += diff
+                new_ids = (
+                    particles_prev.max(initial=-1)
+                    + 1
+                    + np.arange(len(particles_next))
+                )
+                stitched = np.where(
+                    mapping >= 0, particles_prev[mapping], new_ids
+                )
+                shard["particle"] = shard.particle.map(
+                    dict(zip(particles_next, stitched))
+                )
+            core_frames = frames[core:stop]
+            previous = shard.loc[shard.frame.isin(core_frames)]
+            sink.append(previous)
+            for frame, tmp_costs, tmp_lengths in tracked:
+                if frame in core_frames:
+                    repr_errs.append(tmp_costs)
+                    rod_lengths.append(tmp_lengths)
+    return repr_errs, rod_lengths, disagreements
+
+
+def _particle_points(
+    data: pd.DataFrame, frames: List[int], particles: np.ndarray
+) -> np.ndarray:
+    """Endpoints of the given particles in the given frames of shape
+    ``(frames, particles, 2, 3)``, ``NaN`` for missing particles."""
+    index = pd.MultiIndex.from_product([frames, particles])
+    points = (
+        data.set_index(["frame", "particle"])[
+            ["x1", "y1", "z1", "x2", "y2", "z2"]
+        ]
+        .reindex(index)
+        .to_numpy()
+    )
+    return points.reshape((len(frames), len(particles), 2, 3))
+
+
+def track_csv(
+    f_in: Union[str, os.PathLike],
+    f_out: Union[str, os.PathLike],
+    color: str,
+    cam1_name: str,
+    cam2_name: str,
+    rig: StereoRig,
+    frame_numbers: Iterable[int] = None,
+    tracker: "FrameTracker" = None,
+    chunk_size: int = 100_000,
+    flush_interval: int = 100,
+    resume: bool = False,
+    progress: bool = True,
+) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+    """Matches, triangulates and tracks the rods of one color from a
+    ``*.csv`` file frame by frame with bounded memory.
+
+    The input file is read in chunks and only the rows of the current frame
+    are kept, as well as the tracked rods of the last frame and the state of
+    the ``tracker``. The results are streamed to the output file. Every
+    ``flush_interval`` frames, the output file is flushed and a checkpoint
+    with the state needed for the next frame is written next to it
+    (``f"{f_out}.checkpoint"``). An interrupted run can be continued from
+    this checkpoint with ``resume=True``. The checkpoint is removed after the
+    last frame.
+
+    This function is a generator, the tracking only proceeds while the
+    results are consumed.
+
+    Parameters
+    ----------
+    f_in : str | PathLike
+        Path of the ``*.csv`` file with the rod position data of ``color``.
+        Its rows must be ordered by frame.
+    f_out : str | PathLike
+        Path of the output file.
+    color : str
+        Color of the rods in ``f_in``.
+    cam1_name : str
+        First camera's identifier in the given dataset, e.g. ``"gp1"``.
+    cam2_name : str
+        Second camera's identifier in the given dataset, e.g. ``"gp2"``.
+    rig : StereoRig
+        Stereocamera system used for the reconstruction.
+    frame_numbers : Iterable[int], optional
+        Ascending frame numbers to track. Frames without data are skipped.\n
+        By default ``None``, i.e. all frames in ``f_in``.
+    tracker : FrameTracker, optional
+        Tracker of the rods, see :class:`FrameTracker`. It is replaced by the
+        checkpoint's tracker, when a run is resumed.\n
+        By default ``FrameTracker()``.
+    chunk_size : int, optional
+        Number of rows read from ``f_in`` at once.\n
+        By default ``100_000``.
+    flush_interval : int, optional
+        Number of frames between checkpoints.\n
+        By default ``100``.
+    resume : bool, optional
+        Flag, whether to continue after the last checkpoint of an interrupted
+        run. Without a checkpoint, the tracking starts from the beginning.\n
+        By default ``False``.
+    progress : bool, optional
+        Flag, whether to show a progress bar.\n
+        By default ``True``.
+
+    Yields
+    ------
+    Tuple[int, ndarray, ndarray]
+        Frame number, assignment costs and rod lengths of every tracked
+        frame, see :func:`match_frame`. Frames of a previous run are not
+        repeated, when a run is resumed.
+
+    Raises
+    ------
+    ValueError
+        Is raised, if ``frame_numbers`` is not ascending or the rows of
+        ``f_in`` are not ordered by frame.
+    """
+    if tracker is None:
+        tracker = FrameTracker()
+    checkpoint_file = f"{f_out}.checkpoint"
+    last_frame, tmp_df = None, None
+    if resume and os.path.exists(checkpoint_file):
+        with open(checkpoint_file, "rb") as f:
+            checkpoint = pickle.load(f)
+        os.truncate(f_out, checkpoint["size"])
+        last_frame = checkpoint["frame"]
+        tmp_df = checkpoint["data"]
+        tracker = checkpoint["tracker"]
+        _logger.info(f"Resuming the tracking of {f_out} after {last_frame}.")
+    if frame_numbers is not None:
+        frame_numbers = list(frame_numbers)
+        if np.any(np.diff(frame_numbers) <= 0):
+            raise ValueError("The frame numbers must be ascending.")
+        if last_frame is not None:
+            frame_numbers = [f for f in frame_numbers if f > last_frame]
+
+    frames = _read_frames(f_in, frame_numbers, chunk_size, after=last_frame)
+    total = None if frame_numbers is None else len(frame_numbers)
+    with CSVSink(f_out, append=last_frame is not None) as sink:
+        for i, (frame, data) in enumerate(
+            tqdm(frames, total=total, colour="green", disable=not progress)
+        ):
+            if tmp_df is None:
                 # Matching without a previous frame available
                 tmp_df, tmp_costs, tmp_lengths = match2D.match_frame(
                     data,
@@ -327,15 +1301,7 @@ def assign(
                     cam2_name,
                     frame,
                     color,
-                    calibration,
-                    P1,
-                    P2,
-                    rot,
-                    trans,
-                    r1,
-                    r2,
-                    t1,
-                    t2,
+                    rig,
                     renumber=True,
                 )
             else:
@@ -347,26 +1313,299 @@ def assign(
                     cam2_name,
                     frame,
                     color,
-                    calibration,
-                    P1,
-                    P2,
-                    rot,
-                    trans,
-                    r1,
-                    r2,
-                    t1,
-                    t2,
+                    rig,
+                    tracker=tracker,
                 )
-            df_out = pd.concat([df_out, tmp_df])
-            all_repr_errs.append(tmp_costs)
-            all_rod_lengths.append(tmp_lengths)
-
-        # Save results to disk
-        df_out.reset_index(drop=True, inplace=True)
-        df_out.to_csv(
-            os.path.join(output_folder, f"rods_df_{color}.csv"), sep=","
-        )
-    return np.asarray(all_repr_errs), np.asarray(all_rod_lengths)
+            sink.append(tmp_df)
+            if (i + 1) % flush_interval == 0:
+                sink.flush()
+                _write_checkpoint(
+                    checkpoint_file,
+                    {
+                        "frame": frame,
+                        "size": sink.tell(),
+                        "data": tmp_df,
+                        "tracker": tracker,
+                    },
+                )
+            yield frame, tmp_costs, tmp_lengths
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    _logger.info(
+        f"Tracking of color '{color}': {tracker.hits} of "
+        f"{tracker.warm_starts} warm started frames were already optimal."
+    )
+
+
+def _read_frames(
+    f_in: Union[str, os.PathLike],
+    frame_numbers: Union[List[int], None],
+    chunk_size: int,
+    after: int = None,
+) -> Iterator[Tuple[int, pd.DataFrame]]:
+    """Reads the rows of a ``*.csv`` file, that is ordered by frame, in
+    chunks and yields them frame by frame. Only the given frames and the ones
+    ``after`` a frame are yielded."""
+    current, pending = None, []
+    for chunk in pd.read_csv(f_in, sep=",", index_col=0, chunksize=chunk_size):
+        if not len(chunk):
+            continue
+        if not chunk.frame.is_monotonic_increasing or (
+            current is not None and chunk.frame.iloc[0] < current
+        ):
+            raise ValueError(f"The rows of {f_in} must be ordered by frame.")
+        if after is not None:
+            chunk = chunk.loc[chunk.frame > after]
+        if frame_numbers is not None:
+            chunk = chunk.loc[chunk.frame.isin(frame_numbers)]
+        for frame, rows in chunk.groupby("frame", sort=False):
+            if frame != current:
+                if pending:
+                    yield current, pd.concat(pending)
+                current, pending = frame, []
+            pending.append(rows)
+    if pending:
+        yield current, pd.concat(pending)
+
+
+def _write_checkpoint(file: str, checkpoint: dict):
+    """Replaces the checkpoint ``file`` at once, so that it is never
+    incomplete."""
+    with open(f"{file}.tmp", "wb") as f:
+        pickle.dump(checkpoint, f)
+    os.replace(f"{file}.tmp", file)
+
+
+@dataclass
+class FrameGeometry:
+    """Candidate geometry of all stereo rod pairs of one frame.
+
+    It does not depend on the tracking of previous frames, so it can be
+    computed ahead of the assignment, see :func:`frame_geometries`.
+
+    Attributes
+    ----------
+    rods_cam1 : ndarray
+        Endpoints of the rods on camera 1 of shape ``(rods(cam1), 2, 2)``.
+    rods_cam2 : ndarray
+        Endpoints of the rods on camera 2 of shape ``(rods(cam2), 2, 2)``.
+    points : ndarray
+        Triangulated endpoints of all rod pairs and endpoint combinations in
+        *world*/*experiment* coordinates of shape
+        ``(rods(cam1), rods(cam2), 4, 3)``.
+    repr_errs : ndarray
+        Reprojection errors of the triangulated endpoints on both cameras of
+        shape ``(rods(cam1), rods(cam2), 4, 2)``.
+    costs : ndarray
+        Summed reprojection errors of the better endpoint pairing of all rod
+        pairs of shape ``(rods(cam1), rods(cam2))``.
+    """
+
+    rods_cam1: np.ndarray
+    rods_cam2: np.ndarray
+    points: np.ndarray
+    repr_errs: np.ndarray
+    costs: np.ndarray
+
+
+def frame_geometry(
+    data: pd.DataFrame,
+    cam1_name: str,
+    cam2_name: str,
+    frame: int,
+    calibration: Union[dict, StereoRig],
+    rot: R = None,
+    trans: np.ndarray = None,
+) -> Union[FrameGeometry, None]:
+    """Undistorts and triangulates all stereo rod pairs of one frame and
+    computes their reprojection errors.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Dataset of rod positions.
+    cam1_name : str
+        First camera's identifier in the given dataset, e.g. ``"gp1"``.
+    cam2_name : str
+        Second camera's identifier in the given dataset, e.g. ``"gp2"``.
+    frame : int
+        Frame in ``data`` who's rods shall be triangulated.
+    calibration : dict | StereoRig
+        Stereocamera calibration parameters, see :func:`match_frame`.
+    rot : Rotation, optional
+        Rotation from camera 1 coordinates to *world*/*experiment* coordinates.
+        It is ignored, if ``calibration`` is a :class:`.StereoRig`.\n
+        By default ``None``, i.e. no transformation.
+    trans : ndarray, optional
+        Translation vector as part of the transformation to
+        *world*/*experiment* coordinates.
+        It is ignored, if ``calibration`` is a :class:`.StereoRig`.\n
+        By default ``None``, i.e. no transformation.
+
+    Returns
+    -------
+    FrameGeometry | None
+        Returns ``None``, if one of the cameras has no rods in ``frame``.
+    """
+    cols_cam1, cols_cam2 = _camera_columns(cam1_name, cam2_name)
+    in_frame = data.frame.to_numpy() == frame
+    return _rods_geometry(
+        data.loc[in_frame, cols_cam1].to_numpy(),
+        data.loc[in_frame, cols_cam2].to_numpy(),
+        match2D._rig_from_arguments(calibration, rot, trans),
+    )
+
+
+def _rods_geometry(
+    points_cam1: np.ndarray, points_cam2: np.ndarray, rig: StereoRig
+) -> Union[FrameGeometry, None]:
+    """Computes the :class:`FrameGeometry` of one frame's rod positions,
+    given as rows of ``x1, y1, x2, y2`` per camera."""
+    # remove rows with NaNs or only 0s
+    # format of rods_camX: [rod, point, coordinate(x/y)]
+    rods_cam1 = points_cam1[
+        ~np.isnan(points_cam1).all(axis=1) & (points_cam1 != 0).any(axis=1)
+    ].reshape(-1, 2, 2)
+    rods_cam2 = points_cam2[
+        ~np.isnan(points_cam2).all(axis=1) & (points_cam2 != 0).any(axis=1)
+    ].reshape(-1, 2, 2)
+    if len(rods_cam1) == 0 or len(rods_cam2) == 0:
+        # no rod data available for matching
+        return None
+
+    # Undistort points using the camera calibration
+    undist_cam1 = rig.undistort(rods_cam1, cam=1)
+    undist_cam2 = rig.undistort(rods_cam2, cam=2)
+    # Triangulation of all possible point-pairs to 3D, broadcast to
+    # [rod(cam1), rod(cam2), combo, coordinate], see match2D._combo_geometry
+    ep1 = np.array([0, 0, 1, 1])
+    ep2 = np.array([0, 1, 0, 1])
+    shape = (len(rods_cam1), len(rods_cam2), 4, 2)
+    p_triang = rig.triangulate(
+        np.broadcast_to(undist_cam1[:, None, ep1], shape),
+        np.broadcast_to(undist_cam2[None, :, ep2], shape),
+        undistort=False,
+    )
+
+    # Reprojection to the image plane for point matching
+    # rep_errs: [rod(cam1), rod(cam2), combo, cam]
+    rep_errs = np.stack(
+        [
+            np.linalg.norm(
+                rods_cam1[:, None, ep1] - rig.reproject(p_triang, cam=1),
+                axis=-1,
+            ),
+            np.linalg.norm(
+                rods_cam2[None, :, ep2] - rig.reproject(p_triang, cam=2),
+                axis=-1,
+            ),
+        ],
+        axis=-1,
+    )
+    repr_errs = np.sum(rep_errs, axis=-1)
+
+    # Transformation to world coordinates
+    p_triang = rig.to_world(p_triang)
+
+    # Caution: the data order is different form the MATLAB script
+    #   ---> Matlab: (p11, p21), (p12, p21), (p11, p22), (p12, p22)
+    #   ---> Python: (p11, p21), (p11, p22), (p12, p21), (p12, p22)
+    costs = np.minimum(
+        repr_errs[..., 0] + repr_errs[..., 3],
+        repr_errs[..., 1] + repr_errs[..., 2],
+    )
+
+    return FrameGeometry(rods_cam1, rods_cam2, p_triang, rep_errs, costs)
+
+
+def frame_geometries(
+    data: pd.DataFrame,
+    cam1_name: str,
+    cam2_name: str,
+    frames: Iterable[int],
+    calibration: Union[dict, StereoRig],
+    workers: int = 2,
+    prefetch: int = 4,
+) -> Iterator[Tuple[int, Union[FrameGeometry, None]]]:
+    """Computes the candidate geometry of frames ahead of their use.
+
+    The geometries are computed as with :func:`frame_geometry` by a pool of
+    worker threads, while the caller processes the previous frames, e.g.
+    tracks them with :func:`match_frame`. The dataset is grouped by frame
+    only once for all frames. At most ``prefetch`` frames are
+    computed ahead, so the memory consumption is bounded.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Dataset of rod positions.
+    cam1_name : str
+        First camera's identifier in the given dataset, e.g. ``"gp1"``.
+    cam2_name : str
+        Second camera's identifier in the given dataset, e.g. ``"gp2"``.
+    frames : Iterable[int]
+        Frames in ``data`` in the order they are yielded.
+    calibration : dict | StereoRig
+        Stereocamera calibration parameters, see :func:`match_frame`.
+        Preferably, an already prepared :class:`.StereoRig`.
+    workers : int, optional
+        Number of worker threads.\n
+        By default ``2``.
+    prefetch : int, optional
+        Maximum number of frames computed ahead of the one yielded.\n
+        By default ``4``.
+
+    Yields
+    ------
+    Tuple[int, FrameGeometry | None]
+        Frame number and its candidate geometry.
+    """
+    rig = match2D._rig_from_arguments(calibration)
+    cols_cam1, cols_cam2 = _camera_columns(cam1_name, cam2_name)
+    # group the dataset by frame once, instead of filtering it per frame
+    rows = data.groupby("frame").indices
+    points_cam1 = data[cols_cam1].to_numpy()
+    points_cam2 = data[cols_cam2].to_numpy()
+    frames = iter(frames)
+    pending = collections.deque()
+
+    def submit():
+        for frame in itertools.islice(frames, prefetch + 1 - len(pending)):
+            idx = rows.get(frame, [])
+            pending.append(
+                (
+                    frame,
+                    pool.submit(
+                        _rods_geometry,
+                        points_cam1[idx],
+                        points_cam2[idx],
+                        rig,
+                    ),
+                )
+            )
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        submit()
+        while pending:
+            frame, task = pending.popleft()
+            geometry = task.result()
+            submit()
+            yield frame, geometry
+    finally:
+        for _, task in pending:
+            task.cancel()
+        pool.shutdown()
+
+
+def _camera_columns(
+    cam1_name: str, cam2_name: str
+) -> Tuple[List[str], List[str]]:
+    """Columns of the rod endpoints on both cameras."""
+    columns = ("x1", "y1", "x2", "y2")
+    return [f"{c}_{cam1_name}" for c in columns], [
+        f"{c}_{cam2_name}" for c in columns
+    ]
 
 
 def match_frame(
@@ -376,15 +1615,22 @@ def match_frame(
     cam2_name: str,
     frame: int,
     color: str,
-    calibration: dict,
-    P1: np.ndarray,
-    P2: np.ndarray,
-    rot: R,
-    trans: np.ndarray,
-    r1: np.ndarray,
-    r2: np.ndarray,
-    t1: np.ndarray,
-    t2: np.ndarray,
+    calibration: Union[dict, StereoRig],
+    P1: np.ndarray = None,
+    P2: np.ndarray = None,
+    rot: R = None,
+    trans: np.ndarray = None,
+    r1: np.ndarray = None,
+    r2: np.ndarray = None,
+    t1: np.ndarray = None,
+    t2: np.ndarray = None,
+    solver: Union[pulp.LpSolver, AssignmentSolver] = pulp.PULP_CBC_CMD(
+        msg=False
+    ),
+    candidates: int = None,
+    max_displacement: float = None,
+    tracker: "FrameTracker" = None,
+    geometry: "FrameGeometry" = None,
 ):
     """Matches, triangulates and tracks rods for one frame from a
     ``DataFrame``.
@@ -403,29 +1649,58 @@ def match_frame(
         Frame in ``data`` who's endpoints shall be (re-)evaluated.
     color : str
         Color of the rods in ``data`` to match.
-    calibration : dict
+    calibration : dict | StereoRig
         Stereocamera calibration parameters with the required fields:\n
         ``"CM1"``: camera matrix of cam1\n
+        ``"dist1"``: distortion coefficients of cam1\n
+        ``"CM2"``: camera matrix of cam2\n
+        ``"dist2"``: distortion coefficients of cam2\n
         ``"R"``: rotation matrix between cam1 & cam2\n
         ``"T"``: translation vector between cam1 & cam2\n
-        ``"CM2"``: camera matrix of cam2
-    P1 : ndarray
-        Projection matrix for camera 1.
-    P2 : ndarray
-        Projection matrix for camera 2.
-    rot : Rotation
+        Preferably, an already prepared :class:`.StereoRig`, that includes
+        the transformation to *world*/*experiment* coordinates.
+    P1, P2, r1, r2, t1, t2 : ndarray, optional
+        Unused, the projection matrices and camera poses are derived from
+        ``calibration``. Only kept for backwards compatibility.
+    rot : Rotation, optional
         Rotation from camera 1 coordinates to *world*/*experiment* coordinates.
-    trans : ndarray
+        It is ignored, if ``calibration`` is a :class:`.StereoRig`.\n
+        By default ``None``, i.e. no transformation.
+    trans : ndarray, optional
         Translation vector as part of the transformation to
         *world*/*experiment* coordinates.
-    r1 : ndarray
-        Rotation matrix of camera 1.
-    r2 : ndarray
-        Rotation matrix of camera 2.
-    t1 : ndarray
-        Translation vector of camera 1.
-    t2 : ndarray
-        Translation vector of camera 2.
+        It is ignored, if ``calibration`` is a :class:`.StereoRig`.\n
+        By default ``None``, i.e. no transformation.
+    solver : LpSolver | AssignmentSolver, optional
+        Solver that is used for the n-partite matching problem, see
+        :func:`npartite_matching`.\n
+        By default ``PULP_CBC_CMD(msg=False)``.
+    candidates : int, optional
+        Number of stereo rod pairs per rod of the last frame, that are
+        considered for the assignment. The pairs with the closest rod centers
+        are chosen, see :func:`create_sparse_weights`. The assignment is then
+        solved with :func:`sparse_npartite_matching`. If no complete
+        assignment is possible with these candidates, their number is doubled
+        until it is.\n
+        By default ``None``, i.e. all stereo rod pairs are considered.
+    max_displacement : float, optional
+        Maximum displacement of a rod center between the last and the current
+        frame for a stereo rod pair to be considered for the assignment, see
+        ``candidates``. If no complete assignment is possible, the
+        displacement is doubled until it is.\n
+        By default ``None``, i.e. all stereo rod pairs are considered.
+    tracker : FrameTracker, optional
+        Tracker of the rods of ``color``, that carries its state from the
+        last to the current frame, see :class:`FrameTracker`. If it is
+        given, ``solver``, ``candidates`` and ``max_displacement`` are
+        ignored in favor of the tracker's settings.\n
+        By default ``None``, i.e. the frame is matched without information
+        from previous assignments.
+    geometry : FrameGeometry, optional
+        Precomputed candidate geometry of ``frame``, e.g. from
+        :func:`frame_geometries`.\n
+        By default ``None``, i.e. it is computed with
+        :func:`frame_geometry`.
 
     Returns
     -------
@@ -440,116 +1715,27 @@ def match_frame(
     ValueError
         Is raised when an *unbalanced* dataset is encountered, i.e. on
         consecutive frames or camera angles an unequal number of rods is
-        present.
+        present.\n
+        Is raised when ``candidates`` or ``max_displacement`` is not positive.
     """
-    # Load data
-    cols_cam1 = [
-        f"x1_{cam1_name}",
-        f"y1_{cam1_name}",
-        f"x2_{cam1_name}",
-        f"y2_{cam1_name}",
-    ]
-    cols_cam2 = [
-        f"x1_{cam2_name}",
-        f"y1_{cam2_name}",
-        f"x2_{cam2_name}",
-        f"y2_{cam2_name}",
-    ]
-    _data_cam1 = data.loc[data.frame == frame, cols_cam1]
-    _data_cam2 = data.loc[data.frame == frame, cols_cam2]
-    # remove rows with NaNs or only 0s
-    _data_cam1.dropna(how="all", inplace=True)
-    _data_cam2.dropna(how="all", inplace=True)
-    _data_cam1 = _data_cam1.loc[(_data_cam1 != 0).any(axis=1)]
-    _data_cam2 = _data_cam2.loc[(_data_cam2 != 0).any(axis=1)]
-    if len(_data_cam1.index) == 0 or len(_data_cam2.index) == 0:
+    if tracker is None:
+        tracker = FrameTracker(
+            solver, candidates, max_displacement, warm_start=False
+        )
+
+    cols_cam1, cols_cam2 = _camera_columns(cam1_name, cam2_name)
+    if geometry is None:
+        geometry = frame_geometry(
+            data, cam1_name, cam2_name, frame, calibration, rot, trans
+        )
+    if geometry is None:
         # no rod data available for matching
         return
-
-    # format of rods_camX: [rod, point, coordinate(x/y)]
-    rods_cam1 = _data_cam1.to_numpy().reshape(-1, 2, 2)
-    rods_cam2 = _data_cam2.to_numpy().reshape(-1, 2, 2)
-
-    # Undistort points using the camera calibration
-    tmp_points = cv2.undistortImagePoints(
-        rods_cam1.reshape(2, -1), calibration["CM1"], calibration["dist1"]
-    ).squeeze()
-    undist_cam1 = np.zeros(tmp_points.shape)
-    tmp_points = np.concatenate([tmp_points[:, 0], tmp_points[:, 1]])
-    for i in range(len(tmp_points)):
-        undist_cam1[i // 2][i % 2] = tmp_points[i]
-    undist_cam1 = undist_cam1.reshape((-1, 2, 2))
-
-    tmp_points = cv2.undistortImagePoints(
-        rods_cam2.reshape(2, -1), calibration["CM2"], calibration["dist2"]
-    ).squeeze()
-    undist_cam2 = np.zeros(tmp_points.shape)
-    tmp_points = np.concatenate([tmp_points[:, 0], tmp_points[:, 1]])
-    for i in range(len(tmp_points)):
-        undist_cam2[i // 2][i % 2] = tmp_points[i]
-    undist_cam2 = undist_cam2.reshape((-1, 2, 2))
-    # Triangulation of all possible point-pairs to 3D
-    pairs_all = [
-        list(itertools.product(p[0], p[1]))
-        for p in itertools.product(undist_cam1, undist_cam2)
-    ]
-    pairs_original = [
-        list(itertools.product(p[0], p[1]))
-        for p in itertools.product(rods_cam1, rods_cam2)
-    ]
-
-    pairs_all = np.reshape(pairs_all, (-1, 2, 2))
-    pairs_original = np.reshape(pairs_original, (-1, 2, 2))
-
-    p_triang = cv2.triangulatePoints(
-        P1,
-        P2,
-        pairs_all[:, 0, :].squeeze().transpose(),
-        pairs_all[:, 1, :].squeeze().transpose(),
-    )
-    p_triang = np.asarray([p[0:3] / p[3] for p in p_triang.transpose()])
-
-    # Reprojection to the image plane for point matching
-    repr_cam1 = cv2.projectPoints(
-        p_triang, r1, t1, calibration["CM1"], calibration["dist1"]
-    )[0].squeeze()
-    repr_cam2 = cv2.projectPoints(
-        p_triang, r2, t2, calibration["CM2"], calibration["dist2"]
-    )[0].squeeze()
-
-    repr_cam1 = pairs_original[:, 0, :] - repr_cam1
-    repr_cam2 = pairs_original[:, 1, :] - repr_cam2
-    # p_repr: [combo, err_point, cam]
-    p_repr = np.stack([repr_cam1, repr_cam2], axis=2)
-    p_repr = np.swapaxes(p_repr, 1, 2)  # [combo, cam, err_point]
-    repr_errs = np.sum(np.linalg.norm(p_repr, axis=2), axis=1)
-
-    # Transformation to world coordinates
-    p_triang = rot.apply(p_triang) + trans
-
-    # Consolidate data
-    # Caution: the data order is different form the MATLAB script
-    #   ---> Matlab: (p11, p21), (p12, p21), (p11, p22), (p12, p22)
-    #   ---> Python: (p11, p21), (p11, p22), (p12, p21), (p12, p22)
-    # repr_errs desired shape:[block x err(p)] with
-    #   block: re11, re12, re21, re22
-    repr_errs = np.reshape(repr_errs, (-1, 4))
-    costs = np.reshape(
-        np.min(
-            [
-                np.sum(repr_errs[:, 0::3], axis=1),
-                np.sum(repr_errs[:, 1:3], axis=1),
-            ],
-            axis=0,
-        ),
-        (len(undist_cam1), len(undist_cam2)),
-    )
+    rods_cam1, rods_cam2 = geometry.rods_cam1, geometry.rods_cam2
+    p_triang, rep_errs = geometry.points, geometry.repr_errs
+    costs = geometry.costs
 
     # 3-assignment matching
-    p_triang = p_triang.reshape((len(rods_cam1), len(rods_cam2), 4, 3))
-    rep_errs = np.linalg.norm(p_repr, axis=2)
-    rep_errs = np.reshape(rep_errs, (len(rods_cam1), len(rods_cam2), 4, 2))
-
     # TODO: check for NaN, so that an error is thrown, if NaNs encountered in
     # 3D coordinates
     last_points = data_last_frame.loc[
@@ -562,12 +1748,13 @@ def match_frame(
     # p_triang: (rod_id(cam1), rod_id(cam2), end-combo, 3D-coordinates)
     # last_points: (rod_id, end-point, 3D-coordinates)
 
-    weights, point_choices = create_weights(p_triang, last_points, rep_errs)
-    rod, cam1_ind, cam2_ind = npartite_matching(weights, maximize=True)
+    rod, cam1_ind, cam2_ind = tracker.match(
+        p_triang, last_points, rep_errs, rods_cam1, rods_cam2
+    )
 
-    rod_nums = list(range(weights.shape[0]))
+    rod_nums = list(range(len(last_points)))
 
-    idx_out = np.empty((3, weights.shape[0]))
+    idx_out = np.empty((3, len(last_points)))
     idx_out.fill(np.nan)
     idx_out[:, rod] = np.stack([rod, cam1_ind, cam2_ind], axis=0)
 
@@ -583,19 +1770,27 @@ def match_frame(
         ]
 
     idx_out = idx_out.astype(int)
-    point_choices = point_choices.astype(int)
+    try:
+        # endpoint combination of the previous rod matching the rod pair best
+        point_choices = np.argmin(
+            _combination_scores(
+                p_triang[idx_out[1], idx_out[2]],
+                last_points[idx_out[0]],
+                rep_errs[idx_out[1], idx_out[2]],
+            ),
+            axis=-1,
+        )
+    except IndexError:
+        raise ValueError(
+            "Unbalanced dataset given. Please use dataset "
+            "with the same number of rods on every frame."
+        )
     out = np.zeros((idx_out.shape[1], 2 * 3 + 3 + 1 + 4 + 4))
     for rod_id in range(idx_out.shape[1]):
         idx_r = idx_out[0, rod_id]
         i1 = idx_out[1, rod_id]
         i2 = idx_out[2, rod_id]
-        try:
-            i3 = point_choices[idx_r, i1, i2]
-        except IndexError:
-            raise ValueError(
-                "Unbalanced dataset given. Please use dataset "
-                "with the same number of rods on every frame."
-            )
+        i3 = point_choices[rod_id]
 
         out[idx_r, 0:6] = np.concatenate(
             (p_triang[i1, i2, i3], p_triang[i1, i2, 3 - i3])
@@ -608,6 +1803,7 @@ def match_frame(
         )
         out[idx_r, 10:14] = rods_cam1[i1, :].flatten()
         out[idx_r, 14:] = rods_cam2[i2, :].flatten()
+    tracker.observe(out[:, 0:6].reshape(-1, 2, 3))
     out_columns = [
         "x1",
         "y1",
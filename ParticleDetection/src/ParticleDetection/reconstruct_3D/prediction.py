@@ -0,0 +1,208 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Prediction of rod poses for tracking with a lightweight Kalman filter.
+
+A rod's pose is described by its center and its half-axis vector, i.e. its
+endpoints are ``center ± half_axis``. Both are modelled to change with a
+constant rate between frames, so the filter estimates the velocity and the
+angular rate of every rod alongside its pose. The predicted poses can replace
+the last frame's rod positions for gating and assignment costs, see
+:class:`~ParticleDetection.reconstruct_3D.matchND.FrameTracker` and
+:func:`~ParticleDetection.reconstruct_3D.tracking.tracking_predictive`.
+
+**Authors**: Adrian Niemann (adrian.niemann@ovgu.de), Dmitry Puzyrev
+(dmitry.puzyrev@ovgu.de)
+
+**Date**:       2024
+
+"""
+import numpy as np
+
+
+class ConstantVelocityFilter:
+    """Constant-velocity Kalman filter of the poses of multiple rods.
+
+    The centers and half-axis vectors of the rods move with constant rates,
+    disturbed by white-noise accelerations. Every coordinate is filtered
+    independently with the same dynamics, so one ``2x2`` covariance matrix
+    per rod is kept for the center and one for the half-axis vector. All
+    rods are filtered at once.
+
+    Parameters
+    ----------
+    dt : float, optional
+        Time between two frames.\n
+        By default ``1.0``.
+    process_noise : float, optional
+        Spectral density of the accelerations of the rod centers.\n
+        By default ``1.0``.
+    rotation_noise : float, optional
+        Spectral density of the accelerations of the half-axis vectors.\n
+        By default ``1.0``.
+    measurement_noise : float, optional
+        Variance of the measured rod centers and half-axis vectors per
+        coordinate.\n
+        By default ``1.0``.
+    initial_rate_variance : float, optional
+        Variance of the (unknown) rates of newly initialized rods.\n
+        By default ``100.0``.
+
+    Attributes
+    ----------
+    state : ndarray
+        Estimated poses of shape ``(rods, 2, 2, 3)``, i.e. (rod, {center,
+        half-axis}, {value, rate}, 3D-coordinates).
+    covariance : ndarray
+        Covariance matrices of the estimates of shape ``(rods, 2, 2, 2)``,
+        i.e. (rod, {center, half-axis}, {value, rate}, {value, rate}).
+
+    Examples
+    --------
+    >>> kf = ConstantVelocityFilter()
+    >>> kf.initialize(points_frame_0)
+    >>> predicted = kf.predict()
+    >>> kf.update(points_frame_1)
+    >>> kf.velocity
+    array([[0.1, 0. , 0. ], ...])
+    """
+
+    def __init__(
+        self,
+        dt: float = 1.0,
+        process_noise: float = 1.0,
+        rotation_noise: float = 1.0,
+        measurement_noise: float = 1.0,
+        initial_rate_variance: float = 100.0,
+    ):
+        self.dt = dt
+        self.process_noise = process_noise
+        self.rotation_noise = rotation_noise
+        self.measurement_noise = measurement_noise
+        self.initial_rate_variance = initial_rate_variance
+        self.state = np.zeros((0, 2, 2, 3))
+        self.covariance = np.zeros((0, 2, 2, 2))
+
+    def __len__(self) -> int:
+        return len(self.state)
+
+    @property
+    def positions(self) -> np.ndarray:
+        """Estimated endpoints of the rods of shape ``(rods, 2, 3)``."""
+        return _endpoints(self.state[:, 0, 0], self.state[:, 1, 0])
+
+    @property
+    def velocity(self) -> np.ndarray:
+        """Estimated velocities of the rod centers of shape ``(rods, 3)``."""
+        return self.state[:, 0, 1]
+
+    @property
+    def angular_velocity(self) -> np.ndarray:
+        """Estimated angular velocities of the rods of shape ``(rods, 3)``,
+        i.e. the rotating part of the half-axis vectors' rates."""
+        axis, rate = self.state[:, 1, 0], self.state[:, 1, 1]
+        length = np.sum(axis**2, axis=-1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            omega = np.cross(axis, rate) / length
+        return np.where(length > 0, omega, 0.0)
+
+    def initialize(self, points: np.ndarray):
+        """(Re-)Initializes the filter with the endpoints of rods at rest.
+
+        Parameters
+        ----------
+        points : ndarray
+            Endpoints of the rods of shape ``(rods, 2, 3)``.
+        """
+        points = np.asarray(points, dtype=float)
+        center, axis = _pose(points)
+        self.state = np.zeros((len(points), 2, 2, 3))
+        self.state[:, 0, 0] = center
+        self.state[:, 1, 0] = axis
+        self.covariance = np.zeros((len(points), 2, 2, 2))
+        self.covariance[..., 0, 0] = self.measurement_noise
+        self.covariance[..., 1, 1] = self.initial_rate_variance
+
+    def predict(self) -> np.ndarray:
+        """Advances the estimates by one frame.
+
+        Returns
+        -------
+        ndarray
+            Predicted endpoints of the rods of shape ``(rods, 2, 3)``.
+        """
+        dt = self.dt
+        F = np.array([[1.0, dt], [0.0, 1.0]])
+        Q = np.array([[dt**3 / 3, dt**2 / 2], [dt**2 / 2, dt]])
+        noise = np.array([self.process_noise, self.rotation_noise])
+        self.state = np.einsum("ij,nkjc->nkic", F, self.state)
+        self.covariance = (
+            F @ self.covariance @ F.T + noise[:, None, None] * Q[None]
+        )
+        return self.positions
+
+    def update(self, points: np.ndarray, observed: np.ndarray = None):
+        """Corrects the (predicted) estimates with measured rod endpoints.
+
+        The order of a rod's endpoints is irrelevant, the measured half-axis
+        vector is flipped to match the estimated orientation.
+
+        Parameters
+        ----------
+        points : ndarray
+            Measured endpoints of the rods of shape ``(rods, 2, 3)``.
+        observed : ndarray, optional
+            Boolean mask of shape ``(rods,)`` of the rods, that were
+            measured. The other rods keep their predicted estimates.\n
+            By default ``None``, i.e. all rods with finite endpoints.
+
+        Raises
+        ------
+        ValueError
+            Is raised, if the number of rods differs from the filtered ones.
+        """
+        points = np.asarray(points, dtype=float)
+        if len(points) != len(self):
+            raise ValueError(
+                f"Expected endpoints of {len(self)} rods, got {len(points)}."
+            )
+        valid = np.isfinite(points).all(axis=(1, 2))
+        if observed is not None:
+            valid &= np.asarray(observed, dtype=bool)
+        center, axis = _pose(points[valid])
+        flip = np.sum(axis * self.state[valid, 1, 0], axis=-1) < 0
+        axis[flip] = -axis[flip]
+        measured = np.stack([center, axis], axis=1)
+
+        P = self.covariance[valid]
+        # scalar measurement of the value of every (value, rate)-pair
+        gain = (
+            P[..., :, 0] / (P[..., 0, 0] + self.measurement_noise)[..., None]
+        )
+        residual = measured - self.state[valid, :, 0]
+        self.state[valid] += gain[..., None] * residual[:, :, None, :]
+        self.covariance[valid] = P - gain[..., :, None] * P[..., 0, None, :]
+
+
+def _pose(points: np.ndarray):
+    """Centers and half-axis vectors of rods given by their endpoints."""
+    return (points[:, 0] + points[:, 1]) / 2, (points[:, 1] - points[:, 0]) / 2
+
+
+def _endpoints(center: np.ndarray, axis: np.ndarray) -> np.ndarray:
+    """Endpoints of rods given by their centers and half-axis vectors."""
+    return np.stack([center - axis, center + axis], axis=1)
@@ -0,0 +1,139 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Splitting of a frame range into overlapping shards, that can be tracked
+independently, and stitching of the particle numbers of the shards.
+
+Every shard starts ``overlap`` frames before the frames it is responsible
+for, i.e. its *core* frames. These warm-up frames are core frames of the
+previous shard. The tracks of both shards are identified with each other by
+an assignment of their endpoints in the overlapping frames, see
+:func:`stitch_tracks`. The result equals sequential tracking, if the tracks
+of the overlapping frames agree, otherwise the number of disagreeing rods is
+reported.
+
+**Authors**: Adrian Niemann (adrian.niemann@ovgu.de), Dmitry Puzyrev
+(dmitry.puzyrev@ovgu.de)
+
+**Date**:       2024
+
+"""
+from typing import List, Tuple
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+
+def shard_ranges(
+    n_frames: int, shard_size: int, overlap: int = 2
+) -> List[Tuple[int, int, int]]:
+    """Splits a frame range into overlapping shards.
+
+    Parameters
+    ----------
+    n_frames : int
+        Number of frames to split.
+    shard_size : int
+        Number of core frames per shard.
+    overlap : int, optional
+        Number of frames a shard starts before its core frames.\n
+        By default ``2``.
+
+    Returns
+    -------
+    List[Tuple[int, int, int]]
+        ``(start, core_start, stop)`` indices of the frames of every shard,
+        i.e. the shard tracks the frames ``[start, stop)`` and is responsible
+        for the frames ``[core_start, stop)``.
+
+    Raises
+    ------
+    ValueError
+        Is raised, if ``overlap`` is not in ``[1, shard_size)``.
+    """
+    if not 1 <= overlap < shard_size:
+        raise ValueError(
+            f"The overlap must be in [1, {shard_size}), got {overlap}."
+        )
+    return [
+        (max(0, start - overlap), start, min(start + shard_size, n_frames))
+        for start in range(0, n_frames, shard_size)
+    ]
+
+
+def stitch_tracks(
+    points_prev: np.ndarray, points_next: np.ndarray, tolerance: float = 1e-6
+) -> Tuple[np.ndarray, int]:
+    """Identifies the tracks of two shards in their overlapping frames.
+
+    The summed endpoint distances over all overlapping frames are used as
+    the costs of assigning two tracks to each other. A track is missing in a
+    frame, if its endpoints are ``NaN``.
+
+    Parameters
+    ----------
+    points_prev : ndarray
+        Endpoints of the tracks of the previous shard of shape
+        ``(frames, tracks, 2, 3)``.
+    points_next : ndarray
+        Endpoints of the tracks of the next shard in the same frames of shape
+        ``(frames, tracks, 2, 3)``.
+    tolerance : float, optional
+        Largest endpoint distance of assigned tracks, that are regarded as
+        identical.\n
+        By default ``1e-6``.
+
+    Returns
+    -------
+    Tuple[ndarray, int]
+        [0]: Assigned track of the previous shard for every track of the next
+        shard, ``-1`` for tracks without one.\n
+        [1]: Number of disagreements, i.e. rods in the overlapping frames,
+        that are not identical in both shards.
+    """
+    frames = len(points_prev)
+    # (frame, track(prev), track(next))
+    p_prev = points_prev[:, :, None]
+    p_next = points_next[:, None, :]
+    dist = np.minimum(
+        np.linalg.norm(p_prev[..., 0, :] - p_next[..., 0, :], axis=-1)
+        + np.linalg.norm(p_prev[..., 1, :] - p_next[..., 1, :], axis=-1),
+        np.linalg.norm(p_prev[..., 0, :] - p_next[..., 1, :], axis=-1)
+        + np.linalg.norm(p_prev[..., 1, :] - p_next[..., 0, :], axis=-1),
+    )
+    missing_prev = np.isnan(points_prev).any(axis=(-2, -1))
+    missing_next = np.isnan(points_next).any(axis=(-2, -1))
+    both_missing = missing_prev[:, :, None] & missing_next[:, None, :]
+    dist[both_missing] = 0.0
+    finite = np.isfinite(dist)
+    penalty = 2 * dist[finite].max(initial=0.0) + 1.0
+    dist[~finite] = penalty
+    cost = dist.sum(axis=0)
+
+    rows, cols = linear_sum_assignment(cost)
+    mapping = np.full(points_next.shape[1], -1)
+    mapping[cols] = rows
+    agreeing = (dist[:, rows, cols] <= tolerance).sum()
+    present = (~missing_prev).sum() + (~missing_next).sum()
+    present_assigned = (~missing_prev[:, rows]).sum() + (
+        ~missing_next[:, cols]
+    ).sum()
+    # rods of unassigned tracks and rods differing between assigned tracks
+    disagreements = (present - present_assigned) + (
+        len(rows) * frames - agreeing
+    )
+    return mapping, int(disagreements)
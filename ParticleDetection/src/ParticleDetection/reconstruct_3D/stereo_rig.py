@@ -0,0 +1,890 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Representation of a calibrated stereocamera system together with the
+transformation from the first camera's coordinate system to *world*/
+*experiment* coordinates. All quantities derived from the calibration, e.g.
+the projection matrices, are computed only once per :class:`StereoRig`.
+
+**Authors**: Adrian Niemann (adrian.niemann@ovgu.de), Dmitry Puzyrev
+(dmitry.puzyrev@ovgu.de)
+
+**Date**:       2024
+
+"""
+import functools
+import hashlib
+import logging
+import os
+from types import MappingProxyType
+from typing import Mapping, Tuple, Union
+
+import cv2
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+import ParticleDetection.utils.data_loading as dl
+from ParticleDetection.reconstruct_3D.geometry import (
+    project_points,
+    triangulate_points,
+)
+
+_logger = logging.getLogger(__name__)
+
+REQUIRED_CALIBRATION_KEYS = ("CM1", "dist1", "CM2", "dist2", "R", "T")
+"""Tuple[str]: Fields a stereocamera calibration must provide."""
+
+UNDISTORTION_METHODS = ("iterative", "grid")
+"""Tuple[str]: Available methods for the undistortion of image points.
+
+``"iterative"``: solves the inverse distortion model for every point using
+``cv2.undistortImagePoints``.\n
+``"grid"``: bilinear interpolation in a lookup grid, that is precomputed for
+the whole image once, see :class:`UndistortionGrid`.
+"""
+
+_GRID_CRITERIA = (cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, 100, 1e-12)
+
+_worker_rig = None
+
+
+class StereoRig:
+    """Immutable stereocamera system with its transformation to
+    *world*/*experiment* coordinates.
+
+    The projection matrices, camera poses and the world transformation are
+    derived once on construction. All arrays are read-only and instances are
+    hashable, so they can be shared between threads/processes and used as
+    cache keys. Two rigs compare equal if they were created from identical
+    calibration and transformation data.
+
+    Parameters
+    ----------
+    calibration : Mapping[str, ndarray]
+        Stereocamera calibration parameters with the required fields:\n
+        ``"CM1"``: camera matrix of cam1\n
+        ``"dist1"``: distortion coefficients of cam1\n
+        ``"CM2"``: camera matrix of cam2\n
+        ``"dist2"``: distortion coefficients of cam2\n
+        ``"R"``: rotation matrix between cam1 & cam2\n
+        ``"T"``: translation vector between cam1 & cam2\n
+        Additional array-like fields, e.g. ``"E"`` and ``"F"``, are kept.
+    transformation : Mapping[str, ndarray], optional
+        Coordinate system transformation from camera 1 coordinates to
+        *world*/*experiment* coordinates, either with the fields
+        ``"rotation"`` and ``"translation"`` or in the legacy format with the
+        fields ``"M_rotate_x"``, ``"M_rotate_y"``, ``"M_rotate_z"``,
+        ``"M_trans"`` and ``"M_trans2"``.\n
+        By default ``None``, i.e. *world* coordinates are camera 1
+        coordinates.
+    undistortion : str, optional
+        Method used to undistort image points, see
+        :const:`UNDISTORTION_METHODS`.\n
+        By default ``"iterative"``.
+    grid_step : float, optional
+        Distance of the nodes of the undistortion lookup grid in pixels. Only
+        used with ``undistortion="grid"``.\n
+        By default ``4.0``.
+    image_size : Tuple[int, int] | Tuple[Tuple[int, int], Tuple[int, int]]
+        Image size ``(width, height)`` of both cameras, or one per camera.
+        Only used with ``undistortion="grid"``. If it is not given, the
+        ``"img_size"`` field of ``calibration`` is used, if present, or twice
+        the principal point of the respective camera otherwise.\n
+        By default ``None``.
+
+    Raises
+    ------
+    KeyError
+        Is raised if ``calibration`` lacks one of the required fields.
+    ValueError
+        Is raised if an unknown ``undistortion`` method is requested.
+
+    See also
+    --------
+    :func:`~ParticleDetection.utils.data_loading.load_camera_calibration`,
+    :func:`~ParticleDetection.utils.data_loading.load_world_transformation`
+
+    Examples
+    --------
+    >>> rig = StereoRig.from_files("gp12.json", "world_transformation.json")
+    >>> points_3d = rig.to_world(rig.triangulate(points_cam1, points_cam2))
+    >>> repr_cam1 = rig.reproject(points_3d, cam=1, world=True)
+    """
+
+    __slots__ = (
+        "_calibration",
+        "_transformation",
+        "_rot",
+        "_trans",
+        "_rot_inv",
+        "_P1",
+        "_P2",
+        "_r1",
+        "_t1",
+        "_r2",
+        "_t2",
+        "_F",
+        "_epipolar",
+        "_undistortion",
+        "_grids",
+        "_options",
+        "_digest",
+    )
+
+    def __init__(
+        self,
+        calibration: Mapping[str, np.ndarray],
+        transformation: Mapping[str, np.ndarray] = None,
+        undistortion: str = "iterative",
+        grid_step: float = 4.0,
+        image_size: tuple = None,
+    ):
+        if undistortion not in UNDISTORTION_METHODS:
+            raise ValueError(
+                f"Unknown undistortion method '{undistortion}', choose one "
+                f"of {UNDISTORTION_METHODS}."
+            )
+        missing = [
+            k for k in REQUIRED_CALIBRATION_KEYS if k not in calibration
+        ]
+        if missing:
+            raise KeyError(
+                f"The calibration is missing the required fields {missing}."
+            )
+        calib = {}
+        for key, val in calibration.items():
+            if isinstance(val, (str, bytes)) or np.ndim(val) == 0:
+                continue
+            calib[key] = _read_only(val)
+
+        rotation, translation = _parse_transformation(transformation)
+        rotation = _read_only(rotation)
+        translation = _read_only(translation)
+
+        # Derive projection matrices from the calibration
+        r1 = _read_only(np.eye(3))
+        t1 = _read_only(np.zeros((3, 1)))
+        r2 = calib["R"]
+        t2 = calib["T"]
+        P1 = _read_only((np.vstack((r1.T, t1.T)) @ calib["CM1"].T).T)
+        P2 = _read_only((np.vstack((r2.T, t2.T)) @ calib["CM2"].T).T)
+        F = calib.get("F")
+        if F is None:
+            F = _read_only(_fundamental_matrix(calib))
+        epipolar = _epipolar_rectification(calib)
+
+        digest = hashlib.sha1()
+        for key in sorted(calib):
+            digest.update(key.encode())
+            digest.update(str(calib[key].shape).encode())
+            digest.update(calib[key].tobytes())
+        digest.update(rotation.tobytes())
+        digest.update(translation.tobytes())
+
+        grids = (None, None)
+        if undistortion == "grid":
+            sizes = _image_sizes(calib, image_size)
+            grids = tuple(
+                UndistortionGrid(
+                    calib[f"CM{cam}"], calib[f"dist{cam}"], size, grid_step
+                )
+                for cam, size in zip((1, 2), sizes)
+            )
+            for grid in grids:
+                digest.update(str((grid.image_size, grid.step)).encode())
+
+        _set = object.__setattr__
+        _set(self, "_calibration", MappingProxyType(calib))
+        _set(
+            self,
+            "_transformation",
+            MappingProxyType(
+                {"rotation": rotation, "translation": translation}
+            ),
+        )
+        _set(self, "_rot", R.from_matrix(rotation))
+        _set(self, "_trans", translation)
+        _set(self, "_rot_inv", self._rot.inv())
+        _set(self, "_P1", P1)
+        _set(self, "_P2", P2)
+        _set(self, "_r1", r1)
+        _set(self, "_t1", t1)
+        _set(self, "_r2", r2)
+        _set(self, "_t2", t2)
+        _set(self, "_F", F)
+        _set(self, "_epipolar", epipolar)
+        _set(self, "_undistortion", undistortion)
+        _set(self, "_grids", grids)
+        _set(self, "_options", (undistortion, grid_step, image_size))
+        _set(self, "_digest", digest.digest())
+
+    @classmethod
+    def from_files(
+        cls,
+        calibration_file: Union[str, os.PathLike],
+        transformation_file: Union[str, os.PathLike] = None,
+        undistortion: str = "iterative",
+        grid_step: float = 4.0,
+        image_size: tuple = None,
+    ) -> "StereoRig":
+        """Loads a :class:`StereoRig` from ``*.json`` files.
+
+        Loaded rigs are cached by file path and modification time, i.e.
+        repeated calls with unchanged files and options return the same
+        object without reading the files or building lookup grids again.
+
+        Parameters
+        ----------
+        calibration_file : str | PathLike
+            Path to a ``*.json`` file with stereocalibration data.
+        transformation_file : str | PathLike, optional
+            Path to a ``*.json`` file with the transformation from the first
+            camera's coordinate system to the world/box coordinate system.\n
+            By default ``None``, i.e. no transformation.
+        undistortion : str, optional
+            See :class:`StereoRig`.\n
+            By default ``"iterative"``.
+        grid_step : float, optional
+            See :class:`StereoRig`.\n
+            By default ``4.0``.
+        image_size : tuple, optional
+            See :class:`StereoRig`.\n
+            By default ``None``.
+
+        Returns
+        -------
+        StereoRig
+        """
+        calibration_file = os.path.abspath(calibration_file)
+        calibration_mtime = os.stat(calibration_file).st_mtime_ns
+        transformation_mtime = None
+        if transformation_file is not None:
+            transformation_file = os.path.abspath(transformation_file)
+            transformation_mtime = os.stat(transformation_file).st_mtime_ns
+        if image_size is not None:
+            image_size = tuple(np.asarray(image_size, dtype=int).tolist())
+        return _load_rig(
+            calibration_file,
+            calibration_mtime,
+            transformation_file,
+            transformation_mtime,
+            undistortion,
+            grid_step,
+            image_size,
+        )
+
+    @property
+    def calibration(self) -> Mapping[str, np.ndarray]:
+        """Mapping[str, ndarray]: Read-only view of the calibration data."""
+        return self._calibration
+
+    @property
+    def transformation(self) -> Mapping[str, np.ndarray]:
+        """Mapping[str, ndarray]: Read-only view of the transformation to
+        *world*/*experiment* coordinates with the fields ``"rotation"`` and
+        ``"translation"``."""
+        return self._transformation
+
+    @property
+    def P1(self) -> np.ndarray:
+        """ndarray: Projection matrix of camera 1 ``(3, 4)``."""
+        return self._P1
+
+    @property
+    def P2(self) -> np.ndarray:
+        """ndarray: Projection matrix of camera 2 ``(3, 4)``."""
+        return self._P2
+
+    @property
+    def r1(self) -> np.ndarray:
+        """ndarray: Rotation matrix of camera 1."""
+        return self._r1
+
+    @property
+    def t1(self) -> np.ndarray:
+        """ndarray: Translation vector of camera 1."""
+        return self._t1
+
+    @property
+    def r2(self) -> np.ndarray:
+        """ndarray: Rotation matrix of camera 2."""
+        return self._r2
+
+    @property
+    def t2(self) -> np.ndarray:
+        """ndarray: Translation vector of camera 2."""
+        return self._t2
+
+    @property
+    def F(self) -> np.ndarray:
+        """ndarray: Fundamental matrix ``(3, 3)`` relating undistorted image
+        points of camera 1 and camera 2, i.e. ``x2.T @ F @ x1 = 0``. It is
+        taken from the ``"F"`` field of the calibration, if present, and
+        derived from the camera matrices and the relative pose otherwise."""
+        return self._F
+
+    @property
+    def rot(self) -> R:
+        """Rotation: Rotation from camera 1 coordinates to
+        *world*/*experiment* coordinates."""
+        return self._rot
+
+    @property
+    def trans(self) -> np.ndarray:
+        """ndarray: Translation from camera 1 coordinates to
+        *world*/*experiment* coordinates."""
+        return self._trans
+
+    @property
+    def undistortion(self) -> str:
+        """str: Method used to undistort image points, see
+        :const:`UNDISTORTION_METHODS`."""
+        return self._undistortion
+
+    @property
+    def undistortion_error(self) -> Tuple[float, float]:
+        """Tuple[float, float]: Maximum deviation in pixels of the undistorted
+        points from a converged iterative solution for camera 1 and 2,
+        measured when the lookup grids were built. It is ``0.0`` for the
+        ``"iterative"`` method."""
+        return tuple(
+            0.0 if grid is None else grid.max_error for grid in self._grids
+        )
+
+    def undistort(self, points: np.ndarray, cam: int = 1) -> np.ndarray:
+        """Undistorts image points of one camera.
+
+        Parameters
+        ----------
+        points : ndarray
+            Image points of shape ``(..., 2)``.
+        cam : int, optional
+            Camera the points belong to, either ``1`` or ``2``.\n
+            By default ``1``.
+
+        Returns
+        -------
+        ndarray
+            Undistorted image points with the same shape as ``points``.
+        """
+        CM, dist = self._intrinsics(cam)
+        points = np.asarray(points, dtype=float)
+        if not points.size:
+            return points.copy()
+        grid = self._grids[cam - 1]
+        if grid is not None:
+            return grid(points)
+        undistorted = cv2.undistortImagePoints(
+            points.reshape(-1, 1, 2), CM, dist
+        )
+        return undistorted.reshape(points.shape)
+
+    def triangulate(
+        self,
+        points_cam1: np.ndarray,
+        points_cam2: np.ndarray,
+        undistort: bool = True,
+        dtype: type = np.float64,
+    ) -> np.ndarray:
+        """Triangulates corresponding image points of both cameras.
+
+        Parameters
+        ----------
+        points_cam1 : ndarray
+            Image points on camera 1 of shape ``(..., 2)``.
+        points_cam2 : ndarray
+            Corresponding image points on camera 2 of the same shape as
+            ``points_cam1``.
+        undistort : bool, optional
+            Flag, whether the points must be undistorted before triangulation.
+            Set this to ``False``, if the points are undistorted already.\n
+            By default ``True``.
+        dtype : type, optional
+            Floating point type of the triangulation and the result, e.g.
+            ``np.float32`` to halve the memory of large batches, see
+            :func:`.triangulate_points`.\n
+            By default ``np.float64``.
+
+        Returns
+        -------
+        ndarray
+            3D points in camera 1 coordinates of shape ``(..., 3)``.
+        """
+        points_cam1 = np.asarray(points_cam1, dtype=float)
+        points_cam2 = np.asarray(points_cam2, dtype=float)
+        if not points_cam1.size:
+            return np.zeros((*points_cam1.shape[:-1], 3), dtype=dtype)
+        if undistort:
+            points_cam1 = self.undistort(points_cam1, 1)
+            points_cam2 = self.undistort(points_cam2, 2)
+        return triangulate_points(
+            self._P1, self._P2, points_cam1, points_cam2, dtype=dtype
+        )
+
+    def epipolar_distance(
+        self,
+        points_cam1: np.ndarray,
+        points_cam2: np.ndarray,
+        undistort: bool = True,
+    ) -> np.ndarray:
+        """Computes how well image points of both cameras fulfill the
+        epipolar constraint.
+
+        Parameters
+        ----------
+        points_cam1 : ndarray
+            Image points on camera 1 of shape ``(..., 2)``.
+        points_cam2 : ndarray
+            Image points on camera 2 of the same shape as ``points_cam1``.
+        undistort : bool, optional
+            Flag, whether the points must be undistorted first. Set this to
+            ``False``, if the points are undistorted already.\n
+            By default ``True``.
+
+        Returns
+        -------
+        ndarray
+            The larger of the distances in pixels of a point to the epipolar
+            line of its counterpart, of shape ``points_cam1.shape[:-1]``.
+        """
+        points_cam1 = np.asarray(points_cam1, dtype=float)
+        points_cam2 = np.asarray(points_cam2, dtype=float)
+        if not points_cam1.size:
+            return np.zeros(points_cam1.shape[:-1])
+        if undistort:
+            points_cam1 = self.undistort(points_cam1, 1)
+            points_cam2 = self.undistort(points_cam2, 2)
+        x1 = np.concatenate(
+            [points_cam1, np.ones((*points_cam1.shape[:-1], 1))], axis=-1
+        )
+        x2 = np.concatenate(
+            [points_cam2, np.ones((*points_cam2.shape[:-1], 1))], axis=-1
+        )
+        lines2 = x1 @ self._F.T
+        lines1 = x2 @ self._F
+        residual = np.abs(np.sum(x2 * lines2, axis=-1))
+        return np.maximum(
+            residual / np.linalg.norm(lines2[..., :2], axis=-1),
+            residual / np.linalg.norm(lines1[..., :2], axis=-1),
+        )
+
+    def epipolar_coordinates(
+        self, points: np.ndarray, cam: int = 1, undistort: bool = True
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Identifies the epipolar plane of image points.
+
+        Corresponding points of both cameras lie on the same epipolar plane,
+        i.e. they have (almost) the same coordinate. The coordinate is the
+        tangent of the plane's inclination around the baseline, scaled by
+        the mean focal length, so that differences are roughly on the scale
+        of pixels.
+
+        Parameters
+        ----------
+        points : ndarray
+            Image points of shape ``(..., 2)``.
+        cam : int, optional
+            Camera the points belong to, either ``1`` or ``2``.\n
+            By default ``1``.
+        undistort : bool, optional
+            Flag, whether the points must be undistorted first. Set this to
+            ``False``, if the points are undistorted already.\n
+            By default ``True``.
+
+        Returns
+        -------
+        Tuple[ndarray, ndarray]
+            The epipolar coordinates of shape ``points.shape[:-1]`` and their
+            sensitivity, i.e. how much the coordinate changes per pixel
+            perpendicular to the epipolar line at the point.
+        """
+        self._intrinsics(cam)
+        points = np.asarray(points, dtype=float)
+        if not points.size:
+            return np.zeros(points.shape[:-1]), np.zeros(points.shape[:-1])
+        if undistort:
+            points = self.undistort(points, cam)
+        mapping = self._epipolar[cam - 1]
+        rays = points @ mapping[:, :2].T + mapping[:, 2]
+        coords = rays[..., 0] / rays[..., 1]
+        gradient = (
+            mapping[0, :2] - coords[..., None] * mapping[1, :2]
+        ) / rays[..., 1:]
+        return coords, np.linalg.norm(gradient, axis=-1)
+
+    def reproject(
+        self,
+        points: np.ndarray,
+        cam: int = 1,
+        world: bool = False,
+        dtype: type = np.float64,
+    ) -> np.ndarray:
+        """Projects 3D points onto the (distorted) image plane of a camera.
+
+        Parameters
+        ----------
+        points : ndarray
+            3D points of shape ``(..., 3)``.
+        cam : int, optional
+            Camera to project the points on, either ``1`` or ``2``.\n
+            By default ``1``.
+        world : bool, optional
+            Flag, whether ``points`` are given in *world*/*experiment*
+            coordinates instead of camera 1 coordinates.\n
+            By default ``False``.
+        dtype : type, optional
+            Floating point type of the projection and the result, see
+            :func:`.project_points`.\n
+            By default ``np.float64``.
+
+        Returns
+        -------
+        ndarray
+            Image points of shape ``(..., 2)``.
+        """
+        CM, dist = self._intrinsics(cam)
+        points = np.asarray(points)
+        if not points.size:
+            return np.zeros((*points.shape[:-1], 2), dtype=dtype)
+        if world:
+            points = self.from_world(points)
+        r, t = (self._r1, self._t1) if cam == 1 else (self._r2, self._t2)
+        return project_points(points, r, t, CM, dist, dtype=dtype)
+
+    def to_world(self, points: np.ndarray) -> np.ndarray:
+        """Transforms 3D points from camera 1 coordinates to
+        *world*/*experiment* coordinates.
+
+        Parameters
+        ----------
+        points : ndarray
+            3D points of shape ``(..., 3)``.
+
+        Returns
+        -------
+        ndarray
+        """
+        points = np.asarray(points, dtype=float)
+        if not points.size:
+            return points.copy()
+        world = self._rot.apply(points.reshape(-1, 3)) + self._trans
+        return world.reshape(points.shape)
+
+    def from_world(self, points: np.ndarray) -> np.ndarray:
+        """Transforms 3D points from *world*/*experiment* coordinates to
+        camera 1 coordinates.
+
+        Parameters
+        ----------
+        points : ndarray
+            3D points of shape ``(..., 3)``.
+
+        Returns
+        -------
+        ndarray
+        """
+        points = np.asarray(points, dtype=float)
+        if not points.size:
+            return points.copy()
+        cam = self._rot_inv.apply(points.reshape(-1, 3) - self._trans)
+        return cam.reshape(points.shape)
+
+    def _intrinsics(self, cam: int):
+        if cam not in (1, 2):
+            raise ValueError(f"Unknown camera {cam}, must be either 1 or 2.")
+        return self._calibration[f"CM{cam}"], self._calibration[f"dist{cam}"]
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __reduce__(self):
+        return (
+            type(self),
+            (
+                dict(self._calibration),
+                dict(self._transformation),
+                *self._options,
+            ),
+        )
+
+    def __hash__(self) -> int:
+        return hash(self._digest)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, StereoRig):
+            return NotImplemented
+        return self._digest == other._digest
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(<{self._digest.hex()[:12]}>)"
+
+
+class UndistortionGrid:
+    """Lookup grid of undistorted coordinates for one camera.
+
+    The undistorted coordinates are computed once for the nodes of a regular
+    grid covering the whole (distorted) image, using a converged iterative
+    solution. Points are then undistorted by bilinear interpolation between
+    the surrounding nodes. Points outside of the image fall back to the
+    iterative solution.
+
+    Parameters
+    ----------
+    camera_matrix : ndarray
+        Camera matrix ``(3, 3)``.
+    dist_coeffs : ndarray
+        Distortion coefficients of the camera.
+    image_size : Tuple[int, int]
+        Image size ``(width, height)``.
+    step : float, optional
+        Distance of the grid nodes in pixels.\n
+        By default ``4.0``.
+
+    Attributes
+    ----------
+    max_error : float
+        Largest deviation of the interpolation from the converged iterative
+        solution, measured at the centers of the grid cells, i.e. where the
+        interpolation error is largest, in pixels.
+    """
+
+    __slots__ = (
+        "camera_matrix",
+        "dist_coeffs",
+        "image_size",
+        "step",
+        "values",
+        "max_error",
+        "_channels",
+    )
+
+    def __init__(
+        self,
+        camera_matrix: np.ndarray,
+        dist_coeffs: np.ndarray,
+        image_size: Tuple[int, int],
+        step: float = 4.0,
+    ):
+        if step <= 0:
+            raise ValueError(f"The grid step must be positive, got {step}.")
+        self.camera_matrix = camera_matrix
+        self.dist_coeffs = dist_coeffs
+        self.image_size = tuple(int(s) for s in image_size)
+        self.step = float(step)
+
+        width, height = self.image_size
+        xs = np.arange(0, width - 1 + step, step, dtype=float)
+        ys = np.arange(0, height - 1 + step, step, dtype=float)
+        nodes = np.stack(np.meshgrid(xs, ys), axis=-1)
+        self.values = _read_only(self._exact(nodes))
+        self._channels = tuple(
+            _read_only(self.values[..., dim].ravel()) for dim in range(2)
+        )
+
+        # bilinear interpolation is least accurate in the cell centers
+        centers = nodes[:-1, :-1] + step / 2
+        stride = max(1, int(np.sqrt(centers[..., 0].size / 250_000)) + 1)
+        centers = centers[::stride, ::stride].reshape(-1, 2)
+        errors = np.linalg.norm(self(centers) - self._exact(centers), axis=-1)
+        self.max_error = float(errors.max(initial=0.0))
+        _logger.info(
+            f"Built undistortion grid of {nodes.shape[1]}x{nodes.shape[0]} "
+            f"nodes, maximum error: {self.max_error:.2e} px"
+        )
+
+    def __call__(self, points: np.ndarray) -> np.ndarray:
+        """Undistorts image points of shape ``(..., 2)``."""
+        points = np.asarray(points, dtype=float)
+        flat = points.reshape(-1, 2)
+        n_y, n_x = self.values.shape[:2]
+        pos_x = flat[:, 0] / self.step
+        pos_y = flat[:, 1] / self.step
+        inside = (
+            (pos_x >= 0) & (pos_x < n_x - 1) & (pos_y >= 0) & (pos_y < n_y - 1)
+        )
+        rows = slice(None)
+        if not inside.all():
+            rows = inside
+            pos_x = pos_x[inside]
+            pos_y = pos_y[inside]
+        ix = pos_x.astype(np.intp)
+        iy = pos_y.astype(np.intp)
+        fx = pos_x - ix
+        fy = pos_y - iy
+        idx = iy * n_x + ix
+
+        result = np.empty_like(flat)
+        for dim, values in enumerate(self._channels):
+            top = values.take(idx)
+            top += (values.take(idx + 1) - top) * fx
+            bottom = values.take(idx + n_x)
+            bottom += (values.take(idx + n_x + 1) - bottom) * fx
+            top += (bottom - top) * fy
+            result[rows, dim] = top
+
+        outside = ~inside
+        if outside.any():
+            # NaN points end up here as well and stay NaN
+            result[outside] = self._exact(flat[outside])
+        return result.reshape(points.shape)
+
+    def _exact(self, points: np.ndarray) -> np.ndarray:
+        return cv2.undistortImagePoints(
+            points.reshape(-1, 1, 2),
+            self.camera_matrix,
+            self.dist_coeffs,
+            arg1=_GRID_CRITERIA,
+        ).reshape(points.shape)
+
+
+def as_stereo_rig(
+    calibration: Union[StereoRig, Mapping[str, np.ndarray]],
+    transformation: Mapping[str, np.ndarray] = None,
+) -> StereoRig:
+    """Returns ``calibration`` if it is a :class:`StereoRig` already,
+    otherwise creates one from ``calibration`` and ``transformation``."""
+    if isinstance(calibration, StereoRig):
+        return calibration
+    return StereoRig(calibration, transformation)
+
+
+def init_worker(rig: StereoRig):
+    """Keeps a stereocamera system in a worker process, so that it is only
+    transferred once per worker instead of once per task.
+
+    Intended as the ``initializer`` of a
+    ``concurrent.futures.ProcessPoolExecutor``, see :func:`worker_rig`.
+
+    Parameters
+    ----------
+    rig : StereoRig
+        Stereocamera system used by all tasks of the worker.
+    """
+    global _worker_rig
+    _worker_rig = rig
+
+
+def worker_rig(rig: StereoRig = None) -> StereoRig:
+    """Returns ``rig`` or, if it is ``None``, the stereocamera system of the
+    current worker process, that was set with :func:`init_worker`."""
+    return _worker_rig if rig is None else rig
+
+
+def _fundamental_matrix(calibration: Mapping[str, np.ndarray]) -> np.ndarray:
+    """Derives the fundamental matrix from the camera matrices and the
+    relative pose of the cameras."""
+    t = np.ravel(calibration["T"])
+    t_cross = np.array(
+        [[0.0, -t[2], t[1]], [t[2], 0.0, -t[0]], [-t[1], t[0], 0.0]]
+    )
+    E = t_cross @ calibration["R"]
+    return (
+        np.linalg.inv(calibration["CM2"]).T
+        @ E
+        @ np.linalg.inv(calibration["CM1"])
+    )
+
+
+def _epipolar_rectification(
+    calibration: Mapping[str, np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Mappings of undistorted homogeneous image points of both cameras to
+    the rows ``(y * f, z)`` of their viewing rays in a common frame, whose
+    x-axis is the baseline. The ratio of both identifies the epipolar
+    plane."""
+    rotation = calibration["R"]
+    baseline = -rotation.T @ np.ravel(calibration["T"])
+    x_axis = baseline / np.linalg.norm(baseline)
+    viewing = np.array([0.0, 0.0, 1.0]) + rotation.T[:, 2]
+    y_axis = np.cross(viewing, x_axis)
+    y_axis /= np.linalg.norm(y_axis)
+    z_axis = np.cross(x_axis, y_axis)
+    focal = (calibration["CM1"][1, 1] + calibration["CM2"][1, 1]) / 2
+    frame = np.stack([focal * y_axis, z_axis])
+    return (
+        _read_only(frame @ np.linalg.inv(calibration["CM1"])),
+        _read_only(frame @ rotation.T @ np.linalg.inv(calibration["CM2"])),
+    )
+
+
+def _read_only(array) -> np.ndarray:
+    array = np.array(array, dtype=float)
+    array.setflags(write=False)
+    return array
+
+
+def _image_sizes(
+    calibration: Mapping[str, np.ndarray], image_size: tuple = None
+) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """Determines the image size ``(width, height)`` of both cameras."""
+    if image_size is None:
+        image_size = calibration.get("img_size", None)
+    if image_size is None:
+        _logger.warning(
+            "No image size available, assuming the principal points are at "
+            "the image centers."
+        )
+        return tuple(
+            tuple(np.ceil(2 * calibration[f"CM{cam}"][0:2, 2]).astype(int))
+            for cam in (1, 2)
+        )
+    image_size = np.asarray(image_size, dtype=int)
+    if image_size.shape == (2,):
+        image_size = np.stack([image_size, image_size])
+    return tuple(tuple(size) for size in image_size.tolist())
+
+
+def _parse_transformation(transformation: Mapping[str, np.ndarray] = None):
+    """Unifies the supported transformation formats into a rotation matrix
+    and a translation vector."""
+    if transformation is None:
+        return np.eye(3), np.zeros(3)
+    if "rotation" in transformation:
+        return (
+            np.asarray(transformation["rotation"]),
+            np.asarray(transformation["translation"]).reshape(3),
+        )
+    rotx = R.from_matrix(np.asarray(transformation["M_rotate_x"])[0:3, 0:3])
+    roty = R.from_matrix(np.asarray(transformation["M_rotate_y"])[0:3, 0:3])
+    rotz = R.from_matrix(np.asarray(transformation["M_rotate_z"])[0:3, 0:3])
+    tw1 = np.asarray(transformation["M_trans"])[0:3, 3]
+    tw2 = np.asarray(transformation["M_trans2"])[0:3, 3]
+    rot = rotz * roty * rotx
+    return rot.as_matrix(), rot.apply(tw1) + tw2
+
+
+@functools.lru_cache(maxsize=16)
+def _load_rig(
+    calibration_file: str,
+    calibration_mtime: int,
+    transformation_file: str = None,
+    transformation_mtime: int = None,
+    undistortion: str = "iterative",
+    grid_step: float = 4.0,
+    image_size: tuple = None,
+) -> StereoRig:
+    _logger.debug(f"Loading stereo rig from {calibration_file}.")
+    calibration = dl.load_camera_calibration(calibration_file)
+    transformation = None
+    if transformation_file is not None:
+        transformation = dl.load_world_transformation(transformation_file)
+    return StereoRig(
+        calibration, transformation, undistortion, grid_step, image_size
+    )
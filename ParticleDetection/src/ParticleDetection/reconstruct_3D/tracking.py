@@ -24,13 +24,26 @@ implemented for comparison with new, more promising methods.
 **Date:** 31.10.2022
 
 """
-import itertools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
 from typing import Tuple
 
 import numpy as np
 import pandas as pd
 import trackpy as tp
 from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+from scipy.spatial import cKDTree
+
+from ParticleDetection.reconstruct_3D.prediction import ConstantVelocityFilter
+from ParticleDetection.reconstruct_3D.sharding import (
+    shard_ranges,
+    stitch_tracks,
+)
+
+_logger = logging.getLogger(__name__)
 
 
 def tracking_trackpy(data: pd.DataFrame, report: bool = False) -> pd.DataFrame:
@@ -69,18 +82,54 @@ def tracking_trackpy(data: pd.DataFrame, report: bool = False) -> pd.DataFrame:
 
 def tracking_global_assignment(
     data: pd.DataFrame,
+    chunk_size: int = 256,
+    double_unseen: bool = False,
+    shard_size: int = None,
+    overlap: int = 2,
+    workers: int = 1,
 ) -> Tuple[pd.DataFrame, np.ndarray]:
     """Tracks rods (one colour) over multiple frames with optimal assignment.
 
     The rods given are matched with all others in the next frame and the
     optimal assignment is determined by comparing the distances between the
-    endpoints.
+    endpoints. The particle numbers are passed on along the assignments,
+    starting from the first frame.
+
+    With a ``shard_size``, the frames are split into overlapping shards, that
+    are tracked independently, in parallel with multiple ``workers``. The
+    tracks of consecutive shards are stitched by an assignment in their
+    overlapping frames, see
+    :mod:`~ParticleDetection.reconstruct_3D.sharding`. The number of rods,
+    that disagree between the shards, is logged.
 
     Parameters
     ----------
     data : DataFrame
         Data(-slice) from rod tracking. Must contain at least the following
-        columns: x1, y1, z1, x2, y2, z2, frame, particle(, unseen)
+        columns: x1, y1, z1, x2, y2, z2, frame, particle(, unseen)\n
+        The rows must be ordered by frame and every frame must contain the
+        same number of rods.
+    chunk_size : int, optional
+        Number of frames, whose assignment costs are computed together. The
+        memory consumption grows with ``chunk_size * rods**2``, but not with
+        the number of frames.\n
+        By default ``256``.
+    double_unseen : bool, optional
+        Flag, whether to double the cost of assigning rods to each other, if
+        one of them is *unseen*. Rods are *unseen*, if their ``unseen``
+        column is set or, without this column, any of their ``seen_...``
+        columns is ``0``.\n
+        By default ``False``.
+    shard_size : int, optional
+        Number of frames per shard.\n
+        By default ``None``, i.e. all frames are tracked at once.
+    overlap : int, optional
+        Number of frames, that consecutive shards overlap.\n
+        By default ``2``.
+    workers : int, optional
+        Number of worker processes tracking the shards. ``None`` uses all
+        available CPUs.\n
+        By default ``1``.
 
     Returns
     -------
@@ -88,51 +137,278 @@ def tracking_global_assignment(
         Retuns the tracked data, i.e. the initial data with adjusted particle
         numbers. Additionlly, returns the assignment costs per frame, i.e. the
         distance between the endpoints of all matched rods.
+
+    Raises
+    ------
+    ValueError
+        Is raised, if ``overlap`` is not in ``[1, shard_size)``.
     """
-    out = pd.DataFrame()
     # get frame info from data
     frames = data["frame"].unique()
 
     # data_pX: (frame, rod, coord)
     data_p1 = data[["x1", "y1", "z1"]].to_numpy().reshape((len(frames), -1, 3))
     data_p2 = data[["x2", "y2", "z2"]].to_numpy().reshape((len(frames), -1, 3))
+    rods = data_p1.shape[1]
+    unseen = None
+    if double_unseen:
+        unseen = _unseen(data).reshape((len(frames), rods))
+
+    if "particle" in data.columns:
+        first_ids = data["particle"].to_numpy()[:rods]
+    else:
+        first_ids = np.arange(rods)
+
+    # tracks: (frame, rod) -> rod of the first frame
+    if shard_size is None:
+        tracks, total_cost = _chain_assignments(
+            data_p1, data_p2, unseen, chunk_size
+        )
+    else:
+        tracks, total_cost = _sharded_assignments(
+            data_p1, data_p2, unseen, chunk_size, shard_size, overlap, workers
+        )
+    ids = first_ids[tracks]
 
-    point_combos = [
-        list(itertools.product(p1, p2)) for p1, p2 in zip(data_p1, data_p2)
+    out = data.copy()
+    out["particle"] = ids.ravel()
+    out = out.sort_values(by=["frame", "particle"]).reset_index(drop=True)
+    return out, total_cost
+
+
+def _chain_assignments(
+    data_p1: np.ndarray,
+    data_p2: np.ndarray,
+    unseen: np.ndarray = None,
+    chunk_size: int = 256,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Assigns the rods of all consecutive frames to each other. Returns the
+    rod of the first frame every rod is assigned to and the assignment costs
+    per frame."""
+    n_frames, rods = data_p1.shape[:2]
+    tracks = np.empty((n_frames, rods), dtype=int)
+    tracks[0] = np.arange(rods)
+    total_cost = np.zeros(n_frames - 1)
+    chunk_size = max(1, chunk_size)
+    for start in range(0, n_frames - 1, chunk_size):
+        stop = min(start + chunk_size, n_frames - 1)
+        # cost: (frame, rod(frame), rod(frame + 1))
+        cost = _assignment_costs(
+            data_p1[start : stop + 1], data_p2[start : stop + 1]
+        )
+        if unseen is not None:
+            flags = unseen[start : stop + 1]
+            cost[flags[:-1, :, None] | flags[1:, None, :]] *= 2
+        for f, f_cost in enumerate(cost, start=start):
+            rows, cols = linear_sum_assignment(f_cost)
+            tracks[f + 1, cols] = tracks[f, rows]
+            total_cost[f] = f_cost[rows, cols].sum()
+    return tracks, total_cost
+
+
+def _sharded_assignments(
+    data_p1: np.ndarray,
+    data_p2: np.ndarray,
+    unseen: np.ndarray,
+    chunk_size: int,
+    shard_size: int,
+    overlap: int,
+    workers: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Runs :func:`_chain_assignments` on overlapping shards of the frames and
+    stitches their tracks."""
+    ranges = shard_ranges(len(data_p1), shard_size, overlap)
+    shards = [
+        (
+            data_p1[start:stop],
+            data_p2[start:stop],
+            None if unseen is None else unseen[start:stop],
+            chunk_size,
+        )
+        for start, _, stop in ranges
     ]
-    point_combos = np.asarray(point_combos)
-    p1s = point_combos[:, :, 0, :]
-    p2s = point_combos[:, :, 1, :]
-
-    # distances: (combination, frame, data_p1 x data_p2)
-    distances = np.zeros((2, len(frames) - 1, p1s.shape[1]))
-    distances[0, :] = np.linalg.norm(
-        np.diff(p1s, axis=0), axis=2
-    ) + np.linalg.norm(np.diff(p2s, axis=0), axis=2)
-    distances[1, :] = np.linalg.norm(
-        p1s[0:-1, :] - p2s[1:, :], axis=2
-    ) + np.linalg.norm(p2s[0:-1, :] - p1s[1:, :], axis=2)
-
-    # TODO: double weight/distance, if rods were "unseen"
-
-    cost = np.min(distances, axis=0)
-    cost = np.reshape(
-        cost, (len(frames) - 1, data_p1.shape[1], data_p2.shape[1])
+    if workers is None:
+        workers = os.cpu_count()
+    if workers > 1 and len(shards) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as p:
+            results = list(p.map(_chain_assignments, *zip(*shards)))
+    else:
+        results = [_chain_assignments(*shard) for shard in shards]
+
+    # points: (frame, rod, end-point, coord)
+    points = np.stack([data_p1, data_p2], axis=2)
+    tracks = np.empty(data_p1.shape[:2], dtype=int)
+    total_cost = np.zeros(len(data_p1) - 1)
+    disagreements = 0
+    for (start, core, stop), (s_tracks, s_cost) in zip(ranges, results):
+        if start == core:
+            tracks[start:stop] = s_tracks
+            total_cost[start : stop - 1] = s_cost
+            continue
+        mapping, diff = stitch_tracks(
+            _track_points(points[start:core], tracks[start:core]),
+            _track_points(points[start:core], s_tracks[: core - start]),
+        )
+        disagreements += diff
+        tracks[core:stop] = mapping[s_tracks[core - start :]]
+        total_cost[core - 1 : stop - 1] = s_cost[core - start - 1 :]
+    _logger.info(
+        f"Stitched {len(ranges)} shards with {disagreements} rods disagreeing "
+        f"at the shard boundaries."
     )
-    results = [[linear_sum_assignment(f_c)] for f_c in cost]
-    results = np.asarray(results).squeeze()
+    return tracks, total_cost
 
-    out = data.copy()
-    if "particle" not in out.columns:
-        out["particle"] = 0
-        init_ids = np.arange(len(out.loc[out.frame == frames[0]]))
-        out.loc[out.frame == frames[0], ["particle"]] = init_ids
-    for f, new_id in zip(frames[1:], results):
-        tmp = out.loc[out.frame == f].copy()
-        tmp.iloc[new_id[1, :], tmp.columns.get_loc("particle")] = new_id[1, :]
-        out.loc[out.frame == f] = tmp
 
+def _track_points(points: np.ndarray, tracks: np.ndarray) -> np.ndarray:
+    """Reorders the rods of every frame by their tracks."""
+    out = np.empty_like(points)
+    out[np.arange(len(points))[:, None], tracks] = points
+    return out
+
+
+def tracking_predictive(
+    data: pd.DataFrame,
+    predictor: ConstantVelocityFilter = None,
+    candidates: int = 4,
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Tracks rods (one colour) over multiple frames with predicted poses.
+
+    The poses of all rods are filtered over the frames with a
+    constant-velocity Kalman filter, see
+    :class:`~ParticleDetection.reconstruct_3D.prediction.ConstantVelocityFilter`.
+    The rods of a frame are only compared to the ``candidates`` rods with
+    the closest centers to the predicted rod centers, and the resulting
+    sparse assignment problem is solved. The number of candidates is doubled
+    for frames, where this leaves rods unassigned. The particle numbers are
+    passed on along the assignments, starting from the first frame.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Data(-slice) from rod tracking. Must contain at least the following
+        columns: x1, y1, z1, x2, y2, z2, frame(, particle)\n
+        The rows must be ordered by frame and every frame must contain the
+        same number of rods.
+    predictor : ConstantVelocityFilter, optional
+        Filter used for the prediction of the rods' poses. It is initialized
+        with the first frame.\n
+        By default ``ConstantVelocityFilter()``.
+    candidates : int, optional
+        Number of rods compared to every predicted rod.\n
+        By default ``4``.
+
+    Returns
+    -------
+    Tuple[DataFrame, ndarray]
+        Retuns the tracked data, i.e. the initial data with adjusted particle
+        numbers. Additionlly, returns the assignment costs per frame, i.e. the
+        distance between the predicted and assigned endpoints of all rods.
+    """
+    if predictor is None:
+        predictor = ConstantVelocityFilter()
+    frames = data["frame"].unique()
+    # points: (frame, rod, end-point, coord)
+    points = (
+        data[["x1", "y1", "z1", "x2", "y2", "z2"]]
+        .to_numpy()
+        .reshape((len(frames), -1, 2, 3))
+    )
+    rods = points.shape[1]
+
+    # ids: (frame, rod) -> particle number, tracks are the rods of frame 0
+    ids = np.empty((len(frames), rods), dtype=int)
+    if "particle" in data.columns:
+        ids[0] = data["particle"].to_numpy()[:rods]
+    else:
+        ids[0] = np.arange(rods)
+    total_cost = np.zeros(len(frames) - 1)
+    predictor.initialize(points[0])
+    for f in range(1, len(frames)):
+        predicted = predictor.predict()
+        tracks, assigned, cost = _predictive_assignment(
+            predicted, points[f], candidates
+        )
+        ids[f, assigned] = ids[0, tracks]
+        total_cost[f - 1] = cost
+        observed = np.empty_like(predicted)
+        observed[tracks] = points[f, assigned]
+        predictor.update(observed)
+
+    out = data.copy()
+    out["particle"] = ids.ravel()
     out = out.sort_values(by=["frame", "particle"]).reset_index(drop=True)
-    total_cost = cost[:, results[:, 0, :], results[:, 1, :]]
-    total_cost = total_cost.diagonal(offset=0, axis1=0, axis2=1).sum(axis=0)
     return out, total_cost
+
+
+def _predictive_assignment(
+    predicted: np.ndarray, points: np.ndarray, candidates: int
+) -> Tuple[np.ndarray, np.ndarray, float]:
+    """Assigns rods to predicted rods, that are compared only to the
+    ``candidates`` rods with the closest centers. Returns the assigned
+    predicted rods, rods and the total cost."""
+    rods = len(points)
+    tree = cKDTree((points[:, 0] + points[:, 1]) / 2)
+    centers = (predicted[:, 0] + predicted[:, 1]) / 2
+    k = max(1, min(candidates, rods))
+    while k < rods:
+        dist, hits = tree.query(centers, k=k)
+        tracks = np.repeat(np.arange(len(centers)), k)
+        hits = hits.reshape(-1)
+        finite = np.isfinite(dist.reshape(-1))
+        tracks, hits = tracks[finite], hits[finite]
+        cost = _endpoint_distances(predicted[tracks], points[hits])
+        graph = csr_matrix(
+            # offset, because explicit zeros are not treated as edges reliably
+            (cost + 1.0, (tracks, hits)),
+            shape=(len(predicted), rods),
+        )
+        try:
+            row, col = min_weight_full_bipartite_matching(graph)
+        except ValueError:
+            k *= 2
+            _logger.debug(f"Increasing the number of candidates to {k}.")
+            continue
+        return row, col, np.asarray(graph[row, col]).sum() - len(row)
+    cost = _assignment_costs(
+        np.stack([predicted[:, 0], points[:, 0]]),
+        np.stack([predicted[:, 1], points[:, 1]]),
+    )[0]
+    row, col = linear_sum_assignment(cost)
+    return row, col, cost[row, col].sum()
+
+
+def _endpoint_distances(
+    points1: np.ndarray, points2: np.ndarray
+) -> np.ndarray:
+    """Summed endpoint distances of pairs of rods, of the better of both
+    endpoint orientations."""
+    return np.minimum(
+        np.linalg.norm(points1[:, 0] - points2[:, 0], axis=-1)
+        + np.linalg.norm(points1[:, 1] - points2[:, 1], axis=-1),
+        np.linalg.norm(points1[:, 0] - points2[:, 1], axis=-1)
+        + np.linalg.norm(points1[:, 1] - points2[:, 0], axis=-1),
+    )
+
+
+def _assignment_costs(data_p1: np.ndarray, data_p2: np.ndarray) -> np.ndarray:
+    """Summed endpoint distances of all rods with all rods of the next frame,
+    of the better of both endpoint orientations."""
+    # (frame, rod(frame), rod(frame + 1), coord)
+    p1_prev, p1_next = data_p1[:-1, :, None], data_p1[1:, None, :]
+    p2_prev, p2_next = data_p2[:-1, :, None], data_p2[1:, None, :]
+    return np.minimum(
+        np.linalg.norm(p1_next - p1_prev, axis=-1)
+        + np.linalg.norm(p2_next - p2_prev, axis=-1),
+        np.linalg.norm(p1_prev - p2_next, axis=-1)
+        + np.linalg.norm(p2_prev - p1_next, axis=-1),
+    )
+
+
+def _unseen(data: pd.DataFrame) -> np.ndarray:
+    """Flags of rods, that are *unseen* in at least one camera."""
+    if "unseen" in data.columns:
+        return data["unseen"].fillna(0).to_numpy().astype(bool)
+    cols_seen = [col for col in data.columns if col.startswith("seen_")]
+    if not cols_seen:
+        return np.zeros(len(data), dtype=bool)
+    return (data[cols_seen] == 0).any(axis=1).to_numpy()
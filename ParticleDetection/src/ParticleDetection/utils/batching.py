@@ -0,0 +1,155 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev, and others
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Processing of items in batches, e.g. images in one forward pass of a network.
+
+Running a network on several images at once amortizes the framework overhead
+of every forward pass. The best batch size depends on the model and the
+hardware, so :func:`run_batched` can also determine it while processing the
+first items.
+
+**Authors:**    Adrian Niemann (adrian.niemann@ovgu.de)\n
+**Date:**       2024
+
+"""
+import logging
+import time
+from typing import (
+    Callable,
+    Iterator,
+    List,
+    Literal,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+_logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+BatchSize = Union[int, Literal["auto"]]
+"""Number of items processed at once or ``"auto"`` to determine it while
+processing, see :func:`run_batched`."""
+
+
+def batches(items: Sequence[T], batch_size: int) -> Iterator[Sequence[T]]:
+    """Splits items into consecutive batches of ``batch_size`` items, the
+    last batch may be smaller.
+
+    Parameters
+    ----------
+    items : Sequence
+        Items to split.
+    batch_size : int
+        Number of items per batch.
+
+    Raises
+    ------
+    ValueError
+        Is raised, if ``batch_size < 1``.
+    """
+    if batch_size < 1:
+        raise ValueError(f"The batch size must be >= 1, got {batch_size}.")
+    for start in range(0, len(items), batch_size):
+        yield items[start : start + batch_size]
+
+
+def run_batched(
+    function: Callable[[Sequence[T]], List[R]],
+    items: Sequence[T],
+    batch_size: BatchSize = 1,
+    max_batch_size: int = 16,
+    min_speedup: float = 1.1,
+) -> Iterator[Tuple[T, R]]:
+    """Applies a batch function to items and yields the result of every item.
+
+    With ``batch_size="auto"`` the batch size starts at ``1`` and is doubled,
+    as long as the processing time per item decreases by at least a factor
+    of ``min_speedup``. A batch, that runs out of memory, is repeated with
+    half the batch size, which is then kept. The items processed while tuning
+    are not processed again.
+
+    Parameters
+    ----------
+    function : Callable[[Sequence], List]
+        Function computing the results of a batch of items, one per item.
+    items : Sequence
+        Items to process.
+    batch_size : int | ``"auto"``, optional
+        Number of items per batch or ``"auto"`` to determine it while
+        processing.\n
+        By default ``1``.
+    max_batch_size : int, optional
+        Largest batch size tried with ``batch_size="auto"``.\n
+        By default ``16``.
+    min_speedup : float, optional
+        Minimum decrease of the processing time per item to keep doubling the
+        batch size with ``batch_size="auto"``.\n
+        By default ``1.1``.
+
+    Yields
+    ------
+    Tuple[Any, Any]
+        [0]: Item.\n
+        [1]: Result of the item.
+
+    Raises
+    ------
+    RuntimeError
+        Is raised, if a batch of a single item runs out of memory.
+
+    Examples
+    --------
+    >>> for file, result in run_batched(detect_images, files, "auto"):
+    ...     save(file, result)
+    """
+    if batch_size != "auto":
+        for batch in batches(items, batch_size):
+            yield from zip(batch, function(batch))
+        return
+
+    size = 1
+    best = None
+    position = 0
+    while position < len(items):
+        batch = items[position : position + size]
+        start = time.perf_counter()
+        try:
+            results = function(batch)
+        except RuntimeError as e:
+            if "out of memory" not in str(e) or size == 1:
+                raise
+            size //= 2
+            _logger.info(f"Out of memory, reducing the batch size to {size}.")
+            break
+        per_item = (time.perf_counter() - start) / len(batch)
+        position += len(batch)
+        yield from zip(batch, results)
+        if best is not None and per_item * min_speedup > best:
+            if per_item > best:
+                size //= 2
+            break
+        best = per_item
+        if size >= max_batch_size or position >= len(items):
+            break
+        size = min(2 * size, max_batch_size)
+    _logger.info(f"Using a batch size of {size}.")
+    for batch in batches(items[position:], size):
+        yield from zip(batch, function(batch))
@@ -27,7 +27,7 @@ import os
 import warnings
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Set, Tuple, TypedDict
+from typing import Dict, List, Sequence, Set, Tuple, TypedDict, Union
 
 import cv2
 import numpy as np
@@ -80,12 +80,99 @@ RNG_SEED = 1
 """Seed to allow reproducibility of results, that are dependent on the
 generation of random numbers."""
 
+
+class ROIMasks:
+    """Binary instance masks stored as crops of their bounding boxes.
+
+    Full-frame bitmasks of many small objects consist mostly of zeros. Here,
+    every mask is only stored for the part of the image covered by its
+    bounding box, together with the position of this crop in the image.
+
+    Parameters
+    ----------
+    masks : Sequence[ndarray]
+        Mask crops of shape ``(h_i, w_i)`` per instance.
+    offsets : ndarray
+        Image coordinates ``(x, y)`` of the top left pixel of every crop of
+        shape ``(N, 2)``.
+    image_size : Tuple[int, int]
+        Height and width of the image.
+
+    Examples
+    --------
+    >>> masks = ROIMasks([np.ones((2, 3), np.uint8)], [[10, 5]], (20, 30))
+    >>> masks.to_bitmasks().shape
+    torch.Size([1, 20, 30])
+    >>> masks.points(0)[:2]
+    array([[10,  5],
+           [11,  5]])
+    """
+
+    def __init__(
+        self,
+        masks: Sequence[np.ndarray],
+        offsets: np.ndarray,
+        image_size: Tuple[int, int],
+    ):
+        self.masks = list(masks)
+        self.offsets = np.asarray(offsets, dtype=int).reshape(-1, 2)
+        self.image_size = (int(image_size[0]), int(image_size[1]))
+        if len(self.masks) != len(self.offsets):
+            raise ValueError(
+                f"Got {len(self.masks)} masks, but {len(self.offsets)} "
+                f"offsets."
+            )
+
+    def __len__(self) -> int:
+        return len(self.masks)
+
+    def __getitem__(self, item) -> "ROIMasks":
+        """Returns the masks selected by an index, slice or boolean mask."""
+        if isinstance(item, torch.Tensor):
+            item = item.cpu().numpy()
+        idx = np.arange(len(self))[item]
+        return ROIMasks(
+            [self.masks[i] for i in np.atleast_1d(idx)],
+            self.offsets[idx],
+            self.image_size,
+        )
+
+    def to(self, *args, **kwargs) -> "ROIMasks":
+        """Returns the masks unchanged, the crops are always kept in memory
+        as ``ndarray`` objects."""
+        return self
+
+    def crop(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the crop of the ``i``-th mask and its offset ``(x, y)`` in
+        the image."""
+        return self.masks[i], self.offsets[i]
+
+    def points(self, i: int) -> np.ndarray:
+        """Returns the image coordinates ``(x, y)`` of all pixels of the
+        ``i``-th mask of shape ``(n, 2)``, ordered like ``np.nonzero()`` of
+        the full-frame mask."""
+        mask, offset = self.crop(i)
+        idxs = np.nonzero(mask)
+        return np.stack((idxs[1], idxs[0]), axis=1) + offset
+
+    def to_bitmasks(self) -> torch.Tensor:
+        """Pastes all masks into full-frame bitmasks of shape ``(N, H, W)``,
+        e.g. for visualization."""
+        full = torch.zeros((len(self), *self.image_size), dtype=torch.uint8)
+        for i, (mask, (x, y)) in enumerate(zip(self.masks, self.offsets)):
+            h, w = mask.shape
+            full[i, y : y + h, x : x + w] = torch.from_numpy(
+                np.ascontiguousarray(mask, dtype=np.uint8)
+            )
+        return full
+
+
 DetectionResult = TypedDict(
     "DetectionResult",
     {
         "pred_boxes": torch.Tensor,
         "pred_classes": torch.Tensor,
-        "pred_masks": torch.Tensor,
+        "pred_masks": Union[torch.Tensor, ROIMasks],
         "scored": torch.Tensor,
         "input_size": List[int],
     },
@@ -93,6 +180,9 @@ DetectionResult = TypedDict(
 )
 """Results of detecting particles in an image file.
 
+The ``"pred_masks"`` are full-frame bitmasks in results of Detectron2 models
+and :class:`ROIMasks` in results of exported models.
+
 See also
 --------
 :func:`ParticleDetection.utils.detection._run_detection`
@@ -22,9 +22,11 @@ the results for further computations.
 **Date:**       07.11.2022
 
 """
+import json
 import logging
+import os
 from pathlib import Path
-from typing import List
+from typing import Iterable, List, Sequence, Tuple
 
 import pandas as pd
 import torch
@@ -39,16 +41,22 @@ import ParticleDetection  # noqa: F401
 
 # isort: on
 
-import ParticleDetection.utils.data_conversions as d_conv
 import ParticleDetection.utils.data_loading as dl
 import ParticleDetection.utils.datasets as ds
 import ParticleDetection.utils.helper_funcs as hf
+from ParticleDetection.utils.batching import BatchSize, run_batched
+from ParticleDetection.utils.prefetching import ImagePrefetcher
+from ParticleDetection.utils.sinks import ColorCSVSink
 
 _logger = logging.getLogger(__name__)
 
 
 def _run_detection(
-    model: torch.ScriptModule, img: Path, threshold: float = 0.5
+    model: torch.ScriptModule,
+    img: Path,
+    threshold: float = 0.5,
+    loader: ImagePrefetcher = None,
+    batched_masks: bool = False,
 ) -> ds.DetectionResult:
     """Runs detection on one image.
 
@@ -69,6 +77,17 @@ def _run_detection(
     threshold : float, optional
         Threshold for the minimum score of predicted instances.\n
         By default ``0.5``.
+    loader : ImagePrefetcher, optional
+        Prefetcher, that the image is read from.\n
+        By default ``None``, i.e. the image is read on its own.
+    batched_masks : bool, optional
+        Flag, whether to resample all masks of an image at once with
+        :func:`~ParticleDetection.utils.helper_funcs.paste_masks_in_rois`
+        instead of one after another with
+        :func:`~ParticleDetection.utils.helper_funcs.mask_to_roi`. Single
+        pixels at the borders of masks with boxes smaller than the mask
+        resolution can differ.\n
+        By default ``False``.
 
     Returns
     -------
@@ -77,27 +96,137 @@ def _run_detection(
         ``"pred_boxes"``, ``"pred_classes"``, ``"pred_masks"``, ``"scores"``,
         ``"input_size"``
     """
-    input = dl.read_image(img)
+    input = _read_image(img, loader)
     with torch.no_grad():
         ret = model(input)
+    return _to_result(ret, threshold, batched_masks)
+
+
+def _run_detection_batch(
+    model: torch.ScriptModule,
+    imgs: Sequence[Path],
+    threshold: float = 0.5,
+    loader: ImagePrefetcher = None,
+    batched_masks: bool = False,
+) -> List[ds.DetectionResult]:
+    """Runs detection on multiple images.
+
+    Models exported for a batch of images, see
+    :func:`~ParticleDetection.modelling.export.export_model`, are run with as
+    many images at once as they were exported for, the last batch is padded
+    by repeating its last image. Models for single images are run with one
+    image after another using :func:`_run_detection`.
+
+    Parameters
+    ----------
+    model : torch.ScriptModule
+        Model used for the detection process. It must return the outputs
+        described in :func:`_run_detection` for every input image one after
+        another.
+    imgs : Sequence[Path]
+        Paths to the images the detection shall be run on.
+    threshold : float, optional
+        Threshold for the minimum score of predicted instances.\n
+        By default ``0.5``.
+    loader : ImagePrefetcher, optional
+        Prefetcher, that the images are read from.\n
+        By default ``None``, i.e. the images are read on their own.
+    batched_masks : bool, optional
+        Flag, whether to resample all masks of an image at once, see
+        :func:`_run_detection`.\n
+        By default ``False``.
+
+    Returns
+    -------
+    List[:data:`~ParticleDetection.utils.datasets.DetectionResult`]
+        One result per image, see :func:`_run_detection`.
+    """
+    n_inputs = model_batch_size(model)
+    if n_inputs == 1:
+        return [
+            _run_detection(
+                model, img, threshold, loader, batched_masks=batched_masks
+            )
+            for img in imgs
+        ]
+    results = []
+    for start in range(0, len(imgs), n_inputs):
+        inputs = [
+            _read_image(img, loader) for img in imgs[start : start + n_inputs]
+        ]
+        n_images = len(inputs)
+        inputs += [inputs[-1]] * (n_inputs - n_images)
+        with torch.no_grad():
+            ret = model(*inputs)
+        n_out = len(ret) // n_inputs
+        results.extend(
+            _to_result(
+                ret[i * n_out : (i + 1) * n_out], threshold, batched_masks
+            )
+            for i in range(n_images)
+        )
+    return results
+
 
+def _read_image(img: Path, loader: ImagePrefetcher = None) -> torch.Tensor:
+    """Reads an image from the prefetcher, if one is given."""
+    if loader is None:
+        return dl.read_image(img)
+    return loader.read(img)
+
+
+def model_batch_size(model: torch.ScriptModule) -> int:
+    """Returns the number of images an exported model is run with at once.
+
+    Parameters
+    ----------
+    model : torch.ScriptModule
+        Model exported with
+        :func:`~ParticleDetection.modelling.export.export_model`.
+
+    Returns
+    -------
+    int
+        Number of image inputs of the traced model, ``1`` for objects without
+        a traced graph.
+    """
+    try:
+        # the first input is the module itself
+        return max(len(list(model.graph.inputs())) - 1, 1)
+    except AttributeError:
+        return 1
+
+
+def _to_result(
+    ret: Tuple[torch.Tensor, ...], threshold: float, batched_masks: bool
+):
+    """Converts the outputs of a model for one image to a
+    :data:`~ParticleDetection.utils.datasets.DetectionResult`."""
     to_out = ret[3] > threshold
 
-    # Create bit-masks from ROI-masks
-    b_masks = []
-    for i in range(len(ret[0])):
-        if not to_out[i]:
-            continue
-        mask = ret[2][i].squeeze()
-        box = ret[0][i].squeeze()
-        b_masks.append(hf.paste_mask_in_image_old(mask, box, *ret[4]))
-    if not b_masks:
+    # Resample the ROI-masks to the pixels of their boxes
+    if batched_masks:
+        crops, offsets = hf.paste_masks_in_rois(
+            ret[2][to_out].reshape(-1, *ret[2].shape[-2:]),
+            ret[0][to_out].reshape(-1, 4),
+            *ret[4],
+        )
+    else:
+        crops, offsets = [], []
+        for i in range(len(ret[0])):
+            if not to_out[i]:
+                continue
+            mask = ret[2][i].squeeze()
+            box = ret[0][i].squeeze()
+            crop, offset = hf.mask_to_roi(mask, box, *ret[4])
+            crops.append(crop)
+            offsets.append(offset)
+    if not crops:
         return {}
-    b_masks = torch.stack(b_masks)
     return {
         "pred_boxes": ret[0][to_out, :],
         "pred_classes": ret[1][to_out],
-        "pred_masks": b_masks,
+        "pred_masks": ds.ROIMasks(crops, offsets, ret[4]),
         "scores": ret[3][to_out],
         "input_size": ret[4],
     }
@@ -109,9 +238,14 @@ def run_detection(
     classes: dict = None,
     output_dir: Path = Path("./"),
     threshold: float = 0.5,
-    frames: List[int] = [],
+    frames: Iterable[int] = [],
     cam1_name: str = "gp1",
     cam2_name: str = "gp2",
+    resume: bool = False,
+    batch_size: BatchSize = 1,
+    workers: int = 2,
+    prefetch: int = 4,
+    batched_masks: bool = False,
 ) -> None:
     """Runs inference on a given set of images and saves the output to a
     ``*.csv``.
@@ -121,6 +255,12 @@ def run_detection(
     endpoints are saved to a single ``rods_df.csv`` file in the specified
     output folder.
 
+    The rods of every frame are appended to ``rods_df.csv`` and the
+    ``rods_df_{color}.csv`` files right after its detection, see
+    :class:`~ParticleDetection.utils.sinks.ColorCSVSink`. The last completed
+    frame is recorded in ``rods_df.csv.checkpoint``, that is removed after
+    all frames are done.
+
     Parameters
     ----------
     model : ScriptModule
@@ -149,8 +289,8 @@ def run_detection(
     threshold : float, optional
         Threshold for the minimum score of predicted instances.\n
         By default ``0.5``.
-    frames : List[int], optional
-        A list of frames, that shall be used for rod detection.\n
+    frames : Iterable[int], optional
+        Frames, that shall be used for rod detection.\n
         By default ``[]``.
     cam1_name : str, optional
         The name/ID of the first camera in the experiment. This name will be
@@ -162,27 +302,106 @@ def run_detection(
         used for image discovery (see ``dataset_format``) and naming of the
         output ``*.csv file`` columns.\n
         By default ``"gp2"``.
+    resume : bool, optional
+        Flag, whether to continue an interrupted run from its checkpoint in
+        ``output_dir``. Frames up to the last completed one are skipped and
+        the output files are continued. Without a checkpoint all frames are
+        run.\n
+        By default ``False``, i.e. existing output files are overwritten.
+    batch_size : int | ``"auto"``, optional
+        Number of frames, whose images of both cameras are given to the model
+        together, see :func:`_run_detection_batch`, or ``"auto"`` to
+        determine it during the run, see
+        :func:`~ParticleDetection.utils.batching.run_batched`.\n
+        By default ``1``.
+    workers : int, optional
+        Number of threads decoding the upcoming images in the background, see
+        :class:`~ParticleDetection.utils.prefetching.ImagePrefetcher`.\n
+        By default ``2``.
+    prefetch : int, optional
+        Maximum number of images decoded ahead, ``0`` disables
+        prefetching.\n
+        By default ``4``.
+    batched_masks : bool, optional
+        Flag, whether to resample all masks of an image at once, see
+        :func:`_run_detection`.\n
+        By default ``False``.
+
+    Raises
+    ------
+    ValueError
+        Is raised, if ``resume=True`` and the last completed frame of the
+        checkpoint is not in ``frames``.
     """
     cols = [
         col.format(id1=cam1_name, id2=cam2_name) for col in ds.DEFAULT_COLUMNS
     ]
-    data = pd.DataFrame(columns=cols)
-    for frame in tqdm(frames):
-        for cam in [cam1_name, cam2_name]:
-            file = Path(dataset_format.format(frame=frame, cam_id=cam))
-            _logger.debug(f"Inference on: {str(file)}")
-            outputs = _run_detection(model, file, threshold=threshold)
-
-            if "pred_masks" in outputs:
-                _logger.debug("Starting endpoint computation ...")
-                points = hf.rod_endpoints(outputs, classes)
-                data = ds.add_points(points, data, cam, frame)
-            _logger.info(f"Done with: {file.name}")
-        # Save intermediate rod data
-        if len(data) > 0:
-            current_output = output_dir / "rods_df.csv"
-            data.reset_index(drop=True, inplace=True)
-            data = ds.replace_missing_rods(data, cam1_name, cam2_name)
-            data.to_csv(current_output, ",")
-            d_conv.csv_extract_colors(str(current_output.resolve()))
+    output = output_dir / "rods_df.csv"
+    checkpoint = Path(f"{output}.checkpoint")
+    frames = list(frames)
+    sizes = None
+    if resume and checkpoint.exists():
+        with open(checkpoint, "r") as f:
+            state = json.load(f)
+        if state["frame"] not in frames:
+            raise ValueError(
+                f"The last completed frame {state['frame']} of the checkpoint "
+                f"'{checkpoint}' is not in the given frames, the run cannot "
+                f"be resumed."
+            )
+        sizes = state["sizes"]
+        frames = frames[frames.index(state["frame"]) + 1 :]
+        _logger.info(f"Resuming after frame {state['frame']}.")
+
+    def detect_frames(batch: Sequence[int]):
+        files = [
+            Path(dataset_format.format(frame=frame, cam_id=cam))
+            for frame in batch
+            for cam in [cam1_name, cam2_name]
+        ]
+        _logger.debug(f"Inference on: {[str(file) for file in files]}")
+        outputs = _run_detection_batch(
+            model,
+            files,
+            threshold=threshold,
+            loader=loader,
+            batched_masks=batched_masks,
+        )
+        return [
+            list(zip(files[2 * i : 2 * i + 2], outputs[2 * i : 2 * i + 2]))
+            for i in range(len(batch))
+        ]
+
+    files = (
+        Path(dataset_format.format(frame=frame, cam_id=cam))
+        for frame in frames
+        for cam in [cam1_name, cam2_name]
+    )
+    loader = ImagePrefetcher(files, workers=workers, prefetch=prefetch)
+    # chunk_size=1: every frame is on disk, before it is checkpointed
+    with loader, ColorCSVSink(output, chunk_size=1, sizes=sizes) as sink:
+        for frame, results in tqdm(
+            run_batched(detect_frames, frames, batch_size), total=len(frames)
+        ):
+            data = pd.DataFrame(columns=cols)
+            for cam, (file, outputs) in zip([cam1_name, cam2_name], results):
+                if "pred_masks" in outputs:
+                    _logger.debug("Starting endpoint computation ...")
+                    points = hf.rod_endpoints(outputs, classes)
+                    data = ds.add_points(points, data, cam, frame)
+                _logger.info(f"Done with: {file.name}")
+            # Save intermediate rod data
+            if len(data) > 0:
+                data = ds.replace_missing_rods(data, cam1_name, cam2_name)
+                sink.append(data)
+            _write_checkpoint(checkpoint, frame, sink.tell())
+    checkpoint.unlink(missing_ok=True)
     return
+
+
+def _write_checkpoint(file: Path, frame: int, sizes: dict) -> None:
+    """Atomically replaces the checkpoint of :func:`run_detection`."""
+    tmp = Path(f"{file}.tmp")
+    with open(tmp, "w") as f:
+        json.dump({"frame": frame, "sizes": sizes}, f)
+    os.replace(tmp, file)
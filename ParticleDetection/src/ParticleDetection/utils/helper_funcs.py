@@ -22,7 +22,7 @@ import logging
 import multiprocessing as mp
 import sys
 from collections import Counter
-from typing import Dict, Union
+from typing import Dict, List, Tuple, Union
 
 import cv2
 import numpy as np
@@ -32,8 +32,8 @@ from scipy.spatial import ConvexHull
 from skimage.transform import probabilistic_hough_line
 from sklearn.cluster import DBSCAN
 
-import ParticleDetection.utils.data_loading as dl
 import ParticleDetection.utils.datasets as ds
+from ParticleDetection.reconstruct_3D.stereo_rig import StereoRig
 
 _logger = logging.getLogger(__name__)
 
@@ -251,12 +251,16 @@ def rod_endpoints(
             prediction = prediction["instances"].get_fields()
         for k, v in prediction.items():
             prediction[k] = v.to("cpu")
+        masks = prediction["pred_masks"]
         for i_c in classes:
             i_c_list = np.argwhere(prediction["pred_classes"] == i_c).flatten()
-            segmentations = [
-                prediction["pred_masks"][i_m, :, :].numpy().squeeze()
-                for i_m in i_c_list
-            ]
+            if isinstance(masks, ds.ROIMasks):
+                # (crop, offset) per mask
+                segmentations = [masks.crop(i_m) for i_m in i_c_list]
+            else:
+                segmentations = [
+                    (masks[i_m, :, :].numpy().squeeze(),) for i_m in i_c_list
+                ]
             if not len(segmentations):
                 continue
             if expected_particles is not None:
@@ -274,9 +278,13 @@ def rod_endpoints(
                 else:
                     use_processes = cpu_count
                 with mp.Pool(use_processes) as p:
-                    end_points = p.map(line_estimator_simple, segmentations)
+                    end_points = p.starmap(
+                        line_estimator_simple, segmentations
+                    )
             elif method == "simple":
-                end_points = list(map(line_estimator_simple, segmentations))
+                end_points = [
+                    line_estimator_simple(*args) for args in segmentations
+                ]
             else:
                 raise ValueError(
                     "Unknown extraction method. "
@@ -383,19 +391,28 @@ def line_estimator(segmentation: np.ndarray) -> np.ndarray:
     return np.array([xy1, xy2])
 
 
-def line_estimator_simple(segmentation: np.ndarray) -> np.ndarray:
+def line_estimator_simple(
+    segmentation: np.ndarray, offset: np.ndarray = None
+) -> np.ndarray:
     """Calculates the endpoints of rods from the segmentation mask.
 
     Parameters
     ----------
     segmentation : ndarray
         Boolean segmentation (bit-)mask.
+    offset : ndarray, optional
+        Image coordinates ``(x, y)`` of the top left pixel of a segmentation
+        mask, that is cropped from the image, see
+        :class:`~ParticleDetection.utils.datasets.ROIMasks`.\n
+        By default ``None``, i.e. the mask covers the whole image.
     Returns
     -------
     np.ndarray
     """
     idxs = np.nonzero(segmentation)
     points = np.asarray((idxs[1], idxs[0])).swapaxes(0, 1)
+    if offset is not None:
+        points = points + np.asarray(offset)
     if not len(points):
         return np.array([[-1.0, -1.0], [-1.0, -1.0]])
     bbox = _minimum_bounding_rectangle(points)
@@ -476,6 +493,52 @@ def paste_mask_in_image_old(
     ----
     This function is copied from ``detectron2.layers.mask_ops``.
     """
+    crop, (x_0, y_0) = mask_to_roi(mask, box, img_h, img_w, threshold)
+    im_mask = torch.zeros((img_h, img_w), dtype=torch.uint8)
+    h, w = crop.shape
+    im_mask[y_0 : y_0 + h, x_0 : x_0 + w] = torch.from_numpy(crop)
+    return im_mask
+
+
+def mask_to_roi(
+    mask: torch.Tensor,
+    box: torch.Tensor,
+    img_h: int,
+    img_w: int,
+    threshold: float = 0.5,
+):
+    """Resamples a single mask to the pixels of its box in an image.
+
+    This is the same as :func:`paste_mask_in_image_old`, but only returns the
+    part of the pasted mask covered by the box.
+
+    Parameters
+    ----------
+    mask : Tensor
+        A tensor of shape (Hmask, Wmask) storing the mask of a single object
+        instance. Values are :math:`\\in [0, 1]`.
+    box : Tensor
+        A tensor of shape ``(4, )`` storing the ``x0, y0, x1, y1`` box corners
+        of the object instance.
+    img_h : int
+        Image height.
+    img_w : int
+        Image width.
+    threshold : float
+        Mask binarization threshold :math:`\\in [0, 1]`.\n
+        Default is ``0.5``.
+
+    Returns
+    -------
+    Tuple[ndarray, ndarray]
+        [0]: The resized and binarized object mask within the box, clipped to
+        the image plane.\n
+        [1]: Image coordinates ``(x, y)`` of the top left pixel of the mask.
+
+    See also
+    --------
+    :class:`~ParticleDetection.utils.datasets.ROIMasks`
+    """
     # Conversion from continuous box coordinates to discrete pixel coordinates
     # via truncation (cast to int32). This determines which pixels to paste the
     # mask onto.
@@ -504,16 +567,115 @@ def paste_mask_in_image_old(
         # allow it to return an unmodified mask
         mask = torch.from_numpy(mask * 255).to(torch.uint8)
 
-    im_mask = torch.zeros((img_h, img_w), dtype=torch.uint8)
     x_0 = max(box[0], 0)
     x_1 = min(box[2] + 1, img_w)
     y_0 = max(box[1], 0)
     y_1 = min(box[3] + 1, img_h)
 
-    im_mask[y_0:y_1, x_0:x_1] = mask[
+    crop = mask[
         (y_0 - box[1]) : (y_1 - box[1]), (x_0 - box[0]) : (x_1 - box[0])
     ]
-    return im_mask
+    # boxes outside of the image
+    crop = crop[: max(int(y_1 - y_0), 0), : max(int(x_1 - x_0), 0)]
+    return crop.numpy(), np.array([int(x_0), int(y_0)])
+
+
+def paste_masks_in_rois(
+    masks: torch.Tensor,
+    boxes: torch.Tensor,
+    img_h: int,
+    img_w: int,
+    threshold: float = 0.5,
+) -> Tuple[List[np.ndarray], np.ndarray]:
+    """Resamples masks to the pixels of their boxes in an image at once.
+
+    This is a batched version of :func:`mask_to_roi`, that resamples all
+    masks in one call of :func:`torch.nn.functional.grid_sample`. The boxes
+    are mapped to pixels identically. The bilinear interpolation is identical
+    to the one of :func:`mask_to_roi`, if a box is at least as large as the
+    mask. Masks of smaller boxes are downsampled without antialiasing, which
+    can change single pixels at the mask borders.
+
+    Parameters
+    ----------
+    masks : Tensor
+        A tensor of shape (N, Hmask, Wmask) storing the masks of N object
+        instances. Values are :math:`\\in [0, 1]`.
+    boxes : Tensor
+        A tensor of shape ``(N, 4)`` storing the ``x0, y0, x1, y1`` box
+        corners of the object instances.
+    img_h : int
+        Image height.
+    img_w : int
+        Image width.
+    threshold : float
+        Mask binarization threshold :math:`\\in [0, 1]`.\n
+        Default is ``0.5``.
+
+    Returns
+    -------
+    Tuple[List[ndarray], ndarray]
+        [0]: The resized and binarized object masks within their boxes,
+        clipped to the image plane.\n
+        [1]: Image coordinates ``(x, y)`` of the top left pixel of every mask
+        of shape ``(N, 2)``.
+
+    See also
+    --------
+    :class:`~ParticleDetection.utils.datasets.ROIMasks`
+    """
+    n_masks = len(boxes)
+    if not n_masks:
+        return [], np.zeros((0, 2), dtype=int)
+    boxes = boxes.to(device="cpu", dtype=torch.int32)
+    # Number of pixel samples, *not* geometric width/height
+    samples_w = boxes[:, 2] - boxes[:, 0] + 1
+    samples_h = boxes[:, 3] - boxes[:, 1] + 1
+    w_max = int(samples_w.max())
+    h_max = int(samples_h.max())
+
+    # Pixel centers of the boxes in normalized mask coordinates, samples
+    # beyond a box's size are cropped below
+    x = (torch.arange(w_max) + 0.5)[None, :] / samples_w[:, None] * 2 - 1
+    y = (torch.arange(h_max) + 0.5)[None, :] / samples_h[:, None] * 2 - 1
+    grid = torch.stack(
+        (
+            x[:, None, :].expand(n_masks, h_max, w_max),
+            y[:, :, None].expand(n_masks, h_max, w_max),
+        ),
+        dim=3,
+    )
+    resampled = torch.nn.functional.grid_sample(
+        masks.to(device="cpu", dtype=torch.float32)[:, None],
+        grid,
+        mode="bilinear",
+        padding_mode="border",
+        align_corners=False,
+    )[:, 0]
+    if threshold >= 0:
+        resampled = (resampled > threshold).to(torch.uint8)
+    else:
+        # for visualization and debugging, we also
+        # allow it to return an unmodified mask
+        resampled = (resampled * 255).to(torch.uint8)
+    resampled = resampled.numpy()
+
+    x_0 = boxes[:, 0].clamp(min=0)
+    x_1 = (boxes[:, 2] + 1).clamp(max=int(img_w))
+    y_0 = boxes[:, 1].clamp(min=0)
+    y_1 = (boxes[:, 3] + 1).clamp(max=int(img_h))
+    # crop start & end within the resampled masks
+    c_x0 = (x_0 - boxes[:, 0]).tolist()
+    c_x1 = (x_1 - boxes[:, 0]).clamp(min=0).tolist()
+    c_y0 = (y_0 - boxes[:, 1]).tolist()
+    c_y1 = (y_1 - boxes[:, 1]).clamp(min=0).tolist()
+    crops = [
+        resampled[
+            i, c_y0[i] : max(c_y1[i], c_y0[i]), c_x0[i] : max(c_x1[i], c_x0[i])
+        ]
+        for i in range(n_masks)
+    ]
+    return crops, torch.stack((x_0, y_0), dim=1).numpy().astype(int)
 
 
 def find_world_transform(
@@ -528,8 +690,9 @@ def find_world_transform(
 
     Parameters
     ----------
-    calibration_file : str
-        Path to a stereo calibration file
+    calibration_file : str | StereoRig
+        Path to a stereo calibration file or an already loaded
+        :class:`~ParticleDetection.reconstruct_3D.stereo_rig.StereoRig`.
     edges_cam1_dist : np.ndarray(8,2)
         Should contain 2D coordinates of box edges (corners) on 1st camera
         view (not undistorted):\n
@@ -570,35 +733,13 @@ def find_world_transform(
 
     >>> p_world = rot_comb.apply(p_cam1) + trans_vec
     """
-    calibration = dl.load_camera_calibration(str(calibration_file))
-
-    # Derive projection matrices from the calibration
-    r1 = np.eye(3)
-    t1 = np.expand_dims(np.array([0.0, 0.0, 0.0]), 1)
-    P1 = np.vstack((r1.T, t1.T)) @ calibration["CM1"].T
-    P1 = P1.T
-
-    r2 = calibration["R"]
-    t2 = calibration["T"]
-    P2 = np.vstack((r2.T, t2.T)) @ calibration["CM2"].T
-    P2 = P2.T
-
-    # Undistort points using the camera calibration
-    edges_cam1 = cv2.undistortImagePoints(
-        edges_cam1_dist, calibration["CM1"], calibration["dist1"]
-    ).reshape(-1, 2)
-
-    # Undistort points using the camera calibration
-    edges_cam2 = cv2.undistortImagePoints(
-        edges_cam2_dist, calibration["CM2"], calibration["dist2"]
-    ).reshape(-1, 2)
+    if isinstance(calibration_file, StereoRig):
+        rig = calibration_file
+    else:
+        rig = StereoRig.from_files(calibration_file)
 
     # Triangulate box corners (result in cam1 coordinate system)
-    edges_triang = cv2.triangulatePoints(P1, P2, edges_cam1.T, edges_cam2.T)
-
-    edges_triang = np.asarray(
-        [p[0:3] / p[3] for p in edges_triang.transpose()]
-    )
+    edges_triang = rig.triangulate(edges_cam1_dist, edges_cam2_dist)
 
     # Estimate affine transform to coordinate system
     transform_result = cv2.estimateAffine3D(edges_triang, edges_3D)
@@ -0,0 +1,195 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev, and others
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Loading of images in background threads ahead of their use.
+
+Reading and decoding an image right before running a model on it leaves the
+model idle during the decoding and the CPU idle during the inference.
+:class:`ImagePrefetcher` decodes the upcoming images of a run in a thread
+pool instead, while the current ones are processed, and records how often
+the processing had to wait for an image (:class:`PrefetchStats`).
+
+**Authors:**    Adrian Niemann (adrian.niemann@ovgu.de)\n
+**Date:**       2024
+
+"""
+import collections
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterable, Union
+
+import ParticleDetection.utils.data_loading as dl
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PrefetchStats:
+    """Metrics of an :class:`ImagePrefetcher`.
+
+    Attributes
+    ----------
+    reads : int
+        Number of images requested with :meth:`ImagePrefetcher.read`.
+    misses : int
+        Number of requested images, that were not scheduled for prefetching
+        and were loaded on request.
+    stalls : int
+        Number of requested images, that were not loaded yet.
+    stall_time : float
+        Total time in seconds spent waiting for requested images.
+    max_queue_depth : int
+        Largest number of loaded images waiting to be requested.
+    """
+
+    reads: int = 0
+    misses: int = 0
+    stalls: int = 0
+    stall_time: float = 0.0
+    max_queue_depth: int = 0
+    _queue_depth_sum: int = 0
+
+    @property
+    def mean_queue_depth(self) -> float:
+        """float: Mean number of loaded images waiting to be requested, at
+        the time of a request."""
+        if not self.reads:
+            return 0.0
+        return self._queue_depth_sum / self.reads
+
+
+class ImagePrefetcher:
+    """Loads images in background threads in the order they are requested.
+
+    At most ``prefetch`` images are loaded ahead of the last requested one,
+    so the memory consumption is bounded. Images must be requested with
+    :meth:`read` in the order of ``files``. Prefetched images, that are
+    skipped, are discarded and images, that were not prefetched, are loaded on
+    request.
+    The prefetcher can be used as a context manager, that closes it on exit,
+    see :meth:`close`.
+
+    Parameters
+    ----------
+    files : Iterable[str | Path]
+        Images in the order they will be requested.
+    load : Callable[[str | Path], Any], optional
+        Function loading one image.\n
+        By default
+        :func:`~ParticleDetection.utils.data_loading.read_image`, i.e. the
+        images are loaded as ``CHW`` tensors in BGR format.
+    workers : int, optional
+        Number of worker threads.\n
+        By default ``2``.
+    prefetch : int, optional
+        Maximum number of images loaded ahead of the last requested one.\n
+        By default ``4``.
+
+    Attributes
+    ----------
+    stats : PrefetchStats
+        Metrics of the requests so far.
+
+    Examples
+    --------
+    >>> with ImagePrefetcher(files) as loader:
+    ...     for file in files:
+    ...         outputs = model(loader.read(file))
+    >>> loader.stats.stalls
+    0
+    """
+
+    def __init__(
+        self,
+        files: Iterable[Union[str, Path]],
+        load: Callable[[Union[str, Path]], Any] = None,
+        workers: int = 2,
+        prefetch: int = 4,
+    ):
+        self.load = load if load is not None else dl.read_image
+        self.prefetch = prefetch
+        self.stats = PrefetchStats()
+        self._files = iter(files)
+        self._pending = collections.deque()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self._submit()
+
+    def _submit(self):
+        """Schedules images, until ``prefetch`` are pending."""
+        n_new = self.prefetch - len(self._pending)
+        for file in itertools.islice(self._files, max(n_new, 0)):
+            self._pending.append((file, self._pool.submit(self.load, file)))
+
+    def read(self, file: Union[str, Path]) -> Any:
+        """Returns a loaded image.
+
+        Parameters
+        ----------
+        file : str | Path
+            Requested image.
+
+        Returns
+        -------
+        Any
+            Image as returned by the ``load`` function.
+        """
+        self.stats.reads += 1
+        depth = sum(task.done() for _, task in self._pending)
+        self.stats._queue_depth_sum += depth
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, depth)
+
+        position = next(
+            (i for i, (f, _) in enumerate(self._pending) if f == file), None
+        )
+        if position is None:
+            self.stats.misses += 1
+            return self.load(file)
+        for _ in range(position):
+            # skipped images
+            self._pending.popleft()[1].cancel()
+        _, task = self._pending.popleft()
+        if not task.done():
+            self.stats.stalls += 1
+            start = time.perf_counter()
+            image = task.result()
+            self.stats.stall_time += time.perf_counter() - start
+        else:
+            image = task.result()
+        self._submit()
+        return image
+
+    def close(self) -> None:
+        """Discards all pending images and stops the worker threads."""
+        for _, task in self._pending:
+            task.cancel()
+        self._pending.clear()
+        self._pool.shutdown()
+        _logger.info(
+            f"Prefetched images: {self.stats.reads} read, "
+            f"{self.stats.stalls} stalls ({self.stats.stall_time:.2f} s), "
+            f"mean queue depth {self.stats.mean_queue_depth:.1f}."
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
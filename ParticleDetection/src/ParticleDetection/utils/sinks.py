@@ -0,0 +1,318 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev, and others
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Output sinks, that collect rod position data frame by frame.
+
+Appending per-frame results with ``df = pd.concat([df, tmp])`` copies all
+previous rows every time. The sinks in this module instead keep the results
+in chunks, that are combined only once (:class:`MemorySink`) or appended to a
+``*.csv`` file whenever a chunk is full (:class:`CSVSink`), optionally split
+into one additional file per color (:class:`ColorCSVSink`).
+
+**Authors:**    Adrian Niemann (adrian.niemann@ovgu.de)\n
+**Date:**       2024
+
+"""
+import abc
+import io
+import logging
+import os
+from typing import Dict, List, Mapping, Union
+
+import pandas as pd
+
+_logger = logging.getLogger(__name__)
+
+
+class DataSink(abc.ABC):
+    """Base class of sinks for rod position data.
+
+    Data is given to the sink with :meth:`append` in the order it shall
+    appear in the output. Sinks can be used as context managers, that
+    :meth:`close` the sink on exit.
+    """
+
+    def __init__(self):
+        self._n_rows = 0
+
+    @property
+    def n_rows(self) -> int:
+        """int: Number of rows appended to the sink so far."""
+        return self._n_rows
+
+    def append(self, data: pd.DataFrame) -> None:
+        """Appends the rows of ``data`` to the sink.
+
+        Parameters
+        ----------
+        data : DataFrame
+            Rod position data, e.g. the result of one frame. ``None`` and
+            empty ``DataFrame`` objects are ignored.
+        """
+        if data is None or not len(data):
+            return
+        self._n_rows += len(data)
+        self._append(data)
+
+    def flush(self) -> None:
+        """Passes all buffered data on to the sink's destination."""
+
+    def close(self) -> None:
+        """Flushes the remaining data and releases all resources."""
+        self.flush()
+
+    @abc.abstractmethod
+    def _append(self, data: pd.DataFrame) -> None:
+        """Stores the non-empty ``data`` in the sink."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MemorySink(DataSink):
+    """Collects rod position data in memory.
+
+    The appended ``DataFrame`` objects are only concatenated once, when the
+    result is requested with :meth:`to_dataframe`.
+
+    Examples
+    --------
+    >>> sink = MemorySink()
+    >>> for frame in frames:
+    ...     sink.append(match_frame(data, "gp1", "gp2", frame, color, rig)[0])
+    >>> df_out = sink.to_dataframe()
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[pd.DataFrame] = []
+
+    def _append(self, data: pd.DataFrame) -> None:
+        self._chunks.append(data)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Returns all data appended so far as one ``DataFrame`` with a
+        continuous index, starting at ``0``."""
+        if not self._chunks:
+            return pd.DataFrame()
+        if len(self._chunks) > 1:
+            self._chunks = [pd.concat(self._chunks, ignore_index=True)]
+        return self._chunks[0].reset_index(drop=True)
+
+
+class CSVSink(DataSink):
+    """Writes rod position data to a ``*.csv`` file in chunks.
+
+    Appended data is buffered until at least ``chunk_size`` rows are
+    available, which are then appended to the file at once. Every chunk is
+    flushed to disk after writing, i.e. the file can be read, e.g. with
+    ``pd.read_csv()``, while the sink is still in use and contains all
+    completed chunks. After :meth:`close` the file is identical to writing
+    the concatenation of all appended data with a continuous index using
+    ``DataFrame.to_csv()``.
+
+    The columns of the first appended data determine the columns of the
+    file.
+
+    Parameters
+    ----------
+    file : str | PathLike
+        Path of the output file. An existing file is overwritten.
+    chunk_size : int, optional
+        Minimum number of rows written to the file at once.\n
+        By default ``10_000``.
+    sep : str, optional
+        Field separator of the output file.\n
+        By default ``","``.
+    append : bool, optional
+        Flag, whether to append to an existing file, e.g. to continue an
+        interrupted run. The columns and the index are continued from the
+        existing file. A missing file is created.\n
+        By default ``False``, i.e. an existing file is overwritten.
+
+    Raises
+    ------
+    ValueError
+        Is raised by :meth:`append`, if the data has columns, that the first
+        appended data did not have.
+
+    Examples
+    --------
+    >>> with CSVSink("rods_df_blue.csv") as sink:
+    ...     for frame in frames:
+    ...         sink.append(match_frame(data, "gp1", "gp2", frame, "blue",
+    ...                                 rig)[0])
+    """
+
+    def __init__(
+        self,
+        file: Union[str, os.PathLike],
+        chunk_size: int = 10_000,
+        sep: str = ",",
+        append: bool = False,
+    ):
+        super().__init__()
+        self.file = file
+        self.chunk_size = chunk_size
+        self.sep = sep
+        self._buffer: List[pd.DataFrame] = []
+        self._n_buffered = 0
+        self._n_written = 0
+        self._columns: pd.Index = None
+        self._header = False
+        if append and os.path.exists(file) and os.path.getsize(file):
+            with open(file, newline="") as f:
+                header = f.readline()
+                self._n_written = sum(1 for _ in f)
+            self._columns = pd.read_csv(
+                io.StringIO(header), sep=sep, index_col=0
+            ).columns
+            self._header = True
+            self._handle = open(file, "a", newline="")
+        else:
+            self._handle = open(file, "w", newline="")
+
+    def _append(self, data: pd.DataFrame) -> None:
+        if self._columns is None:
+            self._columns = data.columns
+        elif not data.columns.isin(self._columns).all():
+            raise ValueError(
+                f"Unexpected columns "
+                f"{list(data.columns[~data.columns.isin(self._columns)])} "
+                f"for {self.file}."
+            )
+        self._buffer.append(data)
+        self._n_buffered += len(data)
+        if self._n_buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Appends all buffered rows to the file."""
+        if not self._buffer:
+            return
+        chunk = pd.concat(self._buffer, ignore_index=True)
+        chunk = chunk.reindex(columns=self._columns)
+        chunk.index += self._n_written
+        chunk.to_csv(self._handle, sep=self.sep, header=not self._header)
+        self._handle.flush()
+        self._header = True
+        self._n_written += len(chunk)
+        self._buffer = []
+        self._n_buffered = 0
+        _logger.debug(f"Wrote {self._n_written} rows to {self.file}.")
+
+    def tell(self) -> int:
+        """Returns the size of the file in bytes, that contains all rows
+        written so far, i.e. without the buffered rows."""
+        return self._handle.tell()
+
+    def close(self) -> None:
+        """Writes the remaining rows and closes the file."""
+        if self._handle.closed:
+            return
+        self.flush()
+        if not self._header:
+            # keep the output format of an empty DataFrame
+            pd.DataFrame(columns=self._columns).to_csv(
+                self._handle, sep=self.sep
+            )
+        self._handle.close()
+
+
+class ColorCSVSink(DataSink):
+    """Writes rod position data of multiple colors to a combined ``*.csv``
+    file and to one ``*.csv`` file per color.
+
+    The files of the colors are named like the combined file, extended by
+    the color, i.e. ``rods_df.csv`` -> ``rods_df_blue.csv``, see
+    :func:`~ParticleDetection.utils.data_conversions.csv_extract_colors`.
+    Every file is written by a :class:`CSVSink` and is only created, once
+    data for it is appended. After :meth:`close` the files are identical to
+    writing the concatenation of all appended data and extracting the colors
+    from it with
+    :func:`~ParticleDetection.utils.data_conversions.csv_extract_colors`.
+
+    Parameters
+    ----------
+    file : str | PathLike
+        Path of the combined output file.
+    chunk_size : int, optional
+        Minimum number of rows written to every file at once, see
+        :class:`CSVSink`.\n
+        By default ``10_000``.
+    sep : str, optional
+        Field separator of the output files.\n
+        By default ``","``.
+    sizes : Mapping[str, int], optional
+        Sizes of the files of an interrupted run, as returned by
+        :meth:`tell`. These files are truncated to the given sizes and then
+        continued, all other files are overwritten.\n
+        By default ``None``, i.e. existing files are overwritten.
+    """
+
+    def __init__(
+        self,
+        file: Union[str, os.PathLike],
+        chunk_size: int = 10_000,
+        sep: str = ",",
+        sizes: Mapping[str, int] = None,
+    ):
+        super().__init__()
+        self.file = str(file)
+        self.chunk_size = chunk_size
+        self.sep = sep
+        self._continued = dict(sizes) if sizes is not None else {}
+        for path, size in self._continued.items():
+            os.truncate(path, size)
+        self._sinks: Dict[str, CSVSink] = {}
+
+    def _sink(self, file: str) -> CSVSink:
+        """Returns the sink of a file and opens it, if necessary."""
+        if file not in self._sinks:
+            self._sinks[file] = CSVSink(
+                file,
+                self.chunk_size,
+                self.sep,
+                append=file in self._continued,
+            )
+        return self._sinks[file]
+
+    def _append(self, data: pd.DataFrame) -> None:
+        self._sink(self.file).append(data)
+        file_base = os.path.splitext(self.file)[0]
+        for color, rows in data.groupby("color", sort=False):
+            self._sink(file_base + f"_{color}.csv").append(rows)
+
+    def flush(self) -> None:
+        """Appends all buffered rows to the files."""
+        for sink in self._sinks.values():
+            sink.flush()
+
+    def tell(self) -> Dict[str, int]:
+        """Returns the sizes of the files in bytes, that contain all rows
+        written so far, i.e. without the buffered rows."""
+        sizes = dict(self._continued)
+        sizes.update({file: s.tell() for file, s in self._sinks.items()})
+        return sizes
+
+    def close(self) -> None:
+        """Writes the remaining rows and closes all files."""
+        for sink in self._sinks.values():
+            sink.close()
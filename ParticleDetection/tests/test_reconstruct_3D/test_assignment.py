@@ -0,0 +1,136 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev, and others
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+
+import ParticleDetection.reconstruct_3D.matchND as mnd
+from ParticleDetection.reconstruct_3D.assignment import AssignmentSolver
+
+
+def check_assignment(result, shape):
+    assert len(result) == len(shape)
+    for idx, dim in zip(result, shape):
+        assert idx.shape == (min(shape),)
+        assert len(np.unique(idx)) == min(shape)
+        assert idx.max() < dim
+    # sorted like np.where()
+    assert list(zip(*result)) == sorted(zip(*result))
+
+
+@pytest.mark.parametrize(
+    "shape", [(4, 4, 4), (3, 5, 4), (5, 4, 3), (4, 3, 5), (6, 6, 6)]
+)
+@pytest.mark.parametrize("seed", range(3))
+def test_solve_3d(shape, seed):
+    weights = np.random.default_rng(seed).random(shape)
+    solver = AssignmentSolver()
+    result = mnd.npartite_matching(weights, maximize=True, solver=solver)
+    check_assignment(result, shape)
+
+    expected = mnd.npartite_matching(weights, maximize=True)
+    np.testing.assert_allclose(weights[result].sum(), weights[expected].sum())
+    assert solver.gap <= solver.gap_tolerance
+    assert solver.lower_bound <= solver.upper_bound + 1e-12
+    np.testing.assert_allclose(-weights[result].sum(), solver.upper_bound)
+
+
+@pytest.mark.parametrize("shape", [(3, 5), (4, 4), (2, 3, 2, 3)])
+def test_solve_exact(shape):
+    weights = np.random.default_rng(0).random(shape)
+    solver = AssignmentSolver()
+    result = solver.solve(weights, maximize=True)
+    check_assignment(result, shape)
+    expected = mnd.npartite_matching(weights, maximize=True)
+    np.testing.assert_allclose(weights[result].sum(), weights[expected].sum())
+    assert solver.exact
+    assert solver.gap == 0.0
+
+
+def test_solve_minimize():
+    weights = np.random.default_rng(1).random((5, 5, 5))
+    solver = AssignmentSolver()
+    minimum = solver.solve(weights, maximize=False)
+    exact = AssignmentSolver._solve_exact(weights)
+    np.testing.assert_allclose(weights[minimum].sum(), weights[exact].sum())
+
+
+def test_milp_fallback():
+    weights = np.random.default_rng(2).random((6, 6, 6))
+    solver = AssignmentSolver(max_iterations=1, local_search=False)
+    result = solver.solve(weights)
+    expected = AssignmentSolver._solve_exact(-weights)
+    np.testing.assert_allclose(weights[result].sum(), weights[expected].sum())
+    assert solver.exact
+    assert solver.gap == 0.0
+
+
+def test_report_gap():
+    weights = np.random.default_rng(2).random((6, 6, 6))
+    solver = AssignmentSolver(
+        max_iterations=1, local_search=False, exact_fallback=False
+    )
+    result = solver.solve(weights)
+    check_assignment(result, weights.shape)
+    assert solver.gap > solver.gap_tolerance
+    assert not solver.exact
+    np.testing.assert_allclose(
+        solver.gap,
+        (solver.upper_bound - solver.lower_bound)
+        / max(abs(solver.upper_bound), abs(solver.lower_bound)),
+    )
+
+
+@pytest.mark.parametrize("weights", [np.ones(3), np.array([[np.nan, 1.0]])])
+def test_solve_invalid(weights):
+    with pytest.raises(ValueError):
+        AssignmentSolver().solve(weights)
+
+
+def test_solve_empty():
+    result = AssignmentSolver().solve(np.zeros((0, 3, 3)))
+    assert [len(idx) for idx in result] == [0, 0, 0]
+
+
+def test_solve_warm_start():
+    weights = np.random.default_rng(3).random((6, 6, 6))
+    solver = AssignmentSolver()
+    expected = solver.solve(weights)
+    assert solver.relaxed_axis == 2
+    assert solver.multipliers.shape == (6,)
+
+    warm = AssignmentSolver(max_iterations=1, exact_fallback=False)
+    result = warm.solve(
+        weights, initial=expected, multipliers=solver.multipliers
+    )
+    for idx, exp in zip(result, expected):
+        np.testing.assert_array_equal(idx, exp)
+
+
+@pytest.mark.parametrize(
+    "initial",
+    [
+        (np.arange(3), np.arange(3), np.arange(3)),
+        (np.zeros(4, dtype=int), np.arange(4), np.arange(4)),
+        (np.arange(4), np.arange(4), np.arange(1, 5)),
+    ],
+)
+def test_solve_invalid_warm_start(initial):
+    weights = np.random.default_rng(4).random((4, 4, 4))
+    solver = AssignmentSolver()
+    result = solver.solve(weights, initial=initial, multipliers=np.ones(3))
+    expected = AssignmentSolver().solve(weights)
+    np.testing.assert_allclose(weights[result].sum(), weights[expected].sum())
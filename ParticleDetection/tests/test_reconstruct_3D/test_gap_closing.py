@@ -0,0 +1,102 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev, and others
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ParticleDetection.reconstruct_3D.gap_closing import close_gaps
+
+POINTS = ["x1", "y1", "z1", "x2", "y2", "z2"]
+
+
+@pytest.fixture()
+def tracked() -> pd.DataFrame:
+    """Rods moving with constant velocities."""
+    rng = np.random.default_rng(0)
+    n_frames, n_rods = 30, 20
+    centers = rng.uniform(0, 200, (n_rods, 3))
+    velocity = rng.normal(0, 1.0, (n_rods, 3))
+    axis = rng.normal(size=(n_rods, 3))
+    axis *= 2 / np.linalg.norm(axis, axis=1, keepdims=True)
+    frames = np.arange(n_frames)
+    centers = centers + velocity * frames[:, None, None]
+    points = np.concatenate([centers - axis, centers + axis], axis=-1)
+    data = pd.DataFrame(points.reshape(-1, 6), columns=POINTS)
+    data["frame"] = np.repeat(frames, n_rods)
+    data["particle"] = np.tile(np.arange(n_rods), n_frames)
+    data["color"] = "blue"
+    return data
+
+
+def interrupt(
+    data: pd.DataFrame, particle: int, start: int, gap: int, new: int
+) -> pd.DataFrame:
+    """Hides a rod for ``gap`` frames from ``start`` on and continues it as
+    the ``new`` particle afterwards."""
+    data = data.copy()
+    later = (data.particle == particle) & (data.frame >= start)
+    data.loc[later & (data.frame < start + gap), POINTS] = np.nan
+    data.loc[later, "particle"] = new
+    return data
+
+
+def test_close_gaps(tracked: pd.DataFrame):
+    broken = interrupt(tracked, 3, 10, 2, 100)
+    broken = interrupt(broken, 7, 5, 1, 101)
+    # the continued track is interrupted again
+    broken = interrupt(broken, 101, 20, 3, 102)
+    result, costs = close_gaps(broken, max_gap=3, max_distance=5.0)
+    pd.testing.assert_frame_equal(
+        result, broken.assign(particle=tracked.particle)
+    )
+    assert len(costs) == 3
+    assert np.all(costs < 0.1)
+
+
+def test_close_gaps_too_long(tracked: pd.DataFrame):
+    broken = interrupt(tracked, 3, 10, 4, 100)
+    result, costs = close_gaps(broken, max_gap=3, max_distance=5.0)
+    pd.testing.assert_frame_equal(result, broken)
+    assert len(costs) == 0
+
+
+def test_close_gaps_colors(tracked: pd.DataFrame):
+    broken = interrupt(tracked, 3, 10, 2, 100)
+    broken.loc[broken.particle == 100, "color"] = "red"
+    result, costs = close_gaps(broken)
+    pd.testing.assert_frame_equal(result, broken)
+    assert len(costs) == 0
+
+
+def test_close_gaps_unseen(tracked: pd.DataFrame):
+    # unobserved rows of both tracks are kept in the data
+    broken = interrupt(tracked, 3, 10, 2, 100)
+    hidden = broken.loc[broken.particle == 3].copy()
+    hidden.loc[hidden.frame >= 10, POINTS] = np.nan
+    hidden.loc[hidden.frame >= 10, "particle"] = 3
+    before = broken.loc[(broken.particle == 100) & (broken.frame < 10)]
+    before = before.assign(particle=100)
+    before.loc[:, POINTS] = np.nan
+    broken = pd.concat([broken, before], ignore_index=True)
+    broken["unseen"] = broken[POINTS].isna().any(axis=1)
+    broken.loc[broken[POINTS].isna().any(axis=1), POINTS] = 0.0
+
+    result, costs = close_gaps(broken)
+    assert len(costs) == 1
+    assert not result.duplicated(subset=["frame", "particle"]).any()
+    assert set(result.particle) == set(tracked.particle)
+    assert len(result) == len(tracked)
@@ -0,0 +1,122 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev, and others
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+import cv2
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import EXAMPLES
+
+import ParticleDetection.utils.data_loading as dl
+from ParticleDetection.reconstruct_3D.geometry import (
+    project_points,
+    triangulate_points,
+)
+from ParticleDetection.reconstruct_3D.stereo_rig import StereoRig
+
+calibration = dl.load_camera_calibration(EXAMPLES / "gp34.json")
+rig = StereoRig(calibration)
+
+
+@pytest.fixture(scope="module")
+def image_points():
+    # all combinations of detected endpoints, i.e. mostly inconsistent pairs
+    data = pd.read_csv(EXAMPLES / "rods_df_black.csv", index_col=0)
+    data = data.loc[data.frame.isin([505, 506])]
+    cam1 = data[["x1_gp3", "y1_gp3"]].dropna().to_numpy()
+    cam2 = data[["x1_gp4", "y1_gp4"]].dropna().to_numpy()
+    cam1 = rig.undistort(np.repeat(cam1, len(cam2), axis=0), cam=1)
+    cam2 = rig.undistort(np.tile(cam2, (len(cam1) // len(cam2), 1)), cam=2)
+    return cam1, cam2
+
+
+@pytest.mark.parametrize(
+    "dtype, rtol", [(np.float64, 1e-9), (np.float32, 1e-5)]
+)
+def test_triangulate_opencv(image_points, dtype, rtol):
+    cam1, cam2 = image_points
+    expected = cv2.triangulatePoints(rig.P1, rig.P2, cam1.T, cam2.T)
+    expected = (expected[0:3] / expected[3]).T
+
+    result = triangulate_points(rig.P1, rig.P2, cam1, cam2, dtype=dtype)
+    assert result.dtype == dtype
+    errors = np.linalg.norm(result - expected, axis=1)
+    assert (errors <= rtol * np.linalg.norm(expected, axis=1)).all()
+
+
+@pytest.mark.parametrize("cam", [1, 2])
+@pytest.mark.parametrize(
+    "dtype, atol", [(np.float64, 1e-6), (np.float32, 1e-2)]
+)
+def test_project_opencv(image_points, cam, dtype, atol):
+    points = rig.triangulate(*image_points, undistort=False)
+    r, t = (rig.r1, rig.t1) if cam == 1 else (rig.r2, rig.t2)
+    CM, dist = calibration[f"CM{cam}"], calibration[f"dist{cam}"]
+    expected = cv2.projectPoints(points, r, t, CM, dist)[0].squeeze()
+
+    result = project_points(points, r, t, CM, dist, dtype=dtype)
+    assert result.dtype == dtype
+    np.testing.assert_allclose(result, expected, rtol=0, atol=atol)
+
+
+@pytest.mark.parametrize("n_coeffs", [4, 5, 8, 12])
+def test_project_distortion_models(n_coeffs: int):
+    rng = np.random.default_rng(3)
+    points = rng.uniform((-200, -200, 800), (200, 200, 1200), (100, 3))
+    dist = rng.uniform(-0.05, 0.05, n_coeffs)
+    r = cv2.Rodrigues(np.array([0.1, -0.2, 0.05]))[0]
+    t = np.array([10.0, -5.0, 20.0])
+    expected = cv2.projectPoints(points, r, t, calibration["CM1"], dist)[
+        0
+    ].squeeze()
+    result = project_points(points, r, t, calibration["CM1"], dist)
+    np.testing.assert_allclose(result, expected, rtol=0, atol=1e-6)
+
+
+def test_project_unsupported_distortion():
+    with pytest.raises(ValueError):
+        project_points(
+            np.ones((1, 3)), np.eye(3), np.zeros(3), np.eye(3), [0.0] * 14
+        )
+
+
+def test_batch_shapes(image_points):
+    cam1, cam2 = image_points
+    cam1 = cam1[:24].reshape(2, 3, 4, 2)
+    cam2 = cam2[:24].reshape(2, 3, 4, 2)
+    points = triangulate_points(rig.P1, rig.P2, cam1, cam2)
+    assert points.shape == (2, 3, 4, 3)
+    np.testing.assert_allclose(
+        points.reshape(-1, 3),
+        triangulate_points(
+            rig.P1, rig.P2, cam1.reshape(-1, 2), cam2.reshape(-1, 2)
+        ),
+    )
+    projected = project_points(points, rig.r2, rig.t2, calibration["CM2"])
+    assert projected.shape == (2, 3, 4, 2)
+
+    # broadcasting one point against many
+    single = triangulate_points(rig.P1, rig.P2, cam1, cam2[0, 0, 0])
+    assert single.shape == (2, 3, 4, 3)
+
+
+def test_invalid_points():
+    points = triangulate_points(
+        rig.P1, rig.P2, np.full((3, 2), np.nan), np.ones((3, 2))
+    )
+    assert np.isnan(points).all()
+    with pytest.raises(ValueError):
+        triangulate_points(rig.P1, rig.P2, np.ones(2), np.ones(2), dtype=int)
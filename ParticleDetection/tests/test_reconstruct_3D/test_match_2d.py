@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
 
+import shutil
 from pathlib import Path
 
 import numpy as np
@@ -24,6 +25,7 @@ from scipy.spatial.transform import Rotation as R
 
 import ParticleDetection.reconstruct_3D.match2D as m2d
 import ParticleDetection.utils.data_loading as dl
+from ParticleDetection.reconstruct_3D.stereo_rig import StereoRig
 
 
 @pytest.fixture(scope="session")
@@ -33,6 +35,49 @@ def example_data() -> pd.DataFrame:
     return data
 
 
+@pytest.fixture(scope="module")
+def rig() -> StereoRig:
+    return StereoRig.from_files(
+        EXAMPLES / "gp34.json", EXAMPLES / "transformation.json"
+    )
+
+
+@pytest.fixture(scope="module")
+def synthetic_data(rig: StereoRig) -> pd.DataFrame:
+    """Rods projected onto both cameras, with shuffled rods and endpoints on
+    camera 2."""
+    rng = np.random.default_rng(3)
+    n_frames, n_rods = 6, 20
+    centers = rng.uniform(-25, 25, (n_frames, n_rods, 1, 3))
+    directions = rng.normal(size=(n_frames, n_rods, 1, 3))
+    directions /= np.linalg.norm(directions, axis=-1, keepdims=True)
+    lengths = rng.uniform(6, 10, (n_frames, n_rods, 1, 1))
+    points = centers + directions * lengths * np.array([-0.5, 0.5])[:, None]
+
+    cam1 = rig.reproject(points, cam=1, world=True)
+    cam2 = rig.reproject(points, cam=2, world=True)
+    cam1 += rng.normal(0, 0.3, cam1.shape)
+    cam2 += rng.normal(0, 0.3, cam2.shape)
+    order = np.argsort(rng.random((n_frames, n_rods)), axis=1)
+    cam2 = np.take_along_axis(cam2, order[..., None, None], axis=1)
+    flip = rng.random((n_frames, n_rods)) < 0.5
+    cam2[flip] = cam2[flip][:, ::-1]
+
+    data = pd.DataFrame(
+        np.concatenate([cam1.reshape(-1, 4), cam2.reshape(-1, 4)], axis=1),
+        columns=[
+            f"{c}_{cam}"
+            for cam in ("gp3", "gp4")
+            for c in ("x1", "y1", "x2", "y2")
+        ],
+    )
+    data["frame"] = np.repeat(np.arange(n_frames), n_rods)
+    data["seen_gp3"] = 1
+    data["seen_gp4"] = 1
+    data["particle"] = np.tile(np.arange(n_rods), n_frames)
+    return data
+
+
 @pytest.mark.parametrize("rematching", [False, True])
 def test_match_csv_complex(tmp_path: Path, rematching: bool):
     colors = [
@@ -63,6 +108,67 @@ def test_match_csv_complex(tmp_path: Path, rematching: bool):
     assert list(result_df.frame.unique()) == frames
 
 
+@pytest.mark.parametrize("rematching", [False, True])
+def test_match_csv_complex_workers(tmp_path: Path, rematching: bool):
+    colors = ["black", "blue"]
+    frames = list(range(500, 510))
+    for color in colors:
+        shutil.copy(
+            EXAMPLES / "rods_df_black.csv", tmp_path / f"rods_df_{color}.csv"
+        )
+    args = (
+        "gp3",
+        "gp4",
+        frames,
+        EXAMPLES / "gp34.json",
+        EXAMPLES / "transformation.json",
+        rematching,
+    )
+
+    expected = m2d.match_csv_complex(
+        str(tmp_path), str(tmp_path / "serial"), colors, *args
+    )
+    result = m2d.match_csv_complex(
+        str(tmp_path), str(tmp_path / "parallel"), colors, *args, workers=3
+    )
+    np.testing.assert_allclose(result[0], expected[0])
+    np.testing.assert_allclose(result[1], expected[1])
+    for color in colors:
+        pd.testing.assert_frame_equal(
+            pd.read_csv(tmp_path / f"parallel/rods_df_{color}.csv"),
+            pd.read_csv(tmp_path / f"serial/rods_df_{color}.csv"),
+        )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_match_csv_complex_color_generator(tmp_path: Path, workers: int):
+    colors = ["black", "blue"]
+    for color in colors:
+        shutil.copy(
+            EXAMPLES / "rods_df_black.csv", tmp_path / f"rods_df_{color}.csv"
+        )
+    args = (
+        "gp3",
+        "gp4",
+        list(range(505, 508)),
+        EXAMPLES / "gp34.json",
+        EXAMPLES / "transformation.json",
+    )
+    expected = m2d.match_csv_complex(
+        str(tmp_path), str(tmp_path / "list"), colors, *args
+    )
+    result = m2d.match_csv_complex(
+        str(tmp_path),
+        str(tmp_path / "generator"),
+        (color for color in colors),
+        *args,
+        workers=workers,
+    )
+    np.testing.assert_allclose(result[0], expected[0])
+    for color in colors:
+        assert (tmp_path / f"generator/rods_df_{color}.csv").exists()
+
+
 @pytest.mark.parametrize("renumber", [False, True])
 def test_match_complex(
     tmp_path: Path, example_data: pd.DataFrame, renumber: bool
@@ -164,3 +270,217 @@ def test_match_frame(example_data: pd.DataFrame, renumber: bool):
                 assert previous_data.isin(
                     result[0].loc[result[0].particle == particle, col]
                 ).any(axis=None)
+
+
+@pytest.mark.parametrize("renumber", [False, True])
+def test_match_frames(example_data: pd.DataFrame, renumber: bool):
+    frames = [505, 506, 507, 508, 10000]
+    color = "black"
+    calibration = dl.load_camera_calibration(EXAMPLES / "gp34.json")
+    transformation = dl.load_world_transformation(
+        EXAMPLES / "transformation.json"
+    )
+    r1 = np.eye(3)
+    t1 = np.expand_dims(np.array([0.0, 0.0, 0.0]), 1)
+    P1 = (np.vstack((r1.T, t1.T)) @ calibration["CM1"].T).T
+    r2 = calibration["R"]
+    t2 = calibration["T"]
+    P2 = (np.vstack((r2.T, t2.T)) @ calibration["CM2"].T).T
+    rot = R.from_matrix(transformation["rotation"])
+    trans = transformation["translation"]
+    args = (calibration, P1, P2, rot, trans, r1, r2, t1, t2)
+
+    result, costs, lens = m2d.match_frames(
+        example_data,
+        "gp3",
+        "gp4",
+        frames,
+        color,
+        *args,
+        renumber,
+        chunk_size=3,
+    )
+    # Frames without data are omitted from the output
+    assert list(result.frame.unique()) == frames[:-1]
+    assert len(costs) == len(lens) == len(frames) - 1
+
+    for i, frame in enumerate(frames[:-1]):
+        expected = m2d.match_frame(
+            example_data, "gp3", "gp4", frame, color, *args, renumber
+        )
+        result_f = result.loc[result.frame == frame].reset_index(drop=True)
+        pd.testing.assert_frame_equal(
+            result_f, expected[0].reset_index(drop=True)
+        )
+        np.testing.assert_allclose(costs[i], expected[1])
+        np.testing.assert_allclose(lens[i], expected[2])
+
+
+@pytest.mark.parametrize("tolerance", [3.0, 0.0])
+def test_match_frames_gated(
+    synthetic_data: pd.DataFrame, rig: StereoRig, tolerance: float
+):
+    frames = synthetic_data.frame.unique()
+    expected = m2d.match_frames(
+        synthetic_data, "gp3", "gp4", frames, "black", rig
+    )
+    # no candidates at all with tolerance=0.0, i.e. all frames fall back to
+    # using all rod combinations
+    result = m2d.match_frames(
+        synthetic_data,
+        "gp3",
+        "gp4",
+        frames,
+        "black",
+        rig,
+        chunk_size=4,
+        epipolar_tolerance=tolerance,
+    )
+    pd.testing.assert_frame_equal(result[0], expected[0])
+    for costs, expected_costs in zip(result[1], expected[1]):
+        np.testing.assert_allclose(costs, expected_costs)
+
+
+def test_match_frames_rod_length(synthetic_data: pd.DataFrame, rig: StereoRig):
+    frames = synthetic_data.frame.unique()
+    result, _, lens = m2d.match_frames(
+        synthetic_data,
+        "gp3",
+        "gp4",
+        frames,
+        "black",
+        rig,
+        epipolar_tolerance=3.0,
+        rod_length=(5.5, 10.5),
+    )
+    assert len(result) == len(synthetic_data)
+    lens = np.concatenate(lens)
+    assert ((lens >= 5.5) & (lens <= 10.5)).all()
+
+
+def test_match_frames_float32(synthetic_data: pd.DataFrame, rig: StereoRig):
+    frames = synthetic_data.frame.unique()
+    expected, expected_costs, _ = m2d.match_frames(
+        synthetic_data, "gp3", "gp4", frames, "black", rig
+    )
+    result, costs, _ = m2d.match_frames(
+        synthetic_data, "gp3", "gp4", frames, "black", rig, dtype=np.float32
+    )
+    pd.testing.assert_frame_equal(result, expected, rtol=1e-4, atol=1e-3)
+    np.testing.assert_allclose(
+        np.concatenate(costs), np.concatenate(expected_costs), atol=1e-2
+    )
+
+
+def test_triangulate_rods(example_data: pd.DataFrame, rig: StereoRig):
+    frame = 508
+    cols_cam1 = ["x1_gp3", "y1_gp3", "x2_gp3", "y2_gp3"]
+    cols_cam2 = ["x1_gp4", "y1_gp4", "x2_gp4", "y2_gp4"]
+    cols_3d = ["x1", "y1", "z1", "x2", "y2", "z2", "x", "y", "z", "l"]
+    expected, expected_costs, _ = m2d.match_frame(
+        example_data, "gp3", "gp4", frame, "black", rig, renumber=False
+    )
+    data = example_data.loc[example_data.frame == frame]
+    data = data.set_index("particle").loc[expected.particle]
+    result, costs = m2d.triangulate_rods(
+        data[cols_cam1].to_numpy(), data[cols_cam2].to_numpy(), rig
+    )
+    np.testing.assert_allclose(result, expected[cols_3d].to_numpy())
+    np.testing.assert_allclose(costs, expected_costs)
+
+    # single rod
+    result, costs = m2d.triangulate_rods(
+        data[cols_cam1].to_numpy()[3], data[cols_cam2].to_numpy()[3], rig
+    )
+    assert result.shape == (1, 10)
+    np.testing.assert_allclose(result[0], expected[cols_3d].to_numpy()[3])
+
+
+def test_reorder_endpoints(example_data: pd.DataFrame):
+    frames = list(range(500, 511))
+    pairs = [
+        (f"{c}1{cam}", f"{c}2{cam}")
+        for cam in ("", "_gp3", "_gp4")
+        for c in ("x", "y", "z")
+        if not (cam and c == "z")
+    ]
+    expected, expected_costs = m2d.reorder_endpoints(
+        example_data, "gp3", "gp4", frames
+    )
+    assert expected_costs.shape == (25, len(frames) - 1)
+
+    # randomly swapped endpoints must be restored
+    data = example_data.copy()
+    swap = np.random.default_rng(5).random(len(data)) < 0.5
+    swap[data.frame == frames[0]] = False
+    for col1, col2 in pairs:
+        values1 = data[col1].to_numpy(copy=True)
+        data[col1] = np.where(swap, data[col2], values1)
+        data[col2] = np.where(swap, values1, data[col2])
+    result, costs = m2d.reorder_endpoints(data, "gp3", "gp4", frames)
+    pd.testing.assert_frame_equal(result, expected)
+    np.testing.assert_array_equal(costs, expected_costs)
+
+
+def test_reorder_endpoints_particle_ids(example_data: pd.DataFrame):
+    frames = list(range(500, 511))
+    expected, expected_costs = m2d.reorder_endpoints(
+        example_data, "gp3", "gp4", frames
+    )
+    # large and negative particle numbers, in the same order as before
+    data = example_data.copy()
+    data["particle"] = data["particle"] * 10**9 - 5
+    result, costs = m2d.reorder_endpoints(data, "gp3", "gp4", frames)
+    np.testing.assert_array_equal(costs, expected_costs)
+    expected["particle"] = expected["particle"] * 10**9 - 5
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_reorder_endpoints_costs():
+    # one rod moving along x, its endpoints are swapped in frame 2
+    ends = np.array([[0.0, 1.0], [0.1, 1.1], [1.2, 0.2], [0.3, 1.3]])
+    data = pd.DataFrame(
+        {
+            "x1": ends[:, 0],
+            "y1": 0.0,
+            "z1": 0.0,
+            "x2": ends[:, 1],
+            "y2": 0.0,
+            "z2": 0.0,
+            "x1_gp1": ends[:, 0],
+            "y1_gp1": 0.0,
+            "x2_gp1": ends[:, 1],
+            "y2_gp1": 0.0,
+            "x1_gp2": ends[:, 0],
+            "y1_gp2": 0.0,
+            "x2_gp2": ends[:, 1],
+            "y2_gp2": 0.0,
+            "frame": [0, 1, 2, 3],
+            "particle": 0,
+        }
+    )
+    result, costs = m2d.reorder_endpoints(data)
+    np.testing.assert_allclose(result.x1, [0.0, 0.1, 0.2, 0.3])
+    np.testing.assert_allclose(result.x2_gp2, [1.0, 1.1, 1.2, 1.3])
+    np.testing.assert_allclose(costs, [[0.2, 0.2, 0.2]])
+
+    # without a counterpart in the previous frame, nothing is swapped
+    result, costs = m2d.reorder_endpoints(
+        data.drop(index=1), frame_numbers=[0, 1, 2, 3]
+    )
+    np.testing.assert_allclose(result.x1, [0.0, 1.2, 1.3])
+    np.testing.assert_allclose(costs, [[0.0, 0.0, 0.2]])
+
+
+def test_reorder_endpoints_csv(tmp_path: Path, example_data: pd.DataFrame):
+    frames = list(range(500, 511))
+    costs = m2d.reorder_endpoints_csv(
+        str(EXAMPLES), str(tmp_path), ["black"], "gp3", "gp4", frames
+    )
+    expected, expected_costs = m2d.reorder_endpoints(
+        example_data, "gp3", "gp4", frames
+    )
+    np.testing.assert_array_equal(costs, expected_costs)
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / "rods_df_black.csv", index_col=0), expected
+    )
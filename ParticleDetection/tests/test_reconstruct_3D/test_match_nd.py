@@ -14,16 +14,23 @@
 # You should have received a copy of the GNU General Public License
 # along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import shutil
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
+import pulp
 import pytest
 from conftest import EXAMPLES
 from scipy.spatial.transform import Rotation as R
 
+import ParticleDetection.reconstruct_3D.match2D as m2d
 import ParticleDetection.reconstruct_3D.matchND as mnd
 import ParticleDetection.utils.data_loading as dl
+from ParticleDetection.reconstruct_3D.assignment import AssignmentSolver
+from ParticleDetection.reconstruct_3D.prediction import ConstantVelocityFilter
+from ParticleDetection.reconstruct_3D.stereo_rig import StereoRig
 
 
 @pytest.fixture(scope="session")
@@ -65,6 +72,30 @@ def test_create_weights(dimensions):
     assert result[1].shape == (previous_dim, cam1_dim, cam2_dim)
 
 
+@pytest.mark.parametrize("chunk_elements", [1, 100, 2**22])
+def test_create_weights_values(monkeypatch, chunk_elements):
+    rng = np.random.default_rng(1)
+    p_3D = rng.random((4, 5, 4, 3))
+    p_3D_prev = rng.random((6, 2, 3))
+    repr_errs = rng.random((4, 5, 4, 2))
+    # endpoint combinations (of p_3D) matched to the previous endpoints
+    combos = [(0, 3), (1, 2), (2, 1), (3, 0)]
+    errs = [(0, 3), (1,), (1,), (0, 3)]
+    expected = np.zeros((6, 4, 5, 4))
+    for i, j, k in np.ndindex(expected.shape[:3]):
+        for c, (first, second) in enumerate(combos):
+            expected[i, j, k, c] = (
+                np.linalg.norm(p_3D[j, k, first] - p_3D_prev[i, 0])
+                + np.linalg.norm(p_3D[j, k, second] - p_3D_prev[i, 1])
+            ) * np.sum(repr_errs[j, k, list(errs[c])])
+
+    monkeypatch.setattr(mnd, "_WEIGHTS_CHUNK_ELEMENTS", chunk_elements)
+    weights, point_choices = mnd.create_weights(p_3D, p_3D_prev, repr_errs)
+    costs = np.min(expected, axis=-1)
+    np.testing.assert_allclose(weights, np.max(costs) - costs)
+    np.testing.assert_array_equal(point_choices, np.argmin(expected, axis=-1))
+
+
 def test_assign(tmp_path: Path):
     colors = [
         "black",
@@ -93,6 +124,59 @@ def test_assign(tmp_path: Path):
     assert list(result_df.frame.unique()) == frames
 
 
+def test_assign_workers(tmp_path: Path):
+    colors = ["black", "blue"]
+    frames = list(range(505, 508))
+    for color in colors:
+        shutil.copy(
+            EXAMPLES / "rods_df_black.csv", tmp_path / f"rods_df_{color}.csv"
+        )
+    args = (
+        "gp3",
+        "gp4",
+        frames,
+        EXAMPLES / "gp34.json",
+        EXAMPLES / "transformation.json",
+    )
+
+    expected = mnd.assign(
+        str(tmp_path), str(tmp_path / "serial"), colors, *args
+    )
+    result = mnd.assign(
+        str(tmp_path), str(tmp_path / "parallel"), colors, *args, workers=2
+    )
+    np.testing.assert_allclose(result[0], expected[0])
+    np.testing.assert_allclose(result[1], expected[1])
+    for color in colors:
+        pd.testing.assert_frame_equal(
+            pd.read_csv(tmp_path / f"parallel/rods_df_{color}.csv"),
+            pd.read_csv(tmp_path / f"serial/rods_df_{color}.csv"),
+        )
+
+
+@pytest.mark.parametrize("colors", [[], ["black"], ["black", "blue"]])
+def test_assign_workers_color_generator(tmp_path: Path, colors: list):
+    for color in colors:
+        shutil.copy(
+            EXAMPLES / "rods_df_black.csv", tmp_path / f"rods_df_{color}.csv"
+        )
+    result = mnd.assign(
+        str(tmp_path),
+        str(tmp_path / "output"),
+        (color for color in colors),
+        "gp3",
+        "gp4",
+        list(range(505, 507)),
+        EXAMPLES / "gp34.json",
+        EXAMPLES / "transformation.json",
+        workers=2,
+    )
+    assert len(result[0]) == 2 * len(colors)
+    assert sorted(f.name for f in (tmp_path / "output").iterdir()) == [
+        f"rods_df_{color}.csv" for color in colors
+    ]
+
+
 def test_match_frame_nd(example_data: pd.DataFrame):
     frame = 507
     color = "black"
@@ -138,3 +222,490 @@ def test_match_frame_nd(example_data: pd.DataFrame):
     assert len(result[0]) == input_len
     assert result[1].shape == (input_len,)
     assert result[2].shape == (input_len,)
+
+
+def test_match_frame_nd_assignment_solver(example_data: pd.DataFrame):
+    calibration = dl.load_camera_calibration(EXAMPLES / "gp34.json")
+    transformation = dl.load_world_transformation(
+        EXAMPLES / "transformation.json"
+    )
+    rig = StereoRig(calibration, transformation)
+    args = (example_data, example_data, "gp3", "gp4", 507, "black", rig)
+    expected = mnd.match_frame(*args)
+    result = mnd.match_frame(*args, solver=AssignmentSolver())
+    pd.testing.assert_frame_equal(result[0], expected[0])
+    np.testing.assert_array_equal(result[1], expected[1])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_assign_assignment_solver(tmp_path: Path, workers: int):
+    colors = ["black", "blue"]
+    for color in colors:
+        shutil.copy(
+            EXAMPLES / "rods_df_black.csv", tmp_path / f"rods_df_{color}.csv"
+        )
+    args = (
+        "gp3",
+        "gp4",
+        list(range(505, 508)),
+        EXAMPLES / "gp34.json",
+        EXAMPLES / "transformation.json",
+    )
+    expected = mnd.assign(str(tmp_path), str(tmp_path / "pulp"), colors, *args)
+    result = mnd.assign(
+        str(tmp_path),
+        str(tmp_path / "native"),
+        colors,
+        *args,
+        solver=AssignmentSolver(),
+        workers=workers,
+    )
+    np.testing.assert_allclose(result[0], expected[0])
+    for color in colors:
+        pd.testing.assert_frame_equal(
+            pd.read_csv(tmp_path / f"native/rods_df_{color}.csv"),
+            pd.read_csv(tmp_path / f"pulp/rods_df_{color}.csv"),
+        )
+
+
+@pytest.mark.parametrize("solver", [None, AssignmentSolver()])
+@pytest.mark.parametrize(
+    "limits", [{"candidates": 3}, {"max_displacement": 0.01}]
+)
+def test_match_frame_nd_sparse(
+    example_data: pd.DataFrame, solver: AssignmentSolver, limits: dict
+):
+    calibration = dl.load_camera_calibration(EXAMPLES / "gp34.json")
+    transformation = dl.load_world_transformation(
+        EXAMPLES / "transformation.json"
+    )
+    rig = StereoRig(calibration, transformation)
+    args = (example_data, example_data, "gp3", "gp4", 507, "black", rig)
+    kwargs = {} if solver is None else {"solver": solver}
+    expected = mnd.match_frame(*args)
+    result = mnd.match_frame(*args, **kwargs, **limits)
+    pd.testing.assert_frame_equal(result[0], expected[0])
+    np.testing.assert_array_equal(result[1], expected[1])
+
+
+@pytest.mark.parametrize("solver", [None, AssignmentSolver()])
+@pytest.mark.parametrize(
+    "limits",
+    [
+        {"candidates": 1},
+        {"max_displacement": 1e-6},
+        {"candidates": 1, "max_displacement": 1e-6},
+    ],
+)
+def test_match_frame_nd_sparse_relaxed(
+    example_data: pd.DataFrame, solver: AssignmentSolver, limits: dict
+):
+    calibration = dl.load_camera_calibration(EXAMPLES / "gp34.json")
+    args = (example_data, example_data, "gp3", "gp4", 507, "black")
+    kwargs = {} if solver is None else {"solver": solver}
+    expected = mnd.match_frame(*args, calibration)[0]
+    result = mnd.match_frame(*args, calibration, **kwargs, **limits)[0]
+    # the limits are relaxed until every rod is assigned a rod pair
+    assert len(result) == len(expected)
+    for cam in ["gp3", "gp4"]:
+        cols = [f"x1_{cam}", f"y1_{cam}", f"x2_{cam}", f"y2_{cam}"]
+        pd.testing.assert_frame_equal(
+            result[cols].sort_values(cols, ignore_index=True),
+            expected[cols].sort_values(cols, ignore_index=True),
+        )
+
+
+@pytest.mark.parametrize(
+    "limits", [{"candidates": 0}, {"max_displacement": 0}]
+)
+def test_match_frame_nd_sparse_invalid(
+    example_data: pd.DataFrame, limits: dict
+):
+    calibration = dl.load_camera_calibration(EXAMPLES / "gp34.json")
+    args = (example_data, example_data, "gp3", "gp4", 507, "black")
+    with pytest.raises(ValueError):
+        mnd.match_frame(*args, calibration, **limits)
+
+
+@pytest.mark.parametrize("solver", [None, AssignmentSolver()])
+def test_sparse_npartite_matching(solver: AssignmentSolver):
+    weights = np.random.default_rng(0).random((5, 6, 7))
+    expected = mnd.npartite_matching(weights.max() - weights)
+    # keep the optimum and a random subset of the other combinations
+    keep = np.random.default_rng(1).random(weights.shape) < 0.3
+    keep[expected] = True
+    indices = np.stack(np.nonzero(keep))
+    kwargs = {} if solver is None else {"solver": solver}
+    chosen = mnd.sparse_npartite_matching(
+        indices, weights[keep], weights.shape, **kwargs
+    )
+    for result, idx in zip(indices[:, chosen], expected):
+        np.testing.assert_array_equal(result, idx)
+
+
+@pytest.mark.parametrize("solver", [None, AssignmentSolver()])
+def test_sparse_npartite_matching_infeasible(solver: AssignmentSolver):
+    # both members of the first group only have candidates with member 0 of
+    # the other groups
+    indices = np.array([[0, 1], [0, 0], [0, 0]])
+    kwargs = {} if solver is None else {"solver": solver}
+    assert (
+        mnd.sparse_npartite_matching(indices, np.ones(2), (2, 2, 2), **kwargs)
+        is None
+    )
+
+
+def test_create_sparse_weights():
+    rng = np.random.default_rng(0)
+    p_3D = rng.random((6, 7, 4, 3))
+    p_3D_prev = rng.random((5, 2, 3))
+    repr_errs = rng.random((6, 7, 4, 2))
+    weights, choices = mnd.create_weights(p_3D, p_3D_prev, repr_errs)
+
+    indices, costs, point_choices = mnd.create_sparse_weights(
+        p_3D, p_3D_prev, repr_errs, candidates=4
+    )
+    assert indices.shape == (3, 5 * 4)
+    np.testing.assert_array_equal(np.bincount(indices[0]), [4] * 5)
+    # weights are the maximum cost minus the cost
+    assert np.ptp(costs + weights[tuple(indices)]) < 1e-12
+    np.testing.assert_array_equal(point_choices, choices[tuple(indices)])
+
+    indices, costs, _ = mnd.create_sparse_weights(
+        p_3D, p_3D_prev, repr_errs, max_displacement=np.inf
+    )
+    assert indices.shape == (3, 5 * 6 * 7)
+    with pytest.raises(ValueError):
+        mnd.create_sparse_weights(p_3D, p_3D_prev, repr_errs)
+
+
+@pytest.mark.parametrize(
+    "solver", [pulp.PULP_CBC_CMD(msg=False), AssignmentSolver()]
+)
+@pytest.mark.parametrize("candidates", [None, 4])
+def test_frame_tracker(example_data: pd.DataFrame, solver, candidates):
+    calibration = dl.load_camera_calibration(EXAMPLES / "gp34.json")
+    transformation = dl.load_world_transformation(
+        EXAMPLES / "transformation.json"
+    )
+    rig = StereoRig(calibration, transformation)
+    tracker = mnd.FrameTracker(solver, candidates=candidates)
+    assert np.isnan(tracker.hit_rate)
+    expected = m2d.match_frame(
+        example_data, "gp3", "gp4", 500, "black", rig, renumber=True
+    )[0]
+    result = expected
+    for frame in range(501, 505):
+        args = (example_data, "gp3", "gp4", frame, "black", rig)
+        expected = mnd.match_frame(args[0], expected, *args[1:])[0]
+        result = mnd.match_frame(args[0], result, *args[1:], tracker=tracker)
+        pd.testing.assert_frame_equal(result[0], expected)
+        result = result[0]
+    assert tracker.frames == 4
+    # the first frame has no assignment to start from
+    assert tracker.warm_starts == 3
+    assert tracker.hits == 3
+    assert tracker.hit_rate == 1.0
+
+
+def test_frame_tracker_pulp_warm_start():
+    solver = pulp.PULP_CBC_CMD(msg=False)
+    tracker = mnd.FrameTracker(solver)
+    assert tracker.solver is not solver
+    assert tracker.solver.optionsDict["warmStart"]
+    assert not solver.optionsDict.get("warmStart", False)
+    assert mnd.FrameTracker(solver, warm_start=False).solver is solver
+
+
+@pytest.mark.parametrize(
+    "limits", [{"candidates": 0}, {"max_displacement": 0}]
+)
+def test_frame_tracker_invalid(limits: dict):
+    with pytest.raises(ValueError):
+        mnd.FrameTracker(**limits)
+
+
+def test_frame_tracker_predictor(example_data: pd.DataFrame):
+    calibration = dl.load_camera_calibration(EXAMPLES / "gp34.json")
+    transformation = dl.load_world_transformation(
+        EXAMPLES / "transformation.json"
+    )
+    rig = StereoRig(calibration, transformation)
+    predictor = ConstantVelocityFilter()
+    tracker = mnd.FrameTracker(
+        AssignmentSolver(), candidates=2, predictor=predictor
+    )
+    expected = m2d.match_frame(
+        example_data, "gp3", "gp4", 500, "black", rig, renumber=True
+    )[0]
+    result = expected
+    for frame in range(501, 505):
+        args = (example_data, "gp3", "gp4", frame, "black", rig)
+        expected = mnd.match_frame(args[0], expected, *args[1:])[0]
+        result = mnd.match_frame(args[0], result, *args[1:], tracker=tracker)
+        pd.testing.assert_frame_equal(result[0], expected)
+        result = result[0]
+        np.testing.assert_allclose(
+            predictor.positions,
+            result[["x1", "y1", "z1", "x2", "y2", "z2"]]
+            .to_numpy()
+            .reshape(-1, 2, 3),
+            atol=1.0,
+        )
+    assert len(predictor) == len(result)
+
+
+@pytest.fixture(scope="module")
+def example_rig() -> StereoRig:
+    calibration = dl.load_camera_calibration(EXAMPLES / "gp34.json")
+    transformation = dl.load_world_transformation(
+        EXAMPLES / "transformation.json"
+    )
+    return StereoRig(calibration, transformation)
+
+
+def test_track_csv(tmp_path: Path, example_rig: StereoRig):
+    frames = list(range(500, 505))
+    expected = mnd.assign(
+        str(EXAMPLES),
+        str(tmp_path / "assign"),
+        ["black"],
+        "gp3",
+        "gp4",
+        frames,
+        rig=example_rig,
+        solver=AssignmentSolver(),
+    )
+    result = list(
+        mnd.track_csv(
+            EXAMPLES / "rods_df_black.csv",
+            tmp_path / "result.csv",
+            "black",
+            "gp3",
+            "gp4",
+            example_rig,
+            frames,
+            mnd.FrameTracker(AssignmentSolver()),
+            chunk_size=17,
+            flush_interval=2,
+            progress=False,
+        )
+    )
+    assert [frame for frame, _, _ in result] == frames
+    np.testing.assert_allclose(
+        np.stack([costs for _, costs, _ in result]), expected[0]
+    )
+    assert (tmp_path / "result.csv").read_text() == (
+        tmp_path / "assign/rods_df_black.csv"
+    ).read_text()
+    assert not (tmp_path / "result.csv.checkpoint").exists()
+
+
+@pytest.mark.parametrize("interrupt", [1, 3, 4])
+def test_track_csv_resume(
+    tmp_path: Path, example_rig: StereoRig, interrupt: int
+):
+    args = (
+        EXAMPLES / "rods_df_black.csv",
+        tmp_path / "result.csv",
+        "black",
+        "gp3",
+        "gp4",
+        example_rig,
+        range(500, 506),
+    )
+    kwargs = {"flush_interval": 2, "progress": False}
+    expected = list(
+        mnd.track_csv(args[0], tmp_path / "expected.csv", *args[2:], **kwargs)
+    )
+
+    # crash after some frames
+    tracking = mnd.track_csv(*args, **kwargs)
+    for _ in range(interrupt):
+        next(tracking)
+    tracking.close()
+    assert (tmp_path / "result.csv.checkpoint").exists() == (interrupt >= 2)
+
+    result = list(mnd.track_csv(*args, resume=True, **kwargs))
+    resumed = 2 * (interrupt // 2)
+    assert [r[0] for r in result] == [e[0] for e in expected[resumed:]]
+    for res, exp in zip(result, expected[resumed:]):
+        np.testing.assert_allclose(res[1], exp[1])
+    assert (tmp_path / "result.csv").read_text() == (
+        tmp_path / "expected.csv"
+    ).read_text()
+    assert not (tmp_path / "result.csv.checkpoint").exists()
+
+
+def test_track_csv_unordered(tmp_path: Path, example_data: pd.DataFrame):
+    data = example_data.loc[example_data.frame.isin([500, 501])]
+    data.iloc[::-1].to_csv(tmp_path / "rods_df_black.csv")
+    tracking = mnd.track_csv(
+        tmp_path / "rods_df_black.csv",
+        tmp_path / "result.csv",
+        "black",
+        "gp3",
+        "gp4",
+        None,
+        progress=False,
+    )
+    with pytest.raises(ValueError):
+        next(tracking)
+
+
+@pytest.fixture(scope="module")
+def synthetic_folder(tmp_path_factory, example_rig: StereoRig) -> Path:
+    """Rods moving slowly, projected onto both cameras, with shuffled rods
+    on camera 2."""
+    rng = np.random.default_rng(5)
+    n_frames, n_rods = 16, 15
+    centers = rng.uniform(-25, 25, (1, n_rods, 1, 3)) + np.cumsum(
+        rng.normal(0, 0.5, (n_frames, n_rods, 1, 3)), axis=0
+    )
+    directions = rng.normal(size=(1, n_rods, 1, 3)) + np.cumsum(
+        rng.normal(0, 0.05, (n_frames, n_rods, 1, 3)), axis=0
+    )
+    directions /= np.linalg.norm(directions, axis=-1, keepdims=True)
+    points = centers + directions * 8 * np.array([-0.5, 0.5])[:, None]
+
+    cam1 = example_rig.reproject(points, cam=1, world=True)
+    cam2 = example_rig.reproject(points, cam=2, world=True)
+    cam1 += rng.normal(0, 0.3, cam1.shape)
+    cam2 += rng.normal(0, 0.3, cam2.shape)
+    order = np.argsort(rng.random((n_frames, n_rods)), axis=1)
+    cam2 = np.take_along_axis(cam2, order[..., None, None], axis=1)
+
+    data = pd.DataFrame(
+        np.concatenate([cam1.reshape(-1, 4), cam2.reshape(-1, 4)], axis=1),
+        columns=[
+            f"{c}_{cam}"
+            for cam in ("gp3", "gp4")
+            for c in ("x1", "y1", "x2", "y2")
+        ],
+    )
+    data["frame"] = np.repeat(np.arange(n_frames), n_rods)
+    data["seen_gp3"] = 1
+    data["seen_gp4"] = 1
+    data["color"] = "black"
+    data["particle"] = np.tile(np.arange(n_rods), n_frames)
+    folder = tmp_path_factory.mktemp("synthetic")
+    data.to_csv(folder / "rods_df_black.csv")
+    return folder
+
+
+@pytest.mark.parametrize(
+    "shard_size,overlap,workers", [(5, 2, 1), (4, 1, 2), (16, 2, 1)]
+)
+def test_assign_sharded(
+    tmp_path: Path,
+    synthetic_folder: Path,
+    example_rig: StereoRig,
+    caplog,
+    shard_size: int,
+    overlap: int,
+    workers: int,
+):
+    args = (["black"], "gp3", "gp4")
+    kwargs = {"rig": example_rig, "solver": AssignmentSolver()}
+    expected = mnd.assign(
+        str(synthetic_folder), str(tmp_path / "seq"), *args, **kwargs
+    )
+    with caplog.at_level("INFO", logger=mnd.__name__):
+        result = mnd.assign(
+            str(synthetic_folder),
+            str(tmp_path / "sharded"),
+            *args,
+            shard_size=shard_size,
+            overlap=overlap,
+            workers=workers,
+            **kwargs,
+        )
+    assert "0 rods disagreeing" in caplog.text
+    np.testing.assert_allclose(result[0], expected[0])
+    np.testing.assert_allclose(result[1], expected[1])
+    assert os.listdir(tmp_path / "sharded") == ["rods_df_black.csv"]
+    assert (tmp_path / "sharded/rods_df_black.csv").read_text() == (
+        tmp_path / "seq/rods_df_black.csv"
+    ).read_text()
+
+
+def test_assign_sharded_disagreements(
+    tmp_path: Path, example_rig: StereoRig, caplog
+):
+    frames = list(range(500, 511))
+    with caplog.at_level("WARNING", logger=mnd.__name__):
+        result = mnd.assign(
+            str(EXAMPLES),
+            str(tmp_path),
+            ["black"],
+            "gp3",
+            "gp4",
+            frames,
+            rig=example_rig,
+            solver=AssignmentSolver(),
+            shard_size=4,
+        )
+    # the 2D matching of a shard's first frame differs from the tracked one
+    assert "rods disagreeing at the shard boundaries" in caplog.text
+    assert result[0].shape == (11, 25)
+    result_df = pd.read_csv(tmp_path / "rods_df_black.csv", index_col=0)
+    assert list(result_df.frame.unique()) == frames
+    for _, particles in result_df.groupby("frame").particle:
+        assert len(np.unique(particles)) == 25
+
+
+def test_assign_sharded_invalid(tmp_path: Path, example_rig: StereoRig):
+    args = (str(EXAMPLES), str(tmp_path), ["black"], "gp3", "gp4", [500])
+    with pytest.raises(ValueError):
+        mnd.assign(*args, rig=example_rig, shard_size=2, resume=True)
+    with pytest.raises(ValueError):
+        mnd.assign(*args, rig=example_rig, shard_size=2, overlap=2)
+
+
+@pytest.mark.parametrize("workers,prefetch", [(1, 0), (2, 3)])
+def test_frame_geometries(
+    example_data: pd.DataFrame,
+    example_rig: StereoRig,
+    workers: int,
+    prefetch: int,
+):
+    frames = list(range(501, 506))
+    result = list(
+        mnd.frame_geometries(
+            example_data, "gp3", "gp4", frames, example_rig, workers, prefetch
+        )
+    )
+    assert [frame for frame, _ in result] == frames
+    for frame, geometry in result:
+        expected = mnd.frame_geometry(
+            example_data, "gp3", "gp4", frame, example_rig
+        )
+        for field in (
+            "rods_cam1",
+            "rods_cam2",
+            "points",
+            "repr_errs",
+            "costs",
+        ):
+            np.testing.assert_array_equal(
+                getattr(geometry, field), getattr(expected, field)
+            )
+    assert mnd.frame_geometry(example_data, "gp3", "gp4", 0, example_rig) is (
+        None
+    )
+
+
+def test_match_frame_nd_geometry(
+    example_data: pd.DataFrame, example_rig: StereoRig
+):
+    previous = m2d.match_frame(
+        example_data, "gp3", "gp4", 500, "black", example_rig, renumber=True
+    )[0]
+    args = (example_data, previous, "gp3", "gp4", 501, "black", example_rig)
+    geometry = mnd.frame_geometry(example_data, "gp3", "gp4", 501, example_rig)
+    expected = mnd.match_frame(*args, solver=AssignmentSolver())
+    result = mnd.match_frame(
+        *args, solver=AssignmentSolver(), geometry=geometry
+    )
+    pd.testing.assert_frame_equal(result[0], expected[0])
+    np.testing.assert_array_equal(result[1], expected[1])
@@ -0,0 +1,74 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev, and others
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+
+from ParticleDetection.reconstruct_3D.prediction import ConstantVelocityFilter
+
+
+def rod_poses(frame: int) -> np.ndarray:
+    """Two rods moving with constant velocity, one of them rotating."""
+    centers = np.array([[0.0, 1.0, 2.0], [5.0, 5.0, 5.0]])
+    centers += frame * np.array([[0.5, 0.0, 0.1], [-0.2, 0.3, 0.0]])
+    angle = 0.05 * frame
+    axes = np.array([[np.cos(angle), np.sin(angle), 0.0], [0.0, 0.0, 1.0]])
+    return np.stack([centers - axes, centers + axes], axis=1)
+
+
+def test_initialize():
+    kf = ConstantVelocityFilter()
+    assert len(kf) == 0
+    kf.initialize(rod_poses(0))
+    assert len(kf) == 2
+    np.testing.assert_allclose(kf.positions, rod_poses(0))
+    np.testing.assert_array_equal(kf.velocity, 0.0)
+    np.testing.assert_allclose(kf.predict(), rod_poses(0))
+
+
+def test_predict():
+    kf = ConstantVelocityFilter(
+        process_noise=1e-6, rotation_noise=1e-6, measurement_noise=1e-6
+    )
+    kf.initialize(rod_poses(0))
+    for frame in range(1, 20):
+        kf.predict()
+        points = rod_poses(frame)
+        # the endpoint order is irrelevant
+        points[frame % 2] = points[frame % 2, ::-1]
+        kf.update(points)
+    np.testing.assert_allclose(
+        kf.velocity, [[0.5, 0.0, 0.1], [-0.2, 0.3, 0.0]], atol=1e-6
+    )
+    np.testing.assert_allclose(
+        kf.angular_velocity, [[0.0, 0.0, 0.05], [0.0, 0.0, 0.0]], atol=2e-3
+    )
+    np.testing.assert_allclose(kf.predict(), rod_poses(20), atol=5e-3)
+
+
+def test_update_unobserved():
+    kf = ConstantVelocityFilter()
+    kf.initialize(rod_poses(0))
+    predicted = kf.predict()
+    points = rod_poses(1)
+    points[1] = np.nan
+    kf.update(points)
+    np.testing.assert_allclose(kf.positions[1], predicted[1])
+    assert not np.allclose(kf.positions[0], predicted[0])
+
+    kf.update(rod_poses(1), observed=[False, False])
+    with pytest.raises(ValueError):
+        kf.update(rod_poses(1)[:1])
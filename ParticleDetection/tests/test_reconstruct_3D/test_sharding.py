@@ -0,0 +1,68 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev, and others
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+
+from ParticleDetection.reconstruct_3D.sharding import (
+    shard_ranges,
+    stitch_tracks,
+)
+
+
+@pytest.fixture()
+def points() -> np.ndarray:
+    # (frame, track, end-point, coord)
+    return np.random.default_rng(0).uniform(0, 100, (3, 10, 2, 3))
+
+
+def test_shard_ranges():
+    ranges = shard_ranges(10, 4, 2)
+    assert ranges == [(0, 0, 4), (2, 4, 8), (6, 8, 10)]
+    assert shard_ranges(0, 4, 2) == []
+
+
+@pytest.mark.parametrize("overlap", [0, 4, 5])
+def test_shard_ranges_invalid(overlap: int):
+    with pytest.raises(ValueError):
+        shard_ranges(10, 4, overlap)
+
+
+def test_stitch_tracks(points: np.ndarray):
+    order = np.random.default_rng(1).permutation(10)
+    shuffled = points[:, order]
+    # the orientation of a rod is irrelevant
+    shuffled[:, ::2] = shuffled[:, ::2, ::-1]
+    mapping, disagreements = stitch_tracks(points, shuffled)
+    np.testing.assert_array_equal(mapping, order)
+    assert disagreements == 0
+
+
+def test_stitch_tracks_disagreements(points: np.ndarray):
+    shuffled = points[:, ::-1].copy()
+    # two rods are swapped in one frame, one is missing in another
+    shuffled[1, [0, 1]] = shuffled[1, [1, 0]]
+    shuffled[2, 5] = np.nan
+    mapping, disagreements = stitch_tracks(points, shuffled)
+    np.testing.assert_array_equal(mapping, np.arange(10)[::-1])
+    assert disagreements == 3
+
+
+def test_stitch_tracks_unequal(points: np.ndarray):
+    mapping, disagreements = stitch_tracks(points[:, :8], points)
+    np.testing.assert_array_equal(mapping[:8], np.arange(8))
+    np.testing.assert_array_equal(mapping[8:], -1)
+    assert disagreements == 2 * 3
@@ -0,0 +1,172 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev, and others
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import pickle
+import shutil
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import EXAMPLES
+
+import ParticleDetection.reconstruct_3D.match2D as m2d
+import ParticleDetection.utils.data_loading as dl
+from ParticleDetection.reconstruct_3D.stereo_rig import StereoRig
+
+calibration = dl.load_camera_calibration(EXAMPLES / "gp34.json")
+transformation = dl.load_world_transformation(EXAMPLES / "transformation.json")
+
+
+@pytest.fixture(scope="module")
+def rig() -> StereoRig:
+    return StereoRig(calibration, transformation)
+
+
+def test_from_files_cached(tmp_path: Path):
+    calib_file = tmp_path / "gp34.json"
+    shutil.copy(EXAMPLES / "gp34.json", calib_file)
+    rig1 = StereoRig.from_files(calib_file, EXAMPLES / "transformation.json")
+    rig2 = StereoRig.from_files(
+        str(calib_file), EXAMPLES / "transformation.json"
+    )
+    assert rig1 is rig2
+    assert rig1 == StereoRig(calibration, transformation)
+
+    # A modified file must be loaded again
+    stat = os.stat(calib_file)
+    os.utime(calib_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    rig3 = StereoRig.from_files(calib_file, EXAMPLES / "transformation.json")
+    assert rig3 is not rig1
+    assert rig3 == rig1
+
+
+def test_immutable(rig: StereoRig):
+    with pytest.raises(AttributeError):
+        rig.P1 = np.zeros((3, 4))
+    with pytest.raises(AttributeError):
+        rig._P1 = np.zeros((3, 4))
+    with pytest.raises(ValueError):
+        rig.P1[0, 0] = 1.0
+    with pytest.raises(TypeError):
+        rig.calibration["CM1"] = np.eye(3)
+    assert not rig.calibration["CM1"].flags.writeable
+
+
+def test_hashable(rig: StereoRig):
+    same = pickle.loads(pickle.dumps(rig))
+    assert same == rig
+    assert hash(same) == hash(rig)
+    assert len({rig, same, StereoRig(calibration)}) == 2
+
+
+def test_missing_field():
+    incomplete = {k: v for k, v in calibration.items() if k != "dist2"}
+    with pytest.raises(KeyError):
+        StereoRig(incomplete)
+
+
+def test_roundtrip(rig: StereoRig):
+    rng = np.random.default_rng(1)
+    points = rng.uniform(-30, 30, (5, 4, 3))
+    cam1 = rig.reproject(points, cam=1, world=True)
+    cam2 = rig.reproject(points, cam=2, world=True)
+    assert cam1.shape == (5, 4, 2)
+
+    triangulated = rig.to_world(rig.triangulate(cam1, cam2))
+    np.testing.assert_allclose(triangulated, points, atol=1e-3)
+    np.testing.assert_allclose(
+        rig.from_world(triangulated), rig.triangulate(cam1, cam2)
+    )
+
+
+def test_epipolar_geometry(rig: StereoRig):
+    rng = np.random.default_rng(4)
+    points = rng.uniform(-30, 30, (50, 3))
+    cam1 = rig.reproject(points, cam=1, world=True)
+    cam2 = rig.reproject(points, cam=2, world=True)
+    np.testing.assert_allclose(
+        rig.epipolar_distance(cam1, cam2), 0.0, atol=0.5
+    )
+    shifted = rig.epipolar_distance(cam1, cam2 + rng.normal(0, 20, (50, 2)))
+    assert shifted.mean() > 5.0
+
+    coords1, _ = rig.epipolar_coordinates(cam1, cam=1)
+    coords2, sensitivity = rig.epipolar_coordinates(cam2, cam=2)
+    np.testing.assert_allclose(coords1, coords2, atol=0.05)
+    assert (sensitivity > 0).all()
+
+    derived = StereoRig({k: v for k, v in calibration.items() if k != "F"}).F
+    np.testing.assert_allclose(
+        derived / derived[2, 2], rig.F / rig.F[2, 2], rtol=0.05, atol=1e-8
+    )
+
+
+def test_unknown_camera(rig: StereoRig):
+    with pytest.raises(ValueError):
+        rig.undistort(np.zeros((1, 2)), cam=3)
+
+
+def test_match_complex_rig(rig: StereoRig):
+    data = pd.read_csv(EXAMPLES / "rods_df_black.csv", index_col=0)
+    frames = list(range(505, 508))
+    expected = m2d.match_complex(
+        data, frames, "black", calibration, transformation, "gp3", "gp4"
+    )
+    result = m2d.match_complex(data, frames, "black", rig, None, "gp3", "gp4")
+    pd.testing.assert_frame_equal(result[0], expected[0])
+
+
+@pytest.mark.parametrize("image_size", [None, (1307, 974)])
+def test_undistortion_grid(image_size):
+    rig = StereoRig(calibration, undistortion="grid", image_size=image_size)
+    assert rig.undistortion == "grid"
+    assert all(0 < err < 0.01 for err in rig.undistortion_error)
+    assert rig != StereoRig(calibration)
+
+    rng = np.random.default_rng(2)
+    points = rng.uniform((-20, -20), (1320, 990), (100, 2, 2))
+    points[0] = np.nan
+    result = rig.undistort(points, cam=2)
+    assert result.shape == points.shape
+    assert np.isnan(result[0]).all()
+
+    exact = cv2.undistortImagePoints(
+        points[1:].reshape(-1, 1, 2),
+        calibration["CM2"],
+        calibration["dist2"],
+        arg1=(cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, 100, 1e-12),
+    ).reshape(-1, 2, 2)
+    errors = np.linalg.norm(result[1:] - exact, axis=-1)
+    assert errors.max() <= rig.undistortion_error[1] + 1e-9
+
+    same = pickle.loads(pickle.dumps(rig))
+    assert same == rig
+    assert same.undistortion == "grid"
+
+
+def test_undistortion_grid_image_size():
+    calib = dict(calibration, img_size=np.array([640, 480]))
+    rig = StereoRig(calib, undistortion="grid")
+    assert rig._grids[0].image_size == (640, 480)
+    assert rig._grids[1].image_size == (640, 480)
+
+
+def test_unknown_undistortion():
+    with pytest.raises(ValueError):
+        StereoRig(calibration, undistortion="magic")
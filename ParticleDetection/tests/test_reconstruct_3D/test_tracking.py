@@ -0,0 +1,210 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev, and others
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("trackpy")
+from ParticleDetection.reconstruct_3D import tracking  # noqa: E402
+
+POINTS = ["x1", "y1", "z1", "x2", "y2", "z2"]
+
+
+def drifting_rods(
+    n_frames: int = 20, n_rods: int = 15, speed: float = 1.0, seed: int = 0
+) -> pd.DataFrame:
+    """Rods moving with constant velocities, in a random order per frame.
+    The ``true`` column identifies the rods, the ``particle`` numbers are
+    only valid in the first frame."""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(0, 100, (n_rods, 3))
+    velocity = rng.normal(0, speed, (n_rods, 3))
+    axis = rng.normal(size=(n_rods, 3))
+    axis *= 2 / np.linalg.norm(axis, axis=1, keepdims=True)
+    frames = []
+    for frame in range(n_frames):
+        current = centers + velocity * frame
+        order = rng.permutation(n_rods)
+        data = pd.DataFrame(
+            np.concatenate([current - axis, current + axis], axis=1)[order],
+            columns=POINTS,
+        )
+        data["frame"] = frame
+        data["true"] = order
+        data["particle"] = rng.permutation(n_rods) + 100
+        frames.append(data)
+    data = pd.concat(frames, ignore_index=True)
+    # the first frame's particle numbers are kept by the tracking
+    data.loc[data.frame == 0, "particle"] = data["true"] * 2 + 3
+    return data
+
+
+def accelerating_ring(
+    n_frames: int = 20, n_rods: int = 12, seed: int = 0
+) -> pd.DataFrame:
+    """Rods on a rotating ring, like :func:`drifting_rods`. The rotation per
+    frame increases from 10 % to 80 % of the spacing of the rods."""
+    rng = np.random.default_rng(seed)
+    spacing = 2 * np.pi / n_rods
+    steps = spacing * np.linspace(0.1, 0.8, n_frames - 1)
+    angles = np.concatenate([[0], np.cumsum(steps)])
+    axis = np.array([0, 0, 2.0])
+    frames = []
+    for frame, angle in enumerate(angles):
+        phi = angle + spacing * np.arange(n_rods)
+        centers = np.stack(
+            [50 * np.cos(phi), 50 * np.sin(phi), np.zeros(n_rods)], axis=1
+        )
+        order = rng.permutation(n_rods)
+        data = pd.DataFrame(
+            np.concatenate([centers - axis, centers + axis], axis=1)[order],
+            columns=POINTS,
+        )
+        data["frame"] = frame
+        data["true"] = order
+        data["particle"] = order * 2 + 3 if frame == 0 else -1
+        frames.append(data)
+    return pd.concat(frames, ignore_index=True)
+
+
+def assert_identities(result: pd.DataFrame):
+    """Every rod keeps the particle number it has in the first frame."""
+    assert (result.particle == result["true"] * 2 + 3).all()
+
+
+def displacements(data: pd.DataFrame) -> np.ndarray:
+    """Summed endpoint displacements of every rod (frame, true rod) between
+    consecutive frames."""
+    points = (
+        data.sort_values(["frame", "true"])[POINTS]
+        .to_numpy()
+        .reshape(data.frame.nunique(), -1, 2, 3)
+    )
+    return np.linalg.norm(np.diff(points, axis=0), axis=-1).sum(axis=-1)
+
+
+def test_tracking_global_assignment():
+    data = drifting_rods()
+    result, costs = tracking.tracking_global_assignment(data)
+    assert_identities(result)
+    assert list(result.frame) == list(np.repeat(np.arange(20), 15))
+    pd.testing.assert_frame_equal(
+        result.drop(columns="particle"),
+        data.sort_values(["frame", "true"])
+        .reset_index(drop=True)
+        .drop(columns="particle"),
+    )
+    np.testing.assert_allclose(costs, displacements(data).sum(axis=1))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 19, 1000])
+def test_tracking_global_assignment_chunks(chunk_size: int):
+    data = drifting_rods()
+    expected, expected_costs = tracking.tracking_global_assignment(data)
+    result, costs = tracking.tracking_global_assignment(
+        data, chunk_size=chunk_size
+    )
+    pd.testing.assert_frame_equal(result, expected)
+    np.testing.assert_array_equal(costs, expected_costs)
+
+
+@pytest.mark.parametrize("column", ["unseen", "seen_gp3"])
+def test_tracking_global_assignment_double_unseen(column: str):
+    data = drifting_rods()
+    unseen = (data.frame == 5) & (data["true"] == 4)
+    if column == "unseen":
+        data["unseen"] = unseen.astype(int)
+    else:
+        data["seen_gp3"] = 1
+        data["seen_gp4"] = 1
+        data.loc[unseen, "seen_gp3"] = 0
+    plain, plain_costs = tracking.tracking_global_assignment(data)
+    result, costs = tracking.tracking_global_assignment(
+        data, double_unseen=True
+    )
+    assert_identities(plain)
+    assert_identities(result)
+
+    # the costs of the assignments to and from the unseen rod are doubled
+    extra = np.zeros_like(costs)
+    extra[4:6] = displacements(data)[4:6, 4]
+    np.testing.assert_allclose(costs, plain_costs + extra)
+
+
+def test_tracking_global_assignment_double_unseen_choice():
+    # rods along z at x = 0, 3 move to x = 2.5 (unseen), 3.5
+    data = pd.DataFrame(
+        [[x, 0, 0, x, 0, 4] for x in (0, 3, 2.5, 3.5)], columns=POINTS
+    )
+    data["frame"] = [0, 0, 1, 1]
+    data["particle"] = [0, 1, 0, 1]
+    data["unseen"] = [0, 0, 1, 0]
+    plain, plain_costs = tracking.tracking_global_assignment(data)
+    doubled, costs = tracking.tracking_global_assignment(
+        data, double_unseen=True
+    )
+    # 2.5 + 0.5 < 3.5 + 0.5 ...
+    assert list(plain.x1) == [0, 3, 2.5, 3.5]
+    np.testing.assert_allclose(plain_costs, [2 * (2.5 + 0.5)])
+    # ... but 2 * 2.5 + 0.5 > 3.5 + 2 * 0.5
+    assert list(doubled.x1) == [0, 3, 3.5, 2.5]
+    np.testing.assert_allclose(costs, [2 * (3.5 + 2 * 0.5)])
+
+
+@pytest.mark.parametrize(
+    "shard_size,overlap,workers", [(10, 2, 1), (10, 2, 3), (7, 3, 2)]
+)
+def test_tracking_global_assignment_sharded(
+    caplog, shard_size: int, overlap: int, workers: int
+):
+    data = drifting_rods(n_frames=40)
+    expected, expected_costs = tracking.tracking_global_assignment(data)
+    with caplog.at_level("INFO", logger=tracking.__name__):
+        result, costs = tracking.tracking_global_assignment(
+            data, shard_size=shard_size, overlap=overlap, workers=workers
+        )
+    n_shards = len(tracking.shard_ranges(40, shard_size, overlap))
+    assert n_shards > 2
+    assert f"Stitched {n_shards} shards with 0 rods disagreeing" in caplog.text
+    pd.testing.assert_frame_equal(result, expected)
+    np.testing.assert_allclose(costs, expected_costs)
+
+
+@pytest.mark.parametrize("candidates", [1, 2, 4])
+def test_tracking_predictive(candidates: int):
+    data = accelerating_ring()
+    # rods move more than half their spacing between the last frames
+    plain, _ = tracking.tracking_global_assignment(data)
+    assert not (plain.particle == plain["true"] * 2 + 3).all()
+
+    result, costs = tracking.tracking_predictive(data, candidates=candidates)
+    assert_identities(result)
+    assert len(costs) == 19
+    pd.testing.assert_frame_equal(
+        result.drop(columns="particle"),
+        data.sort_values(["frame", "true"])
+        .reset_index(drop=True)
+        .drop(columns="particle"),
+    )
+
+
+def test_tracking_predictive_drifting():
+    data = drifting_rods()
+    result, costs = tracking.tracking_predictive(data, candidates=3)
+    assert_identities(result)
+    # constant velocities are predicted exactly after the first frames
+    assert np.all(costs[5:] < 0.1)
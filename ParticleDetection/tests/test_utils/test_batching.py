@@ -0,0 +1,104 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev, and others
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+import ParticleDetection.utils.batching as batching
+
+
+class FakeModel:
+    """Batch function with a fixed overhead per call, that slows down for
+    batches larger than ``fast_items`` and fails for batches larger than
+    ``max_items``."""
+
+    def __init__(
+        self,
+        overhead: float,
+        per_item: float,
+        max_items: int,
+        fast_items: int = 100,
+    ):
+        self.overhead = overhead
+        self.per_item = per_item
+        self.max_items = max_items
+        self.fast_items = fast_items
+        self.calls = []
+        self.clock = 0.0
+
+    def perf_counter(self) -> float:
+        return self.clock
+
+    def __call__(self, batch):
+        self.calls.append(list(batch))
+        if len(batch) > self.max_items:
+            raise RuntimeError("CUDA out of memory.")
+        slowdown = 1 if len(batch) <= self.fast_items else 4
+        self.clock += self.overhead + slowdown * self.per_item * len(batch)
+        return [2 * item for item in batch]
+
+
+def test_batches():
+    assert list(batching.batches(list(range(7)), 3)) == [
+        [0, 1, 2],
+        [3, 4, 5],
+        [6],
+    ]
+    assert list(batching.batches([], 3)) == []
+    with pytest.raises(ValueError):
+        list(batching.batches([1], 0))
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 20])
+def test_run_batched(batch_size):
+    model = FakeModel(1.0, 0.1, 100)
+    result = list(batching.run_batched(model, range(10), batch_size))
+    assert result == [(i, 2 * i) for i in range(10)]
+    assert max(len(call) for call in model.calls) == min(batch_size, 10)
+
+
+def test_run_batched_auto(monkeypatch: pytest.MonkeyPatch):
+    # batches of 16 are slower per item than batches of 8
+    model = FakeModel(1.0, 0.2, 100, fast_items=8)
+    monkeypatch.setattr(batching.time, "perf_counter", model.perf_counter)
+    result = list(batching.run_batched(model, range(100), "auto"))
+    assert result == [(i, 2 * i) for i in range(100)]
+    sizes = [len(call) for call in model.calls]
+    assert sizes[:5] == [1, 2, 4, 8, 16]
+    assert set(sizes[5:-1]) == {8}
+
+
+def test_run_batched_max(monkeypatch: pytest.MonkeyPatch):
+    model = FakeModel(1.0, 0.0, 100)
+    monkeypatch.setattr(batching.time, "perf_counter", model.perf_counter)
+    result = list(
+        batching.run_batched(model, range(20), "auto", max_batch_size=4)
+    )
+    assert result == [(i, 2 * i) for i in range(20)]
+    assert [len(call) for call in model.calls] == [1, 2, 4, 4, 4, 4, 1]
+
+
+def test_run_batched_out_of_memory(monkeypatch: pytest.MonkeyPatch):
+    model = FakeModel(1.0, 0.0, 5)
+    monkeypatch.setattr(batching.time, "perf_counter", model.perf_counter)
+    result = list(batching.run_batched(model, range(30), "auto"))
+    assert result == [(i, 2 * i) for i in range(30)]
+    sizes = [len(call) for call in model.calls]
+    # the failed batch of 8 is repeated with a batch size of 4
+    assert sizes[:5] == [1, 2, 4, 8, 4]
+    assert set(sizes[4:]) == {4, 3}
+
+    with pytest.raises(RuntimeError):
+        list(batching.run_batched(FakeModel(1.0, 0.0, 0), range(3), "auto"))
@@ -21,6 +21,7 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 import pytest
+import torch
 from conftest import load_rod_data
 
 from ParticleDetection.utils import datasets
@@ -191,3 +192,30 @@ def test_add_points_both_cams():
         inserted.loc["black", frame][sec_cam_cols].to_numpy()
         == np.append(v, np.ones((len(v), 1)), axis=1)
     ).all()
+
+
+def test_roi_masks():
+    crops = [np.ones((2, 3), np.uint8), np.array([[0, 1], [1, 0]], np.uint8)]
+    masks = datasets.ROIMasks(crops, [[10, 5], [0, 18]], (20, 30))
+    assert len(masks) == 2
+
+    full = masks.to_bitmasks()
+    assert full.shape == (2, 20, 30)
+    assert full.sum() == 8
+    assert (full[0, 5:7, 10:13] == 1).all()
+    for i in range(len(masks)):
+        idxs = np.nonzero(full[i].numpy())
+        np.testing.assert_array_equal(
+            masks.points(i), np.stack((idxs[1], idxs[0]), axis=1)
+        )
+
+    selected = masks[torch.tensor([False, True])]
+    assert len(selected) == 1
+    np.testing.assert_array_equal(selected.crop(0)[1], [0, 18])
+    assert torch.equal(selected.to_bitmasks()[0], full[1])
+    assert masks.to("cpu") is masks
+
+
+def test_roi_masks_mismatch():
+    with pytest.raises(ValueError):
+        datasets.ROIMasks([np.ones((2, 2))], np.zeros((2, 2)), (5, 5))
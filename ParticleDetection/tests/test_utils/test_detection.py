@@ -16,11 +16,15 @@
 
 from pathlib import Path
 
+import cv2
 import numpy as np
+import pandas as pd
 import pytest
 import torch
 from conftest import create_dummy_mask
 
+import ParticleDetection.utils.data_conversions as d_conv
+import ParticleDetection.utils.datasets as ds
 import ParticleDetection.utils.detection as det
 
 
@@ -64,3 +68,211 @@ def test_run_detection(monkeypatch: pytest.MonkeyPatch, tmpdir):
             continue
         assert "rods_df" in file.name
         assert file.stem.split("_")[-1] in ["df", "black"]
+
+
+def synthetic_endpoints(outputs, classes):
+    # the detection result is the (frame, cam) the endpoints are made for
+    frame, cam = outputs["pred_masks"]
+    rng = np.random.default_rng([frame, int(cam[-1])])
+    points = {}
+    for color, n_rods in [("black", 3 + frame % 2), ("blue", 2)]:
+        if color == "blue" and frame % 3 == 0:
+            continue
+        # rods not visible in one camera are missing from its detections
+        n_rods -= int(cam == "gp4" and frame % 4 == 1)
+        points[color] = rng.integers(-5, 100, size=(n_rods, 2, 2)) / 4
+    return points
+
+
+def run_synthetic(monkeypatch, folder, frames, fail_at=None, resume=False):
+    def _run_detection(
+        model, file, threshold=0.5, loader=None, batched_masks=False
+    ):
+        frame = int(file.stem)
+        if frame == fail_at:
+            raise RuntimeError("Interrupted")
+        return {"pred_masks": (frame, file.parent.name)}
+
+    monkeypatch.setattr(det, "_run_detection", _run_detection)
+    monkeypatch.setattr(det.hf, "rod_endpoints", synthetic_endpoints)
+    det.run_detection(
+        None,
+        "/{cam_id:s}/{frame:04d}.jpg",
+        output_dir=folder,
+        frames=frames,
+        cam1_name="gp3",
+        cam2_name="gp4",
+        resume=resume,
+    )
+
+
+def expected_output(folder: Path, frames):
+    # previous implementation, rewriting all files after every frame
+    cols = [col.format(id1="gp3", id2="gp4") for col in ds.DEFAULT_COLUMNS]
+    data = pd.DataFrame(columns=cols)
+    for frame in frames:
+        for cam in ["gp3", "gp4"]:
+            points = synthetic_endpoints({"pred_masks": (frame, cam)}, None)
+            data = ds.add_points(points, data, cam, frame)
+        data.reset_index(drop=True, inplace=True)
+        data = ds.replace_missing_rods(data, "gp3", "gp4")
+    data.to_csv(folder / "rods_df.csv", ",")
+    d_conv.csv_extract_colors(str(folder / "rods_df.csv"))
+
+
+def assert_same_files(result: Path, expected: Path):
+    files = sorted(f.name for f in result.iterdir() if f.is_file())
+    assert files == sorted(f.name for f in expected.iterdir())
+    for name in files:
+        assert (result / name).read_text() == (expected / name).read_text()
+
+
+def test_run_detection_incremental(monkeypatch: pytest.MonkeyPatch, tmpdir):
+    tmpdir = Path(tmpdir)
+    frames = list(range(10))
+    (tmpdir / "expected").mkdir()
+    expected_output(tmpdir / "expected", frames)
+    (tmpdir / "result").mkdir()
+    run_synthetic(monkeypatch, tmpdir / "result", frames)
+    assert_same_files(tmpdir / "result", tmpdir / "expected")
+
+
+def test_run_detection_resume(monkeypatch: pytest.MonkeyPatch, tmpdir):
+    tmpdir = Path(tmpdir)
+    frames = list(range(10))
+    (tmpdir / "expected").mkdir()
+    expected_output(tmpdir / "expected", frames)
+
+    result = tmpdir / "result"
+    result.mkdir()
+    with pytest.raises(RuntimeError):
+        run_synthetic(monkeypatch, result, frames, fail_at=6)
+    assert (result / "rods_df.csv.checkpoint").exists()
+    written = pd.read_csv(result / "rods_df.csv", index_col=0)
+    assert written.frame.max() == 5
+
+    run_synthetic(monkeypatch, result, frames, resume=True)
+    assert not (result / "rods_df.csv.checkpoint").exists()
+    assert_same_files(result, tmpdir / "expected")
+
+
+def test_run_detection_no_frames(monkeypatch: pytest.MonkeyPatch, tmpdir):
+    run_synthetic(monkeypatch, Path(tmpdir), [])
+    assert not (Path(tmpdir) / "rods_df.csv.checkpoint").exists()
+
+
+def test_run_detection_frame_generator(
+    monkeypatch: pytest.MonkeyPatch, tmpdir
+):
+    tmpdir = Path(tmpdir)
+    (tmpdir / "expected").mkdir()
+    expected_output(tmpdir / "expected", list(range(5)))
+    (tmpdir / "result").mkdir()
+    run_synthetic(monkeypatch, tmpdir / "result", (f for f in range(5)))
+    assert_same_files(tmpdir / "result", tmpdir / "expected")
+
+
+def test_run_detection_resume_unknown_frame(
+    monkeypatch: pytest.MonkeyPatch, tmpdir
+):
+    result = Path(tmpdir)
+    with pytest.raises(RuntimeError):
+        run_synthetic(monkeypatch, result, list(range(10)), fail_at=6)
+    with pytest.raises(ValueError, match="checkpoint"):
+        run_synthetic(monkeypatch, result, list(range(6, 10)), resume=True)
+
+
+class DummyDetector(torch.nn.Module):
+    """Detects one rod per image, that depends on the image content."""
+
+    def forward(self, *images):
+        outputs = []
+        for image in images:
+            value = image.float().mean()
+            corner = value / 10
+            boxes = torch.stack([corner, corner, corner + 20, corner + 30])
+            outputs.extend(
+                [
+                    boxes[None],
+                    torch.zeros(1, dtype=torch.long),
+                    torch.ones(1, 1, 28, 28) * 0.8,
+                    (value / 255)[None],
+                    torch._shape_as_tensor(image)[1:],
+                ]
+            )
+        return tuple(outputs)
+
+
+@pytest.mark.parametrize("n_inputs", [2, 3])
+def test_run_detection_batch(tmp_path: Path, n_inputs: int):
+    files = []
+    for i in range(5):
+        files.append(tmp_path / f"{i}.png")
+        cv2.imwrite(str(files[-1]), np.full((60, 80, 3), 60 + 30 * i, "uint8"))
+    single = torch.jit.trace(DummyDetector(), (det.dl.read_image(files[0]),))
+    batched = torch.jit.trace(
+        DummyDetector(),
+        tuple(det.dl.read_image(f) for f in files[:n_inputs]),
+    )
+    assert det.model_batch_size(single) == 1
+    assert det.model_batch_size(batched) == n_inputs
+    assert det.model_batch_size(None) == 1
+
+    expected = [det._run_detection(single, f, 0.3) for f in files]
+    with det.ImagePrefetcher(files, prefetch=2) as loader:
+        result = det._run_detection_batch(batched, files, 0.3, loader=loader)
+    assert loader.stats.reads == len(files)
+    assert loader.stats.misses == 0
+    assert len(result) == len(expected)
+    for res, exp in zip(result, expected):
+        assert res.keys() == exp.keys()
+        for key in exp:
+            if key == "pred_masks":
+                torch.testing.assert_close(
+                    res[key].to_bitmasks(), exp[key].to_bitmasks()
+                )
+                continue
+            torch.testing.assert_close(res[key], exp[key])
+    # the lowest scores are below the threshold
+    assert result[0] == {}
+
+
+def test_run_detection_roi_masks(tmp_path: Path):
+    file = tmp_path / "0.png"
+    cv2.imwrite(str(file), np.full((60, 80, 3), 150, "uint8"))
+    model = torch.jit.trace(DummyDetector(), (det.dl.read_image(file),))
+    result = det._run_detection(model, file, 0.3)
+    masks = result["pred_masks"]
+    assert isinstance(masks, det.ds.ROIMasks)
+    assert masks.crop(0)[0].shape == (31, 21)
+
+    ret = model(det.dl.read_image(file))
+    full = det.hf.paste_mask_in_image_old(ret[2][0, 0], ret[0][0], 60, 80)
+    assert torch.equal(masks.to_bitmasks()[0], full)
+    classes = {0: "black"}
+    np.testing.assert_array_equal(
+        det.hf.rod_endpoints(dict(result), classes)["black"],
+        det.hf.rod_endpoints({**result, "pred_masks": full[None]}, classes)[
+            "black"
+        ],
+    )
+
+
+@pytest.mark.parametrize("n_inputs", [1, 2])
+def test_run_detection_batched_masks(tmp_path: Path, n_inputs: int):
+    files = []
+    for i in range(3):
+        files.append(tmp_path / f"{i}.png")
+        cv2.imwrite(str(files[-1]), np.full((60, 80, 3), 90 + 30 * i, "uint8"))
+    model = torch.jit.trace(
+        DummyDetector(),
+        tuple(det.dl.read_image(f) for f in files[:n_inputs]),
+    )
+    expected = det._run_detection_batch(model, files, 0.3)
+    result = det._run_detection_batch(model, files, 0.3, batched_masks=True)
+    for res, exp in zip(result, expected):
+        assert res.keys() == exp.keys()
+        torch.testing.assert_close(
+            res["pred_masks"].to_bitmasks(), exp["pred_masks"].to_bitmasks()
+        )
+        torch.testing.assert_close(res["pred_boxes"], exp["pred_boxes"])
@@ -21,6 +21,7 @@ import pytest
 import torch
 from conftest import create_dummy_mask
 
+import ParticleDetection.utils.datasets as ds
 import ParticleDetection.utils.helper_funcs as hf
 
 
@@ -70,6 +71,65 @@ def test_line_estimator_simple(width, height, angle, length, thickness):
     assert (diff_0 < 10.0) and (diff_1 < 10.0)
 
 
+@pytest.mark.parametrize("angle", angles)
+def test_line_estimator_simple_offset(angle):
+    mask, _, _ = create_dummy_mask(750, 750, angle, 100, 7)
+    ys, xs = np.nonzero(mask)
+    crop = mask[ys.min() : ys.max() + 1, xs.min() : xs.max() + 1]
+    out = hf.line_estimator_simple(crop, np.array([xs.min(), ys.min()]))
+    np.testing.assert_array_equal(out, hf.line_estimator_simple(mask))
+
+
+@pytest.mark.parametrize(
+    "box", [[10.3, 5.8, 40.1, 20.6], [-5.0, 50.2, 20.0, 70.0], [70, 2, 90, 9]]
+)
+def test_mask_to_roi(box):
+    mask = torch.rand((28, 28))
+    box = torch.tensor(box)
+    crop, offset = hf.mask_to_roi(mask, box, 60, 80)
+    assert (offset >= 0).all()
+    full = torch.zeros((60, 80), dtype=torch.uint8)
+    h, w = crop.shape
+    full[offset[1] : offset[1] + h, offset[0] : offset[0] + w] = (
+        torch.from_numpy(crop)
+    )
+    assert torch.equal(full, hf.paste_mask_in_image_old(mask, box, 60, 80))
+
+
+def test_paste_masks_in_rois():
+    torch.manual_seed(0)
+    # smooth masks, like the ones predicted for rods
+    masks = torch.nn.functional.avg_pool2d(
+        torch.rand((50, 1, 28, 28)), 5, stride=1, padding=2
+    )[:, 0]
+    masks = ((masks - 0.45) * 3).clamp(0, 1)
+    corners = torch.rand((50, 2)) * torch.tensor([80.0, 60.0]) - 10
+    sizes = torch.rand((50, 2)) * 50 + 3
+    boxes = torch.cat((corners, corners + sizes), dim=1)
+    crops, offsets = hf.paste_masks_in_rois(masks, boxes, 60, 80)
+    assert len(crops) == len(offsets) == 50
+
+    n_diff = n_pixels = 0
+    for i in range(50):
+        crop, offset = hf.mask_to_roi(masks[i], boxes[i], 60, 80)
+        np.testing.assert_array_equal(offsets[i], offset)
+        assert crops[i].shape == crop.shape
+        if (sizes[i] >= 28).all():
+            # upsampling is identical
+            np.testing.assert_array_equal(crops[i], crop)
+        n_diff += (crops[i] != crop).sum()
+        n_pixels += crop.size
+    assert n_diff / n_pixels < 0.01
+
+
+def test_paste_masks_in_rois_empty():
+    crops, offsets = hf.paste_masks_in_rois(
+        torch.zeros((0, 28, 28)), torch.zeros((0, 4)), 60, 80
+    )
+    assert crops == []
+    assert offsets.shape == (0, 2)
+
+
 @pytest.mark.filterwarnings("ignore:invalid value")
 @pytest.mark.parametrize("width,height,angle,length,thickness", parameters)
 def test_line_estimator(width, height, angle, length, thickness):
@@ -228,3 +288,36 @@ def test_rod_endpoints_unknown_method():
     test_classes = {0: "test0", 1: "test1", 4: "test4"}
     with pytest.raises(ValueError, match="Unknown extraction method"):
         hf.rod_endpoints(test_prediction, test_classes, method="test")
+
+
+@pytest.mark.parametrize("method", ["simple", "advanced"])
+def test_rod_endpoints_roi_masks(method):
+    masks = np.zeros((3, 300, 300), dtype=np.uint8)
+    crops, offsets = [], []
+    for i, angle in enumerate([0, 45, 83]):
+        masks[i] = create_dummy_mask(300, 300, angle, 100, 7)[0]
+        ys, xs = np.nonzero(masks[i])
+        crops.append(
+            masks[i, ys.min() : ys.max() + 1, xs.min() : xs.max() + 1]
+        )
+        offsets.append([xs.min(), ys.min()])
+    classes = {0: "test0", 1: "test1"}
+    full = hf.rod_endpoints(
+        {
+            "pred_classes": torch.tensor([0, 1, 0]),
+            "pred_masks": torch.from_numpy(masks),
+        },
+        classes,
+        method,
+    )
+    roi = hf.rod_endpoints(
+        {
+            "pred_classes": torch.tensor([0, 1, 0]),
+            "pred_masks": ds.ROIMasks(crops, offsets, (300, 300)),
+        },
+        classes,
+        method,
+    )
+    assert roi.keys() == full.keys()
+    for color in full:
+        np.testing.assert_array_equal(roi[color], full[color])
@@ -0,0 +1,101 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev, and others
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+import ParticleDetection.utils.data_loading as dl
+from ParticleDetection.utils.prefetching import ImagePrefetcher
+
+
+class Loader:
+    """Records the loaded files and blocks loading until released."""
+
+    def __init__(self):
+        self.loaded = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, file):
+        self.release.wait()
+        self.loaded.append(file)
+        if file == "broken":
+            raise OSError("Cannot read image.")
+        return f"image {file}"
+
+
+def test_prefetch_images(tmp_path: Path):
+    files = []
+    for i in range(6):
+        files.append(tmp_path / f"{i}.png")
+        cv2.imwrite(str(files[-1]), np.full((6, 8, 3), i, "uint8"))
+    with ImagePrefetcher(files, workers=3, prefetch=2) as loader:
+        for file in files:
+            torch.testing.assert_close(loader.read(file), dl.read_image(file))
+    assert loader.stats.reads == 6
+    assert loader.stats.misses == 0
+
+
+def test_prefetch_bounded():
+    load = Loader()
+    files = list(range(20))
+    with ImagePrefetcher(files, load=load, prefetch=3) as loader:
+        time.sleep(0.1)
+        assert sorted(load.loaded) == [0, 1, 2]
+        for file in files[:5]:
+            assert loader.read(file) == f"image {file}"
+        time.sleep(0.1)
+        assert sorted(load.loaded) == list(range(8))
+    assert loader.stats.max_queue_depth == 3
+    assert loader.stats.mean_queue_depth > 0
+
+
+def test_prefetch_stalls():
+    load = Loader()
+    load.release.clear()
+    with ImagePrefetcher(range(3), load=load, prefetch=2) as loader:
+        threading.Timer(0.2, load.release.set).start()
+        assert loader.read(0) == "image 0"
+        time.sleep(0.1)
+        assert loader.read(1) == "image 1"
+    assert loader.stats.stalls == 1
+    assert loader.stats.stall_time >= 0.1
+    assert loader.stats.reads == 2
+
+
+def test_prefetch_skip_and_miss():
+    load = Loader()
+    with ImagePrefetcher([0, 1, 2, 3, 4], load=load, prefetch=3) as loader:
+        # skips 0 and 1
+        assert loader.read(2) == "image 2"
+        assert loader.read("other") == "image other"
+        assert loader.read(3) == "image 3"
+        assert loader.read(4) == "image 4"
+    assert loader.stats.misses == 1
+    assert loader.stats.reads == 4
+
+
+def test_prefetch_error():
+    with ImagePrefetcher(["broken", "ok"], load=Loader()) as loader:
+        with pytest.raises(OSError):
+            loader.read("broken")
+        assert loader.read("ok") == "image ok"
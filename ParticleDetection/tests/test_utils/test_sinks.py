@@ -0,0 +1,179 @@
+# Copyright (c) 2023-24 Adrian Niemann, Dmitry Puzyrev, and others
+#
+# This file is part of ParticleDetection.
+# ParticleDetection is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ParticleDetection is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ParticleDetection. If not, see <http://www.gnu.org/licenses/>.
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ParticleDetection.utils.data_conversions import csv_extract_colors
+from ParticleDetection.utils.sinks import (
+    ColorCSVSink,
+    CSVSink,
+    DataSink,
+    MemorySink,
+)
+
+
+def frame_data(frame: int, n_rods: int = 4) -> pd.DataFrame:
+    rng = np.random.default_rng(frame)
+    return pd.DataFrame(
+        {
+            "x1": rng.random(n_rods),
+            "y1": rng.random(n_rods),
+            "frame": frame,
+            "particle": np.arange(n_rods),
+            "color": "blue",
+        },
+        index=np.arange(n_rods) + 10,
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 10_000])
+def test_csv_sink(tmp_path: Path, chunk_size: int):
+    frames = [frame_data(i) for i in range(10)]
+    expected = tmp_path / "expected.csv"
+    pd.concat(frames, ignore_index=True).to_csv(expected, sep=",")
+
+    with CSVSink(tmp_path / "result.csv", chunk_size=chunk_size) as sink:
+        for frame in frames:
+            sink.append(frame)
+        sink.append(pd.DataFrame())
+        sink.append(None)
+    assert sink.n_rows == 40
+    assert (tmp_path / "result.csv").read_text() == expected.read_text()
+
+
+def test_csv_sink_readable(tmp_path: Path):
+    sink = CSVSink(tmp_path / "result.csv", chunk_size=8)
+    for i in range(3):
+        sink.append(frame_data(i))
+    # the first 2 frames make up a full chunk, the 3rd is still buffered
+    intermediate = pd.read_csv(tmp_path / "result.csv", index_col=0)
+    assert list(intermediate.frame.unique()) == [0, 1]
+    assert list(intermediate.index) == list(range(8))
+    sink.close()
+    result = pd.read_csv(tmp_path / "result.csv", index_col=0)
+    assert list(result.frame.unique()) == [0, 1, 2]
+
+
+def test_csv_sink_empty(tmp_path: Path):
+    with CSVSink(tmp_path / "result.csv"):
+        pass
+    expected = tmp_path / "expected.csv"
+    pd.DataFrame().to_csv(expected, sep=",")
+    assert (tmp_path / "result.csv").read_text() == expected.read_text()
+
+
+def test_csv_sink_columns(tmp_path: Path):
+    with CSVSink(tmp_path / "result.csv") as sink:
+        sink.append(frame_data(0))
+        # missing columns are left empty
+        sink.append(frame_data(1).drop(columns="color"))
+        with pytest.raises(ValueError):
+            sink.append(frame_data(2).assign(z1=0.0))
+    result = pd.read_csv(tmp_path / "result.csv", index_col=0)
+    assert result.color.isna().sum() == 4
+
+
+def test_csv_sink_append(tmp_path: Path):
+    frames = [frame_data(i) for i in range(6)]
+    expected = tmp_path / "expected.csv"
+    pd.concat(frames, ignore_index=True).to_csv(expected, sep=",")
+
+    with CSVSink(tmp_path / "result.csv") as sink:
+        for frame in frames[:3]:
+            sink.append(frame)
+    with CSVSink(tmp_path / "result.csv", append=True) as sink:
+        for frame in frames[3:]:
+            sink.append(frame)
+    assert (tmp_path / "result.csv").read_text() == expected.read_text()
+
+
+def test_csv_sink_tell(tmp_path: Path):
+    with CSVSink(tmp_path / "result.csv", chunk_size=4) as sink:
+        sink.append(frame_data(0))
+        sink.append(frame_data(1).iloc[:2])
+        size = sink.tell()
+    with open(tmp_path / "result.csv", "r+") as f:
+        f.truncate(size)
+    result = pd.read_csv(tmp_path / "result.csv", index_col=0)
+    pd.testing.assert_frame_equal(result, frame_data(0).reset_index(drop=True))
+
+
+def colored_frame_data(frame: int) -> pd.DataFrame:
+    # exactly representable values survive csv_extract_colors' re-reading
+    data = frame_data(frame, n_rods=6)
+    data[["x1", "y1"]] = np.round(data[["x1", "y1"]] * 64) / 64
+    data["color"] = ["blue", "green", "blue", "red", "blue", "green"]
+    if frame % 3 == 2:
+        data = data.loc[data.color != "red"]
+    return data
+
+
+def test_color_csv_sink(tmp_path: Path):
+    frames = [colored_frame_data(i) for i in range(8)]
+    (tmp_path / "expected").mkdir()
+    expected = tmp_path / "expected" / "rods_df.csv"
+    pd.concat(frames, ignore_index=True).to_csv(expected, sep=",")
+    csv_extract_colors(str(expected))
+
+    result = tmp_path / "rods_df.csv"
+    with ColorCSVSink(result, chunk_size=5) as sink:
+        for frame in frames[:4]:
+            sink.append(frame)
+        sink.flush()
+        sizes = sink.tell()
+        # rows written after the checkpoint are discarded on resuming
+        sink.append(frames[4])
+    with ColorCSVSink(result, chunk_size=5, sizes=sizes) as sink:
+        for frame in frames[4:]:
+            sink.append(frame)
+    assert sink.n_rows == sum(len(f) for f in frames[4:])
+
+    written = sorted(f.name for f in tmp_path.iterdir() if f.is_file())
+    assert written == sorted(f.name for f in (tmp_path / "expected").iterdir())
+    for name in written:
+        assert (tmp_path / name).read_text() == (
+            tmp_path / "expected" / name
+        ).read_text()
+
+
+def test_color_csv_sink_empty(tmp_path: Path):
+    with ColorCSVSink(tmp_path / "rods_df.csv") as sink:
+        sink.append(pd.DataFrame())
+    assert sink.tell() == {}
+    assert not list(tmp_path.iterdir())
+
+
+def test_memory_sink():
+    frames = [frame_data(i) for i in range(5)]
+    sink = MemorySink()
+    assert sink.to_dataframe().empty
+    for frame in frames:
+        sink.append(frame)
+    pd.testing.assert_frame_equal(
+        sink.to_dataframe(), pd.concat(frames, ignore_index=True)
+    )
+    sink.append(frame_data(5))
+    assert sink.n_rows == 24
+    assert list(sink.to_dataframe().index) == list(range(24))
+
+
+def test_data_sink_abstract():
+    with pytest.raises(TypeError):
+        DataSink()
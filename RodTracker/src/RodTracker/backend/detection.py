@@ -30,6 +30,8 @@ import torch
 from ParticleDetection.utils import datasets as ds
 from ParticleDetection.utils import detection
 from ParticleDetection.utils import helper_funcs as hf
+from ParticleDetection.utils.batching import BatchSize, run_batched
+from ParticleDetection.utils.prefetching import ImagePrefetcher
 from PyQt5 import QtCore
 
 from RodTracker.backend.logger import Action, NotInvertableError
@@ -163,6 +165,18 @@ class Detector(QtCore.QRunnable):
         Confidence threshold :math:`\\in [0, 1]` below which objects are
         rejected after detection.\n
         Default is ``0.5``.
+    batch_size : int | ``"auto"``, optional
+        Number of images given to the model together or ``"auto"`` to
+        determine it during the detection, see
+        :func:`~ParticleDetection.utils.batching.run_batched`.\n
+        Default is ``1``.
+    workers : int, optional
+        Number of threads decoding the upcoming images in the background,
+        see :class:`~ParticleDetection.utils.prefetching.ImagePrefetcher`.\n
+        Default is ``2``.
+    prefetch : int, optional
+        Maximum number of images decoded ahead.\n
+        Default is ``4``.
 
     Raises
     ------
@@ -197,6 +211,12 @@ class Detector(QtCore.QRunnable):
         The amount of particles per frame for each class that shall be
         detected.
         ``expected[class] = amount``
+    batch_size : int | ``"auto"``
+        Number of images given to the model together.
+    workers : int
+        Number of threads decoding the upcoming images in the background.
+    prefetch : int
+        Maximum number of images decoded ahead.
     """
 
     classes: Dict[int, str] = {}
@@ -213,6 +233,9 @@ class Detector(QtCore.QRunnable):
         frames: List[int],
         classes: Dict[int, list],
         threshold: float = 0.5,
+        batch_size: BatchSize = 1,
+        workers: int = 2,
+        prefetch: int = 4,
     ):
         super().__init__()
         self.cam_id = cam_id
@@ -235,6 +258,9 @@ class Detector(QtCore.QRunnable):
         elif threshold < 0.0:
             threshold = 0.0
         self.threshold = threshold
+        self.batch_size = batch_size
+        self.workers = workers
+        self.prefetch = prefetch
 
     @error_handler
     def run(self):
@@ -259,21 +285,36 @@ class Detector(QtCore.QRunnable):
         data = pd.DataFrame(columns=cols)
         data = data.loc[:, ~data.columns.duplicated()]
         num_frames = len(self.images)
-        for i in range(num_frames):
-            lock.lockForRead()
-            if abort_requested:
+
+        loader = ImagePrefetcher(
+            self.images, workers=self.workers, prefetch=self.prefetch
+        )
+
+        def detect(batch):
+            return detection._run_detection_batch(
+                self.model, [self.images[i] for i in batch], loader=loader
+            )
+
+        with loader:
+            for i, outputs in run_batched(
+                detect, range(num_frames), self.batch_size
+            ):
+                lock.lockForRead()
+                if abort_requested:
+                    lock.unlock()
+                    self.signals.finished.emit(self.cam_id)
+                    return
                 lock.unlock()
-                self.signals.finished.emit(self.cam_id)
-                return
-            lock.unlock()
-            img = self.images[i]
-            frame = self.frames[i]
-            outputs = detection._run_detection(self.model, img)
-            if "pred_masks" in outputs:
-                points = hf.rod_endpoints(
-                    outputs, self.classes, expected_particles=self.expected
+                frame = self.frames[i]
+                if "pred_masks" in outputs:
+                    points = hf.rod_endpoints(
+                        outputs,
+                        self.classes,
+                        expected_particles=self.expected,
+                    )
+                    tmp_data = ds.add_points(points, data, self.cam_id, frame)
+                self.signals.progress.emit(
+                    1 / num_frames, tmp_data, self.cam_id
                 )
-                tmp_data = ds.add_points(points, data, self.cam_id, frame)
-            self.signals.progress.emit(1 / num_frames, tmp_data, self.cam_id)
         data.reset_index(drop=True, inplace=True)
         self.signals.finished.emit(self.cam_id)
@@ -23,10 +23,11 @@ and tracking of particles, as well as plotting of the resulting metrics
 **Date:**       2022-2024
 """
 
+import contextlib
 import logging
 import sys
 import warnings
-from typing import List
+from typing import List, Union
 
 import numpy as np
 import pandas as pd
@@ -34,10 +35,15 @@ from matplotlib.figure import Figure
 from ParticleDetection.reconstruct_3D import calibrate_cameras as cc
 from ParticleDetection.reconstruct_3D import matchND
 from ParticleDetection.reconstruct_3D import visualization as vis
+from ParticleDetection.reconstruct_3D.assignment import AssignmentSolver
 from ParticleDetection.reconstruct_3D.match2D import match_frame
+from ParticleDetection.reconstruct_3D.stereo_rig import (
+    StereoRig,
+    as_stereo_rig,
+)
 from ParticleDetection.utils import data_loading as dl
+from ParticleDetection.utils.sinks import MemorySink
 from PyQt5 import QtCore
-from scipy.spatial.transform import Rotation as R
 
 from RodTracker.backend.parallelism import error_handler
 
@@ -522,19 +528,22 @@ class Reconstructor(QtCore.QRunnable):
             ``'x2_{cam_id2}'``, ``'y2_{cam_id2}'``, ``'frame'``
     frames : List[int]
         Frames the reconstruction of rods will be performed on.
-    calibration : dict
+    calibration : dict | StereoRig
         Stereocamera calibration parameters with the required fields:\n
         ``"CM1"``: camera matrix of cam1\n
         ``"R"``: rotation matrix between cam1 & cam2\n
         ``"T"``: translation vector between cam1 & cam2\n
-        ``"CM2"``: camera matrix of cam2
+        ``"CM2"``: camera matrix of cam2\n
+        Preferably, an already prepared ``StereoRig``, that is shared between
+        runs.
     transformation : dict
         Coordinate system transformation matrices from camera 1 coordinates to
         *world*/*experiment* coordinates.
         **Must contain the following fields:**\n
         ``"rotation"``, ``"translation"``\n
         If no transformation is desired, either set this value to ``None`` or
-        use as neutral transformation.
+        use as neutral transformation. It is ignored, if ``calibration`` is a
+        ``StereoRig``.
     cams : List[str]
         IDs of the cameras from whos images the 2D position data was generated.
     color : str
@@ -551,19 +560,22 @@ class Reconstructor(QtCore.QRunnable):
         ``'x2_{cam_id2}'``, ``'y2_{cam_id2}'``, ``'frame'``
     frames : List[int]
         Frames the reconstruction of rods will be performed on.
-    calibration : dict
+    calibration : dict | StereoRig
         Stereocamera calibration parameters with the required fields:\n
         ``"CM1"``: camera matrix of cam1\n
         ``"R"``: rotation matrix between cam1 & cam2\n
         ``"T"``: translation vector between cam1 & cam2\n
-        ``"CM2"``: camera matrix of cam2
+        ``"CM2"``: camera matrix of cam2\n
+        Preferably, an already prepared ``StereoRig``, that is shared between
+        runs.
     transformation : dict
         Coordinate system transformation matrices from camera 1 coordinates to
         *world*/*experiment* coordinates.
         **Must contain the following fields:**\n
        ``"rotation"``, ``"translation"``\n
         If no transformation is desired, either set this value to ``None`` or
-        use as neutral transformation.
+        use as neutral transformation. It is ignored, if ``calibration`` is a
+        ``StereoRig``.
     cams : List[str]
         IDs of the cameras from whos images the 2D position data was generated.
     color : str
@@ -583,7 +595,7 @@ class Reconstructor(QtCore.QRunnable):
         self,
         data: pd.DataFrame,
         frames: List[int],
-        calibration: dict,
+        calibration: Union[dict, StereoRig],
         transformation: dict,
         cams: List[str],
         color: str,
@@ -620,43 +632,28 @@ class Reconstructor(QtCore.QRunnable):
         """
         global abort_reconstruction, lock
         try:
-            # Derive projection matrices from the calibration
-            r1 = np.eye(3)
-            t1 = np.expand_dims(np.array([0.0, 0.0, 0.0]), 1)
-            P1 = np.vstack((r1.T, t1.T)) @ self.calibration["CM1"].T
-            P1 = P1.T
-
-            r2 = self.calibration["R"]
-            t2 = self.calibration["T"]
-            P2 = np.vstack((r2.T, t2.T)) @ self.calibration["CM2"].T
-            P2 = P2.T
+            rig = as_stereo_rig(self.calibration, self.transform)
 
-            rot = R.from_matrix(self.transform["rotation"])
-            trans = self.transform["translation"]
-
-            df_out = pd.DataFrame()
+            sink = MemorySink()
             num_frames = len(self.frames)
             for i in range(num_frames):
                 lock.lockForRead()
                 if abort_reconstruction:
                     lock.unlock()
-                    df_out.reset_index(drop=True, inplace=True)
-                    self.signals.result.emit(df_out)
+                    self.signals.result.emit(sink.to_dataframe())
                     return
                 lock.unlock()
 
                 # fmt: off
                 tmp = match_frame(
                     self.data, self.cams[0], self.cams[1], self.frames[i],
-                    self.color, self.calibration, P1, P2, rot, trans,
-                    r1, r2, t1, t2, renumber=False
+                    self.color, rig, renumber=False
                 )[0]
                 # fmt: on
 
-                df_out = pd.concat([df_out, tmp])
+                sink.append(tmp)
                 self.signals.progress.emit(1 / num_frames)
-            df_out.reset_index(drop=True, inplace=True)
-            self.signals.result.emit(df_out)
+            self.signals.result.emit(sink.to_dataframe())
         except:  # noqa: E722
             exctype, value, tb = sys.exc_info()
             self.signals.error.emit((exctype, value, tb))
@@ -681,24 +678,41 @@ class Tracker(Reconstructor):
             ``'x2_{cam_id2}'``, ``'y2_{cam_id2}'``, ``'frame'``
     frames : List[int]
         Frames the reconstruction of rods will be performed on.
-    calibration : dict
+    calibration : dict | StereoRig
         Stereocamera calibration parameters with the required fields:\n
         ``"CM1"``: camera matrix of cam1\n
         ``"R"``: rotation matrix between cam1 & cam2\n
         ``"T"``: translation vector between cam1 & cam2\n
-        ``"CM2"``: camera matrix of cam2
+        ``"CM2"``: camera matrix of cam2\n
+        Preferably, an already prepared ``StereoRig``, that is shared between
+        runs.
     transformation : dict
         Coordinate system transformation matrices from camera 1 coordinates to
         *world*/*experiment* coordinates.
         **Must contain the following fields:**\n
         ``"rotation"``, ``"translation"``\n
         If no transformation is desired, either set this value to ``None`` or
-        use as neutral transformation.
+        use as neutral transformation. It is ignored, if ``calibration`` is a
+        ``StereoRig``.
     cams : List[str]
         IDs of the cameras from whos images the 2D position data was generated.
     color : str
         Color of the rods in :attr:`data`. This value will also be written to
         the output ``DataFrame``.
+    solver : LpSolver | AssignmentSolver, optional
+        Solver for the assignment of rods between frames, see
+        :func:`~ParticleDetection.reconstruct_3D.matchND.npartite_matching`.\n
+        By default ``AssignmentSolver()``, i.e. the problems are solved within
+        the tracking thread.
+    workers : int, optional
+        Number of threads computing the candidate geometry of upcoming frames
+        ahead of their tracking, see
+        :func:`~ParticleDetection.reconstruct_3D.matchND.frame_geometries`.\n
+        By default ``2``.
+    prefetch : int, optional
+        Maximum number of frames, whose candidate geometry is computed ahead
+        of the tracked frame.\n
+        By default ``4``.
 
     Attributes
     ----------
@@ -710,24 +724,38 @@ class Tracker(Reconstructor):
         ``'x2_{cam_id2}'``, ``'y2_{cam_id2}'``, ``'frame'``
     frames : List[int]
         Frames the reconstruction of rods will be performed on.
-    calibration : dict
+    calibration : dict | StereoRig
         Stereocamera calibration parameters with the required fields:\n
         ``"CM1"``: camera matrix of cam1\n
         ``"R"``: rotation matrix between cam1 & cam2\n
         ``"T"``: translation vector between cam1 & cam2\n
-        ``"CM2"``: camera matrix of cam2
+        ``"CM2"``: camera matrix of cam2\n
+        Preferably, an already prepared ``StereoRig``, that is shared between
+        runs.
     transformation : dict
         Coordinate system transformation matrices from camera 1 coordinates to
         *world*/*experiment* coordinates.
         **Must contain the following fields:**\n
         ``"rotation"``, ``"translation"``\n
         If no transformation is desired, either set this value to ``None`` or
-        use as neutral transformation.
+        use as neutral transformation. It is ignored, if ``calibration`` is a
+        ``StereoRig``.
     cams : List[str]
         IDs of the cameras from whos images the 2D position data was generated.
     color : str
         Color of the rods in :attr:`data`. This value will also be written to
         the output ``DataFrame``.
+    solver : LpSolver | AssignmentSolver
+        Solver for the assignment of rods between frames.
+    workers : int
+        Number of threads computing the candidate geometry of upcoming frames.
+    prefetch : int
+        Maximum number of frames, whose candidate geometry is computed ahead
+        of the tracked frame.
+    tracker : FrameTracker | None
+        Tracker of the last run, that carried the assignment from one frame
+        to the next and holds the warm start statistics, see
+        :class:`~ParticleDetection.reconstruct_3D.matchND.FrameTracker`.
     signals : TrackerSignals
         Signals that can be emitted during the running of a
         :class:`Tracker` object. Their purpose is to report errors,
@@ -738,11 +766,36 @@ class Tracker(Reconstructor):
     :meth:`~ParticleDetection.reconstruct_3D.matchND.match_frame`
     """
 
+    def __init__(
+        self,
+        data: pd.DataFrame,
+        frames: List[int],
+        calibration: Union[dict, StereoRig],
+        transformation: dict,
+        cams: List[str],
+        color: str,
+        solver: AssignmentSolver = None,
+        workers: int = 2,
+        prefetch: int = 4,
+    ):
+        super().__init__(
+            data, frames, calibration, transformation, cams, color
+        )
+        self.solver = AssignmentSolver() if solver is None else solver
+        self.workers = workers
+        self.prefetch = prefetch
+        self.tracker = None
+
     @error_handler
     def run(self):
         """Run the tracking of rods coordinates with the parameters set
         in this :class:`Tracker` object.
 
+        The candidate geometry of upcoming frames, i.e. their undistorted,
+        triangulated rod combinations and reprojection errors, is computed
+        by a thread pool ahead of the tracking, so that only the assignment
+        and the rematching of endpoints run frame by frame.
+
         This function is not intended to be run directly but by invoking it via
         a ``QThreadPool.start(reconstructor)`` call.
 
@@ -761,30 +814,18 @@ class Tracker(Reconstructor):
         """
         global abort_reconstruction, lock
         try:
-            # Derive projection matrices from the calibration
-            r1 = np.eye(3)
-            t1 = np.expand_dims(np.array([0.0, 0.0, 0.0]), 1)
-            P1 = np.vstack((r1.T, t1.T)) @ self.calibration["CM1"].T
-            P1 = P1.T
-
-            r2 = self.calibration["R"]
-            t2 = self.calibration["T"]
-            P2 = np.vstack((r2.T, t2.T)) @ self.calibration["CM2"].T
-            P2 = P2.T
-
-            rot = R.from_matrix(self.transform["rotation"])
-            trans = self.transform["translation"]
+            rig = as_stereo_rig(self.calibration, self.transform)
+            self.tracker = matchND.FrameTracker(self.solver)
 
             num_frames = len(self.frames)
-            df_out = pd.DataFrame()
+            sink = MemorySink()
             # TODO: add a check, that the frame has 3D data
             if self.frames[0] - 1 not in self.data.frame.unique():
                 # Do a 2-dimensional reconstruction of 3D positions, because
                 # there is no initial 3D data to relate to.
                 lock.lockForRead()
                 if abort_reconstruction:
-                    df_out.reset_index(drop=True, inplace=True)
-                    self.signals.result.emit(df_out)
+                    self.signals.result.emit(sink.to_dataframe())
                     lock.unlock()
                     return
                 lock.unlock()
@@ -792,46 +833,57 @@ class Tracker(Reconstructor):
                 # fmt: off
                 tmp = match_frame(
                     self.data, self.cams[0], self.cams[1], self.frames[0],
-                    self.color, self.calibration, P1, P2, rot, trans,
-                    r1, r2, t1, t2, renumber=True
+                    self.color, rig, renumber=True
                 )[0]
                 # fmt: on
 
-                df_out = pd.concat([df_out, tmp])
+                sink.append(tmp)
                 self.frames = self.frames[1:]
                 self.signals.progress.emit(1 / num_frames)
             else:
                 # Set initial 3D data to previous frame
                 tmp = self.data[self.data.frame == self.frames[0] - 1]
 
-            for i in range(len(self.frames)):
-                lock.lockForRead()
-                if abort_reconstruction:
-                    df_out.reset_index(drop=True, inplace=True)
-                    self.signals.result.emit(df_out)
+            geometries = matchND.frame_geometries(
+                self.data,
+                self.cams[0],
+                self.cams[1],
+                self.frames,
+                rig,
+                workers=self.workers,
+                prefetch=self.prefetch,
+            )
+            with contextlib.closing(geometries):
+                for frame, geometry in geometries:
+                    lock.lockForRead()
+                    if abort_reconstruction:
+                        self.signals.result.emit(sink.to_dataframe())
+                        lock.unlock()
+                        return
                     lock.unlock()
-                    return
-                lock.unlock()
-
-                # Track particles
-                # fmt: off
-                tmp = matchND.match_frame(
-                    self.data, tmp, self.cams[0], self.cams[1], self.frames[i],
-                    self.color, self.calibration, P1, P2, rot,
-                    trans, r1, r2, t1, t2
-                )[0]
-                # Rematch rod endpoints for better position results
-                tmp = match_frame(
-                    tmp, self.cams[0], self.cams[1], self.frames[i],
-                    self.color, self.calibration, P1, P2, rot, trans,
-                    r1, r2, t1, t2, renumber=False
-                )[0]
-                # fmt: on
 
-                df_out = pd.concat([df_out, tmp])
-                self.signals.progress.emit(1 / num_frames)
-            df_out.reset_index(drop=True, inplace=True)
-            self.signals.result.emit(df_out)
+                    # Track particles
+                    # fmt: off
+                    tmp = matchND.match_frame(
+                        self.data, tmp, self.cams[0], self.cams[1], frame,
+                        self.color, rig, tracker=self.tracker,
+                        geometry=geometry
+                    )[0]
+                    # Rematch rod endpoints for better position results
+                    tmp = match_frame(
+                        tmp, self.cams[0], self.cams[1], frame,
+                        self.color, rig, renumber=False
+                    )[0]
+                    # fmt: on
+
+                    sink.append(tmp)
+                    self.signals.progress.emit(1 / num_frames)
+            _logger.info(
+                f"Tracking of color '{self.color}': {self.tracker.hits} of "
+                f"{self.tracker.warm_starts} warm started frames were "
+                f"already optimal."
+            )
+            self.signals.result.emit(sink.to_dataframe())
         except:  # noqa: E722
             exctype, value, tb = sys.exc_info()
             self.signals.error.emit((exctype, value, tb))
@@ -27,18 +27,24 @@ rod_data : DataFrame | None
     Stores loaded/generated position data of rods. The column naming must
     comply with :const:`~ParticleDetection.utils.datasets.DEFAULT_COLUMNS`
     for most functions to work as intended.
+dirty_frames : Dict[str, Set[int]]
+    Frames per color, whose 2D position data has been changed since their 3D
+    positions were last reconstructed.
 lock : QReadWriteLock
-    Lock to protect access to :attr:`rod_data` during read and write
-    operations.
+    Lock to protect access to :attr:`rod_data` and :attr:`dirty_frames`
+    during read and write operations.
 """
 
 import logging
 import math
 import re
 from pathlib import Path
-from typing import Dict, Iterable, List, Tuple, Union
+from typing import Dict, Iterable, List, Set, Tuple, Union
 
+import numpy as np
 import pandas as pd
+from ParticleDetection.reconstruct_3D.match2D import triangulate_rods
+from ParticleDetection.reconstruct_3D.stereo_rig import StereoRig
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QMessageBox
 
@@ -61,10 +67,13 @@ RE_2D_POS: re.Pattern = re.compile(r"[xy][12]_.+")
 """Pattern : Pattern for columns containing 2D position information."""
 RE_3D_POS: re.Pattern = re.compile(r"[xyz][12]")
 """Pattern : Pattern for columns containing 3D position information."""
+COLS_3D: List[str] = ["x1", "y1", "z1", "x2", "y2", "z2", "x", "y", "z", "l"]
+"""List[str] : Columns updated by the re-triangulation of changed rods."""
 POSITION_SCALING: float = 1.0
 """float : Scale factor for loaded position data."""
 
 rod_data: Union[pd.DataFrame, None] = None
+dirty_frames: Dict[str, Set[int]] = {}
 lock = QtCore.QReadWriteLock(QtCore.QReadWriteLock.Recursive)
 _logger = logging.getLogger(__name__)
 
@@ -101,6 +110,7 @@ class RodData(QtCore.QObject):
         - :meth:`catch_number_switch`
         - :meth:`save_changes`
         - :meth:`select_rods`
+        - :meth:`set_stereo_rig`
         - :meth:`update_frame`
         - :meth:`update_color_2D`
         - :meth:`update_color_3D`
@@ -134,6 +144,10 @@ class RodData(QtCore.QObject):
         Columns of the loaded ``DataFrame`` relevant for 2D data display.
     cols_3D : List[str]
         Columns of the loaded ``DataFrame`` relevant for 3D data display.
+    rig : StereoRig | None
+        Stereo camera system used to re-triangulate rods, whose 2D position
+        has been changed. Changed rods are not re-triangulated, if it is
+        ``None``.
     """
 
     data_2d = QtCore.pyqtSignal([pd.DataFrame, str], name="data_2d")
@@ -230,6 +244,7 @@ class RodData(QtCore.QObject):
         self.rod_2D: int = None
         self.cols_3D: List[str] = []
         self.cols_2D: List[str] = []
+        self.rig: StereoRig = None
 
     @property
     def logger(self) -> lg.ActionLogger:
@@ -405,6 +420,7 @@ class RodData(QtCore.QObject):
         global rod_data
         lock.lockForWrite()
         rod_data, found_colors = self.get_color_data(self.folder)
+        dirty_frames.clear()
         frame_min = rod_data.frame.min()
         frame_max = rod_data.frame.max()
         columns = list(rod_data.columns)
@@ -916,6 +932,8 @@ class RodData(QtCore.QObject):
                         inplace=True,
                     )
                     rod_data.reset_index(inplace=True)
+                    for color, frames in data.groupby("color").frame:
+                        mark_dirty(color, frames.unique())
 
                 # Update the 'available' cameras in other parts of the app
                 columns = list(rod_data.columns)
@@ -955,6 +973,8 @@ class RodData(QtCore.QObject):
                 return
 
             with QtCore.QWriteLocker(lock):
+                for color, frames in data.groupby("color").frame:
+                    mark_dirty(color, frames.unique())
                 rod_data.set_index(
                     ["color", "frame", "particle"], inplace=True
                 )
@@ -1005,12 +1025,20 @@ class RodData(QtCore.QObject):
         if new_data is None:
             return
 
-        worker = pl.Worker(change_data, new_data=new_data)
+        cam_ids = [
+            col.split("_")[-1]
+            for col in self.cols_2D
+            if re.fullmatch(RE_SEEN, col)
+        ]
+        rig = self.rig if len(cam_ids) >= 2 else None
+        worker = pl.Worker(
+            change_data, new_data=new_data, rig=rig, cam_ids=cam_ids[:2]
+        )
         worker.signals.result.connect(lambda ret: self.is_busy.emit(False))
         worker.signals.error.connect(lambda ret: self.is_busy.emit(False))
         self.is_busy.emit(True)
         worker.signals.result.connect(
-            lambda _: self.provide_data(data_3d=False)
+            lambda _: self.provide_data(data_3d=rig is not None)
         )
         worker.signals.error.connect(lambda ret: exception_logger(*ret))
         self.threads.start(worker)
@@ -1030,6 +1058,24 @@ class RodData(QtCore.QObject):
         else:
             self.data_update.emit(new_data)
 
+    @QtCore.pyqtSlot(object)
+    def set_stereo_rig(self, rig: Union[StereoRig, None]) -> None:
+        """Sets the stereo camera system for re-triangulation of changed
+        rods.
+
+        With a stereo camera system available, the 3D coordinates of a rod
+        are updated as soon as its 2D position is changed in one of the
+        cameras (see :meth:`catch_data`), i.e. without running a full
+        reconstruction.
+
+        Parameters
+        ----------
+        rig : StereoRig | None
+            Stereo camera system matching the first two cameras of the loaded
+            data. ``None`` disables the re-triangulation.
+        """
+        self.rig = rig
+
     @QtCore.pyqtSlot(lg.NumberChangeActions, int, int, str)
     @QtCore.pyqtSlot(lg.NumberChangeActions, int, int, str, str, int)
     def catch_number_switch(
@@ -1422,7 +1468,9 @@ class RodData(QtCore.QObject):
             _logger.info(type(event))
 
 
-def change_data(new_data: dict) -> None:
+def change_data(
+    new_data: dict, rig: StereoRig = None, cam_ids: List[str] = None
+) -> None:
     """Changes or extends the :data:`rod_data` dataset with the given new data.
 
     Parameters
@@ -1430,6 +1478,13 @@ def change_data(new_data: dict) -> None:
     new_data : dict
         Dictionary describing the new/changed rod data. Must contain the fields
         ``"frame"``, ``"cam_id"``, ``"color"``, ``"position"``, ``"rod_id"``.
+    rig : StereoRig, optional
+        Stereo camera system to re-triangulate the changed rods with, see
+        :func:`retriangulate_rod`.\n
+        By default ``None``, i.e. the 3D coordinates are not updated.
+    cam_ids : List[str], optional
+        IDs of the two cameras of ``rig``. Required, if ``rig`` is given.\n
+        By default ``None``.
     """
     global rod_data
     lock.lockForWrite()
@@ -1450,7 +1505,7 @@ def change_data(new_data: dict) -> None:
                 "rod_id": rod_id[i],
                 "seen": seen[i],
             }
-            change_data(tmp_data)
+            change_data(tmp_data, rig, cam_ids)
         lock.unlock()
         return
 
@@ -1490,10 +1545,78 @@ def change_data(new_data: dict) -> None:
             ],
         ] = [*points, float(seen)]
     rod_data = rod_data.astype({"frame": "int", "particle": "int"})
+    mark_dirty(color, [frame])
+    if rig is not None:
+        retriangulate_rod(color, frame, rod_id, rig, cam_ids)
     lock.unlock()
     return
 
 
+def retriangulate_rod(
+    color: str, frame: int, rod_id: int, rig: StereoRig, cam_ids: List[str]
+) -> bool:
+    """Updates the 3D coordinates of one rod from its current 2D positions.
+
+    Both endpoint combinations between the cameras are evaluated and the one
+    with the lower reprojection error is used, see
+    :func:`~ParticleDetection.reconstruct_3D.match2D.triangulate_rods`. The
+    columns :const:`COLS_3D` of the rod are updated in :data:`rod_data`.
+
+    Parameters
+    ----------
+    color : str
+    frame : int
+    rod_id : int
+    rig : StereoRig
+        Stereo camera system of the cameras given in ``cam_ids``.
+    cam_ids : List[str]
+        IDs of the first and second camera of ``rig``.
+
+    Returns
+    -------
+    bool
+        ``True``, if the rod has been re-triangulated. ``False``, if its
+        position is not available in both cameras, i.e. it is marked as
+        unseen or its endpoints are missing, all-zero or ``-1`` (deleted), or
+        if the loaded data has no 3D columns.
+    """
+    cols_2d = [
+        f"{coord}{point}_{cam}"
+        for cam in cam_ids
+        for point in (1, 2)
+        for coord in ("x", "y")
+    ]
+    with QtCore.QWriteLocker(lock):
+        if not set([*cols_2d, *COLS_3D]).issubset(rod_data.columns):
+            return False
+        mask = (
+            (rod_data.frame == frame)
+            & (rod_data.particle == rod_id)
+            & (rod_data.color == color)
+        )
+        rods = rod_data.loc[mask, cols_2d].to_numpy(dtype=float)
+        cols_seen = [f"seen_{cam}" for cam in cam_ids]
+        if set(cols_seen).issubset(rod_data.columns):
+            seen = rod_data.loc[mask, cols_seen].to_numpy(dtype=float)
+        else:
+            seen = np.ones((len(rods), len(cam_ids)))
+        if (
+            len(rods) != 1
+            or not np.isfinite(rods).all()
+            or not (seen == 1).all()
+            or any(
+                # all-zero or deleted, i.e. (-1, -1), endpoints
+                not points.any() or (points == -1).all()
+                for points in (rods[0, :4], rods[0, 4:])
+            )
+        ):
+            # unseen in at least one camera
+            return False
+        rod_3d, _ = triangulate_rods(rods[:, :4], rods[:, 4:], rig)
+        rod_data.loc[mask, COLS_3D] = rod_3d
+    return True
+
+
 def rod_number_swap(
     mode: lg.NumberChangeActions,
     previous_id: int,
@@ -1524,6 +1647,12 @@ def rod_number_swap(
     global rod_data
     lock.lockForWrite()
     tmp_set = rod_data.copy()
+    changed_frames = tmp_set.loc[
+        (tmp_set.color == color)
+        & (tmp_set.particle.isin([previous_id, new_id]))
+        & (tmp_set.frame >= frame),
+        "frame",
+    ].unique()
     if mode == lg.NumberChangeActions.ALL:
         rod_data.loc[
             (tmp_set.color == color)
@@ -1557,6 +1686,7 @@ def rod_number_swap(
             mask_previous, cam_cols
         ].values
     elif mode == lg.NumberChangeActions.ONE_BOTH_CAMS:
+        changed_frames = [frame]
         rod_data.loc[
             (tmp_set.color == color)
             & (tmp_set.particle == previous_id)
@@ -1571,6 +1701,54 @@ def rod_number_swap(
         ] = previous_id
     else:
         # Unknown mode
-        pass
+        changed_frames = []
+    mark_dirty(color, changed_frames)
     lock.unlock()
     return
+
+
+def mark_dirty(color: str, frames: Iterable[int]) -> None:
+    """Marks frames of one color as changed since their last 3D
+    reconstruction.
+
+    Parameters
+    ----------
+    color : str
+        Color of the rods that have been changed.
+    frames : Iterable[int]
+        Frames, in which 2D position data of rods with the given ``color``
+        has been changed.
+    """
+    with QtCore.QWriteLocker(lock):
+        dirty_frames.setdefault(color, set()).update(int(f) for f in frames)
+
+
+def take_dirty_frames(color: str, frames: Iterable[int] = None) -> List[int]:
+    """Removes and returns the changed frames of one color.
+
+    Changed frames are returned only once, i.e. they are expected to be
+    reconstructed after this call. Frames can be marked as changed again
+    with :func:`mark_dirty`, e.g. if their reconstruction failed.
+
+    Parameters
+    ----------
+    color : str
+        Color of the rods, whose changed frames are requested.
+    frames : Iterable[int], optional
+        Frames that are of interest. Changed frames outside of these remain
+        marked as changed.\n
+        By default ``None``, i.e. all changed frames are returned.
+
+    Returns
+    -------
+    List[int]
+        Sorted frame numbers, in which 2D position data of rods with the
+        given ``color`` has been changed since the last call.
+    """
+    with QtCore.QWriteLocker(lock):
+        changed = set(dirty_frames.get(color, ()))
+        if frames is not None:
+            changed.intersection_update(frames)
+        if color in dirty_frames:
+            dirty_frames[color] -= changed
+        return sorted(changed)
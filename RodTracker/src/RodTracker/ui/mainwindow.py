@@ -298,6 +298,9 @@ class RodTrackWindow(QtWidgets.QMainWindow):
             self.reconstructor.updated_data.connect(
                 self.rod_data.receive_updated_data
             )
+            self.reconstructor.rig_changed.connect(
+                self.rod_data.set_stereo_rig
+            )
             self.rod_data.data_loaded[str, str].connect(
                 self.reconstructor.set_cam_ids
             )
@@ -856,6 +856,9 @@ class Ui_MainWindow(object):
         self.cb_tracking = QtWidgets.QCheckBox(self.tab_reconstruct)
         self.cb_tracking.setObjectName("cb_tracking")
         self.verticalLayout_11.addWidget(self.cb_tracking)
+        self.cb_changed_only = QtWidgets.QCheckBox(self.tab_reconstruct)
+        self.cb_changed_only.setObjectName("cb_changed_only")
+        self.verticalLayout_11.addWidget(self.cb_changed_only)
         self.horizontalLayout_5.addLayout(self.verticalLayout_11)
         self.pb_solve = QtWidgets.QPushButton(self.tab_reconstruct)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Minimum)
@@ -1154,6 +1157,8 @@ class Ui_MainWindow(object):
         self.cb_yellow.setText(_translate("MainWindow", "yellow"))
         self.cb_blue.setText(_translate("MainWindow", "blue"))
         self.cb_tracking.setText(_translate("MainWindow", "Tracking"))
+        self.cb_changed_only.setToolTip(_translate("MainWindow", "Only solve frames with changed 2D positions. Tracking restarts from the earliest changed frame."))
+        self.cb_changed_only.setText(_translate("MainWindow", "Only changed frames"))
         self.pb_solve.setText(_translate("MainWindow", "Solve"))
         self.lbl_calibration.setText(_translate("MainWindow", "Camera Calibration:"))
         self.tb_calibration.setText(_translate("MainWindow", "..."))
@@ -33,8 +33,10 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import ParticleDetection.utils.data_loading as dl
 from matplotlib.figure import Figure
+from ParticleDetection.reconstruct_3D.stereo_rig import StereoRig
 from PyQt5 import QtCore, QtWidgets
 
+import RodTracker.backend.rod_data as r_data
 import RodTracker.ui.mainwindow_layout as mw_l
 from RodTracker import exception_logger
 from RodTracker.backend import reconstruction
@@ -99,6 +101,7 @@ class ReconstructorUI(QtWidgets.QWidget):
     .. admonition:: Signals
 
         - :attr:`request_data`
+        - :attr:`rig_changed`
         - :attr:`updated_data`
 
     .. admonition:: Slots
@@ -144,6 +147,12 @@ class ReconstructorUI(QtWidgets.QWidget):
     """pyqtSignal(bool) : Notifies when a background task is started/finished.
     """
 
+    rig_changed = QtCore.pyqtSignal(object)
+    """pyqtSignal(object) : Sends the stereo camera system (``StereoRig``)
+    prepared from the loaded calibration and transformation, or ``None`` if
+    one of them is missing.
+    """
+
     data: pd.DataFrame = None
     """DataFrame : Slice of the *main* ``DataFrame`` that is used for
     reconstruction/tracking.
@@ -175,12 +184,14 @@ class ReconstructorUI(QtWidgets.QWidget):
 
         self._calibration = None
         self._transformation = None
+        self._rig: StereoRig = None
         self._custom_solver = None
         self.reprojection_errs = None
         self.used_colors = []
         self.start_frame = 0
         self.end_frame = 0
         self.first_update = False
+        self._solving = {}
 
         # Signal connections
         tb_calibration = ui.findChild(QtWidgets.QToolButton, "tb_calibration")
@@ -205,7 +216,7 @@ class ReconstructorUI(QtWidgets.QWidget):
         end_f.valueChanged.connect(self._change_end_frame)
 
         for cb in ui.findChildren(QtWidgets.QCheckBox):
-            if "tracking" in cb.objectName():
+            if cb.objectName() in ["cb_tracking", "cb_changed_only"]:
                 continue
             cb.stateChanged.connect(self._toggle_color)
 
@@ -259,6 +270,7 @@ class ReconstructorUI(QtWidgets.QWidget):
         None
         """
         self._calibration = dl.load_camera_calibration(path)
+        self._update_rig()
         if self._calibration and self._transformation:
             self.ui.findChild(QtWidgets.QPushButton, "pb_solve").setEnabled(
                 True
@@ -283,6 +295,7 @@ class ReconstructorUI(QtWidgets.QWidget):
             Path to the transformation data that shall be loaded here.
         """
         self._transformation = dl.load_world_transformation(path)
+        self._update_rig()
         if self._calibration and self._transformation:
             self.ui.findChild(QtWidgets.QPushButton, "pb_solve").setEnabled(
                 True
@@ -290,6 +303,14 @@ class ReconstructorUI(QtWidgets.QWidget):
         if self.data is not None:
             self.pb_plots.setEnabled(True)
 
+    def _update_rig(self):
+        """Prepares the stereo camera system used for solving, once both
+        calibration and transformation data are available."""
+        self._rig = None
+        if self._calibration and self._transformation:
+            self._rig = StereoRig(self._calibration, self._transformation)
+        self.rig_changed.emit(self._rig)
+
     def _change_start_frame(self, new_val: int):
         """Callback for the ``QSpinBox`` handling the start frame selection."""
         self.start_frame = new_val
@@ -379,6 +400,12 @@ class ReconstructorUI(QtWidgets.QWidget):
         3D values (and particle IDs) for all frames in between
         :attr:`start_frame` and :attr:`end_frame`.
 
+        If only changed frames shall be solved, the reconstruction is limited
+        to the frames of a color, whose 2D positions have been changed since
+        they were last solved (see :func:`.rod_data.mark_dirty`). Tracking
+        restarts from the earliest changed frame of a color instead. Colors
+        without changes are skipped.
+
         Returns
         -------
         None
@@ -393,6 +420,9 @@ class ReconstructorUI(QtWidgets.QWidget):
         track = self.ui.findChild(
             QtWidgets.QCheckBox, "cb_tracking"
         ).isChecked()
+        changed_only = self.ui.findChild(
+            QtWidgets.QCheckBox, "cb_changed_only"
+        ).isChecked()
         if (
             self.data is None
             or len(self.data) == 0
@@ -402,19 +432,36 @@ class ReconstructorUI(QtWidgets.QWidget):
             _logger.info("Insufficient data for 3D reconstruction given.")
             return
         frames = list(range(self.start_frame, self.end_frame + 1))
+        self._solving = {}
+        to_solve = {}
+        for color in self.used_colors:
+            # frames changed since the last solve are solved now
+            changed = r_data.take_dirty_frames(color, frames)
+            if not changed_only:
+                to_solve[color] = frames
+            elif changed and track:
+                to_solve[color] = list(range(changed[0], self.end_frame + 1))
+            elif changed:
+                to_solve[color] = changed
+            else:
+                continue
+            self._solving[color] = changed
+        if not to_solve:
+            _logger.info("No changed frames to solve.")
+            return
+
         self._progress_val = 0.0
         self.progress.setValue(0)
-        num_colors = len(self.used_colors)
+        num_colors = len(to_solve)
         self._colors_to_solve = num_colors
         self.is_busy.emit(True)
-        for i in range(num_colors):
-            color = self.used_colors[i]
+        for color, frames in to_solve.items():
             tmp = self.data.loc[self.data.color == color]
             if track:
                 tracker = Tracker(
                     tmp,
                     frames,
-                    self._calibration,
+                    self._rig,
                     self._transformation,
                     self.cam_ids,
                     color,
@@ -423,7 +470,7 @@ class ReconstructorUI(QtWidgets.QWidget):
                 tracker = Reconstructor(
                     tmp,
                     frames,
-                    self._calibration,
+                    self._rig,
                     self._transformation,
                     self.cam_ids,
                     color,
@@ -439,6 +486,7 @@ class ReconstructorUI(QtWidgets.QWidget):
                 lambda ret: partial(self._notify_error, color)
             )
             tracker.signals.error.connect(partial(self._notify_error, color))
+            tracker.signals.error.connect(partial(self._restore_dirty, color))
             tracker.signals.result.connect(self._solver_result)
             self._threads.start(tracker)
 
@@ -448,10 +496,18 @@ class ReconstructorUI(QtWidgets.QWidget):
 
     def _abort_reconstruction(self):
         self.pb_solve.setEnabled(False)
+        # unfinished frames must be solved again
+        for color in list(self._solving):
+            self._restore_dirty(color)
         reconstruction.lock.lockForWrite()
         reconstruction.abort_reconstruction = True
         reconstruction.lock.unlock()
 
+    def _restore_dirty(self, color: str, _=None):
+        """Marks the changed frames of an unsuccessfully solved color as
+        changed again."""
+        r_data.mark_dirty(color, self._solving.pop(color, []))
+
     def _notify_error(self, color: str):
         show_warning(
             "Something went wrong during 3D reconstruction of "
@@ -495,6 +551,9 @@ class ReconstructorUI(QtWidgets.QWidget):
             reconstruction.lock.unlock()
         if result is None:
             return
+        if "color" in result.columns:
+            for color in result.color.unique():
+                self._solving.pop(color, None)
         self.data.update(result)
         self.updated_data.emit(result)
         self.select_data()
@@ -628,7 +687,7 @@ class ReconstructorUI(QtWidgets.QWidget):
         """
         self.used_colors = []
         for cb in self.ui.findChildren(QtWidgets.QCheckBox):
-            if "tracking" in cb.objectName():
+            if cb.objectName() in ["cb_tracking", "cb_changed_only"]:
                 continue
             if cb.checkState():
                 self.used_colors.append(cb.objectName().split("_")[1])
@@ -122,3 +122,16 @@ def test_finished(qtbot: QtBot, default_detector: detection.Detector):
     expected_emitted.append(default_detector.signals.finished)
     with qtbot.wait_signals(expected_emitted, order="strict"):
         default_detector.run()
+
+
+@pytest.mark.parametrize("batch_size", [2, "auto"])
+def test_batched(
+    qtbot: QtBot, default_detector: detection.Detector, batch_size
+):
+    default_detector.batch_size = batch_size
+    expected_emitted = len(default_detector.frames) * [
+        default_detector.signals.progress
+    ]
+    expected_emitted.append(default_detector.signals.finished)
+    with qtbot.wait_signals(expected_emitted, order="strict"):
+        default_detector.run()
@@ -23,6 +23,7 @@ import ParticleDetection.utils.data_loading as dl
 import pytest
 from conftest import load_rod_data
 from ParticleDetection.reconstruct_3D import match2D
+from ParticleDetection.reconstruct_3D.assignment import AssignmentSolver
 from pytest import LogCaptureFixture, MonkeyPatch
 from pytestqt.qtbot import QtBot
 
@@ -264,3 +265,73 @@ class TestTracker:
             mp.setattr(default_tracker, "calibration", None)
             with qtbot.wait_signal(default_tracker.signals.error):
                 default_tracker.run()
+
+    def test_solver(
+        self, qtbot: QtBot, monkeypatch: MonkeyPatch, default_tracker: Tracker
+    ):
+        assert isinstance(default_tracker.solver, AssignmentSolver)
+        trackers = []
+
+        def match_frame(*args, tracker=None, **kwargs):
+            trackers.append(tracker)
+            return pd.DataFrame(), None, None
+
+        monkeypatch.setattr(reconstruction.matchND, "match_frame", match_frame)
+        monkeypatch.setattr(
+            reconstruction, "match_frame", lambda *args, **kwargs: (None,)
+        )
+        monkeypatch.setattr(
+            reconstruction.matchND,
+            "frame_geometries",
+            lambda data, cam1, cam2, frames, rig, **kwargs: (
+                (frame, None) for frame in frames
+            ),
+        )
+        monkeypatch.setattr(
+            default_tracker, "data", pd.DataFrame({"frame": [499]})
+        )
+        with qtbot.wait_signal(default_tracker.signals.result):
+            default_tracker.run()
+        # one tracker carries the state over all frames
+        assert trackers == len(default_tracker.frames) * [
+            default_tracker.tracker
+        ]
+        assert default_tracker.tracker.solver is default_tracker.solver
+
+    def test_geometries(
+        self, qtbot: QtBot, monkeypatch: MonkeyPatch, default_tracker: Tracker
+    ):
+        requested = {}
+        tracked = []
+
+        def frame_geometries(data, cam1, cam2, frames, rig, **kwargs):
+            requested.update(kwargs, frames=list(frames))
+            return ((frame, f"geometry {frame}") for frame in frames)
+
+        def match_frame(data, last, cam1, cam2, frame, *args, **kwargs):
+            tracked.append((frame, kwargs["geometry"]))
+            return pd.DataFrame(), None, None
+
+        monkeypatch.setattr(
+            reconstruction.matchND, "frame_geometries", frame_geometries
+        )
+        monkeypatch.setattr(reconstruction.matchND, "match_frame", match_frame)
+        monkeypatch.setattr(
+            reconstruction, "match_frame", lambda *args, **kwargs: (None,)
+        )
+        monkeypatch.setattr(
+            default_tracker, "data", pd.DataFrame({"frame": [499]})
+        )
+        default_tracker.workers = 3
+        default_tracker.prefetch = 2
+        with qtbot.wait_signal(default_tracker.signals.result):
+            default_tracker.run()
+        assert requested == {
+            "frames": default_tracker.frames,
+            "workers": 3,
+            "prefetch": 2,
+        }
+        # the precomputed geometry is used for the assignment of its frame
+        assert tracked == [
+            (frame, f"geometry {frame}") for frame in default_tracker.frames
+        ]
@@ -20,9 +20,12 @@ import shutil
 from pathlib import Path
 
 import importlib_resources
+import numpy as np
 import pandas as pd
 import pytest
 from conftest import load_rod_data
+from ParticleDetection.reconstruct_3D.match2D import triangulate_rods
+from ParticleDetection.reconstruct_3D.stereo_rig import StereoRig
 from PyQt5 import QtWidgets
 from pytest import MonkeyPatch
 from pytestqt.qtbot import QtBot
@@ -47,6 +50,17 @@ def rod_manager() -> RodData:
     rod_data.POSITION_SCALING = 1.0
 
 
+@pytest.fixture(scope="module")
+def rig() -> StereoRig:
+    calibrations = importlib_resources.files(
+        "RodTracker.resources.example_data.calibrations"
+    )
+    return StereoRig.from_files(
+        calibrations.joinpath("gp34.json"),
+        calibrations.joinpath("transformation.json"),
+    )
+
+
 class TestRodData:
     @pytest.mark.parametrize("show", [False, True])
     def test_show_2D_setter(
@@ -628,6 +642,24 @@ class TestRodData:
             rod_manager.catch_data(test_action)
         assert len(bl.all_signals_and_args) == 4
 
+    def test_catch_data_retriangulate(
+        self, qtbot: QtBot, rod_manager: RodData, rig: StereoRig
+    ):
+        test_data = {
+            "frame": 500,
+            "cam_id": "gp3",
+            "color": "black",
+            "position": [500.0, 400.0, 600.0, 450.0],
+            "rod_id": 0,
+            "seen": True,
+        }
+        test_action = lg.Action()
+        test_action.to_save = lambda: test_data
+        rod_manager.frame = 500
+        rod_manager.set_stereo_rig(rig)
+        with qtbot.wait_signals([rod_manager.data_2d, rod_manager.data_3d]):
+            rod_manager.catch_data(test_action)
+
     def test_catch_data_empty(self, qtbot: QtBot, rod_manager: RodData):
         test_action = lg.Action()
         test_action.to_save = lambda: None
@@ -1118,3 +1150,94 @@ def test_rod_number_swap(
             prev_new.reset_index(drop=True)
             == changed_old.reset_index(drop=True)
         ).all(None)
+
+
+def test_change_data_marks_dirty(qtbot: QtBot, rod_manager: RodData):
+    assert rod_data.take_dirty_frames("black") == []
+    for frame in [503, 500, 503]:
+        rod_data.change_data(
+            {
+                "frame": frame,
+                "cam_id": "gp3",
+                "color": "black",
+                "position": [random.random() for _ in range(4)],
+                "rod_id": 0,
+                "seen": 1,
+            }
+        )
+    assert rod_data.take_dirty_frames("blue") == []
+    assert rod_data.take_dirty_frames("black", range(501, 510)) == [503]
+    assert rod_data.take_dirty_frames("black") == [500]
+    assert rod_data.take_dirty_frames("black") == []
+
+
+@pytest.mark.parametrize(
+    "mode,expected",
+    [
+        (lg.NumberChangeActions.ALL, [518, 519]),
+        (lg.NumberChangeActions.ALL_ONE_CAM, [518, 519]),
+        (lg.NumberChangeActions.ONE_BOTH_CAMS, [518]),
+    ],
+)
+def test_rod_number_swap_marks_dirty(
+    qtbot: QtBot,
+    rod_manager: RodData,
+    mode: lg.NumberChangeActions,
+    expected: list,
+):
+    rod_data.rod_number_swap(mode, 4, 2, "black", 518, "gp3")
+    assert rod_data.take_dirty_frames("black") == expected
+    assert rod_data.take_dirty_frames("blue") == []
+
+
+def test_open_rod_folder_resets_dirty(qtbot: QtBot, rod_manager: RodData):
+    rod_data.mark_dirty("black", [500, 501])
+    rod_manager.open_rod_folder(rod_manager.folder)
+    assert rod_data.take_dirty_frames("black") == []
+
+
+def test_change_data_retriangulate(
+    qtbot: QtBot, rod_manager: RodData, rig: StereoRig
+):
+    test_data = {
+        "frame": 500,
+        "cam_id": "gp3",
+        "color": "black",
+        "position": [500.0, 400.0, 600.0, 450.0],
+        "rod_id": 0,
+        "seen": True,
+    }
+    data = rod_data.rod_data
+    mask = (data.frame == 500) & (data.particle == 0) & (data.color == "black")
+    previous = data.loc[~mask, rod_data.COLS_3D].copy()
+    rod_data.change_data(test_data, rig, ["gp3", "gp4"])
+
+    data = rod_data.rod_data
+    cam2 = data.loc[mask, ["x1_gp4", "y1_gp4", "x2_gp4", "y2_gp4"]]
+    expected, _ = triangulate_rods(test_data["position"], cam2, rig)
+    np.testing.assert_allclose(
+        data.loc[mask, rod_data.COLS_3D].to_numpy(), expected
+    )
+    pd.testing.assert_frame_equal(data.loc[~mask, rod_data.COLS_3D], previous)
+
+
+@pytest.mark.parametrize(
+    "points,seen",
+    [
+        (4 * [0.0], 1),  # all-zero endpoints
+        (4 * [-1.0], 0),  # deleted in the GUI
+        (4 * [-1.0], 1),  # deleted, without seen information
+        (None, 0),  # marked as unseen
+    ],
+)
+def test_retriangulate_rod_unseen(
+    qtbot: QtBot, rod_manager: RodData, rig: StereoRig, points, seen
+):
+    data = rod_data.rod_data
+    mask = (data.frame == 500) & (data.particle == 0) & (data.color == "black")
+    if points is not None:
+        data.loc[mask, ["x1_gp4", "y1_gp4", "x2_gp4", "y2_gp4"]] = points
+    data.loc[mask, "seen_gp4"] = seen
+    previous = data[rod_data.COLS_3D].copy()
+    assert not rod_data.retriangulate_rod("black", 500, 0, rig, ["gp3", "gp4"])
+    pd.testing.assert_frame_equal(data[rod_data.COLS_3D], previous)